@@ -48,13 +48,14 @@ class CartItem(models.Model):
     def get_total_price(self):
         return self.price * self.quantity
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, price_book=None, **kwargs):
         # Auto-populate cached fields from variant
         if self.variant:
             self.cached_variant_id = str(self.variant.id)
             self.storage = self.variant.storage
             self.color = self.variant.color
-            self.price = self.variant.price
+            # Snapshot the promotion-adjusted price, from the caller's PriceBook if given
+            self.price = self.variant.get_effective_price(price_book)
             if hasattr(self.variant, 'images') and self.variant.images:
                 self.image = self.variant.images[0] if isinstance(self.variant.images, list) else self.variant.images
         super().save(*args, **kwargs)
@@ -1,6 +1,15 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
-from products.serializers import ProductSerializer, ProductVariantSerializer
+from products.serializers import ProductSerializer, ProductVariantSerializer, get_price_book
+
+
+class CartItemListSerializer(serializers.ListSerializer):
+    """Prices every variant in the cart in one batch."""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        get_price_book(self).prime(item.variant for item in items)
+        return [self.child.to_representation(item) for item in items]
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -21,6 +30,7 @@ class CartItemSerializer(serializers.ModelSerializer):
             'total_price', 'selected_variant', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'price', 'storage', 'color', 'image', 'created_at', 'updated_at']
+        list_serializer_class = CartItemListSerializer
     
     def get_selected_variant(self, obj):
         """Return variant info in format expected by frontend"""
@@ -5,6 +5,7 @@ from rest_framework.permissions import AllowAny
 from django.shortcuts import get_object_or_404
 from .models import Cart, CartItem
 from products.models import Product, ProductVariant
+from products.promotions import PriceBook
 from .serializers import (
     CartSerializer, CartItemSerializer, AddToCartSerializer, UpdateCartItemSerializer
 )
@@ -69,6 +70,8 @@ class CartViewSet(viewsets.ModelViewSet):
         
         # Get or create cart
         cart = self.get_or_create_cart()
+        # Shared by the quantity update and the cart response
+        price_book = PriceBook()
         
         # Check if item already exists in cart
         cart_item, created = CartItem.objects.get_or_create(
@@ -87,9 +90,9 @@ class CartViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             cart_item.quantity = new_quantity
-            cart_item.save()
+            cart_item.save(price_book=price_book)
         
-        cart_serializer = CartSerializer(cart)
+        cart_serializer = CartSerializer(cart, context={'price_book': price_book})
         return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
     
     @action(detail=False, methods=['patch'])
@@ -116,6 +119,7 @@ class CartViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
         
+        price_book = None
         if quantity == 0:
             # Remove item if quantity is 0
             cart_item.delete()
@@ -126,10 +130,11 @@ class CartViewSet(viewsets.ModelViewSet):
                     {'error': f'Only {cart_item.variant.stock} items available in stock'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            price_book = PriceBook()
             cart_item.quantity = quantity
-            cart_item.save()
+            cart_item.save(price_book=price_book)
         
-        cart_serializer = CartSerializer(cart)
+        cart_serializer = CartSerializer(cart, context={'price_book': price_book})
         return Response(cart_serializer.data)
     
     @action(detail=False, methods=['delete'])
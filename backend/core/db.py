@@ -0,0 +1,120 @@
+"""
+Database helpers shared by the apps
+"""
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import TruncDate
+
+
+def conflict_target(fields, using='default'):
+    """
+    `unique_fields` for `bulk_create(update_conflicts=True)`
+
+    PostgreSQL and SQLite need the conflicting unique fields spelled out,
+    while MySQL's ON DUPLICATE KEY UPDATE takes none and Django refuses
+    them there.
+    """
+    return list(fields) if connections[using].features.supports_update_conflicts_with_target else None
+
+
+def value_per_pk(values, default=None, output_field=None):
+    """
+    CASE expression giving each row its value from `{pk: value}`
+
+    Rows sharing a value share one `WHEN pk IN (...)` branch, so a batch of
+    thousands of rows with a few distinct values compiles and runs as a
+    short statement.
+    """
+    pks_by_value = defaultdict(list)
+    for pk, value in values.items():
+        pks_by_value[value].append(pk)
+    return Case(
+        *(When(pk__in=pks, then=Value(value)) for value, pks in pks_by_value.items()),
+        default=Value(default),
+        output_field=output_field or IntegerField(),
+    )
+
+
+class UTCDate(TruncDate):
+    """
+    `TruncDate` in UTC, for bucketing large tables by day
+
+    SQLite would call a Python function per row to truncate; its datetimes
+    are stored as UTC text, so the date is just the first ten characters.
+    """
+
+    def __init__(self, expression, **extra):
+        super().__init__(expression, tzinfo=dt_timezone.utc, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.lhs)
+        return f'substr({sql}, 1, 10)', params
+
+
+class LoadedValuesMixin:
+    """
+    Model mixin remembering the stored values of `LOADED_FIELDS` (attnames)
+
+    Instances read from the database, saved or refreshed can tell which of
+    those fields were changed since, without querying; an instance that
+    was never loaded reports all of them as changed.
+
+    `DERIVED_FIELDS` (a subset, maintained in SQL) are left out of a full
+    save of a loaded instance unless they were changed, so a stale copy
+    does not write back what it was loaded with.
+    """
+    LOADED_FIELDS = ()
+    DERIVED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values(cls.LOADED_FIELDS)
+        return instance
+
+    def _remember_loaded_values(self, names):
+        deferred = self.get_deferred_fields()
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        loaded.update({name: getattr(self, name) for name in names if name not in deferred})
+
+    def changed_fields(self, names=None):
+        """The fields of `names` (default: `LOADED_FIELDS`) changed since they were loaded"""
+        names = self.LOADED_FIELDS if names is None else names
+        loaded = self.__dict__.get('_loaded_values', {})
+        deferred = self.get_deferred_fields()
+        return {
+            name for name in names
+            if name not in deferred and (name not in loaded or getattr(self, name) != loaded[name])
+        }
+
+    def loaded_value(self, name, default=None):
+        """The value `name` was loaded with (`default` if it was not)"""
+        return self.__dict__.get('_loaded_values', {}).get(name, default)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._remember_loaded_values(
+            self.LOADED_FIELDS if fields is None else [name for name in self.LOADED_FIELDS if name in fields]
+        )
+
+    def save(self, *args, **kwargs):
+        if (
+            self.DERIVED_FIELDS and not args and '_loaded_values' in self.__dict__
+            and kwargs.get('update_fields') is None and not kwargs.get('force_insert')
+            and not self._state.adding and not self.get_deferred_fields()
+        ):
+            unchanged = set(self.DERIVED_FIELDS) - self.changed_fields(self.DERIVED_FIELDS)
+            if unchanged:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in unchanged
+                ]
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        self._remember_loaded_values(
+            self.LOADED_FIELDS if update_fields is None
+            else [name for name in self.LOADED_FIELDS if name in update_fields]
+        )
@@ -0,0 +1,128 @@
+"""
+Shared pagination classes
+
+`KeysetPagination` is the default page-number pagination plus an opt-in
+keyset (cursor) mode: a request carrying a `cursor` query parameter (empty
+for the first page) is paged by `(created_at, pk)` position instead of
+OFFSET, and the response has no `count`, so deep pages cost the same as the
+first one and pages stay stable while rows are inserted.
+"""
+import base64
+import json
+from collections import OrderedDict
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page-number pagination with an opt-in keyset mode (`?cursor=`)
+
+    In keyset mode rows are always ordered by `ordering` (newest first by
+    default) and any `?ordering=` parameter is ignored.
+    """
+
+    cursor_query_param = 'cursor'
+    # (timestamp field, unique tie-breaker); the first sets the direction
+    ordering = ('-created_at', '-pk')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.keyset_page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._flip(field) for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(position, ordering))
+
+        # One extra row tells whether there is a further page
+        rows = list(queryset[:self.keyset_page_size + 1])
+        has_more = len(rows) > self.keyset_page_size
+        rows = rows[:self.keyset_page_size]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first_row, self.last_row = (rows[0], rows[-1]) if rows else (None, None)
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or self.last_row is None:
+            return None
+        return self.encode_cursor(self.last_row, reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or self.first_row is None:
+            return None
+        return self.encode_cursor(self.first_row, reverse=True)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(position, ordering):
+        """Rows strictly after `position` in `ordering`"""
+        (first, second), (first_value, second_value) = ordering, position
+        first_name, second_name = first.lstrip('-'), second.lstrip('-')
+        first_op = 'lt' if first.startswith('-') else 'gt'
+        second_op = 'lt' if second.startswith('-') else 'gt'
+        return (
+            Q(**{f'{first_name}__{first_op}': first_value})
+            | Q(**{first_name: first_value, f'{second_name}__{second_op}': second_value})
+        )
+
+    def encode_cursor(self, row, reverse):
+        first, second = (field.lstrip('-') for field in self.ordering)
+        payload = {'p': [getattr(row, first).isoformat(), getattr(row, second)]}
+        if reverse:
+            payload['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        url = remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        """Return ((timestamp, pk) or None, reverse) from the request"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(parse.unquote(token).encode()))
+            timestamp, pk = payload['p']
+            timestamp = parse_datetime(timestamp)
+            if timestamp is None:
+                raise ValueError(token)
+            return (timestamp, pk), bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
@@ -184,6 +184,9 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# Inventory: how long a pending order holds its stock before the sweeper releases it
+STOCK_RESERVATION_TTL_MINUTES = int(os.getenv('STOCK_RESERVATION_TTL_MINUTES', '15'))
+
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
 
@@ -54,7 +54,7 @@ class StockImportAdmin(admin.ModelAdmin):
 
 @admin.register(StockAlert)
 class StockAlertAdmin(admin.ModelAdmin):
-    list_display = ['stock', 'alert_type', 'is_resolved', 'created_at', 'resolved_at']
-    list_filter = ['alert_type', 'is_resolved', 'created_at']
+    list_display = ['stock', 'alert_type', 'status', 'current_quantity', 'created_at', 'resolved_at']
+    list_filter = ['alert_type', 'status', 'created_at']
     search_fields = ['stock__variant__product__name', 'message']
     readonly_fields = ['created_at', 'updated_at']
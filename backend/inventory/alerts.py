@@ -1,291 +1,334 @@
 """
 Stock alert system for low stock notifications
+
+`evaluate_stock_alerts` classifies Stock rows in SQL (a CASE over the
+available units against `low_stock_threshold`) and only pulls the flagged
+rows, in keyset batches. Each batch is diffed against the open alerts of
+its rows with one query and written with one `bulk_create` and one
+`bulk_update`.
+
+A full run looks at every active Stock row; an incremental run only at rows
+whose `updated_at` moved since the previous run started. Every run is
+recorded as a `StockAlertRun` with its timing and the rows it scanned.
+Notifications go through the outbox in `inventory.notifications`.
+
+`resolve_recovered_alerts` closes alerts whose stock recovered with one
+set-based UPDATE per alert type, for all open alerts or just those of the
+Stock rows a write touched.
+
+Stock writes do not wait for the periodic run: `schedule_stock_alert_check`
+(called from the Stock save signal and from the reservation updates)
+collects the touched rows of a transaction and, once it commits, resolves
+and evaluates just those rows (`check_stock_alerts_for`). The periodic
+run is the backstop for anything written around these hooks.
 """
-from django.db import models
-from django.core.mail import send_mail
-from django.conf import settings
-from django.utils import timezone
-from inventory.models import Stock, Warehouse
-from products.models import ProductVariant
 import logging
+import time
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.lookups import LessThanOrEqual
+from django.utils import timezone
+
+from inventory.models import Stock, StockAlert, StockAlertRun
+from inventory.notifications import enqueue_alert_notifications
+from inventory.stock_listing import iter_batches
 
 logger = logging.getLogger(__name__)
 
+# Flagged Stock rows diffed and written per batch
+BATCH_SIZE = 1000
+
+LEVEL_STATS = {
+    StockAlert.AlertType.LOW_STOCK: 'low_stock',
+    StockAlert.AlertType.CRITICAL: 'critical',
+    StockAlert.AlertType.OUT_OF_STOCK: 'out_of_stock',
+}
+
+
+def available_expression(prefix=''):
+    return F(f'{prefix}quantity') - F(f'{prefix}reserved_quantity')
+
+
+def level_conditions(prefix=''):
+    """
+    SQL conditions for a Stock row being at each alert level
+
+    Args:
+        prefix: Lookup path to the Stock row (e.g. `stock__` from StockAlert)
+
+    Returns:
+        Mapping of alert type to condition, most severe first. OUT_OF_STOCK
+        at zero or below, CRITICAL at 30% of the threshold or less,
+        LOW_STOCK up to the threshold.
+    """
+    available, threshold = available_expression(prefix), F(f'{prefix}low_stock_threshold')
+    return {
+        StockAlert.AlertType.OUT_OF_STOCK: LessThanOrEqual(available, 0),
+        # available <= threshold * 0.3, kept in integers
+        StockAlert.AlertType.CRITICAL: LessThanOrEqual(available * 10, threshold * 3),
+        StockAlert.AlertType.LOW_STOCK: LessThanOrEqual(available, threshold),
+    }
+
 
-class StockAlert(models.Model):
-    """Stock alert notifications"""
-    
-    class AlertType(models.TextChoices):
-        LOW_STOCK = 'LOW_STOCK', 'Low Stock'
-        OUT_OF_STOCK = 'OUT_OF_STOCK', 'Out of Stock'
-        CRITICAL = 'CRITICAL', 'Critical Level'
-    
-    class AlertStatus(models.TextChoices):
-        ACTIVE = 'ACTIVE', 'Active'
-        ACKNOWLEDGED = 'ACKNOWLEDGED', 'Acknowledged'
-        RESOLVED = 'RESOLVED', 'Resolved'
-    
-    stock = models.ForeignKey('inventory.Stock', on_delete=models.CASCADE, related_name='alerts')
-    alert_type = models.CharField(max_length=20, choices=AlertType.choices)
-    status = models.CharField(max_length=20, choices=AlertStatus.choices, default=AlertStatus.ACTIVE)
-    
-    # Alert details
-    current_quantity = models.IntegerField()
-    threshold_quantity = models.IntegerField()
-    message = models.TextField()
-    
-    # Notification tracking
-    email_sent = models.BooleanField(default=False)
-    sms_sent = models.BooleanField(default=False)
-    notification_count = models.IntegerField(default=0)
-    last_notified_at = models.DateTimeField(null=True, blank=True)
-    
-    # Resolution
-    resolved_at = models.DateTimeField(null=True, blank=True)
-    resolved_by = models.ForeignKey(
-        settings.AUTH_USER_MODEL,
-        on_delete=models.SET_NULL,
-        null=True,
-        blank=True,
-        related_name='resolved_alerts'
+def alert_level_expression():
+    """SQL expression for a Stock row's alert level (NULL when stock is fine)"""
+    return Case(
+        *(When(condition, then=Value(alert_type)) for alert_type, condition in level_conditions().items()),
+        default=Value(None),
+        output_field=CharField(),
     )
-    resolution_notes = models.TextField(blank=True)
-    
-    # Metadata
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-    
-    class Meta:
-        ordering = ['-created_at']
-        indexes = [
-            models.Index(fields=['status', '-created_at']),
-            models.Index(fields=['stock', 'status']),
-        ]
-    
-    def __str__(self):
-        return f"{self.alert_type} - {self.stock.variant.product.name} at {self.stock.warehouse.name}"
-    
-    def send_email_notification(self, recipients=None):
-        """Send email notification for this alert"""
-        if recipients is None:
-            # Default to warehouse manager and admins
-            from users.models import User
-            recipients = []
-            
-            # Add warehouse manager if exists
-            if self.stock.warehouse.email:
-                recipients.append(self.stock.warehouse.email)
-            
-            # Add admin emails
-            admin_users = User.objects.filter(role='ADMIN', is_active=True)
-            recipients.extend([user.email for user in admin_users if user.email])
-        
-        if not recipients:
-            logger.warning(f"No recipients found for stock alert {self.id}")
-            return False
-        
-        subject = f"🚨 {self.alert_type} Alert: {self.stock.variant.product.name}"
-        message = self.get_email_body()
-        
-        try:
-            send_mail(
-                subject=subject,
+
+
+def alert_message(alert_type, available, threshold, warehouse_name):
+    if alert_type == StockAlert.AlertType.OUT_OF_STOCK:
+        return f"Product is out of stock at {warehouse_name}"
+    if alert_type == StockAlert.AlertType.CRITICAL:
+        return f"Critical stock level: {available} units remaining (threshold: {threshold})"
+    return f"Low stock level: {available} units remaining (threshold: {threshold})"
+
+
+def _sync_batch(rows, stats):
+    """
+    Create or refresh the open alerts for a batch of flagged Stock rows
+
+    Returns:
+        List of the Stock ids in the batch
+    """
+    stock_ids = [row['id'] for row in rows]
+    open_alerts = {
+        (alert.stock_id, alert.alert_type): alert
+        for alert in StockAlert.objects.filter(
+            stock_id__in=stock_ids, status__in=StockAlert.OPEN_STATUSES,
+        ).only('pk', 'stock_id', 'alert_type', 'current_quantity', 'threshold_quantity', 'message')
+    }
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for row in rows:
+        alert_type, available, threshold = row['level'], row['available'], row['low_stock_threshold']
+        stats[LEVEL_STATS[alert_type]] += 1
+        message = alert_message(alert_type, available, threshold, row['warehouse__name'])
+        alert = open_alerts.get((row['id'], alert_type))
+        if alert is None:
+            to_create.append(StockAlert(
+                stock_id=row['id'],
+                alert_type=alert_type,
+                current_quantity=available,
+                threshold_quantity=threshold,
                 message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=recipients,
-                fail_silently=False,
-            )
-            
-            self.email_sent = True
-            self.notification_count += 1
-            self.last_notified_at = timezone.now()
-            self.save()
-            
-            logger.info(f"Stock alert email sent for {self.stock}")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to send stock alert email: {e}")
-            return False
-    
-    def get_email_body(self):
-        """Generate email body for alert"""
-        variant = self.stock.variant
-        product = variant.product
-        warehouse = self.stock.warehouse
-        
-        body = f"""
-Stock Alert Notification
-=========================
-
-Alert Type: {self.get_alert_type_display()}
-Status: {self.get_status_display()}
-
-Product Details:
-- Product: {product.name}
-- Variant: {variant.storage} - {variant.color}
-- SKU: {variant.id}
-
-Stock Information:
-- Warehouse: {warehouse.name} ({warehouse.code})
-- Current Quantity: {self.current_quantity}
-- Threshold: {self.threshold_quantity}
-- Reserved: {self.stock.reserved_quantity}
-
-Message:
-{self.message}
-
-Action Required:
-Please review and restock this item as soon as possible to avoid stockouts.
-
-Alert Created: {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}
-
----
-This is an automated notification from the Electric Store Management System.
-        """.strip()
-        
-        return body
-    
-    def acknowledge(self, user=None):
-        """Mark alert as acknowledged"""
-        self.status = self.AlertStatus.ACKNOWLEDGED
-        self.save()
-        logger.info(f"Alert {self.id} acknowledged by {user}")
-    
-    def resolve(self, user=None, notes=''):
-        """Mark alert as resolved"""
-        self.status = self.AlertStatus.RESOLVED
-        self.resolved_at = timezone.now()
-        self.resolved_by = user
-        self.resolution_notes = notes
-        self.save()
-        logger.info(f"Alert {self.id} resolved by {user}")
+            ))
+        elif (alert.current_quantity, alert.threshold_quantity) != (available, threshold):
+            alert.current_quantity, alert.threshold_quantity, alert.message = available, threshold, message
+            alert.updated_at = now
+            to_update.append(alert)
+
+    StockAlert.objects.bulk_create(to_create)
+    StockAlert.objects.bulk_update(
+        to_update, ['current_quantity', 'threshold_quantity', 'message', 'updated_at'],
+    )
+    stats['alerts_created'] += len(to_create)
+    stats['alerts_updated'] += len(to_update)
+    return stock_ids
+
+
+def _new_stats():
+    return dict.fromkeys(
+        ['low_stock', 'critical', 'out_of_stock', 'alerts_created', 'alerts_updated', 'notifications_queued'], 0,
+    )
+
+
+def _evaluate(scope, stats, notify, batch_size, now):
+    """Sync the alerts of the flagged rows in a Stock queryset, batch by batch"""
+    flagged = scope.annotate(level=alert_level_expression()).exclude(level=None).annotate(
+        available=available_expression(),
+    ).values('id', 'level', 'available', 'low_stock_threshold', 'warehouse__name')
+    stock_ids = []
+    for rows in iter_batches(flagged, batch_size):
+        stock_ids.extend(_sync_batch(rows, stats))
+
+    if notify and stock_ids:
+        stats['notifications_queued'] = sum(
+            enqueue_alert_notifications(StockAlert.objects.filter(stock_id__in=stock_ids[i:i + batch_size]), now)
+            for i in range(0, len(stock_ids), batch_size)
+        )
+
+
+def evaluate_stock_alerts(incremental=False, notify=True, batch_size=BATCH_SIZE):
+    """
+    Create or refresh alerts for low and out of stock rows
+
+    Args:
+        incremental: Only re-evaluate Stock rows updated since the last run
+            (falls back to a full run when there is none)
+        notify: Queue notifications for new alerts and stale ones
+        batch_size: Flagged rows diffed and written per batch
+
+    Returns:
+        StockAlertRun: The recorded run
+    """
+    started_at = timezone.now()
+    started = time.perf_counter()
+
+    scope = Stock.objects.filter(variant__is_active=True, warehouse__is_active=True)
+    since = None
+    if incremental:
+        previous = StockAlertRun.objects.order_by('-started_at').first()
+        since = previous.started_at if previous else None
+        if since is not None:
+            scope = scope.filter(updated_at__gte=since)
+    stats = _new_stats()
+    rows_scanned = scope.aggregate(rows=Count('pk'))['rows']
+    _evaluate(scope, stats, notify, batch_size, started_at)
+
+    run = StockAlertRun.objects.create(
+        mode=StockAlertRun.Mode.INCREMENTAL if since is not None else StockAlertRun.Mode.FULL,
+        started_at=started_at,
+        since=since,
+        duration_ms=int((time.perf_counter() - started) * 1000),
+        rows_scanned=rows_scanned,
+        low_stock=stats['low_stock'],
+        critical=stats['critical'],
+        out_of_stock=stats['out_of_stock'],
+        alerts_created=stats['alerts_created'],
+        alerts_updated=stats['alerts_updated'],
+        notifications_queued=stats['notifications_queued'],
+    )
+    logger.info(
+        f"Stock alert {run.mode.lower()} run: {rows_scanned} rows scanned in {run.duration_ms}ms, "
+        f"{run.alerts_created} alerts created, {run.alerts_updated} updated"
+    )
+    return run
 
 
 def check_stock_levels():
     """
     Check all stock levels and create alerts for low/out of stock items
     This should be run as a periodic task (celery beat or cron)
-    
+
     Returns:
         Dict with statistics of alerts created
     """
-    from inventory.models import Stock
-    
+    run = evaluate_stock_alerts()
     stats = {
-        'checked': 0,
-        'low_stock': 0,
-        'out_of_stock': 0,
-        'critical': 0,
-        'notifications_sent': 0,
+        'checked': run.rows_scanned,
+        'low_stock': run.low_stock,
+        'out_of_stock': run.out_of_stock,
+        'critical': run.critical,
+        'notifications_queued': run.notifications_queued,
     }
-    
-    # Get all active stock records
-    stocks = Stock.objects.filter(
-        variant__is_active=True,
-        warehouse__is_active=True
-    ).select_related('variant__product', 'warehouse')
-    
-    for stock in stocks:
-        stats['checked'] += 1
-        
-        # Calculate available quantity (total - reserved)
-        available = stock.quantity - stock.reserved_quantity
-        
-        # Determine alert type
-        alert_type = None
-        message = None
-        
-        if available <= 0:
-            alert_type = StockAlert.AlertType.OUT_OF_STOCK
-            message = f"Product is out of stock at {stock.warehouse.name}"
-            stats['out_of_stock'] += 1
-        elif available <= (stock.low_stock_threshold * 0.3):
-            # Critical: 30% or less of threshold
-            alert_type = StockAlert.AlertType.CRITICAL
-            message = f"Critical stock level: {available} units remaining (threshold: {stock.low_stock_threshold})"
-            stats['critical'] += 1
-        elif available <= stock.low_stock_threshold:
-            alert_type = StockAlert.AlertType.LOW_STOCK
-            message = f"Low stock level: {available} units remaining (threshold: {stock.low_stock_threshold})"
-            stats['low_stock'] += 1
-        
-        if alert_type:
-            # Check if active alert already exists
-            existing_alert = StockAlert.objects.filter(
-                stock=stock,
-                status=StockAlert.AlertStatus.ACTIVE,
-                alert_type=alert_type
-            ).first()
-            
-            if existing_alert:
-                # Update existing alert
-                existing_alert.current_quantity = available
-                existing_alert.message = message
-                existing_alert.save()
-                
-                # Resend notification if it's been more than 24 hours
-                if existing_alert.last_notified_at:
-                    hours_since_notification = (timezone.now() - existing_alert.last_notified_at).total_seconds() / 3600
-                    if hours_since_notification >= 24:
-                        if existing_alert.send_email_notification():
-                            stats['notifications_sent'] += 1
-            else:
-                # Create new alert
-                alert = StockAlert.objects.create(
-                    stock=stock,
-                    alert_type=alert_type,
-                    current_quantity=available,
-                    threshold_quantity=stock.low_stock_threshold,
-                    message=message
-                )
-                
-                # Send notification
-                if alert.send_email_notification():
-                    stats['notifications_sent'] += 1
-    
     logger.info(f"Stock level check complete: {stats}")
     return stats
 
 
+def resolve_recovered_alerts(stock_ids=None, now=None):
+    """
+    Resolve every open alert whose stock is back above its level
+
+    One UPDATE per alert type (MySQL reads the matching ids first, so at
+    most two statements each), joined to Stock in SQL.
+
+    Args:
+        stock_ids: Only look at alerts of these Stock rows, e.g. right after
+            writing them (default: all open alerts)
+        now: Resolution time (default: now)
+
+    Returns:
+        Dict mapping alert type to the number of alerts resolved
+    """
+    now = now or timezone.now()
+    alerts = StockAlert.objects.filter(status__in=StockAlert.OPEN_STATUSES)
+    if stock_ids is not None:
+        alerts = alerts.filter(stock_id__in=set(stock_ids))
+    current = Stock.objects.filter(pk=OuterRef('stock_id')).annotate(
+        available=available_expression(),
+    ).values('available')
+
+    resolved = {}
+    for alert_type, condition in level_conditions('stock__').items():
+        resolved[alert_type] = alerts.filter(alert_type=alert_type).exclude(condition).update(
+            status=StockAlert.AlertStatus.RESOLVED,
+            current_quantity=Subquery(current, output_field=IntegerField()),
+            resolved_at=now,
+            resolution_notes='Auto-resolved: Stock level restored',
+            updated_at=now,
+        )
+    return resolved
+
+
 def auto_resolve_alerts():
     """
     Automatically resolve alerts when stock levels are restored
     This should be run as a periodic task
-    
+
     Returns:
         Int: Number of alerts auto-resolved
     """
-    resolved_count = 0
-    
-    # Get all active alerts
-    active_alerts = StockAlert.objects.filter(
-        status__in=[StockAlert.AlertStatus.ACTIVE, StockAlert.AlertStatus.ACKNOWLEDGED]
-    ).select_related('stock')
-    
-    
-    for alert in active_alerts:
-        stock = alert.stock
-        available = stock.quantity - stock.reserved_quantity
-        
-        # Check if stock is back above threshold
-        should_resolve = False
-        
-        if alert.alert_type == StockAlert.AlertType.OUT_OF_STOCK:
-            should_resolve = available > 0
-        elif alert.alert_type == StockAlert.AlertType.CRITICAL:
-            should_resolve = available > (stock.low_stock_threshold * 0.3)
-        elif alert.alert_type == StockAlert.AlertType.LOW_STOCK:
-            should_resolve = available > stock.low_stock_threshold
-        
-        if should_resolve:
-            alert.resolve(notes=f'Auto-resolved: Stock level restored to {available} units')
-            resolved_count += 1
-    
+    resolved_count = sum(resolve_recovered_alerts().values())
     if resolved_count > 0:
         logger.info(f"Auto-resolved {resolved_count} stock alerts")
-    
+
     return resolved_count
 
 
-# Add this model to inventory app's models.py
-StockAlert._meta.app_label = 'inventory'
+@transaction.atomic
+def check_stock_alerts_for(stock_ids, notify=True, batch_size=BATCH_SIZE):
+    """
+    Resolve and evaluate the alerts of just these Stock rows
+
+    Returns:
+        Dict with the alerts resolved, created and updated, and the
+        notifications queued
+    """
+    stock_ids = list(stock_ids)
+    now = timezone.now()
+    stats = _new_stats()
+    stats['resolved'] = sum(resolve_recovered_alerts(stock_ids, now).values())
+    for i in range(0, len(stock_ids), batch_size):
+        scope = Stock.objects.filter(
+            pk__in=stock_ids[i:i + batch_size], variant__is_active=True, warehouse__is_active=True,
+        )
+        _evaluate(scope, stats, notify, batch_size, now)
+    return stats
+
+
+class _PendingAlertCheck:
+    """The Stock rows written in a transaction, checked by `run` on commit"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.stock_ids = set()
+
+    def run(self):
+        # Writes made from here on belong to a new check
+        if getattr(self.connection, 'pending_stock_alert_check', None) is self:
+            self.connection.pending_stock_alert_check = None
+        check_stock_alerts_for(sorted(self.stock_ids))
+
+    def is_scheduled(self):
+        """Still waiting for the commit, i.e. not run nor dropped by a rollback"""
+        return any(callback == self.run for _, callback, _ in self.connection.run_on_commit)
+
+
+def schedule_stock_alert_check(stock_ids, using=None):
+    """
+    Check the alerts of Stock rows once the current transaction commits
+
+    The first call in an atomic block registers one on-commit check and
+    later calls add their rows to it, so a burst of writes is evaluated
+    together. A rollback that drops the check drops its rows too; the next
+    write registers a new one. Outside a transaction the check runs right
+    away. Failures are logged rather than raised: the stock write itself
+    has already been committed and the periodic run catches up.
+    """
+    stock_ids = set(stock_ids)
+    if not stock_ids:
+        return
+    connection = transaction.get_connection(using)
+    pending = getattr(connection, 'pending_stock_alert_check', None)
+    if pending is not None and pending.is_scheduled():
+        pending.stock_ids.update(stock_ids)
+        return
+    pending = connection.pending_stock_alert_check = _PendingAlertCheck(connection)
+    pending.stock_ids.update(stock_ids)
+    transaction.on_commit(pending.run, using=using, robust=True)
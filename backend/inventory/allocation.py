@@ -0,0 +1,179 @@
+"""
+Warehouse allocation
+
+Decides which warehouses ship an order. The availability of every ordered
+variant in every active warehouse is read with one query, then warehouses
+are picked greedily:
+
+1. the warehouse that can ship the most of the remaining lines in full
+   (fewest split shipments; a warehouse holding the whole order wins
+   outright),
+2. then the one covering the most remaining units,
+3. then the nearest to the shipping address,
+4. then the cheapest (`Warehouse.shipping_cost`),
+
+and takes everything it can of the remaining lines. Each round only walks
+the lines still open, so thousands of SKUs over dozens of warehouses
+are planned in milliseconds.
+
+Warehouses have no coordinates, so distance is a rank derived from the
+address: same postal code, same postal prefix, same state, same country,
+elsewhere.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from .models import Stock
+
+# Leading postal code characters treated as the same delivery area
+POSTAL_PREFIX_LENGTH = 3
+
+CANDIDATE_FIELDS = (
+    'pk', 'warehouse_id', 'variant_id', 'quantity', 'reserved_quantity', 'warehouse__is_active',
+    'warehouse__state', 'warehouse__postal_code', 'warehouse__country', 'warehouse__shipping_cost',
+)
+
+
+def _normalize(value) -> str:
+    return (value or '').strip().upper()
+
+
+def distance_rank(warehouse: Dict, destination: Dict) -> int:
+    """
+    Rank how near a warehouse is to a destination (0 is nearest)
+
+    Args:
+        warehouse: Dict with `state`, `postal_code` and `country`
+        destination: Dict with the same keys for the shipping address
+    """
+    if _normalize(warehouse['country']) != _normalize(destination.get('country') or warehouse['country']):
+        return 4
+    postal_code, target = _normalize(warehouse['postal_code']), _normalize(destination.get('postal_code'))
+    if postal_code and postal_code == target:
+        return 0
+    if postal_code[:POSTAL_PREFIX_LENGTH] and postal_code[:POSTAL_PREFIX_LENGTH] == target[:POSTAL_PREFIX_LENGTH]:
+        return 1
+    if _normalize(warehouse['state']) and _normalize(warehouse['state']) == _normalize(destination.get('state')):
+        return 2
+    return 3
+
+
+def load_candidates(variant_ids: Iterable[str], lock: bool = False):
+    """
+    Read the warehouse availability of variants in one query
+
+    Args:
+        variant_ids: Variants to look up
+        lock: Lock the Stock rows (not their warehouses) for update
+
+    Returns:
+        Tuple of (warehouses, stocked) where `warehouses` maps each active
+        warehouse id to its details and `{variant_id: (stock_id, available)}`,
+        and `stocked` is the set of variants with any Stock row at all
+    """
+    queryset = Stock.objects.filter(variant_id__in=set(variant_ids)).order_by('variant_id', 'warehouse_id')
+    if lock:
+        queryset = queryset.select_for_update(of=('self',))
+
+    warehouses, stocked = {}, set()
+    for (pk, warehouse_id, variant_id, quantity, reserved, is_active,
+         state, postal_code, country, shipping_cost) in queryset.values_list(*CANDIDATE_FIELDS):
+        stocked.add(variant_id)
+        if not is_active:
+            continue
+        warehouse = warehouses.get(warehouse_id)
+        if warehouse is None:
+            warehouse = warehouses[warehouse_id] = {
+                'id': warehouse_id, 'state': state, 'postal_code': postal_code,
+                'country': country, 'shipping_cost': shipping_cost or Decimal('0'), 'stock': {},
+            }
+        available = quantity - reserved
+        if available > 0:
+            warehouse['stock'][variant_id] = (pk, available)
+    return warehouses, stocked
+
+
+def plan_allocation(quantities: Dict[str, int], warehouses: Dict[int, Dict],
+                    destination: Optional[Dict] = None) -> Tuple[Dict[int, int], Dict[str, int]]:
+    """
+    Split order lines over warehouses, fewest shipments first
+
+    Args:
+        quantities: Mapping of variant id to units ordered
+        warehouses: Candidates as returned by `load_candidates`
+        destination: Shipping address (`state`, `postal_code`, `country`)
+
+    Returns:
+        Tuple of (units, shortfalls): `{stock_id: units}` to take, and
+        `{variant_id: available}` for lines the warehouses cannot cover
+        (when there are shortfalls, `units` is empty)
+    """
+    destination = destination or {}
+    totals = defaultdict(int)
+    for warehouse in warehouses.values():
+        for variant_id, (_, available) in warehouse['stock'].items():
+            totals[variant_id] += available
+    shortfalls = {
+        variant_id: totals[variant_id]
+        for variant_id, quantity in quantities.items() if totals[variant_id] < quantity
+    }
+    if shortfalls:
+        return {}, shortfalls
+
+    remaining = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+    ranks = {pk: distance_rank(warehouse, destination) for pk, warehouse in warehouses.items()}
+    candidates = dict(warehouses)
+    units = {}
+    while remaining:
+        best_key, best = None, None
+        for pk, warehouse in candidates.items():
+            full_lines = covered = 0
+            stock = warehouse['stock']
+            # Walk whichever side is smaller; late rounds only have a few lines left
+            if len(remaining) < len(stock):
+                pairs = ((stock[v][1], wanted) for v, wanted in remaining.items() if v in stock)
+            else:
+                pairs = ((available, remaining[v]) for v, (_, available) in stock.items() if v in remaining)
+            for available, wanted in pairs:
+                covered += min(available, wanted)
+                full_lines += available >= wanted
+            if not covered:
+                continue
+            key = (-full_lines, -covered, ranks[pk], warehouse['shipping_cost'], pk)
+            if best_key is None or key < best_key:
+                best_key, best = key, warehouse
+        del candidates[best['id']]
+
+        for variant_id, (stock_id, available) in best['stock'].items():
+            wanted = remaining.get(variant_id)
+            if not wanted:
+                continue
+            taken = min(available, wanted)
+            units[stock_id] = taken
+            if taken == wanted:
+                del remaining[variant_id]
+            else:
+                remaining[variant_id] = wanted - taken
+    return units, {}
+
+
+def allocate(quantities: Dict[str, int], destination: Optional[Dict] = None,
+             lock: bool = False) -> Tuple[Dict[int, int], Dict[str, int], set]:
+    """
+    Load availability and plan an order's warehouse allocation
+
+    Variants without any Stock row are left out of the plan; the caller
+    handles them from `ProductVariant.stock` alone.
+
+    Returns:
+        Tuple of (units, shortfalls, stocked variant ids), see `plan_allocation`
+    """
+    warehouses, stocked = load_candidates(quantities.keys(), lock=lock)
+    units, shortfalls = plan_allocation(
+        {variant_id: quantity for variant_id, quantity in quantities.items() if variant_id in stocked},
+        warehouses,
+        destination,
+    )
+    return units, shortfalls, stocked
+
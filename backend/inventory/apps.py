@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inventory'
+
+    def ready(self):
+        # Keep ProductVariant/Product stock rollups in sync with Stock writes
+        from inventory import signals  # noqa: F401
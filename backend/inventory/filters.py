@@ -0,0 +1,20 @@
+"""
+Custom filters for inventory
+"""
+from django_filters import rest_framework as filters
+
+from .models import StockAlert
+
+
+class StockAlertFilter(filters.FilterSet):
+    """Stock alert filters; `is_resolved` predates `status` and maps onto it"""
+    is_resolved = filters.BooleanFilter(method='filter_is_resolved')
+
+    class Meta:
+        model = StockAlert
+        fields = ['alert_type', 'status', 'stock__warehouse', 'is_resolved']
+
+    def filter_is_resolved(self, queryset, name, value):
+        if value:
+            return queryset.filter(status=StockAlert.AlertStatus.RESOLVED)
+        return queryset.exclude(status=StockAlert.AlertStatus.RESOLVED)
@@ -0,0 +1,358 @@
+"""
+Stock import (purchase order) creation and receiving
+
+`create_import` builds an import from a supplier manifest of any size: the
+lines are parsed in one pass, every SKU is resolved with a single
+`in_bulk`, all invalid lines and missing SKUs are reported together
+(`ManifestError`), and the items are bulk-created with Decimal totals.
+
+`receive_import` books a delivery against an import in a fixed number of
+statements whatever its size:
+
+1. every line is validated against the import's items, read in one query,
+   and all problems are reported together (`ReceiptError`);
+2. `StockImportItem.quantity_received` is set with one CASE update;
+3. the warehouse `Stock` rows are upserted with one
+   `bulk_create(update_conflicts=True)` (the existing rows are locked first,
+   so the new totals are exact) and IMPORT movements are bulk-created;
+4. the import status is computed in SQL from the items left outstanding.
+
+Line quantities are the item's cumulative received total, as on the
+import's receiving form: re-sending a line with the same total is a no-op
+and only the difference is added to stock.
+"""
+import csv
+import io
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Value, When
+from django.utils import timezone
+
+from core.db import conflict_target, value_per_pk
+from .alerts import schedule_stock_alert_check
+from products.models import ProductVariant
+from .models import Stock, StockImport, StockImportItem, StockMovement
+from .rollup import refresh_stock_rollup
+
+# Column names accepted in manifest and receiving CSV files
+ITEM_COLUMNS = ('item_id', 'item')
+VARIANT_COLUMNS = ('variant_id', 'variant', 'sku')
+QUANTITY_COLUMNS = ('quantity_received', 'quantity', 'received')
+ORDERED_COLUMNS = ('quantity_ordered', 'quantity', 'qty')
+COST_COLUMNS = ('unit_cost', 'cost', 'price')
+
+# Items inserted per statement when creating an import
+ITEM_BATCH_SIZE = 1000
+
+CENT = Decimal('0.01')
+# StockImportItem.unit_cost / total_cost precision
+MAX_UNIT_COST = Decimal('1e8')
+MAX_ITEM_COST = Decimal('1e10')
+
+
+class ImportLineError(Exception):
+    """Raised with every invalid line of a manifest or receipt"""
+    kind = 'import'
+
+    def __init__(self, errors: List[Dict]):
+        self.errors = errors
+        super().__init__(f'{len(errors)} invalid {self.kind} lines')
+
+
+class ManifestError(ImportLineError):
+    """Raised when manifest lines are invalid or name unknown SKUs"""
+    kind = 'manifest'
+
+    def __init__(self, errors: List[Dict], missing_skus: Optional[List[str]] = None):
+        self.missing_skus = missing_skus or []
+        super().__init__(errors)
+
+
+class ReceiptError(ImportLineError):
+    """Raised when receiving lines do not match the import"""
+    kind = 'receiving'
+
+
+def _column(row: Dict, names) -> str:
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ''):
+            return value.strip()
+    return ''
+
+
+def _csv_rows(file) -> Iterator[Dict]:
+    if isinstance(file, (bytes, str)):
+        text = io.StringIO(file.decode('utf-8-sig') if isinstance(file, bytes) else file)
+    else:
+        text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    for row in csv.DictReader(text):
+        yield {(key or '').strip().lower(): value for key, value in row.items()}
+
+
+def read_manifest_csv(file) -> Iterator[Dict]:
+    """
+    Yield manifest lines from a CSV file, row by row
+
+    The header names the variant (`variant_id` / `sku`), the quantity
+    (`quantity_ordered` / `quantity`) and the `unit_cost`.
+    """
+    for row in _csv_rows(file):
+        yield {
+            'variant_id': _column(row, VARIANT_COLUMNS),
+            'quantity_ordered': _column(row, ORDERED_COLUMNS),
+            'unit_cost': _column(row, COST_COLUMNS),
+        }
+
+
+def read_receipt_csv(file) -> Iterator[Dict]:
+    """
+    Yield receiving lines from a CSV upload, row by row
+
+    The header names the item (`item_id`) or the variant (`variant_id` /
+    `sku`) and the quantity (`quantity_received` / `quantity`).
+    """
+    for row in _csv_rows(file):
+        yield {
+            'item_id': _column(row, ITEM_COLUMNS),
+            'variant_id': _column(row, VARIANT_COLUMNS),
+            'quantity_received': _column(row, QUANTITY_COLUMNS),
+        }
+
+
+def _parse_manifest(lines: Iterable[Dict]):
+    """
+    Parse manifest lines in one pass
+
+    Returns:
+        Tuple of (parsed, errors, line numbers by variant id) where `parsed`
+        holds `(line, variant_id, quantity, unit_cost)` for the valid lines
+    """
+    parsed, errors, seen = [], [], {}
+    for number, line in enumerate(lines, start=1):
+        variant_id = str(line.get('variant_id') or '').strip()
+        if not variant_id:
+            errors.append({'line': number, 'error': 'Missing variant_id'})
+            continue
+        if variant_id in seen:
+            errors.append({'line': number, 'error': f'SKU {variant_id} is already on line {seen[variant_id]}'})
+            continue
+        seen[variant_id] = number
+        try:
+            quantity = int(line.get('quantity_ordered'))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity < 1:
+            message = f"Invalid quantity {line.get('quantity_ordered')!r} for {variant_id}"
+            errors.append({'line': number, 'error': message})
+            continue
+        try:
+            unit_cost = Decimal(str(line.get('unit_cost'))).quantize(CENT, rounding=ROUND_HALF_UP)
+        except (InvalidOperation, ValueError):
+            unit_cost = None
+        if unit_cost is None or not 0 <= unit_cost < MAX_UNIT_COST or unit_cost * quantity >= MAX_ITEM_COST:
+            message = f"Invalid unit cost {line.get('unit_cost')!r} for {variant_id}"
+            errors.append({'line': number, 'error': message})
+            continue
+        parsed.append((number, variant_id, quantity, unit_cost))
+    return parsed, errors, seen
+
+
+@transaction.atomic
+def create_import(warehouse, lines: Iterable[Dict], supplier=None, order_date=None, expected_date=None,
+                  notes: str = '', user=None, batch_size: int = ITEM_BATCH_SIZE) -> StockImport:
+    """
+    Create a stock import with its items from manifest lines
+
+    Args:
+        warehouse: Receiving Warehouse
+        lines: Dicts with `variant_id`, `quantity_ordered` and `unit_cost`,
+            consumed once (a CSV reader can be passed straight in)
+        supplier: Supplier, if known
+        order_date: Defaults to today
+        batch_size: Items inserted per statement
+
+    Returns:
+        StockImport: The new import, with `total_cost` set
+
+    Raises:
+        ManifestError: Listing every invalid line and every unknown or
+            inactive SKU
+    """
+    parsed, errors, line_of = _parse_manifest(lines)
+    variants = ProductVariant.objects.only('pk', 'is_active').in_bulk(list(line_of))
+    missing = sorted((sku for sku in line_of if sku not in variants), key=line_of.get)
+    errors += [{'line': line_of[sku], 'error': f'Unknown SKU {sku}'} for sku in missing]
+    errors += [
+        {'line': line_of[sku], 'error': f'SKU {sku} is inactive'}
+        for sku, variant in variants.items() if not variant.is_active
+    ]
+    if not parsed and not errors:
+        errors.append({'line': 0, 'error': 'The manifest has no lines'})
+    if errors:
+        raise ManifestError(sorted(errors, key=lambda error: error['line']), missing)
+
+    items = [
+        StockImportItem(
+            variant_id=variant_id, quantity_ordered=quantity,
+            unit_cost=unit_cost, total_cost=unit_cost * quantity,
+        )
+        for _, variant_id, quantity, unit_cost in parsed
+    ]
+    stock_import = StockImport.objects.create(
+        warehouse=warehouse,
+        supplier=supplier,
+        order_date=order_date or timezone.now().date(),
+        expected_date=expected_date,
+        notes=notes,
+        created_by=user,
+        total_cost=sum((item.total_cost for item in items), Decimal('0')),
+    )
+    for item in items:
+        item.stock_import = stock_import
+    StockImportItem.objects.bulk_create(items, batch_size=batch_size)
+    return stock_import
+
+
+def _validate(stock_import, lines: Iterable[Dict]) -> Dict[int, Tuple[str, int, int]]:
+    """
+    Match lines to the import's items
+
+    Returns:
+        Mapping of each changed item id to its (variant id, previous
+        received total, new received total)
+
+    Raises:
+        ReceiptError: Listing every invalid line
+    """
+    items, by_variant = {}, {}
+    for pk, variant_id, ordered, received in StockImportItem.objects.filter(
+        stock_import=stock_import,
+    ).values_list('pk', 'variant_id', 'quantity_ordered', 'quantity_received'):
+        items[pk] = (variant_id, ordered, received)
+        # A variant ordered on several lines must be received by item id
+        by_variant[variant_id] = None if variant_id in by_variant else pk
+
+    errors, totals = [], {}
+    for number, line in enumerate(lines, start=1):
+        def error(message):
+            errors.append({'line': number, 'error': message})
+
+        item_id, variant_id = line.get('item_id'), line.get('variant_id')
+        try:
+            pk = int(item_id) if item_id not in (None, '') else by_variant.get(str(variant_id or ''), 0)
+        except (TypeError, ValueError):
+            pk = 0
+        if pk is None:
+            error(f'Variant {variant_id} is on several items; give the item id')
+            continue
+        if pk not in items:
+            error(f'Item {item_id or variant_id} is not part of import {stock_import.import_number}')
+            continue
+        if pk in totals:
+            error(f'Item {pk} is listed more than once')
+            continue
+        try:
+            quantity = int(line.get('quantity_received'))
+        except (TypeError, ValueError):
+            error(f"Invalid quantity {line.get('quantity_received')!r} for item {pk}")
+            continue
+        _, ordered, received = items[pk]
+        if quantity > ordered:
+            error(f'Received quantity exceeds ordered quantity for item {pk}')
+        elif quantity < received:
+            error(f'Item {pk} already has {received} units received')
+        else:
+            totals[pk] = quantity
+    if not totals and not errors:
+        errors.append({'line': 0, 'error': 'No lines to receive'})
+    if errors:
+        raise ReceiptError(errors)
+    return {
+        pk: (items[pk][0], items[pk][2], quantity)
+        for pk, quantity in totals.items() if quantity != items[pk][2]
+    }
+
+
+@transaction.atomic
+def receive_import(stock_import, lines: Iterable[Dict], user=None) -> Dict[str, int]:
+    """
+    Book received units of an import into its warehouse
+
+    Args:
+        stock_import: The StockImport being received
+        lines: Dicts with `item_id` (or `variant_id`) and `quantity_received`
+        user: Who received it, recorded on the movements
+
+    Returns:
+        Dict with the items changed and the units added to stock
+
+    Raises:
+        ReceiptError: If the import is closed or any line is invalid
+    """
+    stock_import = StockImport.objects.select_for_update(of=('self',)).select_related('supplier').get(
+        pk=stock_import.pk,
+    )
+    if stock_import.status in (StockImport.ImportStatus.RECEIVED, StockImport.ImportStatus.CANCELLED):
+        raise ReceiptError([{'line': 0, 'error': f'Stock import already {stock_import.status.lower()}'}])
+
+    changed = _validate(stock_import, lines)
+    now = timezone.now()
+    added = {}
+    if changed:
+        StockImportItem.objects.filter(pk__in=changed).update(
+            quantity_received=value_per_pk({pk: total for pk, (_, _, total) in changed.items()}),
+        )
+        for variant_id, previous, total in changed.values():
+            added[variant_id] = added.get(variant_id, 0) + total - previous
+
+        warehouse_id = stock_import.warehouse_id
+        current = dict(
+            Stock.objects.select_for_update().filter(
+                warehouse_id=warehouse_id, variant_id__in=added,
+            ).order_by('pk').values_list('variant_id', 'quantity')
+        )
+        Stock.objects.bulk_create(
+            [
+                Stock(
+                    warehouse_id=warehouse_id, variant_id=variant_id,
+                    quantity=current.get(variant_id, 0) + units, last_restocked_at=now,
+                )
+                for variant_id, units in sorted(added.items())
+            ],
+            update_conflicts=True,
+            unique_fields=conflict_target(['warehouse', 'variant']),
+            update_fields=['quantity', 'last_restocked_at', 'updated_at'],
+        )
+        supplier = stock_import.supplier.name if stock_import.supplier_id else 'supplier'
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                warehouse_id=warehouse_id,
+                variant_id=variant_id,
+                movement_type=StockMovement.MovementType.IMPORT,
+                quantity=total - previous,
+                reference_number=stock_import.import_number,
+                notes=f'Stock import from {supplier}',
+                created_by=user,
+            )
+            for _, (variant_id, previous, total) in sorted(changed.items())
+        ])
+        refresh_stock_rollup(added)
+        schedule_stock_alert_check(Stock.objects.filter(
+            warehouse_id=warehouse_id, variant_id__in=added,
+        ).order_by().values_list('pk', flat=True))
+
+    outstanding = StockImportItem.objects.filter(
+        stock_import=OuterRef('pk'), quantity_received__lt=F('quantity_ordered'),
+    )
+    StockImport.objects.filter(pk=stock_import.pk).update(
+        status=Case(
+            When(Exists(outstanding), then=Value(StockImport.ImportStatus.PARTIALLY_RECEIVED)),
+            default=Value(StockImport.ImportStatus.RECEIVED),
+        ),
+        received_date=now.date(),
+        updated_at=now,
+    )
+    return {'items': len(changed), 'units': sum(added.values())}
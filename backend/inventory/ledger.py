@@ -0,0 +1,277 @@
+"""
+Stock ledger snapshots and point-in-time stock
+
+`StockMovement` is the ledger: a warehouse's units of a variant on a day
+are the sum of its movements up to the end of that day. Summing from the
+beginning every time does not scale, so `take_ledger_snapshots` stores the
+closing balance of every (warehouse, variant, UTC day) that had movements,
+carrying running totals forward day by day. The last snapshotted day is
+recorded as a `StockLedgerRun` watermark.
+
+Questions about a date then read at most two things:
+
+- the pair's latest snapshot on or before the date (capped at the
+  watermark), found with one correlated query;
+- for dates past the watermark, only the movements after it.
+
+`ledger_balances` answers "what was stock on D", `ledger_range` opening,
+change and closing over a period, `ledger_series` a pair's daily closing
+balances, and `inventory_valuation` prices the balances at the latest
+import cost known on the date.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from core.db import UTCDate
+from .models import StockImport, StockImportItem, StockLedgerRun, StockLedgerSnapshot, StockMovement
+
+logger = logging.getLogger(__name__)
+
+# Days of movements aggregated per query when snapshotting
+CHUNK_DAYS = 31
+
+# Snapshot rows inserted per statement
+BATCH_SIZE = 2000
+
+
+def day_start(day: date) -> datetime:
+    """Start of a UTC day as an aware datetime"""
+    return datetime.combine(day, dt_time.min, tzinfo=dt_timezone.utc)
+
+
+def watermark() -> Optional[date]:
+    """Last day the snapshots are complete for, if any run happened"""
+    return StockLedgerRun.objects.order_by('-through_date').values_list('through_date', flat=True).first()
+
+
+def _scope(queryset, warehouse_ids=None, variant_ids=None):
+    if warehouse_ids is not None:
+        queryset = queryset.filter(warehouse_id__in=list(warehouse_ids))
+    if variant_ids is not None:
+        queryset = queryset.filter(variant_id__in=variant_ids)
+    return queryset
+
+
+def snapshot_balances(as_of: date, warehouse_ids=None, variant_ids=None) -> Dict[Tuple[int, str], int]:
+    """Balance per (warehouse id, variant id) from the latest snapshot on or before `as_of`"""
+    latest = StockLedgerSnapshot.objects.filter(
+        warehouse_id=OuterRef('warehouse_id'), variant_id=OuterRef('variant_id'), date__lte=as_of,
+    ).order_by('-date').values('date')[:1]
+    snapshots = _scope(StockLedgerSnapshot.objects.filter(date__lte=as_of), warehouse_ids, variant_ids)
+    return {
+        (warehouse_id, variant_id): quantity
+        for warehouse_id, variant_id, quantity in snapshots.filter(date=Subquery(latest)).order_by().values_list(
+            'warehouse_id', 'variant_id', 'quantity',
+        ).iterator(chunk_size=10000)
+    }
+
+
+def movement_totals(start: Optional[datetime], end: datetime, warehouse_ids=None, variant_ids=None):
+    """Net movement per (warehouse id, variant id) in [start, end), from the beginning if `start` is None"""
+    movements = _scope(StockMovement.objects.filter(created_at__lt=end), warehouse_ids, variant_ids)
+    if start is not None:
+        movements = movements.filter(created_at__gte=start)
+    return {
+        (warehouse_id, variant_id): units
+        for warehouse_id, variant_id, units in movements.values('warehouse_id', 'variant_id').annotate(
+            units=Sum('quantity'),
+        ).order_by().values_list('warehouse_id', 'variant_id', 'units')
+    }
+
+
+def ledger_balances(as_of: date, warehouse_ids: Optional[Iterable[int]] = None,
+                    variant_ids=None) -> Dict[Tuple[int, str], int]:
+    """
+    Units per (warehouse id, variant id) at the end of a UTC day
+
+    Args:
+        as_of: The day
+        warehouse_ids: Only these warehouses (default: all)
+        variant_ids: Only these variants, ids or a `values('id')` queryset
+
+    Returns:
+        Mapping of (warehouse id, variant id) to units, for pairs with any
+        movement up to that day
+    """
+    warehouse_ids = list(warehouse_ids) if warehouse_ids is not None else None
+    cut = watermark()
+    if cut is None:
+        # Nothing snapshotted yet: sum from the beginning
+        balances, start = {}, None
+    elif cut >= as_of:
+        return snapshot_balances(as_of, warehouse_ids, variant_ids)
+    else:
+        balances, start = snapshot_balances(cut, warehouse_ids, variant_ids), day_start(cut + timedelta(days=1))
+    delta = movement_totals(start, day_start(as_of + timedelta(days=1)), warehouse_ids, variant_ids)
+    for key, units in delta.items():
+        balances[key] = balances.get(key, 0) + units
+    return balances
+
+
+def ledger_range(start: date, end: date, warehouse_ids: Optional[Iterable[int]] = None,
+                 variant_ids=None) -> Dict[Tuple[int, str], Tuple[int, int, int]]:
+    """
+    Opening balance, net change and closing balance over [start, end]
+
+    Returns:
+        Mapping of (warehouse id, variant id) to (opening, change, closing)
+    """
+    warehouse_ids = list(warehouse_ids) if warehouse_ids is not None else None
+    opening = ledger_balances(start - timedelta(days=1), warehouse_ids, variant_ids)
+    closing = ledger_balances(end, warehouse_ids, variant_ids)
+    return {
+        key: (opening.get(key, 0), closing.get(key, 0) - opening.get(key, 0), closing.get(key, 0))
+        for key in opening.keys() | closing.keys()
+    }
+
+
+def ledger_series(warehouse_id: int, variant_id: str, start: date, end: date) -> List[Tuple[date, int]]:
+    """
+    Closing balance of one pair for every day in [start, end]
+
+    Snapshotted days come from the snapshots, later days from that pair's
+    movements grouped per day.
+    """
+    opening = ledger_balances(start - timedelta(days=1), [warehouse_id], [variant_id]).get(
+        (warehouse_id, variant_id), 0,
+    )
+    changes = dict(
+        StockLedgerSnapshot.objects.filter(
+            warehouse_id=warehouse_id, variant_id=variant_id, date__gte=start, date__lte=end,
+        ).values_list('date', 'change')
+    )
+    cut = watermark()
+    tail_start = max(start, cut + timedelta(days=1)) if cut else start
+    if tail_start <= end:
+        for day, units in StockMovement.objects.filter(
+            warehouse_id=warehouse_id, variant_id=variant_id,
+            created_at__gte=day_start(tail_start), created_at__lt=day_start(end + timedelta(days=1)),
+        ).annotate(day=UTCDate('created_at')).values('day').annotate(units=Sum('quantity')).order_by().values_list(
+            'day', 'units',
+        ):
+            changes[day] = changes.get(day, 0) + units
+
+    series, balance = [], opening
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        balance += changes.get(day, 0)
+        series.append((day, balance))
+    return series
+
+
+def unit_costs(as_of: date) -> Dict[str, Decimal]:
+    """Latest import unit cost per variant among imports ordered on or before `as_of`"""
+    costs = {}
+    for variant_id, unit_cost in StockImportItem.objects.filter(
+        stock_import__order_date__lte=as_of,
+    ).exclude(stock_import__status=StockImport.ImportStatus.CANCELLED).order_by(
+        'stock_import__order_date', 'pk',
+    ).values_list('variant_id', 'unit_cost').iterator(chunk_size=10000):
+        costs[variant_id] = unit_cost
+    return costs
+
+
+def inventory_valuation(as_of: date, warehouse_ids: Optional[Iterable[int]] = None) -> Dict[int, Dict]:
+    """
+    Value of each warehouse's stock at the end of a day
+
+    Returns:
+        Mapping of warehouse id to its `units`, `value` and the
+        `unvalued_units` of variants never imported (no known cost)
+    """
+    costs = unit_costs(as_of)
+    totals = defaultdict(lambda: {'units': 0, 'value': Decimal('0'), 'unvalued_units': 0})
+    for (warehouse_id, variant_id), units in ledger_balances(as_of, warehouse_ids).items():
+        total = totals[warehouse_id]
+        total['units'] += units
+        if variant_id in costs:
+            total['value'] += costs[variant_id] * units
+        else:
+            total['unvalued_units'] += units
+    return dict(totals)
+
+
+def _write_chunk(start: date, end: date, balances: Dict, batch_size: int) -> Tuple[int, int]:
+    """Snapshot the days in [start, end], updating `balances` in place"""
+    daily = StockMovement.objects.filter(
+        created_at__gte=day_start(start), created_at__lt=day_start(end + timedelta(days=1)),
+    ).annotate(day=UTCDate('created_at')).values('warehouse_id', 'variant_id', 'day').annotate(
+        units=Sum('quantity'), movements=Count('pk'),
+    ).order_by('day').values_list('warehouse_id', 'variant_id', 'day', 'units', 'movements')
+
+    batch, written, scanned = [], 0, 0
+    for warehouse_id, variant_id, day, units, movements in daily.iterator(chunk_size=10000):
+        key = (warehouse_id, variant_id)
+        balances[key] = balances.get(key, 0) + units
+        scanned += movements
+        batch.append(StockLedgerSnapshot(
+            warehouse_id=warehouse_id, variant_id=variant_id,
+            date=day,
+            change=units, quantity=balances[key],
+        ))
+        if len(batch) >= batch_size:
+            StockLedgerSnapshot.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    StockLedgerSnapshot.objects.bulk_create(batch)
+    return written + len(batch), scanned
+
+
+def take_ledger_snapshots(through: Optional[date] = None, rebuild: bool = False,
+                          chunk_days: int = CHUNK_DAYS, batch_size: int = BATCH_SIZE) -> List[StockLedgerRun]:
+    """
+    Snapshot every closed day since the watermark
+
+    Each chunk of days is written in its own transaction and recorded as a
+    run, so an interrupted backfill resumes where it stopped.
+
+    Args:
+        through: Last day to snapshot (default: yesterday, the last closed UTC day)
+        rebuild: Drop all snapshots and runs and start from the first movement
+        chunk_days: Days of movements aggregated per query
+
+    Returns:
+        The runs recorded, one per chunk (none when already up to date)
+    """
+    through = through or timezone.now().astimezone(dt_timezone.utc).date() - timedelta(days=1)
+    if rebuild:
+        with transaction.atomic():
+            StockLedgerSnapshot.objects.all().delete()
+            StockLedgerRun.objects.all().delete()
+
+    last = watermark()
+    if last is None:
+        first = StockMovement.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        if first is None:
+            return []
+        start = first.astimezone(dt_timezone.utc).date()
+        balances = {}
+    else:
+        start = last + timedelta(days=1)
+        balances = snapshot_balances(last)
+
+    runs = []
+    while start <= through:
+        end = min(start + timedelta(days=chunk_days - 1), through)
+        started_at, started = timezone.now(), time.perf_counter()
+        with transaction.atomic():
+            written, scanned = _write_chunk(start, end, balances, batch_size)
+            runs.append(StockLedgerRun.objects.create(
+                started_at=started_at,
+                through_date=end,
+                duration_ms=int((time.perf_counter() - started) * 1000),
+                days=(end - start).days + 1,
+                movements_scanned=scanned,
+                snapshots_written=written,
+            ))
+        logger.info(f"Stock ledger snapshotted {start} to {end}: {scanned} movements, {written} snapshots")
+        start = end + timedelta(days=1)
+    return runs
@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+STATES = ['CA', 'NY', 'TX', 'FL', 'WA', 'IL', 'GA', 'OH']
+
+
+class Command(BaseCommand):
+    help = (
+        'Time warehouse allocation of large orders over a synthetic inventory. Rows are '
+        'created inside a transaction that is rolled back, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warehouses', type=int, default=40)
+        parser.add_argument('--skus', type=int, default=5000)
+        parser.add_argument('--lines', type=int, default=2000,
+                            help='Order lines per allocation.')
+        parser.add_argument('--coverage', type=float, default=0.5,
+                            help='Share of SKUs each warehouse stocks.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options)
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def populate(self, options):
+        from inventory.models import Stock, Warehouse
+        from products.models import Brand, Category, Product, ProductVariant
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        brand = Brand.objects.create(name='bench-brand')
+        category = Category.objects.create(name='bench-category')
+        product = Product.objects.create(
+            id='bench-product', name='Bench product', brand=brand, category=category,
+            base_price=Decimal('10'), image='/bench.png', description='',
+        )
+        ProductVariant.objects.bulk_create([
+            ProductVariant(
+                id=f'bench-{i}', product=product, storage='64GB', color=f'bench-{i}', price=Decimal('10'),
+            )
+            for i in range(options['skus'])
+        ], batch_size=2000)
+        warehouses = Warehouse.objects.bulk_create([
+            Warehouse(
+                name=f'bench-{i}', code=f'bench-{i}', address_line1='1 Bench St', city='City',
+                state=STATES[i % len(STATES)], postal_code=f'{rng.randrange(10000, 99999)}',
+                phone='555', email='bench@example.com', shipping_cost=Decimal(rng.randrange(3, 15)),
+            )
+            for i in range(options['warehouses'])
+        ])
+        stock = [
+            Stock(warehouse=warehouse, variant_id=f'bench-{i}', quantity=rng.randrange(1, 20))
+            for warehouse in warehouses
+            for i in range(options['skus'])
+            if rng.random() < options['coverage']
+        ]
+        Stock.objects.bulk_create(stock, batch_size=5000)
+        self.stdout.write(
+            f"Created {options['skus']} SKUs and {len(stock)} stock rows over "
+            f"{len(warehouses)} warehouses in {time.perf_counter() - started:.1f}s"
+        )
+
+    def run(self, options):
+        from inventory.allocation import load_candidates, plan_allocation
+
+        rng = random.Random(options['seed'])
+        destination = {'state': 'NY', 'postal_code': '10001', 'country': 'USA'}
+        loads, plans, splits = [], [], []
+        for _ in range(options['repeat']):
+            skus = rng.sample(range(options['skus']), min(options['lines'], options['skus']))
+            quantities = {f'bench-{i}': rng.randrange(1, 5) for i in skus}
+
+            started = time.perf_counter()
+            warehouses, _ = load_candidates(quantities.keys())
+            loaded = time.perf_counter()
+            units, shortfalls = plan_allocation(quantities, warehouses, destination)
+            planned = time.perf_counter()
+
+            loads.append((loaded - started) * 1000)
+            plans.append((planned - loaded) * 1000)
+            stock_warehouse = {
+                stock_id: warehouse_id
+                for warehouse_id, warehouse in warehouses.items()
+                for stock_id, _ in warehouse['stock'].values()
+            }
+            splits.append(len({stock_warehouse[stock_id] for stock_id in units}))
+            if shortfalls:
+                self.stdout.write(f'  {len(shortfalls)} lines short')
+
+        self.stdout.write(
+            f"  {options['lines']} lines: load median {statistics.median(loads):8.1f}ms  "
+            f"plan median {statistics.median(plans):8.1f}ms  max {max(plans):8.1f}ms  "
+            f"warehouses used {min(splits)}-{max(splits)}"
+        )
@@ -0,0 +1,104 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the replenishment planner over synthetic SALE history. Rows are created inside a '
+        'transaction that is rolled back, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movements', type=int, default=1_000_000)
+        parser.add_argument('--skus', type=int, default=5000)
+        parser.add_argument('--warehouses', type=int, default=4)
+        parser.add_argument('--window-days', type=int, default=90)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options)
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def populate(self, options):
+        from inventory.models import Stock, StockMovement, Warehouse
+        from products.models import Brand, Category, Product, ProductVariant
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        brand = Brand.objects.create(name='bench-brand')
+        category = Category.objects.create(name='bench-category')
+        product = Product.objects.create(
+            id='bench-product', name='Bench product', brand=brand, category=category,
+            base_price=Decimal('10'), image='/bench.png', description='',
+        )
+        ProductVariant.objects.bulk_create([
+            ProductVariant(
+                id=f'bench-{i}', product=product, storage='64GB', color=f'bench-{i}', price=Decimal('10'),
+            )
+            for i in range(options['skus'])
+        ], batch_size=2000)
+        warehouses = Warehouse.objects.bulk_create([
+            Warehouse(
+                name=f'bench-{i}', code=f'bench-{i}', address_line1='1 Bench St', city='City',
+                state='ST', postal_code='00000', phone='555', email='bench@example.com',
+            )
+            for i in range(options['warehouses'])
+        ])
+        Stock.objects.bulk_create([
+            Stock(warehouse=warehouse, variant_id=f'bench-{i}', quantity=rng.randrange(0, 200))
+            for warehouse in warehouses
+            for i in range(options['skus'])
+        ], batch_size=5000)
+
+        # Raw inserts: created_at is auto_now_add, and history has to be backdated
+        meta = StockMovement._meta
+        columns = ['warehouse_id', 'variant_id', 'movement_type', 'quantity', 'reference_number', 'notes',
+                   'created_at']
+        sql = (
+            f"INSERT INTO {connection.ops.quote_name(meta.db_table)} "
+            f"({', '.join(connection.ops.quote_name(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        now, window = timezone.now(), options['window_days'] * 86400
+        warehouse_ids = [warehouse.pk for warehouse in warehouses]
+        # Skewed popularity, as in real catalogs
+        weights = [1 / (i + 1) for i in range(options['skus'])]
+        with connection.cursor() as cursor:
+            remaining = options['movements']
+            while remaining:
+                batch = min(remaining, 50000)
+                skus = rng.choices(range(options['skus']), weights=weights, k=batch)
+                cursor.executemany(sql, [
+                    (
+                        rng.choice(warehouse_ids), f'bench-{sku}', StockMovement.MovementType.SALE,
+                        -rng.randrange(1, 4), '', '',
+                        connection.ops.adapt_datetimefield_value(now - timedelta(seconds=rng.randrange(window))),
+                    )
+                    for sku in skus
+                ])
+                remaining -= batch
+        self.stdout.write(
+            f"Created {options['movements']} SALE movements over {options['skus']} SKUs and "
+            f"{len(warehouses)} warehouses in {time.perf_counter() - started:.1f}s"
+        )
+
+    def run(self, options):
+        from inventory.replenishment import plan_replenishment
+
+        started = time.perf_counter()
+        plan = plan_replenishment(window_days=options['window_days'])
+        elapsed = time.perf_counter() - started
+        timings = plan['timings']
+        self.stdout.write(
+            f"  planned {len(plan['rows'])} stock rows in {elapsed:.2f}s "
+            f"(demand {timings['demand']:.0f}ms, inputs {timings['inputs']:.0f}ms, plan {timings['plan']:.0f}ms), "
+            f"{sum(row['suggested'] > 0 for row in plan['rows'])} to reorder"
+        )
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Time batch stock transfers between two warehouses and report SKUs moved per second. Rows '
+        'are created inside a transaction that is rolled back, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skus', type=int, default=5000)
+        parser.add_argument('--lines', type=int, default=500,
+                            help='SKUs per transfer.')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            warehouses = self.populate(options)
+            self.run(warehouses, options)
+            transaction.set_rollback(True)
+
+    def populate(self, options):
+        from inventory.models import Stock, Warehouse
+        from products.models import Brand, Category, Product, ProductVariant
+
+        started = time.perf_counter()
+        brand = Brand.objects.create(name='bench-brand')
+        category = Category.objects.create(name='bench-category')
+        product = Product.objects.create(
+            id='bench-product', name='Bench product', brand=brand, category=category,
+            base_price=Decimal('10'), image='/bench.png', description='',
+        )
+        ProductVariant.objects.bulk_create([
+            ProductVariant(
+                id=f'bench-{i}', product=product, storage='64GB', color=f'bench-{i}', price=Decimal('10'),
+            )
+            for i in range(options['skus'])
+        ], batch_size=2000)
+        warehouses = Warehouse.objects.bulk_create([
+            Warehouse(
+                name=f'bench-{code}', code=f'bench-{code}', address_line1='1 Bench St', city='City',
+                state='ST', postal_code='00000', phone='555', email='bench@example.com',
+            )
+            for code in ('a', 'b')
+        ])
+        # Half the SKUs already exist at the target, so both paths are exercised
+        Stock.objects.bulk_create([
+            Stock(warehouse=warehouse, variant_id=f'bench-{i}', quantity=1000)
+            for i in range(options['skus'])
+            for warehouse in warehouses[:1 + i % 2]
+        ], batch_size=5000)
+        self.stdout.write(
+            f"Created {options['skus']} SKUs over 2 warehouses in {time.perf_counter() - started:.1f}s"
+        )
+        return warehouses
+
+    def run(self, warehouses, options):
+        from inventory.transfers import transfer_stock
+
+        rng = random.Random(options['seed'])
+        timings = []
+        source, target = warehouses
+        for _ in range(options['repeat']):
+            skus = rng.sample(range(options['skus']), min(options['lines'], options['skus']))
+            quantities = {f'bench-{i}': rng.randrange(1, 5) for i in skus}
+            started = time.perf_counter()
+            transfer_stock(source, target, quantities)
+            timings.append(time.perf_counter() - started)
+
+        median = statistics.median(timings)
+        self.stdout.write(
+            f"  {options['lines']} SKUs per transfer: median {median * 1000:8.1f}ms  "
+            f"max {max(timings) * 1000:8.1f}ms  {options['lines'] / median:10.0f} SKUs/s"
+        )
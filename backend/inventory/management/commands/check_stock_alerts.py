@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Create or refresh low/out of stock alerts from warehouse Stock rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only re-evaluate Stock rows updated since the previous run.')
+        parser.add_argument('--no-notify', action='store_true',
+                            help='Do not queue notifications for new or stale alerts.')
+        parser.add_argument('--no-resolve', action='store_true',
+                            help='Do not resolve alerts whose stock recovered first.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Flagged rows diffed and written per batch.')
+
+    def handle(self, *args, **options):
+        from inventory.alerts import evaluate_stock_alerts, resolve_recovered_alerts
+
+        if not options['no_resolve']:
+            started = time.perf_counter()
+            resolved = resolve_recovered_alerts()
+            self.stdout.write(
+                f'Resolved {sum(resolved.values())} recovered alerts '
+                f'({", ".join(f"{count} {alert_type.lower()}" for alert_type, count in resolved.items())}) '
+                f'in {(time.perf_counter() - started) * 1000:.0f}ms'
+            )
+        run = evaluate_stock_alerts(
+            incremental=options['incremental'],
+            notify=not options['no_notify'],
+            batch_size=options['batch_size'],
+        )
+        since = f' since {run.since:%Y-%m-%d %H:%M:%S}' if run.since else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{run.get_mode_display()} run{since}: {run.rows_scanned} rows scanned in {run.duration_ms}ms; '
+            f'{run.out_of_stock} out of stock, {run.critical} critical, {run.low_stock} low; '
+            f'{run.alerts_created} alerts created, {run.alerts_updated} updated, '
+            f'{run.notifications_queued} notifications queued'
+        ))
@@ -0,0 +1,61 @@
+import json
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Errors printed before the rest are summarised
+SHOWN_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Create a stock import from a supplier manifest: a CSV file (variant_id/sku, quantity_ordered, '
+        'unit_cost), a JSON array (or {"items": [...]}) or JSON lines.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='Path to a .csv, .json or .jsonl manifest.')
+        parser.add_argument('--warehouse', required=True, help='Receiving warehouse code.')
+        parser.add_argument('--supplier', help='Supplier code.')
+        parser.add_argument('--order-date', type=date.fromisoformat, help='YYYY-MM-DD, defaults to today.')
+        parser.add_argument('--expected-date', type=date.fromisoformat, help='YYYY-MM-DD.')
+        parser.add_argument('--notes', default='')
+
+    def handle(self, *args, **options):
+        from inventory.imports import ManifestError, create_import, read_manifest_csv
+        from inventory.models import Supplier, Warehouse
+
+        try:
+            warehouse = Warehouse.objects.get(code=options['warehouse'])
+            supplier = Supplier.objects.get(code=options['supplier']) if options['supplier'] else None
+        except (Warehouse.DoesNotExist, Supplier.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        path = options['manifest']
+        started = time.perf_counter()
+        try:
+            with open(path, 'rb') as file:
+                if path.endswith('.csv'):
+                    lines = read_manifest_csv(file)
+                elif path.endswith('.jsonl'):
+                    lines = (json.loads(line) for line in file if line.strip())
+                else:
+                    data = json.load(file)
+                    lines = data['items'] if isinstance(data, dict) else data
+                stock_import = create_import(
+                    warehouse, lines, supplier=supplier, order_date=options['order_date'],
+                    expected_date=options['expected_date'], notes=options['notes'],
+                )
+        except ManifestError as e:
+            for error in e.errors[:SHOWN_ERRORS]:
+                self.stderr.write(f"  line {error['line']}: {error['error']}")
+            if len(e.errors) > SHOWN_ERRORS:
+                self.stderr.write(f'  ... and {len(e.errors) - SHOWN_ERRORS} more')
+            raise CommandError(f'{len(e.errors)} invalid manifest lines, {len(e.missing_skus)} unknown SKUs')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {stock_import.import_number} with {stock_import.items.count()} items, '
+            f'total {stock_import.total_cost}, in {(time.perf_counter() - started) * 1000:.0f}ms'
+        ))
+
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+# Suggestions listed when not drafting
+SHOWN_ROWS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute reorder points and suggested order quantities from SALE history and supplier lead '
+        'times; optionally store them as low stock thresholds and draft stock imports.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window-days', type=int, default=90,
+                            help='Days of sales history to measure demand over.')
+        parser.add_argument('--service-level', type=float, default=0.95,
+                            help='Probability of not running out during a lead time.')
+        parser.add_argument('--review-days', type=int, default=14,
+                            help='Days until the next planning run.')
+        parser.add_argument('--warehouse', action='append', default=[],
+                            help='Warehouse code to plan (repeatable, default: all).')
+        parser.add_argument('--apply-thresholds', action='store_true',
+                            help='Store reorder points as low_stock_threshold.')
+        parser.add_argument('--draft', action='store_true',
+                            help='Create PENDING stock imports per warehouse and supplier.')
+
+    def handle(self, *args, **options):
+        from inventory.models import Warehouse
+        from inventory.replenishment import apply_thresholds, draft_imports, plan_replenishment
+
+        if not 0 < options['service_level'] < 1:
+            raise CommandError('--service-level must be between 0 and 1')
+        warehouse_ids = None
+        if options['warehouse']:
+            warehouses = dict(Warehouse.objects.filter(code__in=options['warehouse']).values_list('code', 'pk'))
+            unknown = sorted(set(options['warehouse']) - set(warehouses))
+            if unknown:
+                raise CommandError(f'Unknown warehouses: {", ".join(unknown)}')
+            warehouse_ids = list(warehouses.values())
+
+        plan = plan_replenishment(
+            window_days=options['window_days'], service_level=options['service_level'],
+            review_days=options['review_days'], warehouse_ids=warehouse_ids,
+        )
+        rows, timings = plan['rows'], plan['timings']
+        suggested = [row for row in rows if row['suggested'] > 0]
+        self.stdout.write(
+            f"Planned {len(rows)} stock rows ({sum(row['daily_demand'] > 0 for row in rows)} with demand): "
+            f"{len(suggested)} to reorder, {sum(row['suggested'] for row in suggested)} units. "
+            f"demand {timings['demand']:.0f}ms, inputs {timings['inputs']:.0f}ms, plan {timings['plan']:.0f}ms"
+        )
+
+        with transaction.atomic():
+            if options['apply_thresholds']:
+                self.stdout.write(f'Updated {apply_thresholds(rows)} low stock thresholds')
+            if options['draft']:
+                drafted = draft_imports(suggested)
+                for stock_import in drafted['imports']:
+                    self.stdout.write(
+                        f'  {stock_import.import_number}: {stock_import.supplier.name} -> '
+                        f'{stock_import.warehouse.code}, total {stock_import.total_cost}'
+                    )
+                self.stdout.write(
+                    f"Drafted {len(drafted['imports'])} imports; {drafted['unsourced']} SKUs have no known supplier"
+                )
+
+        if not options['draft']:
+            for row in sorted(suggested, key=lambda row: row['available'] - row['reorder_point'])[:SHOWN_ROWS]:
+                self.stdout.write(
+                    f"  stock {row['stock_id']} {row['variant_id']}: {row['available']} available "
+                    f"+ {row['on_order']} on order, {row['daily_demand']:.2f}/day, "
+                    f"reorder at {row['reorder_point']}, order {row['suggested']}"
+                )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or verify) the per-variant/per-product stock rollup from warehouse Stock rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report drift between the rollup and Stock; do not write.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Variants refreshed per UPDATE statement.')
+        parser.add_argument('--show', type=int, default=20,
+                            help='Number of drifting rows to print.')
+
+    def handle(self, *args, **options):
+        from inventory.rollup import find_rollup_drift, rebuild_stock_rollup
+
+        variant_drift, product_drift = find_rollup_drift()
+        for label, rows in (('variant', variant_drift), ('product', product_drift)):
+            for pk, stored, expected in rows[:options['show']]:
+                self.stdout.write(f'  {label} {pk}: stored={stored} expected={expected}')
+
+        drift = len(variant_drift) + len(product_drift)
+        summary = f'{len(variant_drift)} variants and {len(product_drift)} products drifted'
+        if options['verify']:
+            style = self.style.WARNING if drift else self.style.SUCCESS
+            self.stdout.write(style(summary))
+            return
+
+        with transaction.atomic():
+            refreshed = rebuild_stock_rollup(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'{summary}; rebuilt rollup for {refreshed} variants'))
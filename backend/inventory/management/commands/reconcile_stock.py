@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Report (and optionally repair) variants whose ProductVariant.stock disagrees with their Stock rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=('stock', 'variant'), default='stock',
+                            help='Side taken as correct: rewrite variant stock from warehouse rows (stock) or '
+                                 'book the difference on the default warehouse (variant).')
+        parser.add_argument('--repair', action='store_true',
+                            help='Write the repairs; without it only report.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Variants per grouped query and per repair transaction.')
+        parser.add_argument('--show', type=int, default=20,
+                            help='Number of discrepancies to print.')
+
+    def handle(self, *args, **options):
+        from inventory.reconciliation import ReconciliationError, reconcile_stock
+
+        try:
+            report = reconcile_stock(
+                source=options['source'], repair=options['repair'],
+                chunk_size=options['chunk_size'], sample_size=options['show'],
+            )
+        except ReconciliationError as exc:
+            raise CommandError(str(exc))
+
+        for variant_id, stored, expected, rows in report['sample']:
+            self.stdout.write(f'  variant {variant_id}: stock={stored} expected={expected} stock_rows={rows}')
+        summary = f"{report['discrepancies']} variants disagree with their Stock rows"
+        if not options['repair']:
+            style = self.style.WARNING if report['discrepancies'] else self.style.SUCCESS
+            self.stdout.write(style(f"{summary} ({report['duration_ms']}ms)"))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary}; repaired {report['repaired']} from {report['source']}, "
+            f"{report['unresolved']} unresolved, {report['units_adjusted']} units adjusted "
+            f"({report['duration_ms']}ms)"
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Email the queued stock alert notifications as one digest per recipient.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, default=0,
+                            help='Keep draining the outbox every N seconds instead of running once.')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Outbox entries claimed per transaction.')
+
+    def handle(self, *args, **options):
+        from inventory.notifications import deliver_notifications
+
+        while True:
+            started = time.perf_counter()
+            stats = deliver_notifications(batch_size=options['batch_size'])
+            self.stdout.write(
+                f"Sent {stats['sent']} notifications in {stats['emails']} emails, "
+                f"{stats['retrying']} to retry, {stats['failed']} failed "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
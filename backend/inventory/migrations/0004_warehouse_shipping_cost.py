@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='warehouse',
+            name='shipping_cost',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_resolved_flag(apps, schema_editor):
+    StockAlert = apps.get_model('inventory', 'StockAlert')
+    StockAlert.objects.filter(is_resolved=True).update(status='RESOLVED')
+
+
+def copy_resolved_status(apps, schema_editor):
+    StockAlert = apps.get_model('inventory', 'StockAlert')
+    StockAlert.objects.filter(status='RESOLVED').update(is_resolved=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_warehouse_shipping_cost'),
+        ('products', '0006_product_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockAlertRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(choices=[('FULL', 'Full'), ('INCREMENTAL', 'Incremental')], max_length=20)),
+                ('started_at', models.DateTimeField()),
+                ('since', models.DateTimeField(blank=True, null=True)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('rows_scanned', models.PositiveIntegerField(default=0)),
+                ('low_stock', models.PositiveIntegerField(default=0)),
+                ('critical', models.PositiveIntegerField(default=0)),
+                ('out_of_stock', models.PositiveIntegerField(default=0)),
+                ('alerts_created', models.PositiveIntegerField(default=0)),
+                ('alerts_updated', models.PositiveIntegerField(default=0)),
+                ('notifications_sent', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='current_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='email_sent',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='last_notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='notification_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='resolution_notes',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='resolved_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='resolved_alerts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='sms_sent',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='status',
+            field=models.CharField(choices=[('ACTIVE', 'Active'), ('ACKNOWLEDGED', 'Acknowledged'), ('RESOLVED', 'Resolved')], default='ACTIVE', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='stockalert',
+            name='threshold_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(copy_resolved_flag, copy_resolved_status),
+        migrations.RemoveField(
+            model_name='stockalert',
+            name='is_resolved',
+        ),
+        migrations.AlterField(
+            model_name='stockalert',
+            name='alert_type',
+            field=models.CharField(choices=[('LOW_STOCK', 'Low Stock'), ('OUT_OF_STOCK', 'Out of Stock'), ('CRITICAL', 'Critical Level')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['updated_at'], name='inventory_s_updated_1e6d45_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockalert',
+            index=models.Index(fields=['status', '-created_at'], name='inventory_s_status_81ea13_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockalert',
+            index=models.Index(fields=['stock', 'status'], name='inventory_s_stock_i_9aab27_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_stock_movement_type_created_index'),
+        ('products', '0006_product_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLedgerRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('through_date', models.DateField()),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('days', models.PositiveIntegerField(default=0)),
+                ('movements_scanned', models.PositiveIntegerField(default=0)),
+                ('snapshots_written', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockLedgerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('change', models.IntegerField()),
+                ('quantity', models.IntegerField()),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_snapshots', to='products.productvariant')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_snapshots', to='inventory.warehouse')),
+            ],
+            options={
+                'ordering': ['warehouse', 'variant', 'date'],
+                'indexes': [models.Index(fields=['date'], name='inventory_s_date_e3ceee_idx')],
+                'unique_together': {('warehouse', 'variant', 'date')},
+            },
+        ),
+    ]
@@ -1,11 +1,22 @@
+import logging
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from products.models import Product, ProductVariant
 from django.core.validators import MinValueValidator
 
+from core.db import LoadedValuesMixin
+
+logger = logging.getLogger(__name__)
+
 
-class Warehouse(models.Model):
+class Warehouse(LoadedValuesMixin, models.Model):
     """Warehouse/Branch location model"""
+    # Deactivating a warehouse drops its units from the stock rollup
+    LOADED_FIELDS = ('is_active',)
+
     name = models.CharField(max_length=255, unique=True)
     code = models.CharField(max_length=50, unique=True)
     
@@ -22,6 +33,10 @@ class Warehouse(models.Model):
     email = models.EmailField()
     manager_name = models.CharField(max_length=255, blank=True)
     
+    # Fulfilment: cost of sending one shipment from here, breaks ties
+    # between equally near warehouses when allocating orders
+    shipping_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    
     # Status
     is_active = models.BooleanField(default=True)
     
@@ -95,6 +110,8 @@ class Stock(models.Model):
         indexes = [
             models.Index(fields=['warehouse', 'variant']),
             models.Index(fields=['quantity']),
+            # Incremental alert evaluation
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -116,6 +133,40 @@ class Stock(models.Model):
         return self.available_quantity == 0
 
 
+class StockReservation(models.Model):
+    """Units of a Stock row held for a pending order"""
+    
+    class Status(models.TextChoices):
+        ACTIVE = 'ACTIVE', 'Active'
+        COMMITTED = 'COMMITTED', 'Committed'
+        RELEASED = 'RELEASED', 'Released'
+        EXPIRED = 'EXPIRED', 'Expired'
+        # Committed units put back on the shelf (order cancelled or refunded)
+        RETURNED = 'RETURNED', 'Returned'
+    
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(
+        'orders.Order', on_delete=models.CASCADE, null=True, blank=True, related_name='stock_reservations'
+    )
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.ACTIVE)
+    
+    # Null for holds that never lapse (e.g. cash on delivery)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.stock.variant_id} ({self.get_status_display()})"
+
+
 class StockMovement(models.Model):
     """Track all stock movements (imports, sales, adjustments, transfers)"""
     
@@ -150,6 +201,8 @@ class StockMovement(models.Model):
             models.Index(fields=['-created_at']),
             models.Index(fields=['warehouse', 'variant']),
             models.Index(fields=['movement_type']),
+            # Windowed history scans (replenishment demand)
+            models.Index(fields=['movement_type', 'created_at']),
         ]
     
     def __str__(self):
@@ -203,11 +256,17 @@ class StockImport(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.import_number:
-            import datetime
-            timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-            self.import_number = f"IMP-{timestamp}"
+            self.import_number = self.generate_import_number()
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def generate_import_number():
+        """Generate unique import number"""
+        import datetime
+        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        random_str = str(uuid.uuid4())[:8].upper()
+        return f"IMP-{timestamp}-{random_str}"
+
 
 class StockImportItem(models.Model):
     """Items in a stock import"""
@@ -241,23 +300,211 @@ class StockAlert(models.Model):
     class AlertType(models.TextChoices):
         LOW_STOCK = 'LOW_STOCK', 'Low Stock'
         OUT_OF_STOCK = 'OUT_OF_STOCK', 'Out of Stock'
+        CRITICAL = 'CRITICAL', 'Critical Level'
+    
+    class AlertStatus(models.TextChoices):
+        ACTIVE = 'ACTIVE', 'Active'
+        ACKNOWLEDGED = 'ACKNOWLEDGED', 'Acknowledged'
+        RESOLVED = 'RESOLVED', 'Resolved'
+    
+    # Alerts still waiting for stock to recover
+    OPEN_STATUSES = (AlertStatus.ACTIVE, AlertStatus.ACKNOWLEDGED)
     
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='alerts')
     alert_type = models.CharField(max_length=20, choices=AlertType.choices)
+    status = models.CharField(max_length=20, choices=AlertStatus.choices, default=AlertStatus.ACTIVE)
     
     # Alert details
+    current_quantity = models.IntegerField(default=0)
+    threshold_quantity = models.IntegerField(default=0)
     message = models.TextField()
-    is_resolved = models.BooleanField(default=False)
-    resolved_at = models.DateTimeField(null=True, blank=True)
     
     # Notification tracking
     notified_users = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True, related_name='stock_alerts_received')
+    email_sent = models.BooleanField(default=False)
+    sms_sent = models.BooleanField(default=False)
+    notification_count = models.IntegerField(default=0)
+    last_notified_at = models.DateTimeField(null=True, blank=True)
+    
+    # Resolution
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    resolved_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='resolved_alerts'
+    )
+    resolution_notes = models.TextField(blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', '-created_at']),
+            models.Index(fields=['stock', 'status']),
+        ]
     
     def __str__(self):
         return f"{self.alert_type}: {self.stock}"
+    
+    @property
+    def is_resolved(self):
+        return self.status == self.AlertStatus.RESOLVED
+    
+    def get_email_body(self):
+        """Generate email body for alert"""
+        variant = self.stock.variant
+        product = variant.product
+        warehouse = self.stock.warehouse
+        
+        body = f"""
+Stock Alert Notification
+=========================
+
+Alert Type: {self.get_alert_type_display()}
+Status: {self.get_status_display()}
+
+Product Details:
+- Product: {product.name}
+- Variant: {variant.storage} - {variant.color}
+- SKU: {variant.id}
+
+Stock Information:
+- Warehouse: {warehouse.name} ({warehouse.code})
+- Current Quantity: {self.current_quantity}
+- Threshold: {self.threshold_quantity}
+- Reserved: {self.stock.reserved_quantity}
+
+Message:
+{self.message}
+
+Action Required:
+Please review and restock this item as soon as possible to avoid stockouts.
+
+Alert Created: {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}
+
+---
+This is an automated notification from the Electric Store Management System.
+        """.strip()
+        
+        return body
+    
+    def acknowledge(self, user=None):
+        """Mark alert as acknowledged"""
+        self.status = self.AlertStatus.ACKNOWLEDGED
+        self.save()
+        logger.info(f"Alert {self.id} acknowledged by {user}")
+    
+    def resolve(self, user=None, notes=''):
+        """Mark alert as resolved"""
+        self.status = self.AlertStatus.RESOLVED
+        self.resolved_at = timezone.now()
+        self.resolved_by = user
+        self.resolution_notes = notes
+        self.save()
+        logger.info(f"Alert {self.id} resolved by {user}")
+
+
+class StockAlertNotification(models.Model):
+    """Outbox entry: an alert waiting to be emailed to one recipient"""
+    
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        SENT = 'SENT', 'Sent'
+        FAILED = 'FAILED', 'Failed'
+    
+    alert = models.ForeignKey(StockAlert, on_delete=models.CASCADE, related_name='notifications')
+    recipient = models.EmailField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    
+    # Delivery attempts; failed sends are retried with backoff
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.alert_id} to {self.recipient}: {self.status}"
+
+
+class StockAlertRun(models.Model):
+    """One pass of the stock alert evaluator"""
+    
+    class Mode(models.TextChoices):
+        FULL = 'FULL', 'Full'
+        INCREMENTAL = 'INCREMENTAL', 'Incremental'
+    
+    mode = models.CharField(max_length=20, choices=Mode.choices)
+    started_at = models.DateTimeField()
+    # Incremental runs only look at Stock rows updated since this time
+    since = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(default=0)
+    
+    rows_scanned = models.PositiveIntegerField(default=0)
+    low_stock = models.PositiveIntegerField(default=0)
+    critical = models.PositiveIntegerField(default=0)
+    out_of_stock = models.PositiveIntegerField(default=0)
+    alerts_created = models.PositiveIntegerField(default=0)
+    alerts_updated = models.PositiveIntegerField(default=0)
+    notifications_queued = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"{self.mode} alert run at {self.started_at}: {self.rows_scanned} rows"
+
+
+class StockLedgerSnapshot(models.Model):
+    """
+    Closing balance of a warehouse's variant at the end of a (UTC) day
+
+    Only days with movements get a row: the balance on any other day is that
+    of the pair's latest snapshot before it (see `inventory.ledger`).
+    """
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='ledger_snapshots')
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='ledger_snapshots')
+    date = models.DateField()
+    
+    # Net movement of the day and the running total after it
+    change = models.IntegerField()
+    quantity = models.IntegerField()
+    
+    class Meta:
+        ordering = ['warehouse', 'variant', 'date']
+        unique_together = ['warehouse', 'variant', 'date']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+    
+    def __str__(self):
+        return f"{self.variant_id} at {self.warehouse_id} on {self.date}: {self.quantity}"
+
+
+class StockLedgerRun(models.Model):
+    """One pass of the ledger snapshotter; the latest `through_date` is the snapshot watermark"""
+    started_at = models.DateTimeField()
+    # Snapshots are complete for every day up to and including this one
+    through_date = models.DateField()
+    duration_ms = models.PositiveIntegerField(default=0)
+    
+    days = models.PositiveIntegerField(default=0)
+    movements_scanned = models.PositiveIntegerField(default=0)
+    snapshots_written = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Ledger run at {self.started_at} through {self.through_date}"
@@ -0,0 +1,201 @@
+"""
+Stock alert notification outbox
+
+Alerts are not emailed where they are raised. `enqueue_alert_notifications`
+writes one `StockAlertNotification` per (alert, recipient), skipping alerts
+that already wait in the outbox or were notified within `RESEND_AFTER` (both
+checked in SQL). `deliver_notifications` then drains the outbox in batches:
+each batch is grouped per recipient into a single digest email and sent
+over one connection, and failed sends are retried with exponential backoff
+until `MAX_ATTEMPTS`.
+"""
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from inventory.models import StockAlert, StockAlertNotification
+
+logger = logging.getLogger(__name__)
+
+# Alerts still unresolved are re-sent after this long
+RESEND_AFTER = timedelta(hours=24)
+
+# Outbox rows claimed per delivery transaction
+DELIVERY_BATCH_SIZE = 200
+
+# Failed sends wait RETRY_BACKOFF, then twice as long each time, up to MAX_BACKOFF
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = timedelta(minutes=1)
+MAX_BACKOFF = timedelta(hours=1)
+
+
+def admin_recipients() -> List[str]:
+    """Emails of the active admin users"""
+    from users.models import User
+    return [
+        email for email in User.objects.filter(role=User.Role.ADMIN, is_active=True).values_list('email', flat=True)
+        if email
+    ]
+
+
+def alerts_due(alerts, now=None):
+    """
+    Active alerts among `alerts` that should be (re-)notified: never sent or
+    not within `RESEND_AFTER`, and not already waiting in the outbox
+    """
+    now = now or timezone.now()
+    return alerts.filter(status=StockAlert.AlertStatus.ACTIVE).filter(
+        Q(last_notified_at__isnull=True) | Q(last_notified_at__lte=now - RESEND_AFTER)
+    ).exclude(
+        Exists(StockAlertNotification.objects.filter(
+            alert_id=OuterRef('pk'), status=StockAlertNotification.Status.PENDING,
+        ))
+    )
+
+
+def enqueue_alert_notifications(alerts, now=None) -> int:
+    """
+    Queue notifications for the alerts that are due
+
+    Each alert goes to its warehouse's email and to every admin.
+
+    Args:
+        alerts: StockAlert queryset to consider
+        now: Time the resend rule is checked against (default: now)
+
+    Returns:
+        Int: Notifications queued
+    """
+    rows = list(alerts_due(alerts, now).values_list('pk', 'stock__warehouse__email'))
+    if not rows:
+        return 0
+    admins = admin_recipients()
+    notifications = [
+        StockAlertNotification(alert_id=alert_id, recipient=recipient)
+        for alert_id, warehouse_email in rows
+        for recipient in OrderedDict.fromkeys([warehouse_email, *admins])
+        if recipient
+    ]
+    StockAlertNotification.objects.bulk_create(notifications)
+    return len(notifications)
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Wait before the next attempt after `attempts` failed ones"""
+    return min(RETRY_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def render_digest(recipient: str, alerts: List[StockAlert]) -> EmailMessage:
+    """One email listing every alert for a recipient"""
+    if len(alerts) == 1:
+        alert = alerts[0]
+        subject = f"🚨 {alert.alert_type} Alert: {alert.stock.variant.product.name}"
+        body = alert.get_email_body()
+    else:
+        subject = f"🚨 {len(alerts)} stock alerts need attention"
+        lines = ['Stock Alert Digest', '=' * 18, '']
+        for alert in alerts:
+            variant, warehouse = alert.stock.variant, alert.stock.warehouse
+            lines.append(
+                f"- [{alert.get_alert_type_display()}] {variant.product.name} "
+                f"{variant.storage} - {variant.color} (SKU {variant.id}) at {warehouse.name} ({warehouse.code}): "
+                f"{alert.current_quantity} available, threshold {alert.threshold_quantity}"
+            )
+        lines += [
+            '',
+            'Please review and restock these items as soon as possible to avoid stockouts.',
+            '',
+            '---',
+            'This is an automated notification from the Electric Store Management System.',
+        ]
+        body = '\n'.join(lines)
+    return EmailMessage(subject=subject, body=body, from_email=settings.DEFAULT_FROM_EMAIL, to=[recipient])
+
+
+def _deliver_batch(batch: List[StockAlertNotification], now) -> Dict[str, int]:
+    by_recipient = OrderedDict()
+    for notification in batch:
+        by_recipient.setdefault(notification.recipient, []).append(notification)
+
+    sent, failed = [], []
+    try:
+        connection = get_connection(fail_silently=False)
+        with connection:
+            for recipient, notifications in by_recipient.items():
+                message = render_digest(recipient, [notification.alert for notification in notifications])
+                try:
+                    connection.send_messages([message])
+                    sent.extend(notifications)
+                except Exception as e:
+                    logger.error(f"Failed to send stock alert digest to {recipient}: {e}")
+                    failed.extend((notification, e) for notification in notifications)
+    except Exception as e:
+        # Could not connect at all: everything not sent yet is retried
+        logger.error(f"Failed to open the email connection for stock alerts: {e}")
+        done = {notification.pk for notification in sent} | {notification.pk for notification, _ in failed}
+        failed.extend((notification, e) for notification in batch if notification.pk not in done)
+
+    if sent:
+        StockAlertNotification.objects.filter(pk__in=[n.pk for n in sent]).update(
+            status=StockAlertNotification.Status.SENT, attempts=F('attempts') + 1, sent_at=now,
+        )
+        StockAlert.objects.filter(pk__in={n.alert_id for n in sent}).update(
+            email_sent=True, notification_count=F('notification_count') + 1, last_notified_at=now, updated_at=now,
+        )
+
+    gave_up = 0
+    for notification, error in failed:
+        notification.attempts += 1
+        notification.last_error = str(error)
+        if notification.attempts >= MAX_ATTEMPTS:
+            notification.status = StockAlertNotification.Status.FAILED
+            gave_up += 1
+        else:
+            notification.next_attempt_at = now + retry_delay(notification.attempts)
+    StockAlertNotification.objects.bulk_update(
+        [notification for notification, _ in failed], ['attempts', 'last_error', 'status', 'next_attempt_at'],
+    )
+    return {
+        'sent': len(sent),
+        'emails': len({n.recipient for n in sent}),
+        'retrying': len(failed) - gave_up,
+        'failed': gave_up,
+    }
+
+
+def deliver_notifications(batch_size: int = DELIVERY_BATCH_SIZE, now=None) -> Dict[str, int]:
+    """
+    Drain the due outbox entries, one transaction per batch
+
+    Returns:
+        Dict with the notifications sent, digest emails sent, notifications
+        to be retried and notifications given up on
+    """
+    now = now or timezone.now()
+    stats = dict.fromkeys(['sent', 'emails', 'retrying', 'failed'], 0)
+    while True:
+        with transaction.atomic():
+            # Concurrent workers skip each other's batches
+            batch = list(
+                StockAlertNotification.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+                    status=StockAlertNotification.Status.PENDING, next_attempt_at__lte=now,
+                ).select_related(
+                    'alert__stock__warehouse', 'alert__stock__variant__product',
+                ).order_by('pk')[:batch_size]
+            )
+            if not batch:
+                break
+            for key, value in _deliver_batch(batch, now).items():
+                stats[key] += value
+        if len(batch) < batch_size:
+            break
+    if stats['sent'] or stats['retrying'] or stats['failed']:
+        logger.info(f"Stock alert notifications delivered: {stats}")
+    return stats
@@ -0,0 +1,196 @@
+"""
+Reconciliation of `ProductVariant.stock` with warehouse `Stock` rows
+
+Stock lives in two places: the flat `ProductVariant.stock` the storefront
+reads and the per-warehouse `Stock` rows. For a variant with Stock rows the
+flat field should equal its available units (see `inventory.rollup`);
+writes that bypass the rollup make the two drift.
+
+`find_discrepancies` walks the catalog in primary key order, one grouped
+query per chunk: variants are joined to their Stock rows, aggregated, and
+only the disagreeing ones are returned (HAVING), so the scan never holds
+more than a chunk in memory. `reconcile_stock` reports them and can repair
+them from either side:
+
+- `stock` (default): the warehouse rows are right, the flat field is
+  rewritten from them by the rollup; no units move;
+- `variant`: the flat field is right, the difference is booked on the
+  variant's Stock row in the default warehouse with an ADJUSTMENT movement,
+  creating the row if needed (variants sold from the flat field alone get
+  one too).
+
+Each chunk is repaired in its own transaction, re-reading the locked rows
+so concurrent writes between the scan and the repair are not overwritten.
+"""
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from core.db import value_per_pk
+from products.models import ProductVariant
+from .alerts import schedule_stock_alert_check
+from .models import Stock, StockMovement, Warehouse
+from .rollup import refresh_stock_rollup
+
+SOURCE_STOCK = 'stock'
+SOURCE_VARIANT = 'variant'
+SOURCES = (SOURCE_STOCK, SOURCE_VARIANT)
+
+# Variants returned per grouped query, and repaired per transaction
+CHUNK_SIZE = 1000
+
+# Discrepancies kept in the report
+SAMPLE_SIZE = 50
+
+
+class ReconciliationError(Exception):
+    """Raised when discrepancies cannot be repaired as asked"""
+
+
+def default_warehouse():
+    """Warehouse flat variant stock is booked to, as in the product API"""
+    active = Warehouse.objects.filter(is_active=True).order_by('pk')
+    return active.filter(name__icontains='main').first() or active.first()
+
+
+def find_discrepancies(source: str = SOURCE_STOCK,
+                       chunk_size: int = CHUNK_SIZE) -> Iterator[List[Tuple[str, int, int, int]]]:
+    """
+    Yield chunks of variants whose flat stock disagrees with their Stock rows
+
+    Args:
+        source: With `variant`, variants without Stock rows but with flat
+            stock are discrepancies too
+        chunk_size: Variants per chunk
+
+    Yields:
+        Lists of (variant id, flat stock, expected stock, Stock rows)
+    """
+    disagrees = Q(stock_rows__gt=0) & ~Q(stock=F('expected'))
+    if source == SOURCE_VARIANT:
+        disagrees |= Q(stock_rows=0, stock__gt=0)
+    last_pk = None
+    while True:
+        variants = ProductVariant.objects.all()
+        if last_pk is not None:
+            variants = variants.filter(pk__gt=last_pk)
+        chunk = list(variants.annotate(
+            stock_rows=Count('warehouse_stocks'),
+            expected=Greatest(
+                Coalesce(Sum('warehouse_stocks__quantity') - Sum('warehouse_stocks__reserved_quantity'), Value(0)),
+                Value(0),
+            ),
+        ).filter(disagrees).order_by('pk').values_list('pk', 'stock', 'expected', 'stock_rows')[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+
+def _book_variant_stock(variant_ids: List[str], warehouse: Warehouse, reference: str,
+                        user=None) -> Tuple[List[str], int]:
+    """
+    Adjust the default warehouse rows so Stock matches the flat field
+
+    Returns:
+        Tuple of (variants that now agree, net units booked)
+    """
+    Stock.objects.bulk_create(
+        [Stock(warehouse=warehouse, variant_id=variant_id, quantity=0) for variant_id in variant_ids],
+        ignore_conflicts=True,
+    )
+    flat = dict(
+        ProductVariant.objects.select_for_update().filter(pk__in=variant_ids).order_by('pk').values_list('pk', 'stock')
+    )
+    available, booked_rows = {}, {}
+    for pk, warehouse_id, variant_id, quantity, reserved in Stock.objects.select_for_update().filter(
+        variant_id__in=variant_ids,
+    ).order_by('pk').values_list('pk', 'warehouse_id', 'variant_id', 'quantity', 'reserved_quantity'):
+        available[variant_id] = available.get(variant_id, 0) + quantity - reserved
+        if warehouse_id == warehouse.pk:
+            booked_rows[variant_id] = (pk, quantity, reserved)
+
+    agreed, deltas, movements = [], {}, []
+    for variant_id, stored in flat.items():
+        pk, quantity, reserved = booked_rows[variant_id]
+        units = available.get(variant_id, 0)
+        delta = max(stored, 0) - units
+        # Never book a warehouse below what it has reserved
+        if quantity + delta < reserved:
+            continue
+        agreed.append(variant_id)
+        if max(units, 0) == stored:
+            # Already agrees (written since the scan)
+            continue
+        deltas[pk] = delta
+        movements.append(StockMovement(
+            warehouse=warehouse, variant_id=variant_id, movement_type=StockMovement.MovementType.ADJUSTMENT,
+            quantity=delta, reference_number=reference,
+            notes=f'Reconciled with variant stock: {available.get(variant_id, 0)} available, {stored} expected',
+            created_by=user,
+        ))
+    if deltas:
+        Stock.objects.filter(pk__in=deltas).update(
+            quantity=F('quantity') + value_per_pk(deltas, default=0), updated_at=timezone.now(),
+        )
+        StockMovement.objects.bulk_create(movements)
+        schedule_stock_alert_check(deltas)
+    return agreed, sum(deltas.values())
+
+
+def reconcile_stock(source: str = SOURCE_STOCK, repair: bool = False, user=None,
+                    chunk_size: int = CHUNK_SIZE, sample_size: int = SAMPLE_SIZE) -> Dict:
+    """
+    Report, and optionally repair, every variant whose flat stock drifted
+
+    Args:
+        source: Side taken as correct when repairing, `stock` or `variant`
+        repair: Write the repairs, otherwise only report
+        user: Recorded on the ADJUSTMENT movements
+        chunk_size: Variants per grouped query and per repair transaction
+        sample_size: Discrepancies listed in the report
+
+    Returns:
+        Dict with the `discrepancies` count, `repaired` variants,
+        `unresolved` ones (booking them would go below reserved units),
+        net `units_adjusted`, a `sample` of (variant id, flat stock,
+        expected stock, Stock rows) and `duration_ms`
+
+    Raises:
+        ReconciliationError: Unknown source, or no active warehouse to
+            book variant stock to
+    """
+    if source not in SOURCES:
+        raise ReconciliationError(f"Unknown source {source!r}, expected one of {', '.join(SOURCES)}")
+    warehouse = None
+    if repair and source == SOURCE_VARIANT:
+        warehouse = default_warehouse()
+        if warehouse is None:
+            raise ReconciliationError('No active warehouse to book variant stock to')
+
+    started = time.perf_counter()
+    reference = f"RECONCILE-{timezone.now().strftime('%Y%m%d%H%M%S')}"
+    report = {'source': source, 'discrepancies': 0, 'repaired': 0, 'unresolved': 0, 'units_adjusted': 0,
+              'sample': []}
+    for chunk in find_discrepancies(source, chunk_size):
+        report['discrepancies'] += len(chunk)
+        report['sample'] += chunk[:sample_size - len(report['sample'])]
+        if not repair:
+            continue
+        variant_ids = [row[0] for row in chunk]
+        with transaction.atomic():
+            if source == SOURCE_STOCK:
+                repaired, units = variant_ids, 0
+            else:
+                repaired, units = _book_variant_stock(variant_ids, warehouse, reference, user)
+            refresh_stock_rollup(repaired)
+        report['repaired'] += len(repaired)
+        report['unresolved'] += len(chunk) - len(repaired)
+        report['units_adjusted'] += units
+    report['duration_ms'] = int((time.perf_counter() - started) * 1000)
+    return report
@@ -0,0 +1,267 @@
+"""
+Replenishment planning
+
+Derives per warehouse and SKU reorder points from history instead of the
+static `Stock.low_stock_threshold`:
+
+- demand: SALE movements of the window are summed per (warehouse, variant,
+  UTC day) in SQL, so however many movements there are only the daily totals
+  reach Python, where one pass gives each pair's mean daily demand and its
+  standard deviation (days without sales count as zero);
+- lead time: days from `order_date` to `received_date` of the supplier's
+  received imports (mean and standard deviation), `DEFAULT_LEAD_TIME_DAYS`
+  for suppliers without any;
+- supplier and unit cost: those of the SKU's most recent import line.
+
+With demand d (σd) and lead time L (σL) in days and z for the service
+level:
+
+    safety stock  = z * sqrt(L * σd² + d² * σL²)
+    reorder point = d * L + safety stock
+    order up to   = d * (L + review days) + safety stock
+
+A SKU whose position (available plus still on order) is at or below its
+reorder point gets a suggested order bringing it up to the target.
+`apply_thresholds` stores the reorder points as `low_stock_threshold`, and
+`draft_imports` turns the suggestions into PENDING imports per warehouse
+and supplier.
+"""
+import math
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional
+
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from core.db import UTCDate, value_per_pk
+from .alerts import schedule_stock_alert_check
+from .imports import create_import
+from .models import Stock, StockImport, StockImportItem, StockMovement, Supplier, Warehouse
+
+DEFAULT_WINDOW_DAYS = 90
+DEFAULT_SERVICE_LEVEL = 0.95
+# Days between two planning runs; orders cover demand until the next one
+DEFAULT_REVIEW_DAYS = 14
+# Lead time assumed for suppliers without a received import
+DEFAULT_LEAD_TIME_DAYS = 7
+
+# Thresholds written per UPDATE
+THRESHOLD_BATCH_SIZE = 1000
+
+OPEN_IMPORT_STATUSES = (StockImport.ImportStatus.PENDING, StockImport.ImportStatus.PARTIALLY_RECEIVED)
+
+
+def _mean_std(total: float, squares: float, count: int):
+    mean = total / count
+    return mean, math.sqrt(max(squares / count - mean * mean, 0.0))
+
+
+def demand_stats(since, days: int, warehouse_ids: Optional[Iterable[int]] = None) -> Dict[tuple, tuple]:
+    """
+    Daily SALE demand per (warehouse id, variant id)
+
+    Args:
+        since: Start of the window
+        days: Window length in days, the divisor of the mean
+        warehouse_ids: Only these warehouses (default: all)
+
+    Returns:
+        Mapping of (warehouse id, variant id) to (mean, standard deviation)
+        of units sold per day
+    """
+    movements = StockMovement.objects.filter(
+        movement_type=StockMovement.MovementType.SALE, created_at__gte=since,
+    )
+    if warehouse_ids is not None:
+        movements = movements.filter(warehouse_id__in=list(warehouse_ids))
+    daily = movements.annotate(day=UTCDate('created_at')).values(
+        'warehouse_id', 'variant_id', 'day',
+    ).annotate(units=Sum('quantity')).order_by().values_list('warehouse_id', 'variant_id', 'units')
+
+    sums = defaultdict(lambda: [0, 0])
+    for warehouse_id, variant_id, units in daily.iterator(chunk_size=10000):
+        # SALE movements are recorded negative
+        acc = sums[(warehouse_id, variant_id)]
+        acc[0] -= units
+        acc[1] += units * units
+    return {key: _mean_std(total, squares, days) for key, (total, squares) in sums.items()}
+
+
+def supplier_lead_times() -> Dict[int, tuple]:
+    """Mapping of supplier id to (mean, standard deviation) of lead time in days"""
+    stats = defaultdict(lambda: [0, 0, 0])
+    for supplier_id, ordered, received in StockImport.objects.filter(
+        supplier__isnull=False, received_date__isnull=False,
+    ).exclude(status=StockImport.ImportStatus.CANCELLED).values_list('supplier_id', 'order_date', 'received_date'):
+        days = max((received - ordered).days, 0)
+        acc = stats[supplier_id]
+        acc[0] += days
+        acc[1] += days * days
+        acc[2] += 1
+    return {supplier_id: _mean_std(total, squares, count) for supplier_id, (total, squares, count) in stats.items()}
+
+
+def latest_sources(variant_ids) -> Dict[str, tuple]:
+    """
+    Mapping of variant id to the (supplier id, unit cost) of its latest import line
+
+    Args:
+        variant_ids: Variant ids, or a `values('variant_id')` queryset
+    """
+    sources = {}
+    lines = StockImportItem.objects.filter(
+        variant_id__in=variant_ids, stock_import__supplier__isnull=False,
+    ).exclude(stock_import__status=StockImport.ImportStatus.CANCELLED).order_by('created_at', 'pk')
+    for variant_id, supplier_id, unit_cost in lines.values_list(
+        'variant_id', 'stock_import__supplier_id', 'unit_cost',
+    ).iterator(chunk_size=10000):
+        sources[variant_id] = (supplier_id, unit_cost)
+    return sources
+
+
+def units_on_order(warehouse_ids: Optional[Iterable[int]] = None) -> Dict[tuple, int]:
+    """Units ordered but not yet received per (warehouse id, variant id)"""
+    items = StockImportItem.objects.filter(stock_import__status__in=OPEN_IMPORT_STATUSES)
+    if warehouse_ids is not None:
+        items = items.filter(stock_import__warehouse_id__in=list(warehouse_ids))
+    return {
+        (warehouse_id, variant_id): units
+        for warehouse_id, variant_id, units in items.values('stock_import__warehouse_id', 'variant_id').annotate(
+            units=Sum(F('quantity_ordered') - F('quantity_received')),
+        ).order_by().values_list('stock_import__warehouse_id', 'variant_id', 'units')
+        if units > 0
+    }
+
+
+def plan_replenishment(window_days: int = DEFAULT_WINDOW_DAYS, service_level: float = DEFAULT_SERVICE_LEVEL,
+                       review_days: int = DEFAULT_REVIEW_DAYS, warehouse_ids: Optional[Iterable[int]] = None,
+                       now=None) -> Dict:
+    """
+    Compute reorder points and suggested orders for every active Stock row
+
+    Args:
+        window_days: Days of SALE history the demand is measured over
+        service_level: Probability of not running out during a lead time
+        review_days: Days until the next planning run
+        warehouse_ids: Only plan these warehouses (default: all active)
+
+    Returns:
+        Dict with `rows` (one dict per Stock row: ids, available, on
+        order, demand, lead time, safety stock, reorder point, order up to,
+        suggested units, supplier and unit cost) and `timings` in ms
+    """
+    now = now or timezone.now()
+    warehouse_ids = list(warehouse_ids) if warehouse_ids is not None else None
+    timings = {}
+    started = time.perf_counter()
+
+    demand = demand_stats(now - timedelta(days=window_days), window_days, warehouse_ids)
+    timings['demand'] = (time.perf_counter() - started) * 1000
+
+    stock = Stock.objects.filter(warehouse__is_active=True, variant__is_active=True)
+    if warehouse_ids is not None:
+        stock = stock.filter(warehouse_id__in=warehouse_ids)
+    stock_rows = list(stock.order_by('pk').values_list(
+        'pk', 'warehouse_id', 'variant_id', 'quantity', 'reserved_quantity', 'low_stock_threshold',
+    ))
+    lead_times = supplier_lead_times()
+    sources = latest_sources(stock.values('variant_id'))
+    on_order = units_on_order(warehouse_ids)
+    timings['inputs'] = (time.perf_counter() - started) * 1000 - timings['demand']
+
+    z = NormalDist().inv_cdf(service_level)
+    default_lead_time = (DEFAULT_LEAD_TIME_DAYS, 0.0)
+    rows = []
+    for pk, warehouse_id, variant_id, quantity, reserved, threshold in stock_rows:
+        daily, daily_std = demand.get((warehouse_id, variant_id), (0.0, 0.0))
+        supplier_id, unit_cost = sources.get(variant_id, (None, None))
+        lead_time, lead_time_std = lead_times.get(supplier_id, default_lead_time)
+        safety = z * math.sqrt(lead_time * daily_std ** 2 + daily ** 2 * lead_time_std ** 2)
+        reorder_point = math.ceil(daily * lead_time + safety)
+        order_up_to = math.ceil(daily * (lead_time + review_days) + safety)
+        available = quantity - reserved
+        incoming = on_order.get((warehouse_id, variant_id), 0)
+        position = available + incoming
+        suggested = order_up_to - position if daily > 0 and position <= reorder_point else 0
+        rows.append({
+            'stock_id': pk,
+            'warehouse_id': warehouse_id,
+            'variant_id': variant_id,
+            'available': available,
+            'on_order': incoming,
+            'daily_demand': daily,
+            'demand_std': daily_std,
+            'lead_time': lead_time,
+            'lead_time_std': lead_time_std,
+            'safety_stock': math.ceil(safety),
+            'reorder_point': reorder_point,
+            'order_up_to': order_up_to,
+            'suggested': max(suggested, 0),
+            'threshold': threshold,
+            'supplier_id': supplier_id,
+            'unit_cost': unit_cost,
+        })
+    timings['plan'] = (time.perf_counter() - started) * 1000 - timings['demand'] - timings['inputs']
+    return {'rows': rows, 'timings': timings}
+
+
+def apply_thresholds(rows: List[Dict], batch_size: int = THRESHOLD_BATCH_SIZE) -> int:
+    """
+    Store reorder points as `low_stock_threshold` where they differ
+
+    Rows without demand in the window are left alone. The alerts of the
+    changed rows are re-checked once the transaction commits.
+
+    Returns:
+        Int: Stock rows updated
+    """
+    changed = {
+        row['stock_id']: row['reorder_point']
+        for row in rows if row['daily_demand'] > 0 and row['reorder_point'] != row['threshold']
+    }
+    pks = sorted(changed)
+    now = timezone.now()
+    for i in range(0, len(pks), batch_size):
+        batch = {pk: changed[pk] for pk in pks[i:i + batch_size]}
+        Stock.objects.filter(pk__in=batch).update(low_stock_threshold=value_per_pk(batch), updated_at=now)
+    schedule_stock_alert_check(pks)
+    return len(pks)
+
+
+def draft_imports(rows: List[Dict], user=None, order_date: Optional[date] = None) -> Dict:
+    """
+    Create a PENDING import per warehouse and supplier for the suggested orders
+
+    Lines are priced at the SKU's last unit cost. SKUs never imported from
+    a supplier cannot be drafted and are counted as unsourced.
+
+    Returns:
+        Dict with the created `imports` and the number of `unsourced` rows
+    """
+    lines, unsourced = defaultdict(list), 0
+    for row in rows:
+        if row['suggested'] <= 0:
+            continue
+        if row['supplier_id'] is None:
+            unsourced += 1
+            continue
+        lines[(row['warehouse_id'], row['supplier_id'])].append({
+            'variant_id': row['variant_id'],
+            'quantity_ordered': row['suggested'],
+            'unit_cost': row['unit_cost'] or Decimal('0'),
+        })
+
+    warehouses = Warehouse.objects.in_bulk({warehouse_id for warehouse_id, _ in lines})
+    suppliers = Supplier.objects.in_bulk({supplier_id for _, supplier_id in lines})
+    imports = [
+        create_import(
+            warehouses[warehouse_id], import_lines, supplier=suppliers[supplier_id], order_date=order_date,
+            notes='Drafted by the replenishment planner', user=user,
+        )
+        for (warehouse_id, supplier_id), import_lines in sorted(lines.items())
+    ]
+    return {'imports': imports, 'unsourced': unsourced}
@@ -0,0 +1,258 @@
+"""
+Stock reservations
+
+A pending order holds its units by raising `Stock.reserved_quantity`
+(so `available_quantity` and the stock rollup exclude them) and recording
+a `StockReservation` per Stock row. Holds end in one of three ways:
+
+- commit (payment confirmed / order fulfilled): `quantity` and
+  `reserved_quantity` both drop and SALE movements are recorded;
+- release (payment failed / order cancelled);
+- expiry, when the sweeper finds holds past `expires_at`.
+
+Committed units come back with `restock` (a paid order cancelled or
+refunded): `quantity` rises again and RETURN movements are recorded.
+
+Every transition touches all affected Stock rows with one conditional
+UPDATE, so concurrent orders never need more than row locks, and schedules
+an alert check of those rows for when the transaction commits.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from core.db import value_per_pk
+from .alerts import schedule_stock_alert_check
+from .models import Stock, StockMovement, StockReservation
+from .rollup import refresh_stock_rollup
+
+# Reservations expired per sweeper transaction
+EXPIRY_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+    """Raised when Stock rows no longer have the units being reserved or committed"""
+
+    def __init__(self, stock_ids: Iterable[int]):
+        self.stock_ids = sorted(stock_ids)
+        super().__init__(f'Insufficient stock in rows {self.stock_ids}')
+
+
+def reservation_ttl() -> timedelta:
+    return timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES)
+
+
+def _variant_ids(stock_ids) -> List[str]:
+    return list(Stock.objects.filter(pk__in=stock_ids).values_list('variant_id', flat=True).distinct())
+
+
+@transaction.atomic
+def reserve(units: Dict[int, int], order=None, ttl: Optional[timedelta] = None,
+            expires: bool = True) -> List[StockReservation]:
+    """
+    Hold units on Stock rows
+
+    Args:
+        units: Mapping of Stock id to units to hold
+        order: Order the hold belongs to
+        ttl: Hold lifetime (default: `STOCK_RESERVATION_TTL_MINUTES`)
+        expires: False for holds only ended by commit/release (e.g. cash on delivery)
+
+    Returns:
+        The created reservations
+
+    Raises:
+        InsufficientStock: If any row lacks the units (nothing is reserved)
+    """
+    units = {pk: amount for pk, amount in units.items() if amount > 0}
+    if not units:
+        return []
+
+    amount = value_per_pk(units, default=0)
+    updated = Stock.objects.filter(
+        pk__in=units.keys(),
+        quantity__gte=F('reserved_quantity') + amount,
+    ).update(reserved_quantity=F('reserved_quantity') + amount, updated_at=timezone.now())
+    if updated != len(units):
+        available = Stock.objects.filter(pk__in=units.keys(), quantity__gte=F('reserved_quantity') + amount)
+        raise InsufficientStock(set(units) - set(available.values_list('pk', flat=True)))
+
+    expires_at = timezone.now() + (ttl or reservation_ttl()) if expires else None
+    reservations = StockReservation.objects.bulk_create([
+        StockReservation(stock_id=pk, order=order, quantity=amount, expires_at=expires_at)
+        for pk, amount in units.items()
+    ])
+    refresh_stock_rollup(_variant_ids(units.keys()))
+    schedule_stock_alert_check(units.keys())
+    return reservations
+
+
+def _claim(reservations, new_status, current=StockReservation.Status.ACTIVE) -> Dict[int, int]:
+    """
+    Move reservations in status `current` (active by default) to `new_status`
+
+    Returns:
+        Mapping of Stock id to the units whose hold was claimed
+    """
+    rows = list(
+        reservations.filter(status=current)
+        .select_for_update().order_by('pk').values_list('pk', 'stock_id', 'quantity')
+    )
+    if not rows:
+        return {}
+    StockReservation.objects.filter(
+        pk__in=[pk for pk, _, _ in rows], status=current,
+    ).update(status=new_status, updated_at=timezone.now())
+
+    units = defaultdict(int)
+    for _, stock_id, quantity in rows:
+        units[stock_id] += quantity
+    return dict(units)
+
+
+def _release_units(units: Dict[int, int]):
+    amount = value_per_pk(units, default=0)
+    # Never go below zero, even if the counter was edited by hand
+    Stock.objects.filter(pk__in=units.keys()).update(
+        reserved_quantity=Case(
+            When(reserved_quantity__gte=amount, then=F('reserved_quantity') - amount),
+            default=Value(0),
+        ),
+        updated_at=timezone.now(),
+    )
+    refresh_stock_rollup(_variant_ids(units.keys()))
+    schedule_stock_alert_check(units.keys())
+
+
+@transaction.atomic
+def release(reservations, status=StockReservation.Status.RELEASED) -> int:
+    """
+    Return held units to the available pool
+
+    Args:
+        reservations: StockReservation queryset (only active ones are touched)
+        status: Final status (RELEASED or EXPIRED)
+
+    Returns:
+        Int: Units released
+    """
+    units = _claim(reservations, status)
+    if units:
+        _release_units(units)
+    return sum(units.values())
+
+
+@transaction.atomic
+def commit(reservations, reference_number: str = '', user=None) -> int:
+    """
+    Turn holds into sales: ship the units and record SALE movements
+
+    Returns:
+        Int: Units committed
+
+    Raises:
+        InsufficientStock: If a row's quantity fell below its hold
+    """
+    units = _claim(reservations, StockReservation.Status.COMMITTED)
+    if not units:
+        return 0
+
+    amount = value_per_pk(units, default=0)
+    updated = Stock.objects.filter(
+        pk__in=units.keys(), quantity__gte=amount, reserved_quantity__gte=amount,
+    ).update(
+        quantity=F('quantity') - amount,
+        reserved_quantity=F('reserved_quantity') - amount,
+        updated_at=timezone.now(),
+    )
+    if updated != len(units):
+        consistent = Stock.objects.filter(pk__in=units.keys(), quantity__gte=amount, reserved_quantity__gte=amount)
+        raise InsufficientStock(set(units) - set(consistent.values_list('pk', flat=True)))
+
+    stock_rows = list(Stock.objects.filter(pk__in=units.keys()).values_list('pk', 'warehouse_id', 'variant_id'))
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            warehouse_id=warehouse_id,
+            variant_id=variant_id,
+            movement_type=StockMovement.MovementType.SALE,
+            quantity=-units[pk],
+            reference_number=reference_number,
+            created_by=user,
+        )
+        for pk, warehouse_id, variant_id in stock_rows
+    ])
+    refresh_stock_rollup(variant_id for _, _, variant_id in stock_rows)
+    schedule_stock_alert_check(units.keys())
+    return sum(units.values())
+
+
+@transaction.atomic
+def restock(reservations, reference_number: str = '', user=None) -> int:
+    """
+    Put committed units back on their Stock rows and record RETURN movements
+
+    Returns:
+        Int: Units returned
+    """
+    units = _claim(reservations, StockReservation.Status.RETURNED, current=StockReservation.Status.COMMITTED)
+    if not units:
+        return 0
+
+    amount = value_per_pk(units, default=0)
+    Stock.objects.filter(pk__in=units.keys()).update(quantity=F('quantity') + amount, updated_at=timezone.now())
+    stock_rows = list(Stock.objects.filter(pk__in=units.keys()).values_list('pk', 'warehouse_id', 'variant_id'))
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            warehouse_id=warehouse_id,
+            variant_id=variant_id,
+            movement_type=StockMovement.MovementType.RETURN,
+            quantity=units[pk],
+            reference_number=reference_number,
+            created_by=user,
+        )
+        for pk, warehouse_id, variant_id in stock_rows
+    ])
+    refresh_stock_rollup(variant_id for _, _, variant_id in stock_rows)
+    schedule_stock_alert_check(units.keys())
+    return sum(units.values())
+
+
+def expire_reservations(now=None, batch_size: int = EXPIRY_BATCH_SIZE, on_batch=None) -> Tuple[int, int]:
+    """
+    Release every active hold past its expiry, one transaction per batch
+
+    Args:
+        now: Cut-off time (default: now)
+        batch_size: Reservations expired per transaction
+        on_batch: Optional callable receiving the ids of the orders that lost
+            a hold, run inside the batch's transaction
+
+    Returns:
+        Tuple of (reservations expired, units released)
+    """
+    now = now or timezone.now()
+    expired = released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StockReservation.objects.filter(
+                    status=StockReservation.Status.ACTIVE, expires_at__lte=now,
+                ).order_by('pk').values_list('pk', 'order_id')[:batch_size]
+            )
+            if not batch:
+                break
+            released += release(
+                StockReservation.objects.filter(pk__in=[pk for pk, _ in batch]),
+                status=StockReservation.Status.EXPIRED,
+            )
+            expired += len(batch)
+            if on_batch is not None:
+                on_batch({order_id for _, order_id in batch if order_id})
+        if len(batch) < batch_size:
+            break
+    return expired, released
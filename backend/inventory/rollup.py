@@ -0,0 +1,145 @@
+"""
+Materialized stock rollup
+
+`ProductVariant.available_stock` holds the variant's available units across
+its active warehouses (sum of quantity - reserved_quantity, never negative) and
+`Product.available_stock` the sum over the product's active variants, so
+listings read a precomputed column instead of aggregating `Stock` per row.
+For variants with warehouse stock, `ProductVariant.stock` is kept equal to
+`available_stock` as well: it is a derived cache the storefront reads, and
+only variants without any `Stock` row are sold from the flat field alone.
+Units in an inactive warehouse count for neither until it is reactivated.
+
+Each refresh is a single correlated UPDATE per table, run inside the caller's
+transaction. Model saves are covered by the signals in `inventory.signals`;
+code paths that write with `QuerySet.update()`/`bulk_create()` must call
+`refresh_stock_rollup()` with the touched variant ids.
+"""
+from typing import Iterable
+
+from django.db.models import Case, Exists, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from products.models import Product, ProductVariant
+from inventory.models import Stock
+
+# Variant ids refreshed per UPDATE when rebuilding the whole catalog
+CHUNK_SIZE = 1000
+
+
+def variant_available_expression():
+    """SQL expression for a variant's available units, correlated on its pk"""
+    available = Stock.objects.filter(
+        variant_id=OuterRef('pk'),
+        warehouse__is_active=True,
+    ).values('variant_id').annotate(
+        available=Sum('quantity') - Sum('reserved_quantity')
+    ).values('available')
+    return Greatest(
+        Coalesce(Subquery(available, output_field=IntegerField()), Value(0)),
+        Value(0),
+    )
+
+
+def variant_stock_expression():
+    """`ProductVariant.stock` as derived from warehouse stock, if there is any"""
+    return Case(
+        When(Exists(Stock.objects.filter(variant_id=OuterRef('pk'))), then=variant_available_expression()),
+        default=F('stock'),
+    )
+
+
+def product_available_expression():
+    """SQL expression for a product's available units, correlated on its pk"""
+    available = ProductVariant.objects.filter(
+        product_id=OuterRef('pk'),
+        is_active=True,
+    ).values('product_id').annotate(
+        available=Sum('available_stock')
+    ).values('available')
+    return Coalesce(Subquery(available, output_field=IntegerField()), Value(0))
+
+
+def refresh_product_rollup(product_ids: Iterable[str]) -> int:
+    """
+    Recompute `Product.available_stock` from the variant rollup
+
+    Args:
+        product_ids: Products to refresh
+
+    Returns:
+        Int: Number of products updated
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    return Product.objects.filter(pk__in=product_ids).update(
+        available_stock=product_available_expression()
+    )
+
+
+def refresh_stock_rollup(variant_ids: Iterable[str]) -> int:
+    """
+    Recompute the rollup for variants and their parent products
+
+    Args:
+        variant_ids: Variants whose `Stock` rows changed
+
+    Returns:
+        Int: Number of variants updated
+    """
+    variant_ids = set(variant_ids)
+    if not variant_ids:
+        return 0
+    variants = ProductVariant.objects.filter(pk__in=variant_ids)
+    updated = variants.update(
+        available_stock=variant_available_expression(),
+        stock=variant_stock_expression(),
+    )
+    refresh_product_rollup(variants.values_list('product_id', flat=True).distinct())
+    return updated
+
+
+def find_rollup_drift(limit: int = None):
+    """
+    List variants and products whose stored rollup disagrees with `Stock`
+
+    Returns:
+        Tuple of (variant rows, product rows), each a list of
+        (pk, stored, expected) tuples
+    """
+    variant_rows = ProductVariant.objects.annotate(
+        expected=variant_available_expression(),
+        expected_stock=variant_stock_expression(),
+    ).filter(
+        ~Q(available_stock=F('expected')) | ~Q(stock=F('expected_stock'))
+    ).values_list('pk', 'available_stock', 'expected')
+    product_rows = Product.objects.annotate(
+        expected=product_available_expression()
+    ).exclude(available_stock=F('expected')).values_list('pk', 'available_stock', 'expected')
+    if limit:
+        variant_rows, product_rows = variant_rows[:limit], product_rows[:limit]
+    return list(variant_rows), list(product_rows)
+
+
+def rebuild_stock_rollup(chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Rebuild the rollup for the whole catalog in chunks of variants
+
+    Returns:
+        Int: Number of variants refreshed
+    """
+    total = 0
+    last_pk = None
+    while True:
+        ids = ProductVariant.objects.order_by('pk')
+        if last_pk is not None:
+            ids = ids.filter(pk__gt=last_pk)
+        chunk = list(ids.values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            break
+        total += refresh_stock_rollup(chunk)
+        last_pk = chunk[-1]
+    # Products without any variant still need their rollup zeroed
+    Product.objects.filter(variants__isnull=True).exclude(available_stock=0).update(available_stock=0)
+    return total
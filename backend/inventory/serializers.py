@@ -100,21 +100,30 @@ class CreateStockImportSerializer(serializers.Serializer):
     notes = serializers.CharField(required=False, allow_blank=True)
     items = serializers.ListField(
         child=serializers.DictField(),
-        allow_empty=False
+        allow_empty=False,
+        required=False
     )
+    # CSV manifest with variant_id/sku, quantity_ordered and unit_cost columns
+    file = serializers.FileField(required=False)
+
+    def validate(self, data):
+        if not data.get('items') and not data.get('file'):
+            raise serializers.ValidationError({'items': 'Provide items or a CSV manifest file.'})
+        return data
 
 
 class StockAlertSerializer(serializers.ModelSerializer):
     warehouse_name = serializers.CharField(source='stock.warehouse.name', read_only=True)
     product_name = serializers.CharField(source='stock.variant.product.name', read_only=True)
     variant_details = serializers.SerializerMethodField()
+    is_resolved = serializers.BooleanField(read_only=True)
     
     class Meta:
         model = StockAlert
         fields = [
             'id', 'stock', 'warehouse_name', 'product_name', 'variant_details',
-            'alert_type', 'message', 'is_resolved', 'resolved_at',
-            'created_at', 'updated_at'
+            'alert_type', 'status', 'current_quantity', 'threshold_quantity', 'message',
+            'is_resolved', 'resolved_at', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
     
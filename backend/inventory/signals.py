@@ -0,0 +1,68 @@
+"""
+Signal handlers keeping the stock rollup and alerts in sync with model saves
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import Product, ProductVariant
+from inventory.models import Stock, StockMovement, Warehouse
+from inventory.alerts import schedule_stock_alert_check
+from inventory.rollup import CHUNK_SIZE, refresh_product_rollup, refresh_stock_rollup
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def stock_changed(sender, instance, **kwargs):
+    """Refresh the rollup of the variant whose warehouse stock changed"""
+    refresh_stock_rollup([instance.variant_id])
+
+
+@receiver(post_save, sender=Stock)
+def stock_saved(sender, instance, **kwargs):
+    """Re-check the row's alerts once the write commits"""
+    schedule_stock_alert_check([instance.pk])
+
+
+@receiver(post_save, sender=StockMovement)
+def stock_movement_recorded(sender, instance, created, **kwargs):
+    """Movements accompany stock writes done through `QuerySet.update()`"""
+    if created:
+        refresh_stock_rollup([instance.variant_id])
+
+
+@receiver(post_save, sender=Warehouse)
+def warehouse_saved(sender, instance, created, raw, **kwargs):
+    """Activating or deactivating a warehouse adds or drops its units from the rollup"""
+    if raw or created or 'is_active' not in instance.changed_fields():
+        return
+    variant_ids = list(Stock.objects.filter(warehouse=instance).values_list('variant_id', flat=True))
+    for start in range(0, len(variant_ids), CHUNK_SIZE):
+        refresh_stock_rollup(variant_ids[start:start + CHUNK_SIZE])
+
+
+@receiver(post_save, sender=ProductVariant)
+def variant_saved(sender, instance, created, raw, **kwargs):
+    """
+    Recompute the rollup after a variant save that can change it
+
+    Setting `stock` or `available_stock` by hand is overridden for variants
+    with warehouse stock; activating or deactivating a variant, or moving
+    it, changes its product's total. Other saves leave both columns out
+    (see `LoadedValuesMixin`) and cost no refresh.
+    """
+    changed = instance.changed_fields()
+    if raw or not (created or changed):
+        return
+    refresh_stock_rollup([instance.pk])
+    if 'product_id' in changed and instance.loaded_value('product_id') is not None:
+        refresh_product_rollup([instance.loaded_value('product_id')])
+    instance.refresh_from_db(fields=['stock', 'available_stock'])
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw, **kwargs):
+    """Recompute `available_stock` if a product save set it"""
+    if raw or not (created or instance.changed_fields()):
+        return
+    refresh_product_rollup([instance.pk])
+    instance.refresh_from_db(fields=['available_stock'])
@@ -0,0 +1,153 @@
+"""
+Streaming stock listing
+
+`StockViewSet.list` returns every `Stock` row followed by a "synthetic" row
+for each active variant that has no `Stock` row, so the admin UI sees the
+whole catalog. Both parts are read in keyset batches and encoded as they
+are produced, keeping memory flat however large the inventory is: Stock
+rows in the listing's `?ordering=` (ties broken by primary key), synthetic
+rows after them by variant id. The synthetic rows come from an anti-join
+in SQL rather than an `exclude(id__in=...)` over ids pulled into Python.
+"""
+from typing import Dict, Iterable, Iterator, Sequence
+
+from django.db.models import Exists, OuterRef, Q
+from rest_framework.utils.encoders import JSONEncoder
+
+from products.models import ProductVariant
+from products.promotions import PriceBook
+
+# Rows fetched per query while streaming
+BATCH_SIZE = 500
+
+# Mirrors the Stock defaults for variants without a Stock row
+SYNTHETIC_LOW_STOCK_THRESHOLD = 10
+
+SYNTHETIC_FIELDS = (
+    'id', 'storage', 'color', 'price', 'original_price', 'stock', 'images',
+    'created_at', 'updated_at', 'product_id', 'product__name',
+    'product__category__name', 'product__brand__name',
+)
+
+
+def _row_value(row, field: str):
+    if isinstance(row, dict):
+        return row['id' if field == 'pk' else field]
+    return getattr(row, field)
+
+
+def _after(keys: Sequence[str], values: Sequence) -> Q:
+    """Rows following `values` in the order of `keys` ('-' for descending)"""
+    condition, equal = Q(), {}
+    for key, value in zip(keys, values):
+        field = key.lstrip('-')
+        condition |= Q(**equal, **{f"{field}__{'lt' if key.startswith('-') else 'gt'}": value})
+        equal[field] = value
+    return condition
+
+
+def iter_batches(queryset, batch_size: int = BATCH_SIZE, ordering: Sequence[str] = ()) -> Iterator[list]:
+    """
+    Yield lists of rows, one query per batch
+
+    Rows come in `ordering` (field names, '-' for descending), ties and
+    the default broken by primary key; each batch starts after the last
+    row of the previous one.
+    """
+    keys = [key for key in ordering if key.lstrip('-') not in ('pk', 'id')] + ['pk']
+    queryset = queryset.order_by(*keys)
+    last_values = None
+    while True:
+        page = queryset if last_values is None else queryset.filter(_after(keys, last_values))
+        batch = list(page[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last_values = [_row_value(batch[-1], key.lstrip('-')) for key in keys]
+        if len(batch) < batch_size:
+            return
+
+
+def unstocked_variants(stock_queryset):
+    """Active variants of active products without a row in `stock_queryset`"""
+    return ProductVariant.objects.filter(
+        is_active=True,
+        product__is_active=True,
+    ).exclude(
+        Exists(stock_queryset.order_by().filter(variant_id=OuterRef('pk')))
+    ).values(*SYNTHETIC_FIELDS)
+
+
+def synthetic_stock_row(variant: Dict) -> Dict:
+    """Stock-shaped row for a variant that has no Stock record"""
+    stock = variant['stock']
+    return {
+        'id': f"synthetic-{variant['id']}",
+        'variant': variant['id'],
+        'variant_details': {
+            'id': variant['id'],
+            'storage': variant['storage'],
+            'color': variant['color'],
+            'price': str(variant['price']),
+            'original_price': str(variant['original_price']) if variant['original_price'] else None,
+            'stock': stock,
+            'images': variant['images'] or [],
+            'product': {
+                'id': variant['product_id'],
+                'name': variant['product__name'],
+                'category': variant['product__category__name'],
+                'brand': variant['product__brand__name'],
+            },
+        },
+        'product_name': variant['product__name'],
+        'quantity': stock,
+        'reserved_quantity': 0,
+        'available_quantity': stock,
+        'low_stock_threshold': SYNTHETIC_LOW_STOCK_THRESHOLD,
+        'is_low_stock': stock <= SYNTHETIC_LOW_STOCK_THRESHOLD,
+        'is_out_of_stock': stock == 0,
+        'last_restocked_at': None,
+        'created_at': variant['created_at'].isoformat() if variant['created_at'] else None,
+        'updated_at': variant['updated_at'].isoformat() if variant['updated_at'] else None,
+    }
+
+
+def iter_stock_rows(stock_queryset, serializer_factory, batch_size: int = BATCH_SIZE) -> Iterator[Dict]:
+    """
+    Yield serialized Stock rows, then synthetic rows for unstocked variants
+
+    Args:
+        stock_queryset: Filtered Stock queryset; its explicit ordering (e.g.
+            from `?ordering=`) is kept
+        serializer_factory: Callable returning a list serializer for a batch
+            (e.g. the view's `get_serializer` with `many=True`)
+        batch_size: Rows fetched per query
+    """
+    # One promotion index for the whole listing rather than one per batch
+    price_book = PriceBook()
+    ordering = [key for key in stock_queryset.query.order_by if isinstance(key, str)]
+    for batch in iter_batches(stock_queryset, batch_size, ordering):
+        serializer = serializer_factory(batch)
+        serializer._price_book = price_book
+        yield from serializer.data
+
+    for batch in iter_batches(unstocked_variants(stock_queryset), batch_size):
+        for variant in batch:
+            yield synthetic_stock_row(variant)
+
+
+def encode_json_array(rows: Iterable[Dict]) -> Iterator[str]:
+    """Encode rows as one JSON array, a chunk per row"""
+    encoder = JSONEncoder()
+    separator = '['
+    for row in rows:
+        yield separator + encoder.encode(row)
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+def encode_json_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    """Encode rows as newline-delimited JSON"""
+    encoder = JSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
@@ -1,3 +1,862 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from smtplib import SMTPException
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from products.models import Brand, Category, Product, ProductVariant
+from .alerts import evaluate_stock_alerts, resolve_recovered_alerts
+from .allocation import allocate
+from .ledger import inventory_valuation, ledger_balances, ledger_series, take_ledger_snapshots
+from .imports import create_import, read_manifest_csv, receive_import
+from .models import (
+    Stock, StockAlert, StockAlertNotification, StockAlertRun, StockImport, StockImportItem, StockMovement,
+    Supplier, Warehouse,
+)
+from .reconciliation import ReconciliationError, find_discrepancies, reconcile_stock
+from .notifications import MAX_ATTEMPTS, RETRY_BACKOFF, deliver_notifications, enqueue_alert_notifications
+from .replenishment import apply_thresholds, draft_imports, plan_replenishment
+from .reservations import reserve
+from .rollup import find_rollup_drift
+from .serializers import StockSerializer
+from .stock_listing import iter_stock_rows
+
+
+def make_warehouse(code, **fields):
+    fields = {'state': 'ST', 'postal_code': '00000', **fields}
+    return Warehouse.objects.create(
+        name=f'{code} Warehouse', code=code, address_line1='1 Main St', city='City',
+        phone='555', email=f'{code.lower()}@example.com', **fields,
+    )
+
+
+def make_variant(product_id='phone', variant_id='phone-128', price='500.00'):
+    category, _ = Category.objects.get_or_create(name='Phones')
+    brand, _ = Brand.objects.get_or_create(name='Acme')
+    product, _ = Product.objects.get_or_create(
+        id=product_id,
+        defaults=dict(name=product_id.title(), brand=brand, category=category,
+                      base_price=Decimal(price), image='http://example.com/p.png', description=''),
+    )
+    return ProductVariant.objects.create(
+        id=variant_id, product=product, storage=variant_id, color='Black', price=Decimal(price),
+    )
+
+
+class StockRollupTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.east = make_warehouse('EAST')
+        self.variant = make_variant()
+        self.other = make_variant(variant_id='phone-256')
+
+    def test_stock_writes_maintain_variant_and_product_rollup(self):
+        Stock.objects.create(warehouse=self.main, variant=self.variant, quantity=10, reserved_quantity=3)
+        Stock.objects.create(warehouse=self.east, variant=self.variant, quantity=5)
+        Stock.objects.create(warehouse=self.main, variant=self.other, quantity=4)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.available_stock, 12)
+        self.assertEqual(Product.objects.get(pk='phone').available_stock, 16)
+
+        self.other.is_active = False
+        self.other.save()
+        self.assertEqual(Product.objects.get(pk='phone').available_stock, 12)
+
+    def test_saving_a_stale_instance_keeps_the_rollup(self):
+        variant, product = ProductVariant.objects.get(pk=self.variant.pk), Product.objects.get(pk='phone')
+        Stock.objects.create(warehouse=self.main, variant=self.variant, quantity=10, reserved_quantity=3)
+
+        # Neither save touches the rollup columns, so neither refreshes them
+        variant.price = Decimal('450.00')
+        product.name = 'Phone X'
+        with CaptureQueriesContext(connection) as queries:
+            variant.save()
+            product.save()
+        self.assertFalse([query['sql'] for query in queries if '"available_stock" =' in query['sql']])
+        self.assertEqual(
+            ProductVariant.objects.values_list('stock', 'available_stock').get(pk=self.variant.pk), (7, 7),
+        )
+        self.assertEqual(Product.objects.get(pk='phone').available_stock, 7)
+
+    def test_rollup_changes_and_fixtures_are_handled(self):
+        Stock.objects.create(warehouse=self.main, variant=self.variant, quantity=10, reserved_quantity=3)
+        variant = ProductVariant.objects.get(pk=self.variant.pk)
+        variant.available_stock = 100
+        variant.save()
+        self.assertEqual((variant.stock, variant.available_stock), (7, 7))
+
+        # Fixture loading writes rows as they are; the rebuild command catches up
+        variant.available_stock = 100
+        variant.save_base(raw=True)
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available_stock, 100)
+
+        make_variant(product_id='tablet', variant_id='tablet-64')
+        variant.product_id = 'tablet'
+        variant.save()
+        self.assertEqual(dict(Product.objects.values_list('pk', 'available_stock')), {'phone': 0, 'tablet': 7})
+
+    def test_inactive_warehouses_are_left_out(self):
+        Stock.objects.create(warehouse=self.main, variant=self.variant, quantity=10, reserved_quantity=3)
+        Stock.objects.create(warehouse=self.east, variant=self.variant, quantity=5)
+
+        self.east.is_active = False
+        self.east.save()
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.available_stock), (7, 7))
+        self.assertEqual(Product.objects.get(pk='phone').available_stock, 7)
+
+        east = Warehouse.objects.get(pk=self.east.pk)
+        east.is_active = True
+        east.save()
+        self.assertEqual(Product.objects.get(pk='phone').available_stock, 12)
+        self.assertEqual(find_rollup_drift(), ([], []))
+
+    def test_rebuild_command_detects_and_repairs_drift(self):
+        Stock.objects.create(warehouse=self.main, variant=self.variant, quantity=7)
+        Stock.objects.filter(variant=self.variant).update(quantity=9)  # bypasses signals
+
+        out = StringIO()
+        call_command('rebuild_stock_rollup', '--verify', stdout=out)
+        self.assertIn('1 variants and 0 products drifted', out.getvalue())
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available_stock, 7)
+
+        call_command('rebuild_stock_rollup', stdout=StringIO())
+        self.assertEqual(ProductVariant.objects.get(pk=self.variant.pk).available_stock, 9)
+        self.assertEqual(Product.objects.get(pk='phone').available_stock, 9)
+
+
+    def test_variant_edits_leave_warehouse_stock_alone(self):
+        Stock.objects.create(warehouse=self.main, variant=self.variant, quantity=10, reserved_quantity=3)
+        Stock.objects.create(warehouse=self.east, variant=self.variant, quantity=5)
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x',
+        ))
+        response = client.patch(f'/api/products/variants/{self.variant.pk}/', {'price': '450.00', 'stock': 100},
+                                format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['stock'], 12)
+        self.assertEqual(
+            sorted(Stock.objects.values_list('warehouse__code', 'quantity', 'reserved_quantity')),
+            [('EAST', 5, 0), ('MAIN', 10, 3)],
+        )
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.price, self.variant.stock), (Decimal('450.00'), 12))
+
+
+class WarehouseAllocationTests(TestCase):
+    def setUp(self):
+        self.phone = make_variant()
+        self.case = make_variant(product_id='case', variant_id='case-1', price='20.00')
+
+    def stock(self, warehouse, **units):
+        for variant_id, quantity in units.items():
+            Stock.objects.create(warehouse=warehouse, variant_id=variant_id.replace('_', '-'), quantity=quantity)
+
+    def split(self, units):
+        rows = Stock.objects.filter(pk__in=units).values_list('pk', 'warehouse__code', 'variant_id')
+        return sorted((code, variant_id, units[pk]) for pk, code, variant_id in rows)
+
+    def test_fewest_shipments_then_nearest_then_cheapest(self):
+        # The nearest warehouse only has the phone, so it would split the order
+        self.stock(make_warehouse('NEAR', state='NY', postal_code='10001'), phone_128=5)
+        self.stock(make_warehouse('FAR', state='CA', postal_code='90001'), phone_128=5, case_1=5)
+        self.stock(make_warehouse('CLOSE', state='NY', postal_code='12000', shipping_cost='9.00'),
+                   phone_128=5, case_1=5)
+        self.stock(make_warehouse('CHEAP', state='NY', postal_code='14000', shipping_cost='4.00'),
+                   phone_128=5, case_1=5)
+        destination = {'state': 'NY', 'postal_code': '10002', 'country': 'USA'}
+
+        with self.assertNumQueries(1):
+            units, shortfalls, stocked = allocate({'phone-128': 2, 'case-1': 1}, destination)
+        self.assertEqual(shortfalls, {})
+        self.assertEqual(stocked, {'phone-128', 'case-1'})
+        self.assertEqual(self.split(units), [('CHEAP', 'case-1', 1), ('CHEAP', 'phone-128', 2)])
+
+    def test_splits_only_when_no_warehouse_holds_the_whole_order(self):
+        self.stock(make_warehouse('MAIN'), phone_128=3, case_1=1)
+        self.stock(make_warehouse('EAST'), phone_128=4)
+        self.stock(make_warehouse('WEST', is_active=False), phone_128=50)
+
+        units, shortfalls, _ = allocate({'phone-128': 6, 'case-1': 1})
+        self.assertEqual(self.split(units), [('EAST', 'phone-128', 3), ('MAIN', 'case-1', 1), ('MAIN', 'phone-128', 3)])
+
+        units, shortfalls, _ = allocate({'phone-128': 8, 'case-1': 1})
+        self.assertEqual((units, shortfalls), ({}, {'phone-128': 7}))
+
+    def test_variant_stock_is_derived_from_warehouse_stock(self):
+        main = make_warehouse('MAIN')
+        self.stock(main, phone_128=5)
+        stock = Stock.objects.get(variant=self.phone)
+        reserve({stock.pk: 2})
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 3)
+
+        # Variants without warehouse stock keep their own counter
+        ProductVariant.objects.filter(pk='case-1').update(stock=7)
+        units, _, stocked = allocate({'case-1': 1})
+        self.assertEqual((units, stocked), ({}, set()))
+        call_command('rebuild_stock_rollup', stdout=StringIO())
+        self.assertEqual(ProductVariant.objects.get(pk='case-1').stock, 7)
+
+
+class StockAlertEvaluatorTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.stocks = {
+            quantity: Stock.objects.create(
+                warehouse=self.main, variant=make_variant(variant_id=f'phone-{quantity}'), quantity=quantity,
+            )
+            for quantity in (0, 3, 8, 20)
+        }
+        get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+
+    def alerts(self):
+        return sorted(StockAlert.objects.values_list('stock__quantity', 'alert_type', 'current_quantity'))
+
+    def test_rows_are_classified_and_diffed_against_open_alerts(self):
+        run = evaluate_stock_alerts()
+        self.assertEqual((run.mode, run.rows_scanned, run.alerts_created), (StockAlertRun.Mode.FULL, 4, 3))
+        self.assertEqual(self.alerts(), [
+            (0, 'OUT_OF_STOCK', 0), (3, 'CRITICAL', 3), (8, 'LOW_STOCK', 8),
+        ])
+        # One notification per alert for the warehouse and for the admin
+        self.assertEqual(run.notifications_queued, 6)
+
+        # A rerun neither duplicates alerts nor queues them again
+        run = evaluate_stock_alerts()
+        self.assertEqual((run.alerts_created, run.alerts_updated, run.notifications_queued), (0, 0, 0))
+
+        # Reservations count against availability
+        Stock.objects.filter(pk=self.stocks[8].pk).update(reserved_quantity=1)
+        self.assertEqual(evaluate_stock_alerts().alerts_updated, 1)
+        self.assertEqual(StockAlert.objects.get(stock=self.stocks[8]).current_quantity, 7)
+
+    def test_incremental_run_only_scans_rows_changed_since_the_last_run(self):
+        evaluate_stock_alerts(notify=False)
+        stock = self.stocks[20]
+        stock.quantity = 2
+        stock.save()
+
+        out = StringIO()
+        call_command('check_stock_alerts', '--incremental', '--no-notify', stdout=out)
+        self.assertIn('Incremental run since', out.getvalue())
+        self.assertIn('1 rows scanned', out.getvalue())
+        run = StockAlertRun.objects.first()
+        self.assertEqual((run.rows_scanned, run.critical, run.alerts_created), (1, 1, 1))
+        self.assertEqual(StockAlert.objects.filter(status=StockAlert.AlertStatus.ACTIVE).count(), 4)
+
+
+    def test_recovered_alerts_are_resolved_in_bulk(self):
+        evaluate_stock_alerts(notify=False)
+        Stock.objects.filter(pk=self.stocks[0].pk).update(quantity=2)   # out of stock -> critical
+        Stock.objects.filter(pk=self.stocks[8].pk).update(quantity=11)  # low -> fine
+
+        # Only the touched rows are looked at
+        self.assertEqual(sum(resolve_recovered_alerts(stock_ids=[self.stocks[3].pk]).values()), 0)
+        with self.assertNumQueries(3):
+            resolved = resolve_recovered_alerts()
+        self.assertEqual(resolved, {'OUT_OF_STOCK': 1, 'CRITICAL': 0, 'LOW_STOCK': 1})
+        self.assertEqual(
+            sorted(StockAlert.objects.filter(status='RESOLVED').values_list('alert_type', 'current_quantity')),
+            [('LOW_STOCK', 11), ('OUT_OF_STOCK', 2)],
+        )
+        self.assertEqual(list(StockAlert.objects.filter(status='ACTIVE').values_list('alert_type', flat=True)),
+                         ['CRITICAL'])
+        self.assertEqual(sum(resolve_recovered_alerts().values()), 0)
+
+
+class StockAlertHookTests(TestCase):
+    def setUp(self):
+        main = make_warehouse('MAIN')
+        # Created without signals: every test runs inside one transaction,
+        # which a save here would already have scheduled a check for
+        self.phone, self.case = Stock.objects.bulk_create([
+            Stock(warehouse=main, variant=make_variant(), quantity=20),
+            Stock(warehouse=main, variant=make_variant(product_id='case', variant_id='case-1'), quantity=20),
+        ])
+
+    def open_alerts(self):
+        return sorted(StockAlert.objects.filter(status__in=StockAlert.OPEN_STATUSES).values_list(
+            'stock__variant_id', 'alert_type',
+        ))
+
+    def test_stock_writes_are_checked_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for quantity in (15, 8, 2):
+                    self.phone.quantity = quantity
+                    self.phone.save()
+                reserve({self.case.pk: 20})
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.open_alerts(), [('case-1', 'OUT_OF_STOCK'), ('phone-128', 'CRITICAL')])
+
+    def test_adjustments_raise_and_resolve_alerts_without_a_scan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/inventory/stock/{self.phone.pk}/adjust/', {'adjustment': -20})
+        self.assertEqual(self.open_alerts(), [('phone-128', 'OUT_OF_STOCK')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/inventory/stock/{self.phone.pk}/adjust/', {'adjustment': 50})
+        self.assertEqual(self.open_alerts(), [])
+        self.assertFalse(StockAlertRun.objects.exists())
+
+    def test_is_resolved_filter_maps_onto_status(self):
+        StockAlert.objects.create(stock=self.phone, alert_type='LOW_STOCK', status='RESOLVED', message='low')
+        StockAlert.objects.create(stock=self.case, alert_type='LOW_STOCK', status='ACKNOWLEDGED', message='low')
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        ))
+        for value, stock in (('true', self.phone), ('false', self.case)):
+            response = client.get('/api/inventory/stock-alerts/', {'is_resolved': value})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row['stock'] for row in response.data['results']], [stock.pk])
+
+    def test_rolled_back_writes_schedule_nothing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                sid = transaction.savepoint()
+                self.phone.quantity = 0
+                self.phone.save()
+                transaction.savepoint_rollback(sid)
+                self.case.quantity = 1
+                self.case.save()
+        self.assertEqual(len(callbacks), 1)
+
+    def test_writes_after_a_rolled_back_block_are_checked(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    self.phone.quantity = 0
+                    self.phone.save()
+                    raise RuntimeError
+            with transaction.atomic():
+                self.case.quantity = 0
+                self.case.save()
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.open_alerts(), [('case-1', 'OUT_OF_STOCK')])
+
+
+class StockAlertNotificationTests(TestCase):
+    def setUp(self):
+        main = make_warehouse('MAIN')
+        for quantity in (0, 3):
+            Stock.objects.create(warehouse=main, variant=make_variant(variant_id=f'phone-{quantity}'), quantity=quantity)
+        get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+        evaluate_stock_alerts()
+
+    def test_outbox_is_drained_as_one_digest_per_recipient(self):
+        with self.assertNumQueries(5):
+            stats = deliver_notifications()
+        self.assertEqual(stats, {'sent': 4, 'emails': 2, 'retrying': 0, 'failed': 0})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['admin@example.com', 'main@example.com'])
+        self.assertIn('2 stock alerts', mail.outbox[0].subject)
+        self.assertEqual(
+            set(StockAlert.objects.values_list('email_sent', 'notification_count')), {(True, 1)},
+        )
+
+        # Notified alerts are only queued again after 24 hours
+        alerts = StockAlert.objects.all()
+        self.assertEqual(enqueue_alert_notifications(alerts), 0)
+        self.assertEqual(enqueue_alert_notifications(alerts, now=timezone.now() + timedelta(hours=25)), 4)
+
+    def test_failed_sends_are_retried_with_backoff(self):
+        now = timezone.now()
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException('down')), \
+                self.assertLogs('inventory.notifications', 'ERROR'):
+            self.assertEqual(deliver_notifications(now=now)['retrying'], 4)
+        notification = StockAlertNotification.objects.first()
+        self.assertEqual((notification.status, notification.attempts, notification.last_error), ('PENDING', 1, 'down'))
+        self.assertEqual(notification.next_attempt_at, now + RETRY_BACKOFF)
+
+        # Not due yet
+        self.assertEqual(deliver_notifications(now=now)['sent'], 0)
+        self.assertEqual(deliver_notifications(now=now + RETRY_BACKOFF)['sent'], 4)
+        self.assertEqual(len(mail.outbox), 2)
+
+        StockAlertNotification.objects.update(status='PENDING', attempts=MAX_ATTEMPTS - 1)
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException('down')), \
+                self.assertLogs('inventory.notifications', 'ERROR'):
+            self.assertEqual(deliver_notifications(now=now + timedelta(days=1))['failed'], 4)
+
+
+class StockImportReceivingTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.variants = [make_variant(variant_id=f'phone-{i}') for i in range(4)]
+        Stock.objects.bulk_create([Stock(warehouse=self.main, variant=self.variants[0], quantity=5)])
+        supplier = Supplier.objects.create(
+            name='Parts Co', code='PARTS', contact_person='Pat', email='parts@example.com', phone='555',
+            address_line1='2 Dock Rd', city='City', state='ST', postal_code='00000',
+        )
+        self.stock_import = StockImport.objects.create(
+            warehouse=self.main, supplier=supplier, order_date=timezone.now().date(),
+        )
+        self.items = StockImportItem.objects.bulk_create([
+            StockImportItem(
+                stock_import=self.stock_import, variant=variant, quantity_ordered=10,
+                unit_cost=Decimal('2.00'), total_cost=Decimal('20.00'),
+            )
+            for variant in self.variants
+        ])
+        self.admin = get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = f'/api/inventory/stock-imports/{self.stock_import.pk}/receive/'
+
+    def stock(self):
+        return dict(Stock.objects.values_list('variant_id', 'quantity'))
+
+    def test_partial_then_csv_receipt(self):
+        response = self.client.post(self.url, {'items': [
+            {'item_id': item.pk, 'quantity_received': 4} for item in self.items[:2]
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], StockImport.ImportStatus.PARTIALLY_RECEIVED)
+        self.assertEqual(self.stock(), {'phone-0': 9, 'phone-1': 4})
+
+        # Cumulative totals: phone-0 and phone-1 only add the rest
+        upload = SimpleUploadedFile('receipt.csv', (
+            'sku,quantity\n' + ''.join(f'{variant.pk},10\n' for variant in self.variants)
+        ).encode(), content_type='text/csv')
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], StockImport.ImportStatus.RECEIVED)
+        self.assertEqual(self.stock(), {'phone-0': 15, 'phone-1': 10, 'phone-2': 10, 'phone-3': 10})
+        self.assertEqual(ProductVariant.objects.get(pk='phone-2').available_stock, 10)
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(variant_id='phone-0').values_list('quantity', flat=True)), [4, 6],
+        )
+
+        response = self.client.post(self.url, {'items': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_statement_count_does_not_grow_with_lines(self):
+        def receive(items, quantity):
+            return receive_import(self.stock_import, [
+                {'item_id': item.pk, 'quantity_received': quantity} for item in items
+            ])
+
+        with self.assertNumQueries(13):
+            receive(self.items[:1], 1)
+        with self.assertNumQueries(13):
+            receive(self.items, 2)
+
+    def test_every_invalid_line_is_reported(self):
+        response = self.client.post(self.url, {'items': [
+            {'item_id': self.items[0].pk, 'quantity_received': 11},
+            {'item_id': 999999, 'quantity_received': 1},
+            {'item_id': self.items[1].pk, 'quantity_received': 'many'},
+            {'item_id': self.items[2].pk, 'quantity_received': 3},
+            {'item_id': self.items[2].pk, 'quantity_received': 3},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['line'] for error in response.data['errors']], [1, 2, 3, 5])
+        self.assertEqual(self.stock(), {'phone-0': 5})
+        self.assertFalse(StockMovement.objects.exists())
+
+
+class StockImportManifestTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.phone = make_variant()
+        ProductVariant.objects.bulk_create([
+            ProductVariant(id=f'bulk-{i}', product=self.phone.product, storage='64GB', color=f'c{i}', price=1)
+            for i in range(1500)
+        ])
+        self.admin = get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_create_uses_decimal_totals(self):
+        response = self.client.post('/api/inventory/stock-imports/', {
+            'warehouse_id': self.main.pk, 'order_date': '2026-01-05',
+            'items': [
+                {'variant_id': 'phone-128', 'quantity_ordered': 3, 'unit_cost': '0.10'},
+                {'variant_id': 'bulk-1', 'quantity_ordered': 1, 'unit_cost': '19.99'},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['total_cost'], '20.29')
+        self.assertEqual([item['total_cost'] for item in response.data['items']], ['0.30', '19.99'])
+
+    def test_large_csv_manifest_in_constant_statements(self):
+        manifest = 'sku,quantity,unit_cost\n' + ''.join(f'bulk-{i},{i % 7 + 1},1.10\n' for i in range(1500))
+        with CaptureQueriesContext(connection) as queries:
+            stock_import = create_import(self.main, read_manifest_csv(manifest.encode()), batch_size=1000)
+        # A handful of batched statements (SQLite's parameter limit splits them further)
+        self.assertLess(len(queries), 20)
+        self.assertEqual(stock_import.items.count(), 1500)
+        self.assertEqual(
+            StockImport.objects.get().total_cost, sum(Decimal('1.10') * (i % 7 + 1) for i in range(1500)),
+        )
+
+        upload = SimpleUploadedFile('manifest.csv', manifest.encode(), content_type='text/csv')
+        response = self.client.post('/api/inventory/stock-imports/manifest/', {
+            'warehouse_id': self.main.pk, 'order_date': '2026-01-05', 'file': upload,
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['items'], 1500)
+
+    def test_every_missing_sku_is_reported(self):
+        response = self.client.post('/api/inventory/stock-imports/manifest/', {
+            'warehouse_id': self.main.pk, 'order_date': '2026-01-05',
+            'items': [
+                {'variant_id': 'nope-1', 'quantity_ordered': 1, 'unit_cost': '1'},
+                {'variant_id': 'bulk-1', 'quantity_ordered': 0, 'unit_cost': '1'},
+                {'variant_id': 'nope-2', 'quantity_ordered': 1, 'unit_cost': '1'},
+                {'variant_id': 'bulk-2', 'quantity_ordered': 1, 'unit_cost': 'free'},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['missing_skus'], ['nope-1', 'nope-2'])
+        self.assertEqual([error['line'] for error in response.data['errors']], [1, 2, 3, 4])
+        self.assertFalse(StockImport.objects.exists())
+
+    def test_command_reads_json_lines(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            for i in range(3):
+                file.write(json.dumps({'variant_id': f'bulk-{i}', 'quantity_ordered': 2, 'unit_cost': '2.50'}) + '\n')
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('import_stock_manifest', file.name, '--warehouse', 'MAIN', stdout=out)
+        self.assertIn('with 3 items, total 15.00', out.getvalue())
+
+
+class StockTransferTests(TestCase):
+    def setUp(self):
+        self.main, self.east = make_warehouse('MAIN'), make_warehouse('EAST')
+        self.variants = [make_variant(variant_id=f'phone-{i}') for i in range(3)]
+        Stock.objects.bulk_create(
+            [Stock(warehouse=self.main, variant=variant, quantity=10) for variant in self.variants]
+            + [Stock(warehouse=self.east, variant=self.variants[0], quantity=1, reserved_quantity=1)]
+        )
+        self.url = '/api/inventory/stock/batch_transfer/'
+
+    def levels(self):
+        return {
+            (code, variant_id): quantity
+            for code, variant_id, quantity in Stock.objects.values_list('warehouse__code', 'variant_id', 'quantity')
+        }
+
+    def test_batch_transfer_moves_every_line_with_shared_reference(self):
+        response = self.client.post(self.url, {
+            'source_warehouse_id': self.main.pk, 'target_warehouse_id': self.east.pk,
+            'items': [{'variant_id': 'phone-0', 'quantity': 4}, {'variant_id': 'phone-2', 'quantity': 10}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['lines'], response.data['units']), (2, 14))
+        self.assertEqual(self.levels(), {
+            ('MAIN', 'phone-0'): 6, ('MAIN', 'phone-1'): 10, ('MAIN', 'phone-2'): 0,
+            ('EAST', 'phone-0'): 5, ('EAST', 'phone-2'): 10,
+        })
+        movements = StockMovement.objects.filter(reference_number=response.data['reference_number'])
+        self.assertEqual(
+            sorted(movements.values_list('warehouse__code', 'variant_id', 'quantity')),
+            [('EAST', 'phone-0', 4), ('EAST', 'phone-2', 10), ('MAIN', 'phone-0', -4), ('MAIN', 'phone-2', -10)],
+        )
+        self.assertEqual(ProductVariant.objects.get(pk='phone-2').available_stock, 10)
+
+    def test_shortfalls_are_all_reported_and_nothing_moves(self):
+        response = self.client.post(self.url, {
+            'source_warehouse_id': self.east.pk, 'target_warehouse_id': self.main.pk,
+            'items': [
+                {'variant_id': 'phone-0', 'quantity': 1},
+                {'variant_id': 'phone-1', 'quantity': 2},
+            ],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [(error['variant_id'], error['available']) for error in response.data['errors']],
+            [('phone-0', 0), ('phone-1', 0)],
+        )
+        self.assertEqual(Stock.objects.count(), 4)
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_single_transfer_creates_the_target_row(self):
+        source = Stock.objects.get(warehouse=self.main, variant_id='phone-1')
+        response = self.client.post(
+            f'/api/inventory/stock/{source.pk}/transfer/', {'target_warehouse_id': self.east.pk, 'quantity': 3},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['source_stock']['quantity'], response.data['target_stock']['quantity']), (7, 3))
+
+        response = self.client.post(
+            f'/api/inventory/stock/{source.pk}/transfer/', {'target_warehouse_id': self.east.pk, 'quantity': 8},
+            content_type='application/json',
+        )
+        self.assertEqual(response.data['error'], 'Insufficient stock for phone-1 at MAIN: 7 available')
+
+
+class ReplenishmentPlannerTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.phone, self.idle = make_variant(), make_variant(variant_id='phone-256')
+        self.stock = Stock.objects.create(warehouse=self.main, variant=self.phone, quantity=25, reserved_quantity=20)
+        Stock.objects.create(warehouse=self.main, variant=self.idle, quantity=3)
+        self.supplier = Supplier.objects.create(
+            name='Parts Co', code='PARTS', contact_person='Pat', email='parts@example.com', phone='555',
+            address_line1='2 Dock Rd', city='City', state='ST', postal_code='00000',
+        )
+        today = timezone.now().date()
+        # Lead times of 5 and 7 days
+        for ordered, received, cost in ((12, 7, '4.00'), (9, 2, '4.50')):
+            stock_import = StockImport.objects.create(
+                warehouse=self.main, supplier=self.supplier, status=StockImport.ImportStatus.RECEIVED,
+                order_date=today - timedelta(days=ordered), received_date=today - timedelta(days=received),
+            )
+            StockImportItem.objects.create(
+                stock_import=stock_import, variant=self.phone, quantity_ordered=1, quantity_received=1,
+                unit_cost=Decimal(cost),
+            )
+        # 10 units a day for the whole 30 day window, as two sales a day
+        now = timezone.now()
+        movements = StockMovement.objects.bulk_create([
+            StockMovement(warehouse=self.main, variant=self.phone, movement_type=StockMovement.MovementType.SALE,
+                          quantity=-5)
+            for _ in range(60)
+        ])
+        for i, movement in enumerate(movements):
+            StockMovement.objects.filter(pk=movement.pk).update(created_at=now - timedelta(days=i // 2, hours=1))
+
+    def test_reorder_point_from_demand_and_lead_time(self):
+        rows = {row['variant_id']: row for row in plan_replenishment(window_days=30)['rows']}
+        phone = rows['phone-128']
+        self.assertAlmostEqual(phone['daily_demand'], 10)
+        self.assertAlmostEqual(phone['demand_std'], 0)
+        self.assertEqual((phone['lead_time'], phone['lead_time_std']), (6, 1))
+        # 10/day over 6 days plus 1.645 * sqrt(6 * 0 + 10² * 1²)
+        self.assertEqual((phone['safety_stock'], phone['reorder_point'], phone['order_up_to']), (17, 77, 217))
+        self.assertEqual(phone['suggested'], 217 - 5)
+        self.assertEqual((phone['supplier_id'], phone['unit_cost']), (self.supplier.pk, Decimal('4.50')))
+        self.assertEqual(rows['phone-256']['suggested'], 0)
+
+    def test_thresholds_and_drafted_imports(self):
+        rows = plan_replenishment(window_days=30)['rows']
+        self.assertEqual(apply_thresholds(rows), 1)
+        self.assertEqual(Stock.objects.get(pk=self.stock.pk).low_stock_threshold, 77)
+        self.assertEqual(Stock.objects.get(variant=self.idle).low_stock_threshold, 10)
+
+        drafted = draft_imports(rows)
+        self.assertEqual(drafted['unsourced'], 0)
+        [stock_import] = drafted['imports']
+        self.assertEqual(stock_import.status, StockImport.ImportStatus.PENDING)
+        self.assertEqual(stock_import.total_cost, Decimal('954.00'))
+
+        # What is on order now counts towards the position
+        phone = next(row for row in plan_replenishment(window_days=30)['rows'] if row['variant_id'] == 'phone-128')
+        self.assertEqual((phone['on_order'], phone['suggested']), (212, 0))
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.phone = make_variant()
+        self.today = timezone.now().date()
+        now = timezone.now()
+        for days_ago, quantity, movement_type in (
+            (5, 10, StockMovement.MovementType.IMPORT),
+            (3, -4, StockMovement.MovementType.SALE),
+            (1, -2, StockMovement.MovementType.SALE),
+            (0, 1, StockMovement.MovementType.RETURN),
+        ):
+            movement = StockMovement.objects.create(
+                warehouse=self.main, variant=self.phone, movement_type=movement_type, quantity=quantity,
+            )
+            StockMovement.objects.filter(pk=movement.pk).update(created_at=now - timedelta(days=days_ago))
+
+    def day(self, days_ago):
+        return self.today - timedelta(days=days_ago)
+
+    def balance(self, days_ago):
+        return ledger_balances(self.day(days_ago)).get((self.main.pk, 'phone-128'), 0)
+
+    def test_balances_before_and_after_snapshots(self):
+        expected = {6: 0, 5: 10, 4: 10, 3: 6, 2: 6, 1: 4, 0: 5}
+        self.assertEqual({days_ago: self.balance(days_ago) for days_ago in expected}, expected)
+
+        [run] = take_ledger_snapshots(through=self.day(2))
+        self.assertEqual((run.snapshots_written, run.movements_scanned), (2, 2))
+        self.assertEqual({days_ago: self.balance(days_ago) for days_ago in expected}, expected)
+        # Within the snapshots: the watermark and one snapshot read, no movements
+        with self.assertNumQueries(2):
+            self.balance(4)
+
+        # Resumes after the watermark, up to yesterday
+        [run] = take_ledger_snapshots()
+        self.assertEqual((run.through_date, run.snapshots_written), (self.day(1), 1))
+        self.assertEqual({days_ago: self.balance(days_ago) for days_ago in expected}, expected)
+        self.assertEqual(take_ledger_snapshots(), [])
+
+        self.assertEqual(
+            [quantity for _, quantity in ledger_series(self.main.pk, 'phone-128', self.day(6), self.today)],
+            [0, 10, 10, 6, 6, 4, 5],
+        )
+
+    def test_valuation_and_api(self):
+        take_ledger_snapshots()
+        stock_import = StockImport.objects.create(warehouse=self.main, order_date=self.day(6))
+        StockImportItem.objects.create(
+            stock_import=stock_import, variant=self.phone, quantity_ordered=10, unit_cost=Decimal('2.50'),
+        )
+        self.assertEqual(inventory_valuation(self.day(3))[self.main.pk]['value'], Decimal('15.00'))
+
+        admin = get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.get('/api/inventory/stock-ledger/range/', {
+            'start': self.day(4).isoformat(), 'end': self.today.isoformat(), 'warehouse': self.main.pk,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['results'],
+            [{'warehouse': self.main.pk, 'variant': 'phone-128', 'opening': 10, 'change': -5, 'closing': 5}],
+        )
+        response = client.get('/api/inventory/stock-ledger/', {'as_of': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class StockReconciliationTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.east = make_warehouse('EAST')
+        self.synced = make_variant(variant_id='phone-64')
+        self.drifted = make_variant(variant_id='phone-128')
+        self.flat = make_variant(variant_id='phone-256')
+        self.reserved = make_variant(variant_id='phone-512')
+        Stock.objects.create(warehouse=self.main, variant=self.synced, quantity=5)
+        Stock.objects.create(warehouse=self.east, variant=self.drifted, quantity=10, reserved_quantity=2)
+        Stock.objects.create(warehouse=self.main, variant=self.reserved, quantity=6, reserved_quantity=6)
+        Stock.objects.create(warehouse=self.east, variant=self.reserved, quantity=5)
+        # Writes that bypass the rollup
+        ProductVariant.objects.filter(pk='phone-128').update(stock=12)
+        ProductVariant.objects.filter(pk='phone-256').update(stock=3)
+        ProductVariant.objects.filter(pk='phone-512').update(stock=1)
+
+    def test_finds_discrepancies_in_chunks(self):
+        chunks = list(find_discrepancies('variant', chunk_size=2))
+        self.assertEqual(chunks, [
+            [('phone-128', 12, 8, 1), ('phone-256', 3, 0, 0)],
+            [('phone-512', 1, 5, 2)],
+        ])
+        self.assertEqual(
+            [row[0] for chunk in find_discrepancies(chunk_size=2) for row in chunk], ['phone-128', 'phone-512'],
+        )
+
+    def test_report_only_writes_nothing(self):
+        report = reconcile_stock()
+        self.assertEqual((report['discrepancies'], report['repaired']), (2, 0))
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 12)
+
+    def test_repair_from_stock_rows(self):
+        report = reconcile_stock(repair=True)
+        self.assertEqual((report['repaired'], report['units_adjusted']), (2, 0))
+        self.assertEqual(
+            dict(ProductVariant.objects.values_list('pk', 'stock')),
+            {'phone-64': 5, 'phone-128': 8, 'phone-256': 3, 'phone-512': 5},
+        )
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual(reconcile_stock()['discrepancies'], 0)
+
+    def test_repair_from_variant_books_adjustments(self):
+        report = reconcile_stock(source='variant', repair=True, chunk_size=2)
+        # Booking phone-512 down would take MAIN below its reserved units: left alone
+        self.assertEqual((report['repaired'], report['unresolved'], report['units_adjusted']), (2, 1, 7))
+        self.assertEqual(
+            sorted(StockMovement.objects.values_list('variant_id', 'warehouse_id', 'movement_type', 'quantity')),
+            [('phone-128', self.main.pk, 'ADJUSTMENT', 4), ('phone-256', self.main.pk, 'ADJUSTMENT', 3)],
+        )
+        self.assertEqual(Stock.objects.get(warehouse=self.main, variant=self.flat).quantity, 3)
+        self.assertEqual(
+            dict(ProductVariant.objects.values_list('pk', 'stock')),
+            {'phone-64': 5, 'phone-128': 12, 'phone-256': 3, 'phone-512': 1},
+        )
+        self.assertEqual(reconcile_stock(source='variant')['discrepancies'], 1)
+
+        with self.assertRaises(ReconciliationError):
+            reconcile_stock(source='warehouse')
+
+    def test_command(self):
+        out = StringIO()
+        call_command('reconcile_stock', '--repair', stdout=out)
+        self.assertIn('2 variants disagree with their Stock rows; repaired 2 from stock', out.getvalue())
+
+
+class StockListStreamingTests(TestCase):
+    def setUp(self):
+        self.main = make_warehouse('MAIN')
+        self.east = make_warehouse('EAST')
+        self.stocked = make_variant()
+        self.unstocked = make_variant(variant_id='phone-256')
+        self.unstocked.stock = 4
+        self.unstocked.save()
+        Stock.objects.create(warehouse=self.main, variant=self.stocked, quantity=10)
+
+    def get_rows(self, **params):
+        response = self.client.get('/api/inventory/stock/', params)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        if params.get('stream') == 'jsonl':
+            return [json.loads(line) for line in body.splitlines()]
+        return json.loads(body)
+
+    def test_stock_rows_are_followed_by_synthetic_rows(self):
+        rows = self.get_rows()
+        self.assertEqual([row['id'] for row in rows], [Stock.objects.get().pk, 'synthetic-phone-256'])
+        self.assertEqual(rows[1]['quantity'], 4)
+        self.assertEqual(rows[1]['variant_details']['product']['brand'], 'Acme')
+        self.assertEqual(self.get_rows(stream='jsonl'), rows)
+
+        # Synthetic rows are relative to the filtered Stock rows
+        rows = self.get_rows(warehouse=self.east.pk)
+        self.assertEqual([row['id'] for row in rows], ['synthetic-phone-128', 'synthetic-phone-256'])
+
+    def test_stock_rows_follow_the_requested_ordering(self):
+        for i, quantity in enumerate([3, 10, 7, 10]):
+            Stock.objects.create(warehouse=self.east, variant=make_variant(variant_id=f'phone-o{i}'),
+                                 quantity=quantity)
+        expected = list(Stock.objects.order_by('-quantity', 'pk').values_list('pk', flat=True))
+        self.assertEqual([row['id'] for row in self.get_rows(ordering='-quantity')], expected + ['synthetic-phone-256'])
+        # Batches resume after ties on the ordering field
+        rows = iter_stock_rows(
+            Stock.objects.select_related('warehouse', 'variant__product').order_by('-quantity'),
+            lambda batch: StockSerializer(batch, many=True), batch_size=2,
+        )
+        self.assertEqual([row['id'] for row in rows], expected + ['synthetic-phone-256'])
 
-# Create your tests here.
+    def test_rows_are_read_in_batches(self):
+        for i in range(5):
+            make_variant(variant_id=f'phone-x{i}')
+        # 1 stock batch, promotions, then 3 full variant batches and an empty one
+        with self.assertNumQueries(6):
+            rows = list(iter_stock_rows(
+                Stock.objects.select_related('warehouse', 'variant__product'),
+                lambda batch: StockSerializer(batch, many=True), batch_size=2,
+            ))
+        self.assertEqual(len(rows), 7)
@@ -0,0 +1,165 @@
+"""
+Stock transfers between warehouses
+
+`transfer_stock` moves any number of SKUs from one warehouse to another in
+a single transaction, all or nothing:
+
+1. missing target Stock rows are inserted empty (`ignore_conflicts`), so
+   every row the transfer touches exists;
+2. the source and target rows are locked together in primary key order,
+   the same order every transfer uses, so concurrent transfers in
+   opposite directions cannot deadlock;
+3. availability is checked for every line and all shortfalls are reported
+   at once (`TransferError`);
+4. one CASE update applies the decrements and increments, and the paired
+   TRANSFER movements share one reference number.
+"""
+import uuid
+from typing import Dict, Iterable, List
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.db import value_per_pk
+from .alerts import schedule_stock_alert_check
+from .models import Stock, StockMovement, Warehouse
+from .rollup import refresh_stock_rollup
+
+
+class TransferError(Exception):
+    """Raised with every line of a transfer that cannot be moved"""
+
+    def __init__(self, errors: List[Dict]):
+        self.errors = errors
+        super().__init__(f'{len(errors)} invalid transfer lines')
+
+
+def generate_transfer_reference() -> str:
+    """Reference number shared by both movements of every transferred line"""
+    timestamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    return f"TRANSFER-{timestamp}-{str(uuid.uuid4())[:8].upper()}"
+
+
+def parse_transfer_lines(lines: Iterable[Dict]) -> Dict[str, int]:
+    """
+    Validate `{variant_id, quantity}` lines
+
+    Returns:
+        Mapping of variant id to units, in line order
+
+    Raises:
+        TransferError: Listing every invalid line
+    """
+    quantities, errors = {}, []
+    for number, line in enumerate(lines, start=1):
+        variant_id = str(line.get('variant_id') or '').strip()
+        try:
+            quantity = int(line.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+        if not variant_id:
+            errors.append({'line': number, 'error': 'Missing variant_id'})
+        elif variant_id in quantities:
+            errors.append({'line': number, 'error': f'SKU {variant_id} is listed more than once'})
+        elif quantity <= 0:
+            message = f"Invalid quantity {line.get('quantity')!r} for {variant_id}"
+            errors.append({'line': number, 'error': message})
+        else:
+            quantities[variant_id] = quantity
+    if not quantities and not errors:
+        errors.append({'line': 0, 'error': 'No lines to transfer'})
+    if errors:
+        raise TransferError(errors)
+    return quantities
+
+
+@transaction.atomic
+def transfer_stock(source: Warehouse, target: Warehouse, quantities: Dict[str, int], user=None,
+                   reference: str = None, notes: str = '') -> Dict:
+    """
+    Move units of several variants from one warehouse to another
+
+    Args:
+        source: Warehouse the units leave
+        target: Warehouse the units arrive at
+        quantities: Mapping of variant id to units (see `parse_transfer_lines`)
+        user: Recorded on the movements
+        reference: Shared movement reference (default: a new TRANSFER-... number)
+        notes: Appended to the movement notes
+
+    Returns:
+        Dict with the `reference`, the units moved and, per variant, the
+        `(source stock id, target stock id)` pair
+
+    Raises:
+        TransferError: If the warehouses are invalid or any line lacks
+            available units (nothing is moved)
+    """
+    if source.pk == target.pk:
+        raise TransferError([{'line': 0, 'error': 'Source and target warehouse are the same'}])
+    if not target.is_active:
+        raise TransferError([{'line': 0, 'error': f'Warehouse {target.code} is not active'}])
+    quantities = {variant_id: quantity for variant_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        raise TransferError([{'line': 0, 'error': 'No lines to transfer'}])
+
+    sources = dict(
+        Stock.objects.filter(warehouse=source, variant_id__in=quantities).values_list('variant_id', 'pk')
+    )
+    Stock.objects.bulk_create(
+        [Stock(warehouse=target, variant_id=variant_id, quantity=0) for variant_id in sources],
+        ignore_conflicts=True,
+    )
+    rows = {
+        (warehouse_id, variant_id): (pk, quantity - reserved)
+        for pk, warehouse_id, variant_id, quantity, reserved in Stock.objects.select_for_update().filter(
+            warehouse_id__in=[source.pk, target.pk], variant_id__in=quantities,
+        ).order_by('pk').values_list('pk', 'warehouse_id', 'variant_id', 'quantity', 'reserved_quantity')
+    }
+
+    errors = []
+    for number, (variant_id, quantity) in enumerate(quantities.items(), start=1):
+        available = rows.get((source.pk, variant_id), (None, 0))[1]
+        if available < quantity:
+            errors.append({
+                'line': number, 'variant_id': variant_id, 'available': max(available, 0),
+                'error': f'Insufficient stock for {variant_id} at {source.code}: {max(available, 0)} available',
+            })
+    if errors:
+        raise TransferError(errors)
+
+    pairs = {
+        variant_id: (rows[(source.pk, variant_id)][0], rows[(target.pk, variant_id)][0])
+        for variant_id in quantities
+    }
+    deltas = {}
+    for variant_id, (source_id, target_id) in pairs.items():
+        deltas[source_id] = -quantities[variant_id]
+        deltas[target_id] = quantities[variant_id]
+    now = timezone.now()
+    Stock.objects.filter(pk__in=deltas).update(quantity=F('quantity') + value_per_pk(deltas, default=0), updated_at=now)
+
+    reference = reference or generate_transfer_reference()
+    suffix = f' - {notes}' if notes else ''
+    movements = []
+    for variant_id, quantity in quantities.items():
+        movements += [
+            StockMovement(
+                warehouse=source, variant_id=variant_id, movement_type=StockMovement.MovementType.TRANSFER,
+                quantity=-quantity, reference_number=reference, notes=f'Transfer to {target.name}{suffix}',
+                created_by=user,
+            ),
+            StockMovement(
+                warehouse=target, variant_id=variant_id, movement_type=StockMovement.MovementType.TRANSFER,
+                quantity=quantity, reference_number=reference, notes=f'Transfer from {source.name}{suffix}',
+                created_by=user,
+            ),
+        ]
+    StockMovement.objects.bulk_create(movements)
+
+    # The rollup only counts active warehouses: units drained out of an
+    # inactive one become available again
+    refresh_stock_rollup(quantities)
+    schedule_stock_alert_check(deltas)
+    return {'reference': reference, 'lines': len(quantities), 'units': sum(quantities.values()), 'stock': pairs}
@@ -2,7 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     WarehouseViewSet, SupplierViewSet, StockViewSet,
-    StockMovementViewSet, StockImportViewSet, StockAlertViewSet
+    StockMovementViewSet, StockImportViewSet, StockAlertViewSet, StockLedgerViewSet
 )
 
 router = DefaultRouter()
@@ -12,6 +12,7 @@ router.register(r'stock', StockViewSet, basename='stock')
 router.register(r'stock-movements', StockMovementViewSet, basename='stock-movement')
 router.register(r'stock-imports', StockImportViewSet, basename='stock-import')
 router.register(r'stock-alerts', StockAlertViewSet, basename='stock-alert')
+router.register(r'stock-ledger', StockLedgerViewSet, basename='stock-ledger')
 
 urlpatterns = [
     path('', include(router.urls)),
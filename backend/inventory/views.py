@@ -1,21 +1,32 @@
+from datetime import date
+
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from .models import (
     Warehouse, Supplier, Stock, StockMovement,
-    StockImport, StockImportItem, StockAlert
+    StockImport, StockAlert
 )
 from .serializers import (
     WarehouseSerializer, SupplierSerializer, StockSerializer,
     StockMovementSerializer, StockImportSerializer, CreateStockImportSerializer,
     StockAlertSerializer, StockImportItemSerializer
 )
-from products.models import ProductVariant
+from core.pagination import KeysetPagination
+from .filters import StockAlertFilter
+from .imports import (
+    ManifestError, ReceiptError, create_import, read_manifest_csv, read_receipt_csv, receive_import,
+)
+from .ledger import inventory_valuation, ledger_balances, ledger_range, ledger_series
+from .transfers import TransferError, parse_transfer_lines, transfer_stock
+from .stock_listing import encode_json_array, encode_json_lines, iter_stock_rows
 from users.permissions import IsAdminUser
 
 
@@ -88,99 +99,20 @@ class StockViewSet(viewsets.ModelViewSet):
     
     def list(self, request, *args, **kwargs):
         """
-        List stock items. If no Stock records exist, synthesize from ProductVariant.stock
-        to ensure the frontend displays inventory even without per-warehouse Stock records.
+        List stock items, streamed as a JSON array.
+
+        Active variants without a Stock row are appended as synthetic entries
+        (built from ProductVariant.stock) so the frontend always sees a
+        complete inventory. `?ordering=` orders the Stock rows; the synthetic
+        ones follow by variant id. `?stream=jsonl` streams newline-delimited
+        JSON instead. Rows are read in batches, so memory stays flat regardless
+        of catalog size.
         """
-        # Check if we have explicit Stock records
         stock_records = self.filter_queryset(self.get_queryset())
-        
-        # If explicit Stock records exist, we will return them AND synthesize
-        # entries for any active variants that do not have a Stock row so the
-        # frontend always sees a complete inventory.
-        response_items = []
-
-        if stock_records.exists():
-            serializer = self.get_serializer(stock_records, many=True)
-            response_items.extend(serializer.data)
-
-            # Find variants that don't have Stock rows and synthesize entries
-            stocked_variant_ids = stock_records.values_list('variant_id', flat=True)
-            variants = ProductVariant.objects.filter(
-                is_active=True,
-                product__is_active=True
-            ).exclude(id__in=stocked_variant_ids).select_related('product', 'product__brand', 'product__category')
-
-            for variant in variants:
-                response_items.append({
-                    'id': f'synthetic-{variant.id}',
-                    'variant': variant.id,
-                    'variant_details': {
-                        'id': variant.id,
-                        'storage': variant.storage,
-                        'color': variant.color,
-                        'price': str(variant.price),
-                        'original_price': str(variant.original_price) if variant.original_price else None,
-                        'stock': variant.stock,
-                        'images': variant.images or [],
-                        'product': {
-                            'id': variant.product.id,
-                            'name': variant.product.name,
-                            'category': variant.product.category.name if variant.product.category else None,
-                            'brand': variant.product.brand.name if variant.product.brand else None,
-                        }
-                    },
-                    'product_name': variant.product.name,
-                    'quantity': variant.stock,
-                    'reserved_quantity': 0,
-                    'available_quantity': variant.stock,
-                    'low_stock_threshold': 10,
-                    'is_low_stock': variant.stock <= 10,
-                    'is_out_of_stock': variant.stock == 0,
-                    'last_restocked_at': None,
-                    'created_at': variant.created_at.isoformat() if variant.created_at else None,
-                    'updated_at': variant.updated_at.isoformat() if variant.updated_at else None,
-                })
-
-            return Response(response_items)
-
-        # No explicit Stock rows at all: synthesize all active variants
-        variants = ProductVariant.objects.filter(
-            is_active=True,
-            product__is_active=True
-        ).select_related('product', 'product__brand', 'product__category')
-
-        for variant in variants:
-            response_items.append({
-                'id': f'synthetic-{variant.id}',
-                'variant': variant.id,
-                'variant_details': {
-                    'id': variant.id,
-                    'storage': variant.storage,
-                    'color': variant.color,
-                    'price': str(variant.price),
-                    'original_price': str(variant.original_price) if variant.original_price else None,
-                    'stock': variant.stock,
-                    'images': variant.images or [],
-                    'product': {
-                        'id': variant.product.id,
-                        'name': variant.product.name,
-                        'category': variant.product.category.name if variant.product.category else None,
-                        'brand': variant.product.brand.name if variant.product.brand else None,
-                    }
-                },
-                'product_name': variant.product.name,
-                'quantity': variant.stock,
-                'reserved_quantity': 0,
-                'available_quantity': variant.stock,
-                'low_stock_threshold': 10,
-                'is_low_stock': variant.stock <= 10,
-                'is_out_of_stock': variant.stock == 0,
-                'last_restocked_at': None,
-                'created_at': variant.created_at.isoformat() if variant.created_at else None,
-                'updated_at': variant.updated_at.isoformat() if variant.updated_at else None,
-            })
-
-        return Response(response_items)
+        rows = iter_stock_rows(stock_records, lambda batch: self.get_serializer(batch, many=True))
+        if request.query_params.get('stream') == 'jsonl':
+            return StreamingHttpResponse(encode_json_lines(rows), content_type='application/x-ndjson')
+        return StreamingHttpResponse(encode_json_array(rows), content_type='application/json')
     
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
@@ -245,72 +177,54 @@ class StockViewSet(viewsets.ModelViewSet):
     def transfer(self, request, pk=None):
         """Transfer stock between warehouses"""
         source_stock = self.get_object()
-        target_warehouse_id = request.data.get('target_warehouse_id')
+        target_warehouse = get_object_or_404(Warehouse, id=request.data.get('target_warehouse_id'))
         quantity = request.data.get('quantity', 0)
-        
+
+        created_by = request.user if request.user and request.user.is_authenticated else None
         try:
-            quantity = int(quantity)
-        except ValueError:
-            return Response(
-                {'error': 'Invalid quantity'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if quantity <= 0:
-            return Response(
-                {'error': 'Quantity must be positive'},
-                status=status.HTTP_400_BAD_REQUEST
+            quantities = parse_transfer_lines([{'variant_id': source_stock.variant_id, 'quantity': quantity}])
+            result = transfer_stock(source_stock.warehouse, target_warehouse, quantities, user=created_by)
+        except TransferError as e:
+            return Response({'error': e.errors[0]['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+        source_id, target_id = result['stock'][source_stock.variant_id]
+        stocks = self.get_queryset().in_bulk([source_id, target_id])
+        return Response({
+            'message': 'Stock transferred successfully',
+            'reference_number': result['reference'],
+            'source_stock': StockSerializer(stocks[source_id]).data,
+            'target_stock': StockSerializer(stocks[target_id]).data
+        })
+
+    @action(detail=False, methods=['post'])
+    def batch_transfer(self, request):
+        """
+        Transfer many SKUs between two warehouses, all or nothing
+
+        Body: `source_warehouse_id`, `target_warehouse_id`, `items`
+        ([{variant_id, quantity}]) and optional `notes`. Every movement
+        shares the returned reference number.
+        """
+        source = get_object_or_404(Warehouse, id=request.data.get('source_warehouse_id'))
+        target = get_object_or_404(Warehouse, id=request.data.get('target_warehouse_id'))
+
+        created_by = request.user if request.user and request.user.is_authenticated else None
+        try:
+            quantities = parse_transfer_lines(request.data.get('items') or [])
+            result = transfer_stock(
+                source, target, quantities, user=created_by, notes=request.data.get('notes', ''),
             )
-        
-        if source_stock.available_quantity < quantity:
+        except TransferError as e:
             return Response(
-                {'error': 'Insufficient stock'},
+                {'error': e.errors[0]['error'], 'errors': e.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        target_warehouse = get_object_or_404(Warehouse, id=target_warehouse_id)
-        
-        with transaction.atomic():
-            # Reduce source stock
-            source_stock.quantity -= quantity
-            source_stock.save()
-            
-            # Increase target stock
-            target_stock, created = Stock.objects.get_or_create(
-                warehouse=target_warehouse,
-                variant=source_stock.variant,
-                defaults={'quantity': 0}
-            )
-            target_stock.quantity += quantity
-            target_stock.save()
-            
-            # Record movements
-            ref_number = f"TRANSFER-{timezone.now().strftime('%Y%m%d%H%M%S')}"
-            
-            StockMovement.objects.create(
-                warehouse=source_stock.warehouse,
-                variant=source_stock.variant,
-                movement_type=StockMovement.MovementType.TRANSFER,
-                quantity=-quantity,
-                reference_number=ref_number,
-                notes=f"Transfer to {target_warehouse.name}",
-                created_by=request.user
-            )
-            
-            StockMovement.objects.create(
-                warehouse=target_warehouse,
-                variant=source_stock.variant,
-                movement_type=StockMovement.MovementType.TRANSFER,
-                quantity=quantity,
-                reference_number=ref_number,
-                notes=f"Transfer from {source_stock.warehouse.name}",
-                created_by=request.user
-            )
-        
+
         return Response({
             'message': 'Stock transferred successfully',
-            'source_stock': StockSerializer(source_stock).data,
-            'target_stock': StockSerializer(target_stock).data
+            'reference_number': result['reference'],
+            'lines': result['lines'],
+            'units': result['units'],
         })
 
 
@@ -321,12 +235,20 @@ class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = StockMovement.objects.all().select_related('warehouse', 'variant__product', 'created_by')
     serializer_class = StockMovementSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['warehouse', 'variant', 'movement_type']
     ordering_fields = ['created_at']
     ordering = ['-created_at']
 
 
+def manifest_error_response(error):
+    return Response(
+        {'error': error.errors[0]['error'], 'errors': error.errors, 'missing_skus': error.missing_skus},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
 class StockImportViewSet(viewsets.ModelViewSet):
     """
     ViewSet for Stock Import management
@@ -340,116 +262,82 @@ class StockImportViewSet(viewsets.ModelViewSet):
     ordering = ['-created_at']
     
     def get_serializer_class(self):
-        if self.action == 'create':
+        if self.action in ('create', 'manifest'):
             return CreateStockImportSerializer
         return StockImportSerializer
     
-    @transaction.atomic
-    def create(self, request):
-        """Create new stock import"""
+    def _create_from_request(self, request):
         serializer = CreateStockImportSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
+
         data = serializer.validated_data
         warehouse = get_object_or_404(Warehouse, id=data['warehouse_id'])
         supplier = None
         if data.get('supplier_id'):
             supplier = get_object_or_404(Supplier, id=data['supplier_id'])
-        
-        # Create stock import
-        stock_import = StockImport.objects.create(
-            warehouse=warehouse,
+
+        upload = data.get('file')
+        return create_import(
+            warehouse,
+            read_manifest_csv(upload) if upload else data['items'],
             supplier=supplier,
             order_date=data['order_date'],
             expected_date=data.get('expected_date'),
             notes=data.get('notes', ''),
-            created_by=request.user
+            user=request.user,
         )
-        
-        # Create import items
-        total_cost = 0
-        for item_data in data['items']:
-            variant = get_object_or_404(ProductVariant, id=item_data['variant_id'])
-            quantity_ordered = int(item_data['quantity_ordered'])
-            unit_cost = float(item_data['unit_cost'])
-            
-            StockImportItem.objects.create(
-                stock_import=stock_import,
-                variant=variant,
-                quantity_ordered=quantity_ordered,
-                unit_cost=unit_cost
-            )
-            
-            total_cost += quantity_ordered * unit_cost
-        
-        stock_import.total_cost = total_cost
-        stock_import.save()
-        
+
+    def create(self, request):
+        """Create new stock import"""
+        try:
+            stock_import = self._create_from_request(request)
+        except ManifestError as e:
+            return manifest_error_response(e)
+
         response_serializer = StockImportSerializer(stock_import)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-    
+
+    @action(detail=False, methods=['post'])
+    def manifest(self, request):
+        """
+        Create a stock import from a large supplier manifest
+
+        Same input as create (`items` or a CSV upload in `file`), but only
+        a summary of the new import is returned.
+        """
+        try:
+            stock_import = self._create_from_request(request)
+        except ManifestError as e:
+            return manifest_error_response(e)
+
+        return Response({
+            'id': stock_import.id,
+            'import_number': stock_import.import_number,
+            'items': stock_import.items.count(),
+            'total_cost': str(stock_import.total_cost),
+        }, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def receive(self, request, pk=None):
-        """Mark stock import as received and update stock levels"""
+        """
+        Receive stock import items and update stock levels
+
+        Takes `items` ([{item_id, quantity_received}]) or a CSV upload in
+        `file`; quantities are each item's total received so far.
+        """
         stock_import = self.get_object()
-        
-        if stock_import.status == StockImport.ImportStatus.RECEIVED:
+
+        upload = request.FILES.get('file')
+        lines = read_receipt_csv(upload) if upload else request.data.get('items', [])
+        try:
+            receive_import(stock_import, lines, user=request.user)
+        except ReceiptError as e:
             return Response(
-                {'error': 'Stock import already received'},
+                {'error': e.errors[0]['error'], 'errors': e.errors},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        items_received = request.data.get('items', [])
-        
-        with transaction.atomic():
-            for item_data in items_received:
-                item = get_object_or_404(
-                    StockImportItem,
-                    stock_import=stock_import,
-                    id=item_data['item_id']
-                )
-                quantity_received = int(item_data['quantity_received'])
-                
-                if quantity_received > item.quantity_ordered:
-                    return Response(
-                        {'error': f'Received quantity exceeds ordered quantity for item {item.id}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                item.quantity_received = quantity_received
-                item.save()
-                
-                # Update stock
-                stock, created = Stock.objects.get_or_create(
-                    warehouse=stock_import.warehouse,
-                    variant=item.variant,
-                    defaults={'quantity': 0}
-                )
-                stock.quantity += quantity_received
-                stock.last_restocked_at = timezone.now()
-                stock.save()
-                
-                # Record movement
-                StockMovement.objects.create(
-                    warehouse=stock_import.warehouse,
-                    variant=item.variant,
-                    movement_type=StockMovement.MovementType.IMPORT,
-                    quantity=quantity_received,
-                    reference_number=stock_import.import_number,
-                    notes=f"Stock import from {stock_import.supplier.name if stock_import.supplier else 'supplier'}",
-                    created_by=request.user
-                )
-            
-            # Update import status
-            all_items = stock_import.items.all()
-            if all(item.quantity_received == item.quantity_ordered for item in all_items):
-                stock_import.status = StockImport.ImportStatus.RECEIVED
-            else:
-                stock_import.status = StockImport.ImportStatus.PARTIALLY_RECEIVED
-            
-            stock_import.received_date = timezone.now().date()
-            stock_import.save()
-        
+
+        stock_import.refresh_from_db()
         response_serializer = StockImportSerializer(stock_import)
         return Response(response_serializer.data)
 
@@ -462,7 +350,7 @@ class StockAlertViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = StockAlertSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ['alert_type', 'is_resolved', 'stock__warehouse']
+    filterset_class = StockAlertFilter
     ordering_fields = ['created_at']
     ordering = ['-created_at']
     
@@ -470,9 +358,7 @@ class StockAlertViewSet(viewsets.ReadOnlyModelViewSet):
     def resolve(self, request, pk=None):
         """Mark alert as resolved"""
         alert = self.get_object()
-        alert.is_resolved = True
-        alert.resolved_at = timezone.now()
-        alert.save()
+        alert.resolve(user=request.user, notes=request.data.get('notes', ''))
         
         serializer = self.get_serializer(alert)
         return Response(serializer.data)
@@ -480,7 +366,93 @@ class StockAlertViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def unresolved(self, request):
         """Get all unresolved alerts"""
-        alerts = self.queryset.filter(is_resolved=False)
+        alerts = self.queryset.filter(status__in=StockAlert.OPEN_STATUSES)
         serializer = self.get_serializer(alerts, many=True)
         return Response(serializer.data)
 
+
+
+class StockLedgerViewSet(viewsets.ViewSet):
+    """
+    Point-in-time stock from ledger snapshots
+
+    Dates are UTC days (YYYY-MM-DD). `warehouse` and `variant` narrow the
+    rows and can be repeated.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def _date(self, request, name, default=None):
+        value = request.query_params.get(name)
+        if not value:
+            if default is None:
+                raise ValidationError({name: 'This parameter is required.'})
+            return default
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ValidationError({name: 'Use YYYY-MM-DD.'})
+
+    def _scope(self, request):
+        warehouses = request.query_params.getlist('warehouse')
+        variants = request.query_params.getlist('variant')
+        try:
+            warehouse_ids = [int(pk) for pk in warehouses] if warehouses else None
+        except ValueError:
+            raise ValidationError({'warehouse': 'Warehouse ids are numbers.'})
+        return warehouse_ids, variants or None
+
+    def list(self, request):
+        """Units per warehouse and variant at the end of `as_of` (default: today)"""
+        as_of = self._date(request, 'as_of', timezone.now().date())
+        warehouse_ids, variant_ids = self._scope(request)
+        balances = ledger_balances(as_of, warehouse_ids, variant_ids)
+        return Response({
+            'as_of': as_of,
+            'results': [
+                {'warehouse': warehouse_id, 'variant': variant_id, 'quantity': quantity}
+                for (warehouse_id, variant_id), quantity in sorted(balances.items())
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def range(self, request):
+        """Opening balance, net change and closing balance between `start` and `end`"""
+        start, end = self._date(request, 'start'), self._date(request, 'end')
+        if start > end:
+            raise ValidationError({'start': 'start must not be after end.'})
+        warehouse_ids, variant_ids = self._scope(request)
+        rows = ledger_range(start, end, warehouse_ids, variant_ids)
+        return Response({
+            'start': start,
+            'end': end,
+            'results': [
+                {'warehouse': warehouse_id, 'variant': variant_id,
+                 'opening': opening, 'change': change, 'closing': closing}
+                for (warehouse_id, variant_id), (opening, change, closing) in sorted(rows.items())
+            ],
+        })
+
+    @action(detail=False, methods=['get'])
+    def series(self, request):
+        """Daily closing balances of one warehouse and variant between `start` and `end`"""
+        start, end = self._date(request, 'start'), self._date(request, 'end')
+        warehouse_ids, variant_ids = self._scope(request)
+        if not warehouse_ids or not variant_ids or len(warehouse_ids) > 1 or len(variant_ids) > 1:
+            raise ValidationError({'warehouse': 'Give exactly one warehouse and one variant.'})
+        if not 0 <= (end - start).days <= 3660:
+            raise ValidationError({'end': 'end must be after start, at most ten years later.'})
+        series = ledger_series(warehouse_ids[0], variant_ids[0], start, end)
+        return Response([{'date': day, 'quantity': quantity} for day, quantity in series])
+
+    @action(detail=False, methods=['get'])
+    def valuation(self, request):
+        """Stock value per warehouse at the end of `as_of`, at the latest import cost known then"""
+        as_of = self._date(request, 'as_of', timezone.now().date())
+        warehouse_ids, _ = self._scope(request)
+        totals = inventory_valuation(as_of, warehouse_ids)
+        return Response({
+            'as_of': as_of,
+            'results': [
+                {'warehouse': warehouse_id, **total} for warehouse_id, total in sorted(totals.items())
+            ],
+        })
@@ -0,0 +1,323 @@
+"""
+Checkout pipeline
+
+Turns a cart into an order in one transaction:
+
+1. lock the cart's variants, then their warehouse `Stock` rows, always in
+   primary-key order so concurrent checkouts cannot deadlock each other;
+2. pick the shipping warehouses (`inventory.allocation`) from the locked
+   rows and report every shortfall at once (`OversellError`);
+3. reserve the chosen warehouse units for the order. Each UPDATE re-checks
+   availability in the database, so even backends without row locks such
+   as SQLite cannot oversell. `ProductVariant.stock` follows from the
+   warehouse rows; only variants without any `Stock` row are decremented
+   directly;
+4. bulk-create the order items.
+
+The reservation is committed (units shipped, SALE movements recorded) once
+payment is confirmed or the order moves on to fulfilment, and released when
+the order is cancelled or the hold expires; a failed payment keeps it, so
+the customer can retry. A payment is only taken with the order's holds
+locked and live (`lock_order_stock`). Cancelling or refunding an order
+whose units were already committed puts them back on their Stock rows
+(RETURN movements).
+"""
+from collections import OrderedDict, defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from core.db import value_per_pk
+from inventory.allocation import allocate, load_candidates
+from inventory.models import Stock, StockReservation
+from inventory.reservations import InsufficientStock, commit, expire_reservations, release, reserve, restock
+from products.models import ProductVariant
+from .models import Order, OrderItem
+
+TAX_RATE = Decimal('0.08')
+FREE_SHIPPING_THRESHOLD = Decimal('100')
+SHIPPING_COST = Decimal('10')
+CENT = Decimal('0.01')
+
+# Statuses of orders whose units have been given back
+CLOSED_STATUSES = (Order.OrderStatus.CANCELLED, Order.OrderStatus.REFUNDED)
+
+
+class OversellError(Exception):
+    """Raised when the cart asks for more units than are available"""
+
+    def __init__(self, conflicts: List[Dict]):
+        self.conflicts = conflicts
+        names = ', '.join(conflict['product_name'] for conflict in conflicts)
+        super().__init__(f'Insufficient stock for {names}')
+
+
+class StockNotHeldError(Exception):
+    """Raised when an order to fulfil no longer holds the warehouse units it was placed with"""
+
+    def __init__(self, order):
+        self.order = order
+        super().__init__(f'Order {order.order_number} holds no stock to ship')
+
+
+def _conditional_decrement(model, field: str, quantities: Dict) -> bool:
+    """
+    Subtract `quantities[pk]` from `field` on every row in one UPDATE
+
+    Returns False unless every row still had enough (the caller's
+    transaction must then be rolled back).
+    """
+    amount = value_per_pk(quantities)
+    updated = model.objects.filter(pk__in=quantities.keys(), **{f'{field}__gte': amount}).update(
+        **{field: F(field) - amount}
+    )
+    return updated == len(quantities)
+
+
+def _conflict(variant, name, requested, available):
+    return {
+        'variant': variant,
+        'product_name': name,
+        'requested': requested,
+        'available': max(available, 0),
+    }
+
+
+def _current_conflicts(quantities: Dict, names: Dict) -> List[Dict]:
+    """Re-read availability after a failed conditional update"""
+    variant_stock = dict(
+        ProductVariant.objects.filter(pk__in=quantities.keys()).values_list('pk', 'stock')
+    )
+    warehouses, stocked = load_candidates(quantities.keys())
+    warehouse_stock = defaultdict(int)
+    for warehouse in warehouses.values():
+        for variant_id, (_, available) in warehouse['stock'].items():
+            warehouse_stock[variant_id] += available
+
+    conflicts = []
+    for variant_id, quantity in quantities.items():
+        available = warehouse_stock[variant_id] if variant_id in stocked else variant_stock.get(variant_id, 0)
+        if available < quantity:
+            conflicts.append(_conflict(variant_id, names[variant_id], quantity, available))
+    return conflicts
+
+
+@transaction.atomic
+def place_order(user, cart_items, shipping: Dict) -> Order:
+    """
+    Create an order from cart items, decrementing stock atomically
+
+    Args:
+        user: Buyer
+        cart_items: The buyer's CartItem rows (deleted on success)
+        shipping: Validated CreateOrderSerializer data
+
+    Returns:
+        Order: The new order
+
+    Raises:
+        OversellError: If any variant (or its warehouses) lacks the requested units
+    """
+    items = list(cart_items.select_related('product', 'variant'))
+    quantities = OrderedDict()
+    for item in sorted(items, key=lambda item: item.variant_id):
+        quantities[item.variant_id] = quantities.get(item.variant_id, 0) + item.quantity
+
+    # Lock in a deterministic order: variants first, then their Stock rows
+    variants = {
+        variant.pk: variant
+        for variant in ProductVariant.objects.select_for_update().filter(
+            pk__in=quantities.keys()
+        ).order_by('pk')
+    }
+    destination = {
+        'state': shipping['shipping_state'],
+        'postal_code': shipping['shipping_postal_code'],
+        'country': shipping.get('shipping_country', 'USA'),
+    }
+    units, shortfalls, stocked = allocate(quantities, destination, lock=True)
+
+    names = {item.variant_id: item.product.name for item in items}
+    conflicts = []
+    for variant_id, quantity in quantities.items():
+        variant = variants.get(variant_id)
+        if variant is None or not variant.is_active:
+            conflicts.append(_conflict(variant_id, names[variant_id], quantity, 0))
+        elif variant_id in shortfalls:
+            conflicts.append(_conflict(variant_id, names[variant_id], quantity, shortfalls[variant_id]))
+        elif variant_id not in stocked and variant.stock < quantity:
+            conflicts.append(_conflict(variant_id, names[variant_id], quantity, variant.stock))
+    if conflicts:
+        raise OversellError(conflicts)
+
+    # Variants sold from the flat counter alone
+    unstocked = {variant_id: quantity for variant_id, quantity in quantities.items() if variant_id not in stocked}
+    if unstocked and not _conditional_decrement(ProductVariant, 'stock', unstocked):
+        # Only reachable when the rows were not really locked (e.g. SQLite)
+        raise OversellError(_current_conflicts(quantities, names))
+
+    subtotal = sum((item.price * item.quantity for item in items), Decimal('0'))
+    tax = (subtotal * TAX_RATE).quantize(CENT, rounding=ROUND_HALF_UP)
+    shipping_cost = Decimal('0') if subtotal > FREE_SHIPPING_THRESHOLD else SHIPPING_COST
+    order = Order.objects.create(
+        user=user,
+        status=Order.OrderStatus.PENDING,
+        shipping_name=shipping['shipping_name'],
+        shipping_email=shipping['shipping_email'],
+        shipping_phone=shipping['shipping_phone'],
+        shipping_address_line1=shipping['shipping_address_line1'],
+        shipping_address_line2=shipping.get('shipping_address_line2', ''),
+        shipping_city=shipping['shipping_city'],
+        shipping_state=shipping['shipping_state'],
+        shipping_postal_code=shipping['shipping_postal_code'],
+        shipping_country=shipping.get('shipping_country', 'USA'),
+        payment_method=shipping['payment_method'],
+        customer_notes=shipping.get('customer_notes', ''),
+        subtotal=subtotal,
+        tax=tax,
+        shipping_cost=shipping_cost,
+        total=subtotal + tax + shipping_cost,
+    )
+
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=item.product,
+            variant=item.variant,
+            product_name=item.product.name,
+            variant_storage=item.storage,
+            variant_color=item.color,
+            unit_price=item.price,
+            quantity=item.quantity,
+            # bulk_create skips OrderItem.save(), which computes the subtotal
+            subtotal=item.price * item.quantity,
+            product_image=item.image or item.product.image,
+        )
+        for item in items
+    ])
+    try:
+        reserve(
+            units,
+            order=order,
+            # Cash on delivery orders keep their units until fulfilled or cancelled
+            expires=order.payment_method != Order.PaymentMethod.CASH_ON_DELIVERY,
+        )
+    except InsufficientStock:
+        raise OversellError(_current_conflicts(quantities, names))
+
+    cart_items.delete()
+    return order
+
+
+def _restore_variant_stock(order_ids):
+    """
+    Give the ordered units of cancelled orders back to variants without
+    warehouse stock (the others follow from their released reservations)
+    """
+    quantities = {}
+    for variant_id, quantity in OrderItem.objects.filter(
+        order_id__in=order_ids,
+    ).values_list('variant_id', 'quantity'):
+        quantities[variant_id] = quantities.get(variant_id, 0) + quantity
+    if quantities:
+        amount = value_per_pk(quantities)
+        ProductVariant.objects.filter(pk__in=quantities.keys()).exclude(
+            Exists(Stock.objects.filter(variant_id=OuterRef('pk')))
+        ).update(stock=F('stock') + amount)
+
+
+def _sells_warehouse_stock(order) -> bool:
+    return order.items.filter(Exists(Stock.objects.filter(variant_id=OuterRef('variant_id')))).exists()
+
+
+def lock_order_stock(order, now=None):
+    """
+    Lock the holds of an order about to be charged
+
+    Neither the expiry sweeper nor a cancellation can take them until the
+    caller's transaction ends.
+
+    Raises:
+        StockNotHeldError: If the order sells warehouse-stocked variants and
+            holds none of them any more, or one of its holds has lapsed
+    """
+    now = now or timezone.now()
+    expiries = list(order.stock_reservations.filter(
+        status=StockReservation.Status.ACTIVE,
+    ).select_for_update().order_by('pk').values_list('expires_at', flat=True))
+    lapsed = any(expires_at is not None and expires_at <= now for expires_at in expiries)
+    if lapsed or (not expiries and _sells_warehouse_stock(order)):
+        raise StockNotHeldError(order)
+
+
+def commit_order_stock(order, user=None) -> int:
+    """
+    Ship the units held for an order (payment confirmed or fulfilment started)
+
+    Committing an order already shipped does nothing.
+
+    Raises:
+        StockNotHeldError: If the order sells warehouse-stocked variants but
+            neither holds nor has shipped any units (e.g. its hold was released)
+    """
+    reservations = order.stock_reservations.all()
+    committed = commit(reservations, reference_number=order.order_number, user=user)
+    if not committed and not reservations.filter(status=StockReservation.Status.COMMITTED).exists() and (
+        _sells_warehouse_stock(order)
+    ):
+        raise StockNotHeldError(order)
+    return committed
+
+
+@transaction.atomic
+def cancel_order(order, status=Order.OrderStatus.CANCELLED, user=None):
+    """
+    Cancel (or refund) an order and give its units back
+
+    Held units are released, units already shipped to it are restocked on
+    their warehouse rows and variants without warehouse stock get their
+    counter back. An order already cancelled or refunded only changes status.
+    """
+    # Locked, so concurrent cancellations cannot give the units back twice
+    current = Order.objects.select_for_update().values_list('status', flat=True).get(pk=order.pk)
+    if current not in CLOSED_STATUSES:
+        reservations = order.stock_reservations.all()
+        release(reservations)
+        restock(reservations, reference_number=order.order_number, user=user)
+        _restore_variant_stock([order.pk])
+    order.status = status
+    order.save()
+
+
+def _cancel_unpaid(order_ids):
+    """Cancel the still-unpaid pending orders among `order_ids`"""
+    order_ids = list(Order.objects.filter(
+        pk__in=order_ids, status=Order.OrderStatus.PENDING,
+    ).exclude(payment_status='PAID').values_list('pk', flat=True))
+    if not order_ids:
+        return 0
+    # Holds of the same order that have not lapsed yet go too
+    release(StockReservation.objects.filter(order_id__in=order_ids))
+    _restore_variant_stock(order_ids)
+    # updated_at drives the incremental report refresh, so bulk writes bump it too
+    return Order.objects.filter(pk__in=order_ids).update(status=Order.OrderStatus.CANCELLED, updated_at=timezone.now())
+
+
+def expire_pending_orders(now=None):
+    """
+    Release expired holds and cancel the unpaid orders they belonged to
+
+    Returns:
+        Dict with the reservations expired, units released and orders cancelled
+    """
+    cancelled = 0
+
+    def cancel(order_ids):
+        nonlocal cancelled
+        cancelled += _cancel_unpaid(order_ids)
+
+    expired, released = expire_reservations(now, on_batch=cancel)
+    return {'expired': expired, 'released': released, 'cancelled': cancelled}
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Release stock held by pending orders past their reservation TTL and cancel those orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, default=0,
+                            help='Keep sweeping every N seconds instead of running once.')
+
+    def handle(self, *args, **options):
+        from orders.checkout import expire_pending_orders
+
+        while True:
+            started = time.perf_counter()
+            stats = expire_pending_orders()
+            self.stdout.write(
+                f"Expired {stats['expired']} reservations ({stats['released']} units), "
+                f"cancelled {stats['cancelled']} orders in {time.perf_counter() - started:.2f}s"
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -78,6 +78,8 @@ class Order(models.Model):
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['status']),
             models.Index(fields=['order_number']),
+            # Watermark scans of the incremental report refresh
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -7,6 +7,9 @@ from django.conf import settings
 from typing import Dict, Optional
 import logging
 
+from .checkout import cancel_order
+from .models import Order
+
 logger = logging.getLogger(__name__)
 
 # Initialize Stripe (add STRIPE_SECRET_KEY to settings)
@@ -264,35 +267,52 @@ def confirm_payment_for_order(order, payment_intent_id: str) -> Dict:
     if result.get('success'):
         # Update order
         order.payment_status = 'PAID'
-        order.transaction_id = payment_intent_id
+        order.payment_transaction_id = payment_intent_id
         order.save()
     
     return result
 
 
-def process_refund(order, amount: Optional[Decimal] = None) -> Dict:
+def void_payment(order, payment_id: str) -> Dict:
+    """
+    Give back a payment taken for an order that cannot be fulfilled (e.g.
+    its stock hold lapsed while the customer paid)
+    """
+    processor = get_payment_processor(order.payment_method)
+    return processor.refund_payment(payment_id)
+
+
+def process_refund(order, amount: Optional[Decimal] = None, user=None) -> Dict:
     """
     Process a refund for an order
     
+    A successful refund marks the order REFUNDED through `cancel_order`,
+    which releases its held units and restocks the shipped ones in the
+    same transaction.
+    
     Args:
         order: Order instance
         amount: Refund amount (None for full refund)
+        user: User recorded on the RETURN stock movements
     
     Returns:
         Dict with refund result
     """
-    if not order.transaction_id:
+    if order.status == Order.OrderStatus.REFUNDED:
+        return {
+            'success': False,
+            'error': 'Order is already refunded',
+        }
+    if not order.payment_transaction_id:
         return {
             'success': False,
             'error': 'No transaction ID found for this order',
         }
     
     processor = get_payment_processor(order.payment_method)
-    result = processor.refund_payment(order.transaction_id, amount)
+    result = processor.refund_payment(order.payment_transaction_id, amount)
     
     if result.get('success'):
-        # Update order status
-        order.status = 'REFUNDED'
-        order.save()
+        cancel_order(order, status=Order.OrderStatus.REFUNDED, user=user)
     
     return result
@@ -0,0 +1,319 @@
+import random
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from cart.models import Cart, CartItem
+from inventory.models import Stock, StockMovement, StockReservation
+from inventory.reservations import release
+from inventory.tests import make_variant, make_warehouse
+from products.models import ProductVariant
+from .checkout import OversellError, StockNotHeldError, commit_order_stock, expire_pending_orders, place_order
+from .models import Order, OrderItem
+
+SHIPPING = {
+    'shipping_name': 'Jane Doe', 'shipping_email': 'jane@example.com', 'shipping_phone': '5551234567',
+    'shipping_address_line1': '1 Main St', 'shipping_city': 'City', 'shipping_state': 'ST',
+    'shipping_postal_code': '00000', 'payment_method': 'CREDIT_CARD',
+}
+
+
+def make_buyer(username):
+    user = get_user_model().objects.create_user(username=username, email=f'{username}@example.com', password='x')
+    return user, Cart.objects.create(user=user)
+
+
+def set_stock(variant, units, *warehouses):
+    ProductVariant.objects.filter(pk=variant.pk).update(stock=sum(units))
+    for warehouse, quantity in zip(warehouses, units):
+        Stock.objects.create(warehouse=warehouse, variant=variant, quantity=quantity)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.main, self.east = make_warehouse('MAIN'), make_warehouse('EAST')
+        self.phone = make_variant()
+        self.tablet = make_variant(product_id='tablet', variant_id='tablet-64', price='300.00')
+        set_stock(self.phone, [2, 3], self.main, self.east)
+        set_stock(self.tablet, [1], self.main)
+        self.user, self.cart = make_buyer('jane')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, variant, quantity):
+        CartItem.objects.create(cart=self.cart, product=variant.product, variant=variant, quantity=quantity)
+
+    def checkout(self, **lines):
+        for variant, quantity in lines.items():
+            self.add(getattr(self, variant), quantity)
+        return self.client.post('/api/orders/orders/', SHIPPING, format='json')
+
+    def stock_levels(self):
+        return sorted(Stock.objects.values_list(
+            'warehouse__code', 'variant_id', 'quantity', 'reserved_quantity',
+        ))
+
+    def test_checkout_reserves_stock_until_payment_is_confirmed(self):
+        response = self.checkout(phone=4, tablet=1)
+        self.assertEqual(response.status_code, 201, response.data)
+
+        order = Order.objects.get()
+        self.assertEqual(order.subtotal, Decimal('2300.00'))
+        self.assertEqual(order.tax, Decimal('184.00'))
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list('variant_id', 'subtotal')),
+            [('phone-128', Decimal('2000.00')), ('tablet-64', Decimal('300.00'))],
+        )
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 1)
+        # MAIN ships the whole tablet line, EAST the rest; held, not shipped
+        self.assertEqual(self.stock_levels(), [
+            ('EAST', 'phone-128', 3, 2), ('MAIN', 'phone-128', 2, 2), ('MAIN', 'tablet-64', 1, 1),
+        ])
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').available_stock, 1)
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertFalse(self.cart.items.exists())
+
+        self.assertEqual(commit_order_stock(order), 5)
+        self.assertEqual(commit_order_stock(order), 0)
+        self.assertEqual(self.stock_levels(), [
+            ('EAST', 'phone-128', 1, 0), ('MAIN', 'phone-128', 0, 0), ('MAIN', 'tablet-64', 0, 0),
+        ])
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(reference_number=order.order_number).values_list(
+                'warehouse__code', 'variant_id', 'movement_type', 'quantity',
+            )),
+            [('EAST', 'phone-128', 'SALE', -2), ('MAIN', 'phone-128', 'SALE', -2), ('MAIN', 'tablet-64', 'SALE', -1)],
+        )
+
+    def test_cancel_releases_held_units(self):
+        self.checkout(phone=4)
+        order = Order.objects.get()
+        response = self.client.post(f'/api/orders/orders/{order.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock_levels(), [
+            ('EAST', 'phone-128', 3, 0), ('MAIN', 'phone-128', 2, 0), ('MAIN', 'tablet-64', 1, 0),
+        ])
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 5)
+        self.assertEqual(
+            set(order.stock_reservations.values_list('status', flat=True)), {StockReservation.Status.RELEASED},
+        )
+
+    def confirm(self, order, success):
+        with mock.patch('orders.payment.confirm_payment_for_order', return_value={'success': success}):
+            return self.client.post(
+                f'/api/orders/orders/{order.pk}/confirm_payment/', {'payment_intent_id': 'pi_1'}, format='json',
+            )
+
+    def test_failed_payment_keeps_the_hold_for_a_retry(self):
+        self.checkout(phone=2)
+        order = Order.objects.get()
+        self.assertEqual(self.confirm(order, False).status_code, 400)
+        self.assertEqual(
+            set(order.stock_reservations.values_list('status', flat=True)), {StockReservation.Status.ACTIVE},
+        )
+
+        self.assertEqual(self.confirm(order, True).status_code, 200)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.OrderStatus.PROCESSING)
+        self.assertEqual(self.stock_levels(), [
+            ('EAST', 'phone-128', 3, 0), ('MAIN', 'phone-128', 0, 0), ('MAIN', 'tablet-64', 1, 0),
+        ])
+
+    def test_an_expired_hold_is_refused_before_charging(self):
+        self.checkout(phone=2)
+        order = Order.objects.get()
+        order.stock_reservations.update(expires_at=timezone.now() - timedelta(minutes=1))
+        with mock.patch('orders.payment.confirm_payment_for_order') as charge:
+            response = self.client.post(
+                f'/api/orders/orders/{order.pk}/confirm_payment/', {'payment_intent_id': 'pi_1'}, format='json',
+            )
+        self.assertEqual(response.status_code, 409)
+        charge.assert_not_called()
+
+        # Once the sweeper has cancelled it, the order is no longer payable at all
+        expire_pending_orders()
+        with mock.patch('orders.payment.confirm_payment_for_order') as charge:
+            response = self.client.post(
+                f'/api/orders/orders/{order.pk}/confirm_payment/', {'payment_intent_id': 'pi_1'}, format='json',
+            )
+        self.assertEqual(response.status_code, 409)
+        charge.assert_not_called()
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.paid_at), (Order.OrderStatus.CANCELLED, None))
+
+    def test_a_charge_that_cannot_be_fulfilled_is_refunded(self):
+        self.checkout(phone=2)
+        order = Order.objects.get()
+        processor = mock.Mock()
+        processor.refund_payment.return_value = {'success': True}
+        with mock.patch('orders.payment.get_payment_processor', return_value=processor), \
+                mock.patch('orders.views.commit_order_stock', side_effect=StockNotHeldError(order)):
+            processor.confirm_payment.return_value = {'success': True}
+            response = self.client.post(
+                f'/api/orders/orders/{order.pk}/confirm_payment/', {'payment_intent_id': 'pi_1'}, format='json',
+            )
+        self.assertEqual(response.status_code, 409)
+        processor.refund_payment.assert_called_once_with('pi_1')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.payment_status), (Order.OrderStatus.PENDING, 'PENDING'))
+
+    def test_refund_restocks_shipped_units(self):
+        self.checkout(phone=4)
+        order = Order.objects.get()
+        commit_order_stock(order)
+        Order.objects.filter(pk=order.pk).update(payment_transaction_id='pi_1', payment_status='PAID')
+        admin = get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+        self.client.force_authenticate(admin)
+        processor = mock.Mock()
+        processor.refund_payment.return_value = {'success': True}
+        with mock.patch('orders.payment.get_payment_processor', return_value=processor):
+            response = self.client.post(f'/api/orders/orders/{order.pk}/refund/')
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(self.client.post(f'/api/orders/orders/{order.pk}/refund/').status_code, 400)
+        processor.refund_payment.assert_called_once()
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.OrderStatus.REFUNDED)
+        self.assertEqual(self.stock_levels(), [
+            ('EAST', 'phone-128', 3, 0), ('MAIN', 'phone-128', 2, 0), ('MAIN', 'tablet-64', 1, 0),
+        ])
+        self.assertEqual(
+            StockMovement.objects.filter(reference_number=order.order_number, movement_type='RETURN').count(), 2,
+        )
+
+    def test_paying_an_order_without_a_hold_takes_no_stock(self):
+        self.checkout(phone=2)
+        order = Order.objects.get()
+        release(order.stock_reservations.all())
+        response = self.confirm(order, True)
+        self.assertEqual(response.status_code, 409)
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.OrderStatus.PENDING)
+        self.assertIsNone(order.paid_at)
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_cancelling_a_paid_order_restocks_its_units(self):
+        self.checkout(phone=4)
+        order = Order.objects.get()
+        self.assertEqual(self.confirm(order, True).status_code, 200)
+        response = self.client.post(f'/api/orders/orders/{order.pk}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock_levels(), [
+            ('EAST', 'phone-128', 3, 0), ('MAIN', 'phone-128', 2, 0), ('MAIN', 'tablet-64', 1, 0),
+        ])
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 5)
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(movement_type='RETURN').values_list('warehouse__code', 'quantity')),
+            [('EAST', 3), ('MAIN', 1)],
+        )
+        self.assertEqual(
+            set(order.stock_reservations.values_list('status', flat=True)), {StockReservation.Status.RETURNED},
+        )
+
+    def test_admin_cancel_releases_cash_on_delivery_hold(self):
+        self.add(self.phone, 1)
+        self.client.post('/api/orders/orders/', {**SHIPPING, 'payment_method': 'COD'}, format='json')
+        order = Order.objects.get()
+        admin = get_user_model().objects.create_user(
+            username='admin', email='admin@example.com', password='x', role='ADMIN',
+        )
+        self.client.force_authenticate(admin)
+        response = self.client.patch(f'/api/orders/orders/{order.pk}/update_status/', {'status': 'CANCELLED'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'CANCELLED')
+        self.assertFalse(Stock.objects.filter(reserved_quantity__gt=0).exists())
+
+    def test_sweeper_cancels_orders_whose_hold_expired(self):
+        self.checkout(phone=2)
+        order = Order.objects.get()
+        self.assertEqual(expire_pending_orders()['cancelled'], 0)
+
+        later = timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES + 1)
+        self.assertEqual(expire_pending_orders(now=later), {'expired': 1, 'released': 2, 'cancelled': 1})
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.OrderStatus.CANCELLED)
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 5)
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').available_stock, 5)
+
+    def test_cash_on_delivery_holds_do_not_expire(self):
+        self.add(self.phone, 1)
+        self.client.post('/api/orders/orders/', {**SHIPPING, 'payment_method': 'COD'}, format='json')
+        later = timezone.now() + timedelta(days=30)
+        self.assertEqual(expire_pending_orders(now=later)['expired'], 0)
+
+    def test_oversell_reports_every_conflict_and_changes_nothing(self):
+        Stock.objects.filter(variant=self.tablet).update(reserved_quantity=1)
+        self.add(self.phone, 6)
+        self.add(self.tablet, 1)
+        response = self.client.post('/api/orders/orders/', SHIPPING, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(
+            [(c['variant'], c['requested'], c['available']) for c in response.data['conflicts']],
+            [('phone-128', 6, 5), ('tablet-64', 1, 0)],
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ProductVariant.objects.get(pk='phone-128').stock, 5)
+        self.assertEqual(self.cart.items.count(), 2)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    BUYERS = 12
+    UNITS = 5
+
+    def test_concurrent_buyers_cannot_oversell_the_last_units(self):
+        warehouse = make_warehouse('MAIN')
+        variant = make_variant()
+        set_stock(variant, [self.UNITS], warehouse)
+        carts = []
+        for i in range(self.BUYERS):
+            user, cart = make_buyer(f'buyer{i}')
+            CartItem.objects.create(cart=cart, product=variant.product, variant=variant, quantity=1)
+            carts.append((user, cart))
+
+        outcomes = []
+        start = threading.Barrier(self.BUYERS)
+
+        def buy(user, cart):
+            start.wait()
+            try:
+                for _ in range(200):
+                    try:
+                        place_order(user, cart.items.all(), SHIPPING)
+                        outcomes.append('ordered')
+                        return
+                    except OversellError:
+                        outcomes.append('conflict')
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting;
+                        # jitter keeps the retries from colliding again
+                        time.sleep(random.uniform(0.005, 0.05))
+                outcomes.append('gave up')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=buyer) for buyer in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count('ordered'), self.UNITS)
+        self.assertEqual(outcomes.count('conflict'), self.BUYERS - self.UNITS)
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).stock, 0)
+        stock = Stock.objects.get(variant=variant)
+        self.assertEqual((stock.quantity, stock.reserved_quantity), (self.UNITS, self.UNITS))
+        self.assertEqual(Order.objects.count(), self.UNITS)
+        self.assertEqual(
+            sum(StockReservation.objects.values_list('quantity', flat=True)), self.UNITS,
+        )
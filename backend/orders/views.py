@@ -2,10 +2,10 @@ from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from .models import Order, OrderItem, Favorite
+from .models import Order, Favorite
 from .serializers import (
     OrderSerializer, OrderListSerializer, CreateOrderSerializer,
     OrderItemSerializer, FavoriteSerializer
@@ -13,6 +13,11 @@ from .serializers import (
 from cart.models import Cart
 from products.models import Product, ProductVariant
 from inventory.models import Stock, StockMovement
+from core.pagination import KeysetPagination
+from .checkout import (
+    CLOSED_STATUSES, OversellError, StockNotHeldError, cancel_order, commit_order_stock, lock_order_stock,
+    place_order,
+)
 
 
 class OrderViewSet(viewsets.ModelViewSet):
@@ -20,6 +25,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     ViewSet for Order operations
     """
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     filter_backends = [filters.OrderingFilter, filters.SearchFilter]
     ordering_fields = ['created_at', 'total', 'status']
     ordering = ['-created_at']
@@ -38,7 +44,6 @@ class OrderViewSet(viewsets.ModelViewSet):
             return CreateOrderSerializer
         return OrderSerializer
     
-    @transaction.atomic
     def create(self, request):
         """Create order from cart"""
         serializer = CreateOrderSerializer(data=request.data)
@@ -62,61 +67,13 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Validate stock availability for all items
-        for cart_item in cart_items:
-            if cart_item.variant.stock < cart_item.quantity:
-                return Response(
-                    {'error': f'Insufficient stock for {cart_item.product.name}'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Calculate totals
-        subtotal = sum(item.get_total_price() for item in cart_items)
-        tax = subtotal * 0.08  # 8% tax (adjust as needed)
-        shipping_cost = 0 if subtotal > 100 else 10  # Free shipping over $100
-        total = subtotal + tax + shipping_cost
-        
-        # Create order
-        order = Order.objects.create(
-            user=user,
-            status=Order.OrderStatus.PENDING,
-            shipping_name=serializer.validated_data['shipping_name'],
-            shipping_email=serializer.validated_data['shipping_email'],
-            shipping_phone=serializer.validated_data['shipping_phone'],
-            shipping_address_line1=serializer.validated_data['shipping_address_line1'],
-            shipping_address_line2=serializer.validated_data.get('shipping_address_line2', ''),
-            shipping_city=serializer.validated_data['shipping_city'],
-            shipping_state=serializer.validated_data['shipping_state'],
-            shipping_postal_code=serializer.validated_data['shipping_postal_code'],
-            shipping_country=serializer.validated_data.get('shipping_country', 'USA'),
-            payment_method=serializer.validated_data['payment_method'],
-            customer_notes=serializer.validated_data.get('customer_notes', ''),
-            subtotal=subtotal,
-            tax=tax,
-            shipping_cost=shipping_cost,
-            total=total
-        )
-        
-        # Create order items and update stock
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                variant=cart_item.variant,
-                product_name=cart_item.product.name,
-                variant_storage=cart_item.storage,
-                variant_color=cart_item.color,
-                unit_price=cart_item.price,
-                quantity=cart_item.quantity,
-                product_image=cart_item.image or cart_item.product.image
+        try:
+            order = place_order(user, cart_items, serializer.validated_data)
+        except OversellError as exc:
+            return Response(
+                {'error': str(exc), 'conflicts': exc.conflicts},
+                status=status.HTTP_409_CONFLICT
             )
-            
-            # Update stock
-            cart_item.variant.stock -= cart_item.quantity
-            cart_item.variant.save()
-        
-        # Clear cart
-        cart_items.delete()
         
         order_serializer = OrderSerializer(order)
         return Response(order_serializer.data, status=status.HTTP_201_CREATED)
@@ -139,16 +96,31 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        order.status = new_status
+        if new_status in CLOSED_STATUSES:
+            # Releases held units and restocks the ones already shipped
+            cancel_order(order, status=new_status, user=request.user)
+            return Response(OrderSerializer(order).data)
         
-        # Update timestamps based on status
-        now = timezone.now()
-        if new_status == Order.OrderStatus.SHIPPED and not order.shipped_at:
-            order.shipped_at = now
-        elif new_status == Order.OrderStatus.DELIVERED and not order.delivered_at:
-            order.delivered_at = now
-        
-        order.save()
+        try:
+            with transaction.atomic():
+                if new_status in (
+                    Order.OrderStatus.PROCESSING, Order.OrderStatus.SHIPPED, Order.OrderStatus.DELIVERED,
+                ):
+                    # Fulfilment started (e.g. cash on delivery): ship the held units
+                    commit_order_stock(order, user=request.user)
+                
+                order.status = new_status
+                
+                # Update timestamps based on status
+                now = timezone.now()
+                if new_status == Order.OrderStatus.SHIPPED and not order.shipped_at:
+                    order.shipped_at = now
+                elif new_status == Order.OrderStatus.DELIVERED and not order.delivered_at:
+                    order.delivered_at = now
+                
+                order.save()
+        except StockNotHeldError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
         
         serializer = OrderSerializer(order)
         return Response(serializer.data)
@@ -164,14 +136,8 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            # Restore stock
-            for item in order.items.all():
-                item.variant.stock += item.quantity
-                item.variant.save()
-            
-            order.status = Order.OrderStatus.CANCELLED
-            order.save()
+        # Releases held warehouse units and restores variant stock
+        cancel_order(order)
         
         serializer = OrderSerializer(order)
         return Response(serializer.data)
@@ -211,7 +177,7 @@ class OrderViewSet(viewsets.ModelViewSet):
         if result.get('success'):
             # Update order with payment intent details
             if 'payment_intent_id' in result:
-                order.transaction_id = result['payment_intent_id']
+                order.payment_transaction_id = result['payment_intent_id']
                 order.payment_status = 'PENDING'
                 order.save()
             
@@ -221,8 +187,14 @@ class OrderViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def confirm_payment(self, request, pk=None):
-        """Confirm payment completion"""
-        from .payment import confirm_payment_for_order
+        """
+        Confirm payment completion
+
+        The order and its stock holds are locked before the customer is
+        charged: an order the sweeper cancelled, or whose hold lapsed, is
+        refused without taking the payment.
+        """
+        from .payment import confirm_payment_for_order, void_payment
         
         order = self.get_object()
         payment_intent_id = request.data.get('payment_intent_id')
@@ -233,21 +205,41 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        result = confirm_payment_for_order(order, payment_intent_id)
+        payment = None
+        try:
+            with transaction.atomic():
+                order = Order.objects.select_for_update().get(pk=order.pk)
+                if order.status != Order.OrderStatus.PENDING:
+                    return Response(
+                        {'error': f'Order is {order.get_status_display().lower()}, not awaiting payment'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                lock_order_stock(order)
+                
+                result = confirm_payment_for_order(order, payment_intent_id)
+                if not result.get('success'):
+                    # The hold stays for a retry; cancelling the order or its expiry releases it
+                    return Response(result, status=status.HTTP_400_BAD_REQUEST)
+                payment = result
+                
+                # Update order status
+                order.status = Order.OrderStatus.PROCESSING
+                order.paid_at = timezone.now()
+                order.save()
+                commit_order_stock(order, user=request.user)
+        except StockNotHeldError as exc:
+            order.refresh_from_db()
+            body = {'error': str(exc)}
+            if payment is not None:
+                # Charged all the same: give the money back rather than keep it for nothing
+                body.update(payment=payment, refund=void_payment(order, payment_intent_id))
+            return Response(body, status=status.HTTP_409_CONFLICT)
         
-        if result.get('success'):
-            # Update order status
-            order.status = Order.OrderStatus.PROCESSING
-            order.paid_at = timezone.now()
-            order.save()
-            
-            serializer = OrderSerializer(order)
-            return Response({
-                'message': 'Payment confirmed successfully',
-                'order': serializer.data
-            })
-        else:
-            return Response(result, status=status.HTTP_400_BAD_REQUEST)
+        serializer = OrderSerializer(order)
+        return Response({
+            'message': 'Payment confirmed successfully',
+            'order': serializer.data
+        })
     
     @action(detail=True, methods=['post'])
     def refund(self, request, pk=None):
@@ -267,7 +259,7 @@ class OrderViewSet(viewsets.ModelViewSet):
             from decimal import Decimal
             amount = Decimal(str(amount))
         
-        result = process_refund(order, amount)
+        result = process_refund(order, amount, user=request.user)
         
         if result.get('success'):
             serializer = OrderSerializer(order)
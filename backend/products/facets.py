@@ -0,0 +1,107 @@
+"""
+Faceted counts for the product catalog
+
+Given a filtered product queryset (typically the output of `ProductFilter`),
+count matching products per brand, category, price bucket, storage and
+color. Brand/category/price facets come from one grouped query over the
+products and storage/color from one UNION of two grouped queries over their
+active variants, so the cost does not depend on the number of facet values.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List
+
+from django.db.models import Case, CharField, Count, F, IntegerField, Value, When
+
+from products.models import ProductVariant
+
+# Upper bounds (exclusive) of the price buckets on `base_price`; the last
+# bucket is open-ended.
+PRICE_BUCKETS = [Decimal(bound) for bound in ('250', '500', '1000', '1500', '2000')]
+
+
+def price_bucket_expression():
+    """SQL expression mapping `base_price` to its bucket index"""
+    return Case(
+        *(When(base_price__lt=bound, then=Value(i)) for i, bound in enumerate(PRICE_BUCKETS)),
+        default=Value(len(PRICE_BUCKETS)),
+        output_field=IntegerField(),
+    )
+
+
+def price_bucket_bounds(index: int):
+    """(min_price, max_price) of a bucket, `None` meaning unbounded"""
+    low = PRICE_BUCKETS[index - 1] if index > 0 else None
+    high = PRICE_BUCKETS[index] if index < len(PRICE_BUCKETS) else None
+    return low, high
+
+
+def _sorted_counts(counts: Dict, labels: Dict = None) -> List[Dict]:
+    rows = [
+        {'value': value, 'label': labels[value] if labels else value, 'count': count}
+        for value, count in counts.items()
+    ]
+    rows.sort(key=lambda row: (-row['count'], str(row['label'])))
+    return rows
+
+
+def get_facet_counts(queryset) -> Dict[str, List[Dict]]:
+    """
+    Count products per facet value for a filtered product queryset
+
+    Args:
+        queryset: Product queryset with the current filters applied
+
+    Returns:
+        Dict mapping facet name ('brand', 'category', 'storage', 'color')
+        to a list of {'value', 'label', 'count'} rows, most frequent first,
+        and 'price' to {'value', 'min_price', 'max_price', 'count'} buckets
+        in ascending order
+    """
+    queryset = queryset.prefetch_related(None).order_by()
+
+    brands, categories, prices = defaultdict(int), defaultdict(int), defaultdict(int)
+    brand_names, category_names = {}, {}
+    rows = queryset.annotate(bucket=price_bucket_expression()).values(
+        'brand_id', 'brand__name', 'category_id', 'category__name', 'bucket',
+    ).annotate(count=Count('pk'))
+    for row in rows:
+        brands[row['brand_id']] += row['count']
+        brand_names[row['brand_id']] = row['brand__name']
+        categories[row['category_id']] += row['count']
+        category_names[row['category_id']] = row['category__name']
+        prices[row['bucket']] += row['count']
+
+    # A product counts once per storage/color it is offered in
+    variants = ProductVariant.objects.filter(
+        is_active=True, product_id__in=queryset.values('pk'),
+    ).order_by()
+    per_attribute = [
+        variants.values(attribute).annotate(
+            facet=Value(facet, output_field=CharField()),
+            value=F(attribute),
+            count=Count('product_id', distinct=True),
+        ).values('facet', 'value', 'count')
+        for facet, attribute in (('storage', 'storage'), ('color', 'color'))
+    ]
+    attributes = {'storage': {}, 'color': {}}
+    for row in per_attribute[0].union(per_attribute[1], all=True):
+        attributes[row['facet']][row['value']] = row['count']
+
+    price_rows = []
+    for bucket in sorted(prices):
+        low, high = price_bucket_bounds(bucket)
+        price_rows.append({
+            'value': bucket,
+            'min_price': low,
+            'max_price': high,
+            'count': prices[bucket],
+        })
+
+    return {
+        'brand': _sorted_counts(brands, brand_names),
+        'category': _sorted_counts(categories, category_names),
+        'price': price_rows,
+        'storage': _sorted_counts(attributes['storage']),
+        'color': _sorted_counts(attributes['color']),
+    }
@@ -3,7 +3,9 @@ Custom filters for products
 """
 from django_filters import rest_framework as filters
 from django.db import models
-from .models import Product
+from rest_framework.filters import OrderingFilter
+from .models import Product, ProductVariant
+from .search import search_products, tokenize
 
 
 class ProductFilter(filters.FilterSet):
@@ -21,6 +23,10 @@ class ProductFilter(filters.FilterSet):
     brand = filters.CharFilter(field_name='brand__id')
     brand__name = filters.CharFilter(field_name='brand__name', lookup_expr='iexact')
     
+    # Variant attribute filters (products with an active variant matching)
+    storage = filters.CharFilter(method='variant_filter')
+    color = filters.CharFilter(method='variant_filter')
+    
     # Custom search filter
     search = filters.CharFilter(method='search_filter')
     
@@ -28,11 +34,42 @@ class ProductFilter(filters.FilterSet):
         model = Product
         fields = ['category', 'brand', 'is_active', 'min_price', 'max_price']
     
+    def variant_filter(self, queryset, name, value):
+        """Keep products offering an active variant with the given storage/color"""
+        variants = ProductVariant.objects.filter(is_active=True, **{f'{name}__iexact': value})
+        return queryset.filter(pk__in=variants.values('product_id'))
+    
     def search_filter(self, queryset, name, value):
-        """Custom search across multiple fields"""
-        return queryset.filter(
-            models.Q(name__icontains=value) |
-            models.Q(description__icontains=value) |
-            models.Q(brand__name__icontains=value) |
-            models.Q(category__name__icontains=value)
-        )
+        """
+        Full-text search over name, brand, category, variants and specs
+
+        Matches come from the in-memory index in `products.search`, which
+        hands over the best `MAX_RESULTS` of them: the SQL statement stays
+        bounded however broad the term. Their ranking and the number of
+        products matching are kept on the request, for
+        `RelevanceOrderingFilter` and the list response.
+        """
+        if not tokenize(value):
+            return queryset
+        product_ids, matches = search_products(value)
+        if self.request is not None:
+            self.request.search_ranking = product_ids
+            self.request.search_matches = matches
+        return queryset.filter(pk__in=product_ids)
+
+
+class RelevanceOrderingFilter(OrderingFilter):
+    """
+    Order search results by relevance unless `ordering` is given explicitly
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        ranking = getattr(request, 'search_ranking', None)
+        if ranking and not request.query_params.get(self.ordering_param):
+            rank = models.Case(
+                *(models.When(pk=product_id, then=position) for position, product_id in enumerate(ranking)),
+                default=len(ranking),
+                output_field=models.IntegerField(),
+            )
+            return queryset.order_by(rank, 'pk')
+        return super().filter_queryset(request, queryset, view)
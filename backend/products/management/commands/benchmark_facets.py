@@ -0,0 +1,87 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+BRANDS = ['Apple', 'Samsung', 'Sony', 'Dell', 'Canon', 'Google', 'Xiaomi', 'Lenovo']
+CATEGORIES = ['Smartphones', 'Laptops', 'Tablets', 'Headphones', 'Cameras', 'Accessories']
+STORAGES = ['64GB', '128GB', '256GB', '512GB', '1TB']
+COLORS = ['Black', 'White', 'Silver', 'Blue', 'Green', 'Gold', 'Red', 'Purple']
+
+
+class Command(BaseCommand):
+    help = (
+        'Time facet counts over a synthetic catalog. Rows are created inside a '
+        'transaction that is rolled back, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--variants', type=int, default=5,
+                            help='Variants per product.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options)
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def populate(self, options):
+        from products.models import Brand, Category, Product, ProductVariant
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        brands = [Brand.objects.create(name=f'bench-{name}') for name in BRANDS]
+        categories = [Category.objects.create(name=f'bench-{name}') for name in CATEGORIES]
+
+        products, variants = [], []
+        for i in range(options['products']):
+            product = Product(
+                id=f'bench-{i}', name=f'Bench product {i}', brand=rng.choice(brands),
+                category=rng.choice(categories), base_price=Decimal(rng.randrange(50, 3000)),
+                image='/bench.png', description='',
+            )
+            products.append(product)
+            offset = rng.randrange(len(COLORS))
+            for j in range(options['variants']):
+                variants.append(ProductVariant(
+                    id=f'bench-{i}-{j}', product=product, storage=STORAGES[j % len(STORAGES)],
+                    color=COLORS[(offset + j) % len(COLORS)], price=product.base_price,
+                    is_active=rng.random() > 0.1,
+                ))
+        Product.objects.bulk_create(products, batch_size=2000)
+        ProductVariant.objects.bulk_create(variants, batch_size=2000)
+        self.stdout.write(
+            f'Created {len(products)} products and {len(variants)} variants '
+            f'in {time.perf_counter() - started:.1f}s'
+        )
+        self.brand, self.category = brands[0], categories[0]
+
+    def run(self, options):
+        from products.facets import get_facet_counts
+        from products.filters import ProductFilter
+        from products.models import Product
+
+        scenarios = {
+            'no filters': {},
+            'brand': {'brand': self.brand.pk},
+            'category + price': {'category': self.category.pk, 'min_price': 500, 'max_price': 1500},
+            'storage + color': {'storage': '256GB', 'color': 'blue'},
+        }
+        for label, params in scenarios.items():
+            queryset = ProductFilter(params, queryset=Product.objects.filter(is_active=True)).qs
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                facets = get_facet_counts(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            matched = sum(row['count'] for row in facets['category'])
+            self.stdout.write(
+                f'  {label:18} {matched:6} products  '
+                f'median {statistics.median(timings):8.1f}ms  max {max(timings):8.1f}ms'
+            )
@@ -0,0 +1,57 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+WORDS = (
+    'pro max mini ultra plus lite air neo edge fold flip note pixel galaxy '
+    'titanium graphite silver midnight starlight blue green black white gold '
+    'oled amoled retina display camera battery wireless charging waterproof '
+    'bluetooth noise cancelling processor chip usb fast zoom portrait night'
+).split()
+BRANDS = ['Apple', 'Samsung', 'Sony', 'Dell', 'Canon', 'Google', 'Xiaomi', 'Lenovo']
+CATEGORIES = ['Smartphones', 'Laptops', 'Tablets', 'Headphones', 'Cameras', 'Accessories']
+QUERIES = ['pro', 'galaxy ultra', 'samsung blue 256gb', 'noise cancel', 'tit', 'apple pro max', 'camera zoom']
+
+
+class Command(BaseCommand):
+    help = 'Time catalog search queries against a synthetic in-memory index (no database access).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Times each query is run.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        from products.search import SearchIndex
+
+        rng = random.Random(options['seed'])
+        index = SearchIndex()
+        started = time.perf_counter()
+        for i in range(options['products']):
+            brand = rng.choice(BRANDS)
+            index.add(f'product-{i}', {
+                'name': f'{brand} ' + ' '.join(rng.sample(WORDS, 3)),
+                'brand': brand,
+                'category': rng.choice(CATEGORIES),
+                'variants': f'{rng.choice(["128GB", "256GB", "512GB"])} {rng.choice(WORDS)}',
+                'body': ' '.join(rng.sample(WORDS, 12)),
+            }, sort_vocabulary=False)
+        index.sort_vocabulary()
+        self.stdout.write(
+            f'Indexed {len(index)} products ({len(index.vocabulary)} tokens) '
+            f'in {time.perf_counter() - started:.2f}s'
+        )
+
+        for query in QUERIES:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                results = index.search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(
+                f'  {query!r:24} {len(results):5} hits  '
+                f'median {statistics.median(timings):7.2f}ms  max {max(timings):7.2f}ms'
+            )
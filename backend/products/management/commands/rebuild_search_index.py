@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+
+class Command(BaseCommand):
+    help = 'Rewrite every product search document and optionally run a test query.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', help='Search the rebuilt index and print the top matches.')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Number of matches printed for --query.')
+
+    def handle(self, *args, **options):
+        from products.search import SearchIndex, rebuild_search_documents
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            written = rebuild_search_documents()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rewrote {written} search documents in {time.perf_counter() - started:.2f}s'
+        ))
+
+        if options['query']:
+            index = SearchIndex()
+            index.sync()
+            for product_id in index.search(options['query'], limit=options['limit']):
+                self.stdout.write(f'  {product_id}')
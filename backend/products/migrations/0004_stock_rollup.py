@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:24
+
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def populate_stock_rollup(apps, schema_editor):
+    Stock = apps.get_model('inventory', 'Stock')
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+
+    variant_available = Stock.objects.filter(variant_id=OuterRef('pk')).values('variant_id').annotate(
+        available=Sum('quantity') - Sum('reserved_quantity')
+    ).values('available')
+    ProductVariant.objects.update(available_stock=Greatest(
+        Coalesce(Subquery(variant_available, output_field=IntegerField()), Value(0)), Value(0)
+    ))
+
+    product_available = ProductVariant.objects.filter(product_id=OuterRef('pk'), is_active=True).values(
+        'product_id'
+    ).annotate(available=Sum('available_stock')).values('available')
+    Product.objects.update(available_stock=Coalesce(
+        Subquery(product_available, output_field=IntegerField()), Value(0)
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_pricingrule'),
+        ('inventory', '0002_alter_stockmovement_created_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='available_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='productvariant',
+            name='available_stock',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_stock_rollup, migrations.RunPython.noop),
+    ]
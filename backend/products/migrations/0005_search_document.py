@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+CHUNK_SIZE = 500
+
+
+def document_fields(product, variants):
+    """Searchable text of a product, frozen as of this migration (see products.search)"""
+    specs = product.specs if isinstance(product.specs, dict) else {}
+    features = product.features if isinstance(product.features, list) else []
+    body = [f'{key} {value}' for key, value in specs.items()]
+    body.extend(str(feature) for feature in features)
+    variant_text = {
+        f'{variant.storage} {variant.color}' for variant in variants if variant.is_active
+    }
+    return {
+        'name': product.name,
+        'brand': product.brand.name if product.brand_id else '',
+        'category': product.category.name if product.category_id else '',
+        'variants': ' '.join(sorted(variant_text)),
+        'body': ' '.join(body),
+    }
+
+
+def populate_search_documents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    SearchDocument = apps.get_model('products', 'SearchDocument')
+
+    now = timezone.now()
+    documents = [
+        SearchDocument(
+            product=product,
+            is_active=product.is_active,
+            updated_at=now,
+            **document_fields(product, product.variants.all()),
+        )
+        for product in Product.objects.select_related('brand', 'category').prefetch_related('variants')
+    ]
+    SearchDocument.objects.bulk_create(documents, batch_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_stock_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('name', models.CharField(max_length=255)),
+                ('brand', models.CharField(blank=True, max_length=100)),
+                ('category', models.CharField(blank=True, max_length=100)),
+                ('variants', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+        migrations.RunPython(populate_search_documents, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,8 @@ from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 
+from core.db import LoadedValuesMixin
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -31,7 +33,10 @@ class Brand(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(LoadedValuesMixin, models.Model):
+    # Saves leave the rollup alone unless it was set by hand
+    LOADED_FIELDS = DERIVED_FIELDS = ('available_stock',)
+
     # Basic Information
     id = models.CharField(max_length=100, primary_key=True)  # e.g., "iphone-15-pro-max"
     name = models.CharField(max_length=255)
@@ -58,6 +63,10 @@ class Product(models.Model):
     average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, validators=[MinValueValidator(0), MaxValueValidator(5)])
     total_reviews = models.IntegerField(default=0)
     
+    # Stock rollup: available units across active variants, maintained by
+    # inventory.rollup (rebuild with `manage.py rebuild_stock_rollup`)
+    available_stock = models.IntegerField(default=0)
+    
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -65,12 +74,19 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class ProductVariant(models.Model):
+class ProductVariant(LoadedValuesMixin, models.Model):
+    # Fields a save must change for the stock rollup to be recomputed
+    LOADED_FIELDS = ('stock', 'available_stock', 'is_active', 'product_id')
+    DERIVED_FIELDS = ('stock', 'available_stock')
+
     # Variant ID (SKU)
     id = models.CharField(max_length=100, primary_key=True)  # e.g., "iphone-15-pro-max-256gb-blue"
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
@@ -85,6 +101,8 @@ class ProductVariant(models.Model):
     
     # Stock
     stock = models.IntegerField(default=0)
+    # Rollup of warehouse Stock (quantity - reserved), maintained by inventory.rollup
+    available_stock = models.IntegerField(default=0)
     
     # Variant-specific Images
     images = models.JSONField(default=list, blank=True)  # Color-specific images
@@ -101,18 +119,15 @@ class ProductVariant(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.storage} - {self.color}"
     
-    def get_effective_price(self):
-        """Get the effective price considering active promotions"""
-        promotions = self.promotions.filter(
-            is_active=True,
-            start_date__lte=timezone.now(),
-            end_date__gte=timezone.now()
-        )
-        
-        if promotions.exists():
-            promotion = promotions.first()
-            return promotion.calculate_discounted_price(self.price)
-        return self.price
+    def get_effective_price(self, price_book=None):
+        """Get the effective price considering active promotions.
+
+        Loading the promotions costs up to five queries; callers pricing
+        more than one variant pass a shared `products.promotions.PriceBook`
+        (or prime one with the whole batch) so they are loaded once.
+        """
+        from products.promotions import PriceBook
+        return (price_book or PriceBook()).price(self)
 
 
 class PricingRule(models.Model):
@@ -154,6 +169,67 @@ class PricingRule(models.Model):
     
     def __str__(self):
         return self.name
+    
+    def is_valid_now(self, now=None):
+        """Check if rule is currently valid"""
+        if not self.is_active:
+            return False
+        
+        now = now or timezone.now()
+        if self.start_date and now < self.start_date:
+            return False
+        if self.end_date and now > self.end_date:
+            return False
+        
+        return True
+    
+    def applies_to_product(self, product):
+        """Check if rule applies to given product (queries; see products.pricing for bulk use)"""
+        if not self.is_valid_now():
+            return False
+        
+        # If no specific products/categories, applies to all
+        if not self.products.exists() and not self.categories.exists():
+            return True
+        
+        # Check if product is in rule
+        if self.products.filter(pk=product.pk).exists():
+            return True
+        
+        # Check if product's category is in rule
+        if self.categories.filter(pk=product.category_id).exists():
+            return True
+        
+        return False
+    
+    def calculate_discount(self, base_price, quantity=1):
+        """Calculate discounted price based on rule type and quantity"""
+        from decimal import Decimal
+        base_price = Decimal(str(base_price))
+        
+        if self.rule_type == self.RuleType.PERCENTAGE_DISCOUNT:
+            discount_pct = Decimal(str(self.parameters.get('discount_pct', 0)))
+            return base_price * (Decimal('1') - discount_pct / Decimal('100'))
+        
+        elif self.rule_type == self.RuleType.FIXED_DISCOUNT:
+            discount_amount = Decimal(str(self.parameters.get('discount_amount', 0)))
+            return max(base_price - discount_amount, Decimal('0'))
+        
+        elif self.rule_type == self.RuleType.BULK_PRICING:
+            # Find applicable tier
+            tiers = self.parameters.get('tiers', [])
+            applicable_tier = None
+            
+            for tier in sorted(tiers, key=lambda x: x['min_qty'], reverse=True):
+                if quantity >= tier['min_qty']:
+                    applicable_tier = tier
+                    break
+            
+            if applicable_tier:
+                discount_pct = Decimal(str(applicable_tier.get('discount_pct', 0)))
+                return base_price * (Decimal('1') - discount_pct / Decimal('100'))
+        
+        return base_price
 
 
 class Promotion(models.Model):
@@ -258,6 +334,24 @@ class BulkPricingRule(models.Model):
         return f"{self.name} (Buy {self.min_quantity}+, get {self.discount_percentage}% off)"
 
 
+class SearchDocument(models.Model):
+    """Denormalized per-product text used to build the catalog search index"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    
+    # Searchable fields, weighted differently by products.search
+    name = models.CharField(max_length=255)
+    brand = models.CharField(max_length=100, blank=True)
+    category = models.CharField(max_length=100, blank=True)
+    variants = models.TextField(blank=True)  # Active variant storage/color values
+    body = models.TextField(blank=True)  # Specs and features
+    
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    def __str__(self):
+        return f"Search document: {self.name}"
+
+
 class ProductReview(models.Model):
     """Customer product reviews"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
@@ -1,142 +1,183 @@
 """
 Pricing rules and promotional pricing logic
+
+Active `PricingRule`s are compiled once per process into an in-memory index
+(rules bucketed by product id, category id and "global", each bucket
+pre-sorted by priority) so resolving a price is pure in-memory work.
+The index is rebuilt when the shared version counter, bumped by the signal
+handlers in `products.signals` on any rule or rule M2M change, moves on.
 """
-from django.db import models
-from django.utils import timezone
+import threading
+import time
+from collections import defaultdict
 from decimal import Decimal
+from typing import Dict, Iterable, List
+
+from django.core.cache import cache
+from django.utils import timezone
+
+VERSION_CACHE_KEY = 'products:pricing_rules:version'
+
+# Safety net for deployments whose cache is not shared between processes:
+# rebuild at least this often even without a version bump.
+MAX_INDEX_AGE = 300
+
+
+def get_rules_version() -> int:
+    """Current pricing rules version (shared through the Django cache)"""
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, 1, timeout=None)
+        version = cache.get(VERSION_CACHE_KEY, 1)
+    return version
+
+
+def bump_rules_version():
+    """Invalidate every compiled rule index (called on PricingRule changes)"""
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 2, timeout=None)
+    global _index
+    _index = None
 
 
-class PricingRule(models.Model):
-    """Pricing rules for bulk discounts and promotions"""
-    
-    class RuleType(models.TextChoices):
-        PERCENTAGE_DISCOUNT = 'PERCENTAGE', 'Percentage Discount'
-        FIXED_DISCOUNT = 'FIXED', 'Fixed Amount Discount'
-        BULK_PRICING = 'BULK', 'Bulk/Volume Pricing'
-        BUNDLE = 'BUNDLE', 'Bundle Deal'
-        
-    name = models.CharField(max_length=255)
-    description = models.TextField(blank=True)
-    rule_type = models.CharField(max_length=20, choices=RuleType.choices)
-    
-    # Applicable products (null = all products)
-    products = models.ManyToManyField('products.Product', blank=True, related_name='pricing_rules')
-    categories = models.ManyToManyField('products.Category', blank=True, related_name='pricing_rules')
-    
-    # Rule parameters (stored as JSON for flexibility)
-    # Example for BULK: {"tiers": [{"min_qty": 10, "discount_pct": 20}, {"min_qty": 20, "discount_pct": 30}]}
-    # Example for PERCENTAGE: {"discount_pct": 15}
-    # Example for FIXED: {"discount_amount": 50}
-    parameters = models.JSONField(default=dict)
-    
-    # Time constraints
-    start_date = models.DateTimeField(null=True, blank=True)
-    end_date = models.DateTimeField(null=True, blank=True)
-    
-    # Priority (higher number = higher priority)
-    priority = models.IntegerField(default=0)
-    
-    is_active = models.BooleanField(default=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-    
-    class Meta:
-        ordering = ['-priority', '-created_at']
-    
-    def __str__(self):
-        return self.name
-    
-    def is_valid_now(self):
-        """Check if rule is currently valid"""
-        if not self.is_active:
-            return False
-        
-        now = timezone.now()
-        if self.start_date and now < self.start_date:
-            return False
-        if self.end_date and now > self.end_date:
-            return False
-        
-        return True
-    
-    def applies_to_product(self, product):
-        """Check if rule applies to given product"""
-        if not self.is_valid_now():
-            return False
-        
-        # If no specific products/categories, applies to all
-        if not self.products.exists() and not self.categories.exists():
-            return True
-        
-        # Check if product is in rule
-        if self.products.filter(pk=product.pk).exists():
-            return True
-        
-        # Check if product's category is in rule
-        if self.categories.filter(pk=product.category.pk).exists():
-            return True
-        
-        return False
-    
-    def calculate_discount(self, base_price, quantity=1):
-        """Calculate discounted price based on rule type and quantity"""
-        base_price = Decimal(str(base_price))
-        
-        if self.rule_type == self.RuleType.PERCENTAGE_DISCOUNT:
-            discount_pct = Decimal(str(self.parameters.get('discount_pct', 0)))
-            return base_price * (Decimal('1') - discount_pct / Decimal('100'))
-        
-        elif self.rule_type == self.RuleType.FIXED_DISCOUNT:
-            discount_amount = Decimal(str(self.parameters.get('discount_amount', 0)))
-            return max(base_price - discount_amount, Decimal('0'))
-        
-        elif self.rule_type == self.RuleType.BULK_PRICING:
-            # Find applicable tier
-            tiers = self.parameters.get('tiers', [])
-            applicable_tier = None
-            
-            for tier in sorted(tiers, key=lambda x: x['min_qty'], reverse=True):
-                if quantity >= tier['min_qty']:
-                    applicable_tier = tier
+class PricingRuleIndex:
+    """Active pricing rules bucketed by the products they apply to"""
+
+    def __init__(self, rules, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.by_product: Dict[str, List] = defaultdict(list)
+        self.by_category: Dict[int, List] = defaultdict(list)
+        self.global_rules: List = []
+
+        for rule, product_ids, category_ids in rules:
+            if not product_ids and not category_ids:
+                self.global_rules.append(rule)
+            for product_id in product_ids:
+                self.by_product[product_id].append(rule)
+            for category_id in category_ids:
+                self.by_category[category_id].append(rule)
+
+        for bucket in [self.global_rules, *self.by_product.values(), *self.by_category.values()]:
+            bucket.sort(key=self._sort_key)
+
+    @staticmethod
+    def _sort_key(rule):
+        # Same order as PricingRule.Meta.ordering: priority desc, newest first
+        return (-rule.priority, -rule.created_at.timestamp(), -rule.pk)
+
+    @classmethod
+    def build(cls, version=None) -> 'PricingRuleIndex':
+        """Compile the index with 3 queries (rules + both M2M tables)"""
+        from products.models import PricingRule
+
+        rules = {rule.pk: rule for rule in PricingRule.objects.filter(is_active=True)}
+        product_ids = defaultdict(list)
+        category_ids = defaultdict(list)
+        if rules:
+            for rule_id, product_id in PricingRule.products.through.objects.filter(
+                pricingrule_id__in=rules.keys()
+            ).values_list('pricingrule_id', 'product_id'):
+                product_ids[rule_id].append(product_id)
+            for rule_id, category_id in PricingRule.categories.through.objects.filter(
+                pricingrule_id__in=rules.keys()
+            ).values_list('pricingrule_id', 'category_id'):
+                category_ids[rule_id].append(category_id)
+
+        return cls(
+            [(rule, product_ids[pk], category_ids[pk]) for pk, rule in rules.items()],
+            version=version,
+        )
+
+    def best_rule(self, product_id, category_id, now=None):
+        """Highest priority rule applicable to a product at `now`, if any"""
+        now = now or timezone.now()
+        best = None
+        for bucket in (self.by_product.get(product_id), self.by_category.get(category_id), self.global_rules):
+            if not bucket:
+                continue
+            # Buckets are sorted, so the first rule inside its window is the bucket's best
+            for rule in bucket:
+                if rule.is_valid_now(now):
+                    if best is None or self._sort_key(rule) < self._sort_key(best):
+                        best = rule
                     break
-            
-            if applicable_tier:
-                discount_pct = Decimal(str(applicable_tier.get('discount_pct', 0)))
-                return base_price * (Decimal('1') - discount_pct / Decimal('100'))
-        
-        return base_price
+        return best
+
+    def price(self, product, variant=None, quantity=1, now=None) -> Decimal:
+        """Effective unit price for a product/variant at a given quantity"""
+        base_price = Decimal(str(variant.price if variant else product.base_price))
+        rule = self.best_rule(product.pk, product.category_id, now)
+        if rule is None:
+            return base_price
+        return max(rule.calculate_discount(base_price, quantity), Decimal('0'))
+
+
+# The compiled index is immutable once built, so threads share it freely
+_index = None
+_build_lock = threading.Lock()
+
+
+def _is_stale(index, version):
+    return (
+        index is None
+        or index.version != version
+        or time.monotonic() - index.built_at > MAX_INDEX_AGE
+    )
+
+
+def get_rule_index() -> PricingRuleIndex:
+    """
+    Return this process' compiled rule index, rebuilding it when stale
+
+    Costs one cache read per call; rebuilding costs 3 queries.
+    """
+    global _index
+    version = get_rules_version()
+    if _is_stale(_index, version):
+        with _build_lock:
+            if _is_stale(_index, version):
+                _index = PricingRuleIndex.build(version=version)
+    return _index
 
 
 def get_effective_price(product, variant=None, quantity=1):
     """
     Calculate effective price for a product considering all applicable pricing rules
-    
+
     Args:
         product: Product instance
         variant: ProductVariant instance (optional)
         quantity: Quantity being purchased
-    
+
     Returns:
         Decimal: Final price after all applicable discounts
     """
-    from products.models import PricingRule as PR
-    
-    # Start with base/variant price
-    base_price = Decimal(str(variant.price if variant else product.base_price))
-    
-    # Get all applicable rules
-    rules = PR.objects.filter(is_active=True).order_by('-priority')
-    
-    applicable_rules = [
-        rule for rule in rules 
-        if rule.is_valid_now() and rule.applies_to_product(product)
-    ]
-    
-    if not applicable_rules:
-        return base_price
-    
     # Apply highest priority rule only (can be changed to stack discounts)
-    best_rule = applicable_rules[0]
-    final_price = best_rule.calculate_discount(base_price, quantity)
-    
-    return max(final_price, Decimal('0'))
+    return get_rule_index().price(product, variant, quantity)
+
+
+def get_effective_prices(items: Iterable, now=None) -> List[Decimal]:
+    """
+    Calculate effective unit prices for many cart/order lines at once
+
+    Args:
+        items: Objects with `product`, `variant` and `quantity` attributes
+            (CartItem, OrderItem) or `(product, variant, quantity)` tuples
+        now: Optional point in time for rule validity windows
+
+    Returns:
+        List of Decimal unit prices, in the same order as `items`
+    """
+    index = get_rule_index()
+    now = now or timezone.now()
+    prices = []
+    for item in items:
+        if isinstance(item, (tuple, list)):
+            product, variant, quantity = item
+        else:
+            product, variant, quantity = item.product, item.variant, item.quantity
+        prices.append(index.price(product, variant, quantity, now))
+    return prices
@@ -0,0 +1,207 @@
+"""
+Batch promotion pricing
+
+Resolves effective (promotion-adjusted) prices for many variants at once.
+Active promotions are loaded a single time and indexed by the variant,
+product, category and brand they target, so pricing a whole catalog page
+costs a constant number of queries instead of several per variant.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.utils import timezone
+
+from products.models import Product, ProductVariant, Promotion
+
+
+class PromotionIndex:
+    """Currently active promotions keyed by the objects they apply to"""
+
+    # Most specific target wins: a variant promotion beats a product one, etc.
+    TARGETS = (
+        ('variants', 'productvariant_id'),
+        ('products', 'product_id'),
+        ('categories', 'category_id'),
+        ('brands', 'brand_id'),
+    )
+
+    def __init__(self, promotions, links):
+        self.promotions = promotions
+        self.links = links
+
+    @classmethod
+    def load(cls, at=None) -> 'PromotionIndex':
+        """
+        Load active promotions and their targets
+
+        Args:
+            at: Point in time to evaluate validity windows against (default: now)
+
+        Returns:
+            PromotionIndex: 1 query when nothing is running, 5 otherwise
+        """
+        at = at or timezone.now()
+        promotions = {
+            promo.id: promo
+            for promo in Promotion.objects.filter(
+                is_active=True,
+                start_date__lte=at,
+                end_date__gte=at,
+            )
+        }
+
+        links = {target: defaultdict(list) for target, _ in cls.TARGETS}
+        if promotions:
+            for target, column in cls.TARGETS:
+                through = getattr(Promotion, target).through
+                rows = through.objects.filter(
+                    promotion_id__in=promotions.keys()
+                ).values_list(column, 'promotion_id')
+                for target_id, promotion_id in rows:
+                    links[target][target_id].append(promotions[promotion_id])
+
+            # Keep the model's ordering (newest first) within each bucket so
+            # the winner matches what `promotions.first()` used to return.
+            for buckets in links.values():
+                for bucket in buckets.values():
+                    bucket.sort(key=lambda p: (p.created_at, p.id), reverse=True)
+
+        return cls(promotions, links)
+
+    def __bool__(self):
+        return bool(self.promotions)
+
+    def best_promotion(self, variant_id, product_id, category_id, brand_id) -> Optional[Promotion]:
+        """Return the promotion that applies to a variant, if any"""
+        keys = (variant_id, product_id, category_id, brand_id)
+        for (target, _), key in zip(self.TARGETS, keys):
+            bucket = self.links[target].get(key)
+            if bucket:
+                return bucket[0]
+        return None
+
+    def apply(self, price, variant_id, product_id, category_id, brand_id) -> Decimal:
+        """Return the promotion-adjusted price for a variant"""
+        promotion = self.best_promotion(variant_id, product_id, category_id, brand_id)
+        if promotion is None:
+            return price
+        try:
+            return promotion.calculate_discounted_price(price)
+        except (TypeError, ArithmeticError):
+            # Misconfigured promotion (e.g. percentage without a value)
+            return price
+
+
+class PriceBook:
+    """
+    Memoized effective prices for a unit of work (a request, a cart, ...)
+
+    The promotion index is built lazily on first use and shared by every
+    lookup made through the book.
+    """
+
+    def __init__(self, at=None):
+        self.at = at
+        self._index = None
+        self._prices: Dict[str, Decimal] = {}
+
+    @property
+    def index(self) -> PromotionIndex:
+        if self._index is None:
+            self._index = PromotionIndex.load(self.at)
+        return self._index
+
+    def prime(self, variants: Iterable[ProductVariant]) -> Dict[str, Decimal]:
+        """
+        Resolve effective prices for variants not priced yet
+
+        Args:
+            variants: ProductVariant instances
+
+        Returns:
+            Dict mapping variant id to effective price for the given variants
+        """
+        variants = list(variants)
+        missing = [v for v in variants if v.pk not in self._prices]
+        if missing:
+            index = self.index
+            if not index:
+                for variant in missing:
+                    self._prices[variant.pk] = variant.price
+            else:
+                owners = _product_owners(missing)
+                for variant in missing:
+                    category_id, brand_id = owners.get(variant.product_id, (None, None))
+                    self._prices[variant.pk] = index.apply(
+                        variant.price, variant.pk, variant.product_id, category_id, brand_id
+                    )
+        return {v.pk: self._prices[v.pk] for v in variants}
+
+    def price(self, variant: ProductVariant) -> Decimal:
+        """Effective price for a single variant"""
+        return self.prime([variant])[variant.pk]
+
+
+def _product_owners(variants) -> Dict[str, Tuple[int, int]]:
+    """Map product id -> (category_id, brand_id) using cached products when possible"""
+    owners = {}
+    unknown = set()
+    for variant in variants:
+        if ProductVariant.product.is_cached(variant):
+            owners[variant.product_id] = (variant.product.category_id, variant.product.brand_id)
+        else:
+            unknown.add(variant.product_id)
+    unknown -= owners.keys()
+    if unknown:
+        rows = Product.objects.filter(pk__in=unknown).values_list('id', 'category_id', 'brand_id')
+        for product_id, category_id, brand_id in rows:
+            owners[product_id] = (category_id, brand_id)
+    return owners
+
+
+def get_promotion_prices(variants: Iterable[ProductVariant], at=None) -> Dict[str, Decimal]:
+    """
+    Resolve promotion-adjusted prices for many variants in constant queries
+
+    Args:
+        variants: ProductVariant instances
+        at: Optional point in time (default: now)
+
+    Returns:
+        Dict mapping variant id to effective price
+    """
+    return PriceBook(at).prime(variants)
+
+
+def get_price_ranges(products, price_book: Optional[PriceBook] = None) -> Dict[str, Tuple[Decimal, Decimal]]:
+    """
+    Compute (min, max) effective price over the active variants of each product
+
+    Products without active variants fall back to their base price. Variants
+    are read from a `variants` prefetch when present.
+
+    Args:
+        products: Product instances (ideally with `variants` prefetched)
+        price_book: Optional PriceBook to share with other lookups
+
+    Returns:
+        Dict mapping product id to (min_price, max_price)
+    """
+    from django.db.models import prefetch_related_objects
+
+    products = list(products)
+    prefetch_related_objects(products, 'variants')
+    price_book = price_book or PriceBook()
+
+    active = {p.pk: [v for v in p.variants.all() if v.is_active] for p in products}
+    prices = price_book.prime(v for variants in active.values() for v in variants)
+
+    ranges = {}
+    for product in products:
+        values = [prices[v.pk] for v in active[product.pk]]
+        if values:
+            ranges[product.pk] = (min(values), max(values))
+        else:
+            ranges[product.pk] = (product.base_price, product.base_price)
+    return ranges
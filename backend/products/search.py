@@ -0,0 +1,326 @@
+"""
+Catalog full-text search
+
+Each product has a denormalized `SearchDocument` (name, brand, category,
+variant storage/colors, specs and features) rewritten whenever the product,
+one of its variants, or its brand/category is saved. Every process keeps an
+in-memory inverted index over those documents: tokens map to postings of
+(document, weight), a sorted vocabulary gives prefix matching, and results
+are ranked by field-weighted TF-IDF. Before each search the index pulls the
+documents changed since its last sync (one indexed query), so updates show
+up without rebuilding. One thread syncs at a time, outside the lock that
+guards the in-memory index; catalog searches hand the best `MAX_RESULTS`
+matches to SQL and report how many there were.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.utils import timezone
+
+from core.db import conflict_target
+
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+# Relative importance of a token depending on the field it appears in
+FIELD_WEIGHTS = {
+    'name': 4.0,
+    'brand': 3.0,
+    'category': 2.0,
+    'variants': 1.5,
+    'body': 1.0,
+}
+
+# Prefix matches score a bit lower than exact token matches
+PREFIX_FACTOR = 0.8
+# Upper bound on vocabulary tokens a single prefix may expand to
+MAX_PREFIX_EXPANSION = 200
+# Documents saved in a transaction that commits after a sync still carry an
+# `updated_at` older than the watermark; re-read this much history each sync.
+SYNC_OVERLAP = timedelta(seconds=30)
+# Full rebuild interval, which also drops hard-deleted products
+MAX_INDEX_AGE = 3600
+# Documents written per bulk upsert
+CHUNK_SIZE = 500
+# Ranked matches a catalog search hands to SQL; the total is reported apart
+MAX_RESULTS = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric tokens"""
+    return TOKEN_RE.findall(text.casefold()) if text else []
+
+
+def document_fields(product, variants) -> Dict[str, str]:
+    """
+    Build the searchable text of a product
+
+    Args:
+        product: Product instance (brand and category are read from it)
+        variants: The product's variants
+
+    Returns:
+        Dict mapping SearchDocument field name to text
+    """
+    specs = product.specs if isinstance(product.specs, dict) else {}
+    features = product.features if isinstance(product.features, list) else []
+    body = [f'{key} {value}' for key, value in specs.items()]
+    body.extend(str(feature) for feature in features)
+    variant_text = {
+        f'{variant.storage} {variant.color}' for variant in variants if variant.is_active
+    }
+    return {
+        'name': product.name,
+        'brand': product.brand.name if product.brand_id else '',
+        'category': product.category.name if product.category_id else '',
+        'variants': ' '.join(sorted(variant_text)),
+        'body': ' '.join(body),
+    }
+
+
+def reindex_products(product_ids: Iterable[str]) -> int:
+    """
+    Rewrite the search documents of the given products
+
+    Args:
+        product_ids: Products whose searchable data changed
+
+    Returns:
+        Int: Number of documents written
+    """
+    from products.models import Product, SearchDocument
+
+    product_ids = list(set(product_ids))
+    written = 0
+    now = timezone.now()
+    for start in range(0, len(product_ids), CHUNK_SIZE):
+        chunk = product_ids[start:start + CHUNK_SIZE]
+        products = Product.objects.filter(pk__in=chunk).select_related(
+            'brand', 'category'
+        ).prefetch_related('variants')
+        documents = [
+            SearchDocument(
+                product=product,
+                is_active=product.is_active,
+                updated_at=now,
+                **document_fields(product, product.variants.all()),
+            )
+            for product in products
+        ]
+        SearchDocument.objects.bulk_create(
+            documents,
+            update_conflicts=True,
+            unique_fields=conflict_target(['product']),
+            update_fields=[*FIELD_WEIGHTS, 'is_active', 'updated_at'],
+        )
+        written += len(documents)
+    return written
+
+
+def rebuild_search_documents() -> int:
+    """Rewrite every product's search document"""
+    from products.models import Product
+    return reindex_products(Product.objects.values_list('pk', flat=True))
+
+
+class SearchIndex:
+    """In-memory inverted index over SearchDocument rows"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self.vocabulary: List[str] = []
+        self.doc_numbers: Dict[str, int] = {}
+        self.doc_products: List[str] = []
+        self.doc_tokens: Dict[int, Tuple[str, ...]] = {}
+        self.synced_at = None
+        self.built_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.doc_tokens)
+
+    def add(self, product_id: str, fields: Dict[str, str], sort_vocabulary: bool = True):
+        """
+        Index (or re-index) one product
+
+        Bulk loads pass `sort_vocabulary=False` and call `sort_vocabulary()` once at the end.
+        """
+        self.remove(product_id)
+        docno = self.doc_numbers.get(product_id)
+        if docno is None:
+            docno = len(self.doc_products)
+            self.doc_numbers[product_id] = docno
+            self.doc_products.append(product_id)
+
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(fields.get(field, '')):
+                weights[token] += weight
+        for token, weight in weights.items():
+            postings = self.postings[token]
+            if not postings and sort_vocabulary:
+                position = bisect_left(self.vocabulary, token)
+                if position == len(self.vocabulary) or self.vocabulary[position] != token:
+                    self.vocabulary.insert(position, token)
+            # Dampen repeated tokens so long spec sheets don't dominate
+            postings[docno] = 1.0 + math.log(weight)
+        self.doc_tokens[docno] = tuple(weights)
+
+    def sort_vocabulary(self):
+        """Rebuild the sorted vocabulary used for prefix matching"""
+        self.vocabulary = sorted(token for token, postings in self.postings.items() if postings)
+
+    def remove(self, product_id: str):
+        """Drop a product from the index (no-op if absent)"""
+        docno = self.doc_numbers.get(product_id)
+        if docno is None:
+            return
+        for token in self.doc_tokens.pop(docno, ()):
+            self.postings[token].pop(docno, None)
+
+    def _term_scores(self, term: str) -> Dict[int, float]:
+        """Best score per document for one query term (exact or prefix)"""
+        total = max(len(self.doc_tokens), 1)
+        scores: Dict[int, float] = {}
+        position = bisect_left(self.vocabulary, term)
+        for token in self.vocabulary[position:position + MAX_PREFIX_EXPANSION]:
+            if not token.startswith(term):
+                break
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1.0 + total / len(postings))
+            factor = idf if token == term else idf * PREFIX_FACTOR
+            for docno, weight in postings.items():
+                score = weight * factor
+                if score > scores.get(docno, 0.0):
+                    scores[docno] = score
+        return scores
+
+    def rank(self, query: str, limit: Optional[int] = None) -> Tuple[List[str], int]:
+        """
+        Rank products matching every query term
+
+        Each term matches tokens equal to it or starting with it.
+
+        Args:
+            query: Search text
+            limit: Keep only the best `limit` matches (default: all of them)
+
+        Returns:
+            Tuple of (product ids, best match first; number of matches)
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0
+        per_term = sorted((self._term_scores(term) for term in terms), key=len)
+        if not per_term[0]:
+            return [], 0
+
+        totals = dict(per_term[0])
+        for scores in per_term[1:]:
+            totals = {docno: total + scores[docno] for docno, total in totals.items() if docno in scores}
+            if not totals:
+                return [], 0
+
+        key = lambda item: (item[1], -item[0])
+        if limit is None:
+            best = sorted(totals.items(), key=key, reverse=True)
+        else:
+            best = heapq.nlargest(limit, totals.items(), key=key)
+        return [self.doc_products[docno] for docno, _ in best], len(totals)
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Product ids matching every query term, best match first (see `rank`)"""
+        return self.rank(query, limit)[0]
+
+    def changes(self) -> Tuple[List[Dict], datetime]:
+        """Read the search documents changed since the last sync, and the instant the read started"""
+        from products.models import SearchDocument
+
+        rows = SearchDocument.objects.all()
+        if self.synced_at is not None:
+            rows = rows.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+        started = timezone.now()
+        return list(rows.values('product_id', 'is_active', *FIELD_WEIGHTS).iterator(chunk_size=2000)), started
+
+    def apply(self, rows: List[Dict], started: datetime):
+        """Apply documents read by `changes`"""
+        full_build = self.synced_at is None
+        for row in rows:
+            if row['is_active']:
+                self.add(row['product_id'], row, sort_vocabulary=not full_build)
+            else:
+                self.remove(row['product_id'])
+        if full_build:
+            self.sort_vocabulary()
+        self.synced_at = started
+
+    def sync(self):
+        """Apply search documents changed since the last sync"""
+        self.apply(*self.changes())
+
+
+_index = None
+# Guards the index while it is read or changed in memory, never during a query
+_index_lock = threading.Lock()
+# Held by the one thread reading changes from the database
+_sync_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """
+    Return this process' search index, synced with the database
+
+    Only one thread syncs at a time; searches arriving meanwhile use the
+    index as it is rather than queue behind its query. A replacement index
+    (the first, or one past `MAX_INDEX_AGE`) is built before it is swapped in.
+    """
+    global _index
+    index = _index
+    # Without an index there is nothing to serve meanwhile: wait for the build
+    if not _sync_lock.acquire(blocking=index is None):
+        return index
+    try:
+        index = _index
+        if index is None or time.monotonic() - index.built_at > MAX_INDEX_AGE:
+            index = SearchIndex()
+            index.sync()
+            with _index_lock:
+                _index = index
+        else:
+            rows, started = index.changes()
+            with _index_lock:
+                index.apply(rows, started)
+    finally:
+        _sync_lock.release()
+    return index
+
+
+def search_products(query: str, limit: Optional[int] = None) -> Tuple[List[str], int]:
+    """
+    Rank the products matching `query`
+
+    Args:
+        query: Search text
+        limit: Product ids returned (default: `MAX_RESULTS`)
+
+    Returns:
+        Tuple of (the best `limit` product ids, most relevant first; the
+        number of products matching)
+    """
+    index = get_search_index()
+    with _index_lock:
+        return index.rank(query, limit=MAX_RESULTS if limit is None else limit)
+
+
+def search_product_ids(query: str, limit: Optional[int] = None) -> List[str]:
+    """Product ids matching `query` (all of them unless `limit` is given), most relevant first"""
+    index = get_search_index()
+    with _index_lock:
+        return index.search(query, limit=limit)
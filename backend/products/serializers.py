@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from .models import Product, ProductVariant, Category, Brand
-from django.db.models import Sum, F
-from inventory.models import Stock
+from .promotions import PriceBook, get_price_ranges
+from django.db import models
 from django.conf import settings
 
 
@@ -21,6 +21,34 @@ def _make_absolute_url(request, value: str):
     return request.build_absolute_uri(media_url + value)
 
 
+def get_price_book(serializer):
+    """
+    Return the PriceBook shared by every serializer in the same tree
+
+    A view that already priced variants passes its book as the
+    `price_book` context entry.
+    """
+    root = serializer.root
+    book = getattr(root, '_price_book', None)
+    if book is None:
+        book = root.context.get('price_book') or PriceBook()
+        root._price_book = book
+    return book
+
+
+def _as_list(data):
+    return list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+
+
+class PricedVariantListSerializer(serializers.ListSerializer):
+    """Prices all variants of the list in one batch before serializing them."""
+
+    def to_representation(self, data):
+        variants = _as_list(data)
+        get_price_book(self).prime(variants)
+        return [self.child.to_representation(item) for item in variants]
+
+
 class CategorySerializer(serializers.ModelSerializer):
     product_count = serializers.SerializerMethodField()
     
@@ -31,6 +59,9 @@ class CategorySerializer(serializers.ModelSerializer):
     
     def get_product_count(self, obj):
         """Return the count of products in this category"""
+        count = getattr(obj, 'active_product_count', None)
+        if count is not None:
+            return count
         return obj.products.filter(is_active=True).count()
 
 
@@ -53,27 +84,30 @@ class ProductVariantSerializer(serializers.ModelSerializer):
             'stock', 'total_stock', 'images', 'is_active', 'created_at', 'updated_at', 'effective_price'
         ]
         read_only_fields = ['created_at', 'updated_at']
+        list_serializer_class = PricedVariantListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # `stock` of a variant with warehouse Stock rows is derived from them
+        # (inventory.rollup); those change through stock adjustments instead
+        if (
+            hasattr(self, 'initial_data') and isinstance(self.instance, ProductVariant)
+            and self.instance.warehouse_stocks.exists()
+        ):
+            fields['stock'].read_only = True
+        return fields
 
     def get_effective_price(self, obj):
         try:
-            # ProductVariant.get_effective_price may return a Decimal
-            val = obj.get_effective_price()
+            # Resolved from the batch primed by the list serializer when available
+            val = get_price_book(self).price(obj)
             return float(val) if val is not None else None
         except Exception:
             return float(obj.price)
 
     def get_total_stock(self, obj):
-        try:
-            qs = Stock.objects.filter(variant=obj)
-            agg = qs.aggregate(total_qty=Sum('quantity'), total_reserved=Sum('reserved_quantity'))
-            total = (agg.get('total_qty') or 0) - (agg.get('total_reserved') or 0)
-            return max(0, int(total))
-        except Exception:
-            # Fallback to variant.stock field if inventory table is unavailable
-            try:
-                return int(obj.stock or 0)
-            except Exception:
-                return 0
+        # Precomputed from warehouse Stock rows by inventory.rollup
+        return max(0, int(obj.available_stock or 0))
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -185,6 +219,15 @@ class ProductSerializer(serializers.ModelSerializer):
         return product
 
 
+class ProductListPricingSerializer(serializers.ListSerializer):
+    """Resolves min/max prices for the whole page before serializing it."""
+
+    def to_representation(self, data):
+        products = _as_list(data)
+        self.child._price_ranges = get_price_ranges(products, get_price_book(self))
+        return [self.child.to_representation(item) for item in products]
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for product lists"""
     brand_name = serializers.CharField(source='brand.name', read_only=True)
@@ -202,58 +245,31 @@ class ProductListSerializer(serializers.ModelSerializer):
             'image', 'variant_count', 'min_price', 'max_price', 'is_active',
             'total_stock', 'in_stock',
         ]
+        list_serializer_class = ProductListPricingSerializer
     
     def get_variant_count(self, obj):
-        return obj.variants.filter(is_active=True).count()
+        # Counted from the `variants` prefetch rather than one COUNT per row
+        return sum(1 for v in obj.variants.all() if v.is_active)
+
+    def _get_price_range(self, obj):
+        ranges = getattr(self, '_price_ranges', None) or {}
+        if obj.pk not in ranges:
+            # Serialized on its own (e.g. a nested favorite); price just this one
+            ranges.update(get_price_ranges([obj], get_price_book(self)))
+            self._price_ranges = ranges
+        return ranges[obj.pk]
     
     def get_min_price(self, obj):
-        variants = obj.variants.filter(is_active=True)
-        if variants.exists():
-            # Use effective price (promotions) when available
-            prices = []
-            for v in variants:
-                try:
-                    prices.append(float(v.get_effective_price() or v.price))
-                except Exception:
-                    prices.append(float(v.price))
-            return min(prices)
-        return float(obj.base_price)
+        # Use effective price (promotions) when available
+        return float(self._get_price_range(obj)[0])
     
     def get_max_price(self, obj):
-        variants = obj.variants.filter(is_active=True)
-        if variants.exists():
-            prices = []
-            for v in variants:
-                try:
-                    prices.append(float(v.get_effective_price() or v.price))
-                except Exception:
-                    prices.append(float(v.price))
-            return max(prices)
-        return float(obj.base_price)
+        return float(self._get_price_range(obj)[1])
 
     def get_total_stock(self, obj):
-        # Sum available stock across warehouses for all active variants.
-        try:
-            # Get all variant ids for this product
-            variant_ids = list(obj.variants.filter(is_active=True).values_list('id', flat=True))
-            if not variant_ids:
-                return 0
-            qs = Stock.objects.filter(variant_id__in=variant_ids)
-            agg = qs.aggregate(total_qty=Sum('quantity'), total_reserved=Sum('reserved_quantity'))
-            total = (agg.get('total_qty') or 0) - (agg.get('total_reserved') or 0)
-            return max(0, int(total))
-        except Exception:
-            # Fallback: sum variant.stock fields
-            variants = obj.variants.filter(is_active=True)
-            if not variants.exists():
-                return 0
-            total = 0
-            for v in variants:
-                try:
-                    total += int(v.stock or 0)
-                except Exception:
-                    continue
-            return total
+        # Available stock across active warehouses for all active variants,
+        # precomputed by inventory.rollup
+        return max(0, int(obj.available_stock or 0))
 
     def get_in_stock(self, obj):
         return self.get_total_stock(obj) > 0
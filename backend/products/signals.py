@@ -0,0 +1,45 @@
+"""
+Signal handlers invalidating the compiled pricing rule index and keeping
+catalog search documents up to date
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import Brand, Category, PricingRule, Product, ProductVariant
+from products.pricing import bump_rules_version
+from products.search import reindex_products
+
+
+@receiver(post_save, sender=PricingRule)
+@receiver(post_delete, sender=PricingRule)
+def pricing_rule_changed(sender, **kwargs):
+    # Bump after commit so other processes never rebuild from uncommitted rows
+    transaction.on_commit(bump_rules_version)
+
+
+@receiver(m2m_changed, sender=PricingRule.products.through)
+@receiver(m2m_changed, sender=PricingRule.categories.through)
+def pricing_rule_targets_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(bump_rules_version)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_products([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        reindex_products([instance.product_id])
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def product_owner_renamed(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        reindex_products(instance.products.values_list('pk', flat=True))
@@ -1,3 +1,255 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import search
+from .facets import get_facet_counts
+from .models import Brand, Category, PricingRule, Product, ProductVariant, Promotion
+from .pricing import get_effective_price, get_effective_prices
+from .promotions import PriceBook, get_price_ranges, get_promotion_prices
+from .serializers import ProductListSerializer, ProductSerializer
+
+PAGE_SIZE = settings.REST_FRAMEWORK['PAGE_SIZE']
+
+
+def make_catalog(count, variants_per_product=3):
+    category = Category.objects.create(name='Phones')
+    brand = Brand.objects.create(name='Acme')
+    for i in range(count):
+        product = Product.objects.create(
+            id=f'phone-{i}', name=f'Phone {i}', brand=brand, category=category,
+            base_price=Decimal('500.00'), image='http://example.com/p.png', description='',
+        )
+        for j in range(variants_per_product):
+            ProductVariant.objects.create(
+                id=f'phone-{i}-{j}', product=product, storage=f'{64 * (j + 1)}GB',
+                color='Black', price=Decimal('500.00') + 100 * j, stock=5,
+            )
+    return category, brand
+
+
+def make_promotion(name, percentage, **targets):
+    now = timezone.now()
+    promotion = Promotion.objects.create(
+        name=name, discount_type=Promotion.DiscountType.PERCENTAGE,
+        discount_percentage=Decimal(percentage),
+        start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+    )
+    for field, objs in targets.items():
+        getattr(promotion, field).set(objs)
+    return promotion
+
+
+class BatchPricingTests(TestCase):
+    def setUp(self):
+        self.category, self.brand = make_catalog(PAGE_SIZE)
+        make_promotion('Brand sale', 10, brands=[self.brand])
+        make_promotion('Variant sale', 50, variants=['phone-0-0'])
+
+    def test_most_specific_promotion_wins(self):
+        variants = ProductVariant.objects.filter(product_id='phone-0')
+        prices = get_promotion_prices(variants)
+        self.assertEqual(prices['phone-0-0'], Decimal('250.00'))
+        self.assertEqual(prices['phone-0-1'], Decimal('540.00'))
+        self.assertEqual(prices['phone-0-0'], ProductVariant.objects.get(pk='phone-0-0').get_effective_price())
+
+    def test_price_ranges_use_constant_queries_for_a_page(self):
+        # products + variants prefetch + promotions + 4 promotion target tables
+        with self.assertNumQueries(7):
+            ranges = get_price_ranges(Product.objects.all()[:PAGE_SIZE])
+        self.assertEqual(len(ranges), PAGE_SIZE)
+        self.assertEqual(ranges['phone-0'], (Decimal('250.00'), Decimal('630.00')))
+
+    def test_list_serializer_reports_promotion_prices(self):
+        products = Product.objects.prefetch_related('variants').order_by('id')[:2]
+        rows = {row['id']: row for row in ProductListSerializer(products, many=True).data}
+        self.assertEqual(rows['phone-0']['min_price'], 250.0)
+        self.assertEqual(rows['phone-0']['max_price'], 630.0)
+        self.assertEqual(rows['phone-1']['min_price'], 450.0)
+        self.assertEqual(rows['phone-0']['variant_count'], 3)
+
+
+class ProductListQueryCountTests(TestCase):
+    def setUp(self):
+        make_catalog(PAGE_SIZE * 2)
+        make_promotion('Sitewide', 5, categories=Category.objects.all())
+
+    def test_list_endpoint_query_count_is_pinned_to_page_size(self):
+        # count + products + variants/brand/category prefetches + promotions (1 + 4 targets)
+        for page in (1, 2):
+            with self.assertNumQueries(10):
+                response = self.client.get('/api/products/products/', {'page': page})
+            self.assertEqual(len(response.data['results']), PAGE_SIZE)
+
+    def test_pricing_queries_stay_flat_as_the_catalog_grows(self):
+        def queries(serializer_class, count):
+            products = Product.objects.prefetch_related('variants', 'brand', 'category').order_by('id')[:count]
+            with CaptureQueriesContext(connection) as captured:
+                rows = serializer_class(products, many=True).data
+            self.assertEqual(len(rows), count)
+            return len(captured)
+
+        for serializer_class in (ProductListSerializer, ProductSerializer):
+            self.assertEqual(queries(serializer_class, 2), queries(serializer_class, PAGE_SIZE * 2))
+
+        category, brand = Category.objects.get(), Brand.objects.get()
+        for i in range(PAGE_SIZE * 2, PAGE_SIZE * 4):
+            product = Product.objects.create(
+                id=f'phone-{i}', name=f'Phone {i}', brand=brand, category=category,
+                base_price=Decimal('500.00'), image='http://example.com/p.png', description='',
+            )
+            ProductVariant.objects.create(
+                id=f'phone-{i}-0', product=product, storage='64GB', color='Black', price=Decimal('500.00'),
+            )
+        with self.assertNumQueries(10):
+            self.client.get('/api/products/products/', {'page': 3})
+
+        # One book prices any number of variants with a single load of the promotions
+        book = PriceBook()
+        variants = list(ProductVariant.objects.select_related('product'))
+        with self.assertNumQueries(5):
+            prices = [variant.get_effective_price(book) for variant in variants]
+        self.assertEqual(prices[0], variants[0].price * Decimal('0.95'))
+
+    def test_cursor_mode_walks_the_catalog_without_offset_or_count(self):
+        # Ties on created_at are broken by pk
+        Product.objects.filter(pk__in=['phone-3', 'phone-4', 'phone-5']).update(
+            created_at=Product.objects.get(pk='phone-3').created_at
+        )
+        expected = list(Product.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        seen, url, params = [], '/api/products/products/', {'cursor': ''}
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertNotIn('count', response.data)
+            self.assertFalse([q for q in queries if 'OFFSET' in q['sql'] or 'COUNT(' in q['sql']])
+            seen.extend(row['id'] for row in response.data['results'])
+            url, params = response.data['next'], {}
+            last = response
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual([row['id'] for row in previous.data['results']], expected[:PAGE_SIZE])
+        self.assertEqual(self.client.get('/api/products/products/', {'cursor': 'garbage'}).status_code, 404)
+
+
+class PricingRuleIndexTests(TestCase):
+    def setUp(self):
+        self.category, _ = make_catalog(2, variants_per_product=1)
+        self.phone = Product.objects.get(pk='phone-0')
+        self.other = Product.objects.get(pk='phone-1')
+
+    def make_rule(self, name, priority=0, products=(), categories=(), **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = PricingRule.objects.create(
+                name=name, rule_type=fields.pop('rule_type', PricingRule.RuleType.PERCENTAGE_DISCOUNT),
+                parameters=fields.pop('parameters', {'discount_pct': 10}), priority=priority, **fields,
+            )
+            rule.products.set(products)
+            rule.categories.set(categories)
+        return rule
+
+    def test_highest_priority_applicable_rule_wins(self):
+        self.make_rule('Global', priority=1)
+        self.make_rule('Phones', priority=5, products=[self.phone], parameters={'discount_pct': 20})
+        self.make_rule(
+            'Expired', priority=9, categories=[self.category], parameters={'discount_pct': 90},
+            end_date=timezone.now() - timedelta(days=1),
+        )
+        self.assertEqual(get_effective_price(self.phone), Decimal('400.00'))
+        self.assertEqual(get_effective_price(self.other), Decimal('450.00'))
+
+    def test_lookups_are_in_memory_until_rules_change(self):
+        self.make_rule('Bulk', rule_type=PricingRule.RuleType.BULK_PRICING,
+                       parameters={'tiers': [{'min_qty': 10, 'discount_pct': 30}]})
+        variant = self.phone.variants.get()
+        get_effective_price(self.phone)  # compile
+
+        with self.assertNumQueries(0):
+            prices = get_effective_prices([(self.phone, variant, 1), (self.phone, variant, 10)])
+        self.assertEqual(prices, [Decimal('500.00'), Decimal('350.00')])
+
+        self.make_rule('Override', priority=10, parameters={'discount_pct': 50})
+        self.assertEqual(get_effective_price(self.phone, variant), Decimal('250.00'))
+
+
+class CatalogSearchTests(TestCase):
+    def setUp(self):
+        search._index = None
+        self.category, self.brand = make_catalog(3, variants_per_product=1)
+        Product.objects.filter(pk='phone-0').update(specs={'Display': 'OLED'})
+        Product.objects.filter(pk='phone-1').update(name='Galaxy OLED Edition')
+        search.rebuild_search_documents()
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/products/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_results_are_ranked_by_relevance(self):
+        # A name match outranks a spec match unless an ordering is requested
+        self.assertEqual(self.search('oled'), ['phone-1', 'phone-0'])
+        self.assertEqual(self.search('oled', ordering='-name'), ['phone-0', 'phone-1'])
+        self.assertEqual(self.search('gal acme'), ['phone-1'])
+        self.assertEqual(self.search('256gb'), [])
+
+    def test_broad_matches_list_the_best_and_count_them_all(self):
+        Product.objects.filter(pk='phone-2').update(name='OLED Max OLED')
+        search.rebuild_search_documents()
+        self.assertEqual(search.search_products('oled', limit=1), (['phone-2'], 3))
+        self.assertEqual(search.search_product_ids('oled'), ['phone-2', 'phone-1', 'phone-0'])
+        # Only the best matches reach SQL; the response still says how many there are
+        with mock.patch.object(search, 'MAX_RESULTS', 2):
+            response = self.client.get('/api/products/products/', {'search': 'oled'})
+        self.assertEqual((response.json()['count'], response.json()['search_matches']), (2, 3))
+        self.assertEqual([row['id'] for row in response.json()['results']], ['phone-2', 'phone-1'])
+
+    def test_index_follows_saves(self):
+        self.assertEqual(self.search('nokia'), [])
+        self.brand.name = 'Nokia'
+        self.brand.save()
+        self.assertEqual(sorted(self.search('nokia')), ['phone-0', 'phone-1', 'phone-2'])
+
+        product = Product.objects.get(pk='phone-2')
+        product.is_active = False
+        product.save()
+        self.assertEqual(sorted(search.search_product_ids('nokia')), ['phone-0', 'phone-1'])
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        search._index = None
+        make_catalog(4, variants_per_product=2)
+        Product.objects.filter(pk='phone-3').update(base_price=Decimal('1200.00'))
+        ProductVariant.objects.filter(pk='phone-0-1').update(color='Blue')
+
+    def test_facets_follow_the_current_filters(self):
+        response = self.client.get('/api/products/products/', {'facets': 'true', 'storage': '128gb'})
+        facets = response.json()['facets']
+        self.assertEqual(response.json()['count'], 4)
+        self.assertEqual(facets['brand'], [{'value': facets['brand'][0]['value'], 'label': 'Acme', 'count': 4}])
+        self.assertEqual(
+            [(row['min_price'], row['count']) for row in facets['price']],
+            [(500.0, 3), (1000.0, 1)],
+        )
+        self.assertEqual(facets['color'], [
+            {'value': 'Black', 'label': 'Black', 'count': 4},
+            {'value': 'Blue', 'label': 'Blue', 'count': 1},
+        ])
+
+        response = self.client.get('/api/products/products/facets/', {'color': 'blue'})
+        self.assertEqual(response.json()['storage'], [
+            {'value': '128GB', 'label': '128GB', 'count': 1},
+            {'value': '64GB', 'label': '64GB', 'count': 1},
+        ])
 
-# Create your tests here.
+    def test_facets_cost_two_queries(self):
+        with self.assertNumQueries(2):
+            facets = get_facet_counts(Product.objects.filter(is_active=True))
+        self.assertEqual(sum(row['count'] for row in facets['category']), 4)
@@ -2,13 +2,16 @@ from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db.models import Count, Q
 from rest_framework.parsers import MultiPartParser, FormParser
 from .models import Product, ProductVariant, Category, Brand
 from .serializers import (
     ProductSerializer, ProductListSerializer, ProductVariantSerializer,
     CategorySerializer, BrandSerializer
 )
-from .filters import ProductFilter
+from core.pagination import KeysetPagination
+from .facets import get_facet_counts
+from .filters import ProductFilter, RelevanceOrderingFilter
 import os
 import uuid
 
@@ -17,7 +20,9 @@ class CategoryViewSet(viewsets.ModelViewSet):
     """
     ViewSet for Category CRUD operations
     """
-    queryset = Category.objects.all()
+    queryset = Category.objects.annotate(
+        active_product_count=Count('products', filter=Q(products__is_active=True))
+    )
     serializer_class = CategorySerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
@@ -40,9 +45,9 @@ class ProductViewSet(viewsets.ModelViewSet):
     ViewSet for Product CRUD operations with filtering and search
     """
     queryset = Product.objects.filter(is_active=True).prefetch_related('variants', 'brand', 'category')
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, RelevanceOrderingFilter]
     filterset_class = ProductFilter
-    search_fields = ['name', 'description', 'brand__name', 'category__name']
     ordering_fields = ['name', 'base_price', 'created_at', 'average_rating']
     ordering = ['-created_at']
     
@@ -51,6 +56,31 @@ class ProductViewSet(viewsets.ModelViewSet):
             return ProductListSerializer
         return ProductSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        List products; `?facets=true` adds facet counts for the current
+        filters to the response. A `?search=` response also carries
+        `search_matches`, the number of products matching the terms, of
+        which the best `products.search.MAX_RESULTS` are listed.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        else:
+            response = Response(self.get_serializer(queryset, many=True).data)
+
+        if hasattr(request, 'search_matches'):
+            response.data['search_matches'] = request.search_matches
+        if request.query_params.get('facets', '').lower() in ('1', 'true', 'yes'):
+            response.data['facets'] = get_facet_counts(queryset)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Facet counts (brand, category, price, storage, color) for the current filters"""
+        return Response(get_facet_counts(self.filter_queryset(self.get_queryset())))
+
     def create(self, request, *args, **kwargs):
         """
         Wrap default create to log validation errors with payload context
@@ -205,23 +235,24 @@ class ProductVariantViewSet(viewsets.ModelViewSet):
             pass
 
     def perform_update(self, serializer):
-        """When a variant's stock is updated via the product/variant API,
-        propagate the change to the default warehouse Stock row so both
-        product management and stock management remain consistent.
+        """Give a variant still sold from its flat `stock` a Stock row in the
+        default warehouse, so stock management sees it. Variants that already
+        have Stock rows are not synced here: their `stock` is derived from the
+        rows (and read-only in the serializer); change them through the
+        inventory stock `adjust` endpoint, which records ADJUSTMENT movements.
         """
         instance = serializer.save()
         try:
             from inventory.models import Warehouse, Stock
+            if instance.warehouse_stocks.exists():
+                return
             warehouse = Warehouse.objects.filter(name__icontains='main', is_active=True).first() or Warehouse.objects.filter(is_active=True).first()
             if warehouse:
-                stock_obj, created = Stock.objects.get_or_create(
+                Stock.objects.get_or_create(
                     warehouse=warehouse,
                     variant=instance,
                     defaults={'quantity': int(instance.stock or 0)}
                 )
-                if not created:
-                    stock_obj.quantity = int(instance.stock or 0)
-                    stock_obj.save()
         except Exception:
             pass
     
@@ -30,7 +30,7 @@ class ProductTrendAdmin(admin.ModelAdmin):
 
 @admin.register(ProductRelation)
 class ProductRelationAdmin(admin.ModelAdmin):
-    list_display = ['product_a', 'product_b', 'times_bought_together', 'confidence_score']
+    list_display = ['product_a', 'product_b', 'times_bought_together', 'confidence_score', 'lift']
     list_filter = ['last_updated']
     search_fields = ['product_a__name', 'product_b__name']
     readonly_fields = ['last_updated', 'created_at']
@@ -8,7 +8,7 @@ from collections import defaultdict
 from typing import List, Dict, Tuple
 from products.models import Product, ProductVariant
 from orders.models import Order, OrderItem
-from reports.models import ProductTrend, ProductPerformance
+from reports.models import ProductTrend, ProductPerformance, ProductRelation
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,44 +16,33 @@ logger = logging.getLogger(__name__)
 
 def analyze_product_relations(product: Product, min_occurrences: int = 5) -> List[Dict]:
     """
-    Analyze "frequently bought together" relationships for a product
+    "Frequently bought together" relationships for a product
+    
+    Reads the relations precomputed by `reports.relations`, kept current by
+    the `refresh_product_relations` job.
     
     Args:
         product: Product to analyze
         min_occurrences: Minimum times products must be bought together
     
     Returns:
-        List of related products with co-purchase count
+        List of related products with co-purchase count, confidence (in
+        percent) and lift
     """
-    # Find all orders containing this product
-    orders_with_product = OrderItem.objects.filter(
-        variant__product=product
-    ).values_list('order_id', flat=True).distinct()
-    
-    # Find other products in those orders
-    related_products = OrderItem.objects.filter(
-        order_id__in=orders_with_product
-    ).exclude(
-        variant__product=product
-    ).values(
-        'variant__product__id',
-        'variant__product__name'
-    ).annotate(
-        co_purchase_count=Count('order_id', distinct=True)
-    ).filter(
-        co_purchase_count__gte=min_occurrences
-    ).order_by('-co_purchase_count')[:10]
-    
-    relations = list(related_products)
-    
-    # Calculate confidence (what % of orders with product A also have product B)
-    total_orders_with_product = len(set(orders_with_product))
-    
-    for relation in relations:
-        relation['confidence'] = round(
-            (relation['co_purchase_count'] / total_orders_with_product * 100), 2
-        ) if total_orders_with_product > 0 else 0
-    
+    relations = [
+        {
+            'variant__product__id': product_id,
+            'variant__product__name': name,
+            'co_purchase_count': together,
+            'confidence': round(float(confidence) * 100, 2),
+            'lift': float(lift),
+        }
+        for product_id, name, together, confidence, lift in ProductRelation.objects.filter(
+            product_a=product, times_bought_together__gte=min_occurrences,
+        ).order_by('-times_bought_together', '-lift').values_list(
+            'product_b_id', 'product_b__name', 'times_bought_together', 'confidence_score', 'lift',
+        )[:10]
+    ]
     logger.info(f"Analyzed relations for {product.name}: found {len(relations)} frequently bought together products")
     return relations
 
@@ -76,13 +65,8 @@ def generate_product_recommendations(product: Product, limit: int = 5) -> List[P
     recommended_ids = [r['variant__product__id'] for r in relations[:limit]]
     
     # Fetch product instances (preserve order)
-    recommended_products = []
-    for product_id in recommended_ids:
-        try:
-            p = Product.objects.get(pk=product_id, is_active=True)
-            recommended_products.append(p)
-        except Product.DoesNotExist:
-            continue
+    active = Product.objects.filter(is_active=True).in_bulk(recommended_ids)
+    recommended_products = [active[product_id] for product_id in recommended_ids if product_id in active]
     
     # If we don't have enough, fill with products from same category
     if len(recommended_products) < limit:
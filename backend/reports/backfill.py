@@ -0,0 +1,211 @@
+"""
+Historical report backfill
+
+Regenerates the sales cube, the DAILY product rows and the daily
+`SalesReport` rows of a date range, then the weekly, monthly and yearly
+reports rolled up from the cube.
+
+The range is split into calendar-month chunks. Chunks are aggregated on a
+process pool, each worker reading with its own database connection, and
+the parent writes each result as it arrives: the chunk's cube rows are
+replaced, its daily reports upserted (one bulk update and one bulk insert)
+and its `ReportBackfillChunk` checkpoint completed, in one transaction.
+Workers only read, so the one-writer limit of SQLite and row locks on
+other backends never make them wait on each other. Completed chunks are
+skipped when the backfill runs again, so an interrupted backfill resumes
+where it stopped. The weekly, monthly and yearly reports have no
+checkpoint: they are regenerated on every run, rolled up from the cube, so
+a run stopped between the last month and them completes them.
+"""
+import logging
+import time
+from calendar import monthrange
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.db import connections, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order
+from reports.cube import BATCH_SIZE, REPORTED_STATUSES, aggregate_day, date_range, day_bounds, write_days
+from reports.models import ReportBackfillChunk, SalesReport
+
+logger = logging.getLogger(__name__)
+
+DAILY_REPORT_FIELDS = [
+    'total_orders', 'total_items_sold', 'total_revenue', 'average_order_value', 'new_customers',
+    'returning_customers',
+]
+
+
+def plan_chunks(start: date, end: date) -> List[Tuple[date, date]]:
+    """Calendar months of [start, end], the first and last clipped to the range"""
+    chunks = []
+    while start <= end:
+        month_end = start.replace(day=monthrange(start.year, start.month)[1])
+        chunks.append((start, min(month_end, end)))
+        start = month_end + timedelta(days=1)
+    return chunks
+
+
+def daily_customers(start: date, end: date) -> Dict[date, Tuple[int, int]]:
+    """Mapping of day to (customers, returning customers) of [start, end], in one grouped query"""
+    orders = Order.objects.filter(
+        created_at__gte=day_bounds(start)[0], created_at__lt=day_bounds(end)[1], status__in=REPORTED_STATUSES,
+    ).annotate(day=TruncDate('created_at'))
+    return {
+        day: (customers, returning)
+        for day, customers, returning in orders.annotate(
+            ordered_before=Exists(Order.objects.filter(user=OuterRef('user'), created_at__date__lt=OuterRef('day'))),
+        ).values('day').annotate(
+            customers=Count('user', distinct=True),
+            returning=Count('user', distinct=True, filter=Q(ordered_before=True)),
+        ).order_by().values_list('day', 'customers', 'returning')
+    }
+
+
+def compute_chunk(start: date, end: date) -> Dict:
+    """
+    Aggregate a chunk of days, read-only (runs in the pool workers)
+
+    Returns:
+        Dict with the chunk bounds, the `(cells, products)` of each day, the
+        daily report figures, the `orders` read and `duration_ms`
+    """
+    started = time.perf_counter()
+    days, reports, orders = {}, {}, 0
+    customers = daily_customers(start, end)
+    for day in date_range(start, end):
+        cells, products, count = aggregate_day(day)
+        days[day] = (cells, products)
+        orders += count
+        revenue = sum((cell['revenue'] for cell in cells.values()), Decimal('0'))
+        everyone, returning = customers.get(day, (0, 0))
+        reports[day] = {
+            'total_orders': count,
+            'total_items_sold': sum(cell['items'] for cell in cells.values()),
+            'total_revenue': revenue,
+            'average_order_value': revenue / count if count else Decimal('0'),
+            'new_customers': everyone - returning,
+            'returning_customers': returning,
+        }
+    return {
+        'start': start, 'end': end, 'days': days, 'reports': reports, 'orders': orders,
+        'duration_ms': int((time.perf_counter() - started) * 1000),
+    }
+
+
+def upsert_daily_reports(reports: Dict[date, Dict], batch_size: int = BATCH_SIZE) -> int:
+    """Write unfiltered DAILY `SalesReport` rows: bulk update the existing ones, bulk insert the rest"""
+    # The unique key holds NULLs, so the database cannot detect the conflicts itself
+    existing = dict(SalesReport.objects.filter(
+        report_type=SalesReport.ReportType.DAILY, report_date__in=list(reports),
+        warehouse__isnull=True, category__isnull=True, brand__isnull=True,
+    ).values_list('report_date', 'pk'))
+    rows = [
+        SalesReport(pk=existing.get(day), report_type=SalesReport.ReportType.DAILY, report_date=day, **figures)
+        for day, figures in reports.items()
+    ]
+    SalesReport.objects.bulk_update([row for row in rows if row.pk], DAILY_REPORT_FIELDS, batch_size=batch_size)
+    SalesReport.objects.bulk_create([row for row in rows if not row.pk], batch_size=batch_size)
+    return len(rows)
+
+
+def write_chunk(result: Dict, batch_size: int = BATCH_SIZE) -> Dict:
+    """Write a computed chunk and complete its checkpoint, in one transaction"""
+    with transaction.atomic():
+        write_days(result['start'], result['end'], result['days'], batch_size)
+        reports = upsert_daily_reports(result['reports'], batch_size)
+        facts = sum(len(cells) for cells, _ in result['days'].values())
+        ReportBackfillChunk.objects.filter(start_date=result['start'], end_date=result['end']).update(
+            completed_at=timezone.now(), orders=result['orders'], facts_written=facts, reports_written=reports,
+            duration_ms=result['duration_ms'],
+        )
+    return {'days': len(result['days']), 'orders': result['orders'], 'facts': facts, 'reports': reports}
+
+
+def write_period_reports(start: date, end: date) -> int:
+    """Regenerate the weekly (from Mondays), monthly and yearly reports overlapping [start, end]"""
+    from reports.reporting import generate_monthly_report, generate_weekly_report, generate_yearly_report
+
+    written = 0
+    monday = start - timedelta(days=start.weekday())
+    while monday <= end:
+        generate_weekly_report(monday)
+        monday += timedelta(days=7)
+        written += 1
+    for month_start, _ in plan_chunks(start.replace(day=1), end):
+        generate_monthly_report(month_start.year, month_start.month)
+        written += 1
+    for year in range(start.year, end.year + 1):
+        generate_yearly_report(year)
+        written += 1
+    return written
+
+
+def _init_worker():
+    # Spawned workers start from scratch; forked ones already have the apps loaded
+    import django
+    django.setup()
+
+
+def backfill_reports(start: date, end: date, workers: int = 1, restart: bool = False, periods: bool = True,
+                     on_chunk: Optional[Callable[[Dict], None]] = None, batch_size: int = BATCH_SIZE) -> Dict:
+    """
+    Regenerate the reports of [start, end]
+
+    Args:
+        start: First day
+        end: Last day
+        workers: Processes aggregating chunks; 1 aggregates in this process
+        restart: Redo chunks already completed
+        periods: Also regenerate the weekly, monthly and yearly reports
+        on_chunk: Called with the stats of every chunk written
+
+    Returns:
+        Dict with the `chunks` written and `skipped`, the `days`,
+        `orders`, `facts` and `reports` written and the elapsed `seconds`
+    """
+    started = time.perf_counter()
+    chunks = plan_chunks(start, end)
+    ReportBackfillChunk.objects.bulk_create(
+        [ReportBackfillChunk(start_date=chunk_start, end_date=chunk_end) for chunk_start, chunk_end in chunks],
+        ignore_conflicts=True,
+    )
+    checkpoints = ReportBackfillChunk.objects.filter(start_date__gte=start, end_date__lte=end)
+    if restart:
+        checkpoints.update(completed_at=None)
+    done = set(checkpoints.filter(completed_at__isnull=False).values_list('start_date', 'end_date'))
+    pending = [chunk for chunk in chunks if chunk not in done]
+
+    stats = {'chunks': 0, 'skipped': len(chunks) - len(pending), 'days': 0, 'orders': 0, 'facts': 0, 'reports': 0}
+
+    def written(result):
+        chunk_stats = write_chunk(result, batch_size)
+        stats['chunks'] += 1
+        for name, value in chunk_stats.items():
+            stats[name] += value
+        logger.info(f"Backfilled {result['start']} to {result['end']}: {chunk_stats}")
+        if on_chunk:
+            on_chunk({'start': result['start'], 'end': result['end'], 'duration_ms': result['duration_ms'],
+                      **chunk_stats})
+
+    if workers > 1 and len(pending) > 1:
+        # Workers must not inherit this process's connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(compute_chunk, chunk_start, chunk_end) for chunk_start, chunk_end in pending]
+            for future in as_completed(futures):
+                written(future.result())
+    else:
+        for chunk_start, chunk_end in pending:
+            written(compute_chunk(chunk_start, chunk_end))
+
+    if periods:
+        stats['reports'] += write_period_reports(start, end)
+    stats['seconds'] = time.perf_counter() - started
+    return stats
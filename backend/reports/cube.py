@@ -0,0 +1,277 @@
+"""
+Daily sales fact cube
+
+`DailySalesFact` holds, per day, warehouse, category, brand and payment
+method, the orders, units, revenue, tax, shipping and discount of the
+reported orders created that day; `ProductPerformance` DAILY rows hold the
+units and revenue per product and warehouse. Weekly, monthly and yearly
+reports read a range of these rows (one indexed read each) and roll them
+up in memory instead of rescanning orders per bucket.
+
+A day is rebuilt as a whole by `refresh_sales_facts`: its orders, lines and
+reservations are read once, aggregated in memory and the day's rows are
+replaced in one transaction, so refreshing is idempotent and only the days
+given are touched. Orders have no warehouse: a line belongs to the
+warehouse its stock was reserved at (the one holding most units), lines
+without a reservation to none, and an order's own measures go with its
+largest line. The daily report applies the same rule in SQL
+(`line_warehouse`, `order_warehouse`), so its warehouse figures add up
+to those rolled up from the cube.
+
+Every build records its days in `SalesCubeDay`, empty days included, so a
+day missing from the cube can be told from a day without sales.
+`ensure_sales_facts` builds the days of a range never built, or built
+before they were over, before the weekly and longer reports read it; late
+changes to older orders are `reports.refresh`'s. On deploy, build the
+history once with `manage.py build_sales_cube` (or `backfill_reports`)
+rather than on the first report requests.
+"""
+import logging
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from core.db import conflict_target
+from inventory.models import StockReservation, Warehouse
+from orders.models import Order, OrderItem
+from reports.models import DailySalesFact, ProductPerformance, SalesCubeDay, SalesReport
+
+logger = logging.getLogger(__name__)
+
+# Order statuses counted as sales
+REPORTED_STATUSES = ['PROCESSING', 'SHIPPED', 'DELIVERED']
+
+ORDER_MEASURES = ('orders', 'revenue', 'tax', 'shipping', 'discount')
+LINE_MEASURES = ('items', 'item_revenue')
+MEASURES = ORDER_MEASURES + LINE_MEASURES
+
+# Fact rows inserted per statement
+BATCH_SIZE = 2000
+
+
+def day_bounds(day: date):
+    """Aware [start, end) datetimes of a day in the current time zone, for index-friendly range filters"""
+    tz = timezone.get_current_timezone()
+    start = datetime.combine(day, time.min, tzinfo=tz)
+    return start, datetime.combine(day + timedelta(days=1), time.min, tzinfo=tz)
+
+
+def _empty_cell():
+    return {'orders': 0, 'items': 0, 'revenue': Decimal('0'), 'tax': Decimal('0'), 'shipping': Decimal('0'),
+            'discount': Decimal('0'), 'item_revenue': Decimal('0')}
+
+
+def line_warehouse():
+    """
+    SQL for the warehouse an OrderItem is attributed to, correlated on it
+
+    The warehouse holding most of the line's reserved units, the lowest id
+    on ties (as `aggregate_day`); NULL without a reservation.
+    """
+    return Subquery(StockReservation.objects.filter(
+        order_id=OuterRef('order_id'), stock__variant_id=OuterRef('variant_id'),
+    ).values('stock__warehouse_id').annotate(units=Sum('quantity')).order_by(
+        '-units', 'stock__warehouse_id',
+    ).values('stock__warehouse_id')[:1])
+
+
+def order_warehouse():
+    """SQL for the warehouse an Order's measures go to: that of its largest line, the first one on ties"""
+    return Subquery(OrderItem.objects.filter(order_id=OuterRef('pk')).annotate(
+        amount=F('unit_price') * F('quantity'), warehouse_id=line_warehouse(),
+    ).order_by('-amount', 'pk').values('warehouse_id')[:1])
+
+
+def aggregate_day(day: date) -> Tuple[Dict, Dict, int]:
+    """
+    Aggregate one day's reported orders into cube cells, read-only
+
+    Returns:
+        Tuple of (cells keyed (warehouse id, category id, brand id, payment
+        method), product totals keyed (product id, warehouse id) as
+        [units, revenue], orders read)
+    """
+    start, end = day_bounds(day)
+    in_day = dict(created_at__gte=start, created_at__lt=end, status__in=REPORTED_STATUSES)
+    orders = list(Order.objects.filter(**in_day).order_by().values_list(
+        'pk', 'payment_method', 'total', 'tax', 'shipping_cost', 'discount',
+    ).iterator(chunk_size=10000))
+
+    # Warehouse of each (order, variant): the one with most units reserved
+    reserved = {}
+    for order_id, variant_id, warehouse_id, units in StockReservation.objects.filter(
+        **{f'order__{lookup}': value for lookup, value in in_day.items()},
+    ).values('order_id', 'stock__variant_id', 'stock__warehouse_id').annotate(units=Sum('quantity')).order_by(
+        'order_id', 'stock__variant_id', '-units', 'stock__warehouse_id',
+    ).values_list('order_id', 'stock__variant_id', 'stock__warehouse_id', 'units').iterator(chunk_size=10000):
+        reserved.setdefault((order_id, variant_id), warehouse_id)
+
+    methods = {order_id: method for order_id, method, *_ in orders}
+    cells = defaultdict(_empty_cell)
+    products = defaultdict(lambda: [0, Decimal('0')])
+    primary = {}
+    for pk, order_id, variant_id, product_id, category_id, brand_id, quantity, unit_price in OrderItem.objects.filter(
+        **{f'order__{lookup}': value for lookup, value in in_day.items()},
+    ).order_by().values_list(
+        'pk', 'order_id', 'variant_id', 'product_id', 'product__category_id', 'product__brand_id', 'quantity',
+        'unit_price',
+    ).iterator(chunk_size=10000):
+        warehouse_id = reserved.get((order_id, variant_id))
+        key = (warehouse_id, category_id, brand_id, methods[order_id])
+        amount = unit_price * quantity
+        cell = cells[key]
+        cell['items'] += quantity
+        cell['item_revenue'] += amount
+        product = products[(product_id, warehouse_id)]
+        product[0] += quantity
+        product[1] += amount
+        # Order measures go to the largest line, the first one on ties
+        rank = (amount, -pk)
+        if order_id not in primary or rank > primary[order_id][0]:
+            primary[order_id] = (rank, key)
+
+    for order_id, method, order_total, tax, shipping, discount in orders:
+        key = primary[order_id][1] if order_id in primary else (None, None, None, method)
+        cell = cells[key]
+        cell['orders'] += 1
+        cell['revenue'] += order_total
+        cell['tax'] += tax
+        cell['shipping'] += shipping
+        cell['discount'] += discount
+    return dict(cells), dict(products), len(orders)
+
+
+def write_days(start: date, end: date, days: Dict[date, Tuple[Dict, Dict]], batch_size: int = BATCH_SIZE):
+    """Replace the fact and DAILY product rows of [start, end] with the `(cells, products)` of each day"""
+    DailySalesFact.objects.filter(date__gte=start, date__lte=end).delete()
+    ProductPerformance.objects.filter(
+        period_type=SalesReport.ReportType.DAILY, report_date__gte=start, report_date__lte=end,
+    ).delete()
+    DailySalesFact.objects.bulk_create([
+        DailySalesFact(
+            date=day, warehouse_id=warehouse_id, category_id=category_id, brand_id=brand_id,
+            payment_method=method, **cell,
+        )
+        for day, (cells, _) in days.items()
+        for (warehouse_id, category_id, brand_id, method), cell in cells.items()
+    ], batch_size=batch_size)
+    ProductPerformance.objects.bulk_create([
+        ProductPerformance(
+            product_id=product_id, warehouse_id=warehouse_id, report_date=day,
+            period_type=SalesReport.ReportType.DAILY, units_sold=units, revenue=revenue,
+        )
+        for day, (_, products) in days.items()
+        for (product_id, warehouse_id), (units, revenue) in products.items()
+    ], batch_size=batch_size)
+    built_at = timezone.now()
+    SalesCubeDay.objects.bulk_create(
+        [SalesCubeDay(date=day, built_at=built_at) for day in date_range(start, end)],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=conflict_target(['date']),
+        update_fields=['built_at'],
+    )
+
+
+def _build_day(day: date, batch_size: int = BATCH_SIZE) -> Dict:
+    """Replace the fact and DAILY product rows of one day"""
+    cells, products, orders = aggregate_day(day)
+    write_days(day, day, {day: (cells, products)}, batch_size)
+    return {'orders': orders, 'facts': len(cells), 'products': len(products)}
+
+
+def refresh_sales_facts(days: Iterable[date], batch_size: int = BATCH_SIZE) -> Dict:
+    """
+    Rebuild the cube for the given days, each in its own transaction
+
+    Returns:
+        Dict with the `days` rebuilt and the `orders` read, `facts` and
+        `products` rows written
+    """
+    stats = {'days': 0, 'orders': 0, 'facts': 0, 'products': 0}
+    for day in sorted(set(days)):
+        with transaction.atomic():
+            built = _build_day(day, batch_size)
+        stats['days'] += 1
+        for name, value in built.items():
+            stats[name] += value
+        logger.debug(f"Sales cube rebuilt for {day}: {built}")
+    return stats
+
+
+def date_range(start: date, end: date) -> List[date]:
+    """Every day in [start, end]"""
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def ensure_sales_facts(start: date, end: date, batch_size: int = BATCH_SIZE) -> Dict:
+    """
+    Build the days of [start, end], up to today, that the cube is missing:
+    those never built and those built before they were over
+
+    Returns:
+        The `refresh_sales_facts` stats of the days built
+    """
+    end = min(end, timezone.localdate())
+    if start > end:
+        return refresh_sales_facts([])
+    built = {
+        day for day, built_at in SalesCubeDay.objects.filter(
+            date__gte=start, date__lte=end,
+        ).values_list('date', 'built_at')
+        if built_at >= day_bounds(day)[1]
+    }
+    missing = [day for day in date_range(start, end) if day not in built]
+    if missing:
+        logger.info(f"Building {len(missing)} missing days of the sales cube between {start} and {end}")
+    return refresh_sales_facts(missing, batch_size)
+
+
+def sales_facts(start: date, end: date, warehouse: Optional[Warehouse] = None,
+                fields: Iterable[str] = ('date',)) -> List[Dict]:
+    """Fact rows of [start, end] with the measures and the extra `fields`, in one range read"""
+    facts = DailySalesFact.objects.filter(date__gte=start, date__lte=end)
+    if warehouse:
+        facts = facts.filter(warehouse=warehouse)
+    return list(facts.order_by().values(*fields, *MEASURES))
+
+
+def rollup(facts: Iterable[Dict], key: Callable[[Dict], object]) -> Dict[object, Dict]:
+    """Sum the measures of fact rows per `key(row)`"""
+    totals = defaultdict(_empty_cell)
+    for fact in facts:
+        cell = totals[key(fact)]
+        for measure in MEASURES:
+            cell[measure] += fact[measure]
+    return totals
+
+
+def total(cells: Iterable[Dict]) -> Dict:
+    """Sum of rolled-up cells"""
+    return rollup(cells, lambda cell: None)[None]
+
+
+def top_products(start: date, end: date, warehouse: Optional[Warehouse] = None, limit: int = 10,
+                 order_by: str = 'revenue') -> List[Dict]:
+    """Best products of [start, end] from the DAILY product rows, in the report row format"""
+    rows = ProductPerformance.objects.filter(
+        period_type=SalesReport.ReportType.DAILY, report_date__gte=start, report_date__lte=end,
+    )
+    if warehouse:
+        rows = rows.filter(warehouse=warehouse)
+    products = {}
+    for product_id, name, units, revenue in rows.order_by().values_list(
+        'product_id', 'product__name', 'units_sold', 'revenue',
+    ).iterator(chunk_size=10000):
+        product = products.setdefault(product_id, {
+            'variant__product__name': name, 'variant__product__id': product_id, 'units_sold': 0,
+            'revenue': Decimal('0'),
+        })
+        product['units_sold'] += units
+        product['revenue'] += revenue
+    return sorted(products.values(), key=lambda product: -product[order_by])[:limit]
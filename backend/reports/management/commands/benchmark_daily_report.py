@@ -0,0 +1,147 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the daily sales report, and the sales cube rebuild of that day, over a synthetic day of '
+        'orders. Rows are created inside a '
+        'transaction that is rolled back, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=50_000)
+        parser.add_argument('--customers', type=int, default=20_000)
+        parser.add_argument('--skus', type=int, default=500)
+        parser.add_argument('--returning', type=float, default=0.5,
+                            help='Share of customers with an order before the day.')
+        parser.add_argument('--compare', action='store_true',
+                            help='Also time the former per-customer first-order classification.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            day = self.populate(options)
+            self.run(day, options)
+            transaction.set_rollback(True)
+
+    def populate(self, options):
+        from orders.models import Order, OrderItem
+        from products.models import Brand, Category, Product, ProductVariant
+        from users.models import User
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        brand = Brand.objects.create(name='bench-brand')
+        category = Category.objects.create(name='bench-category')
+        product = Product.objects.create(
+            id='bench-product', name='Bench product', brand=brand, category=category,
+            base_price=Decimal('10'), image='/bench.png', description='',
+        )
+        variants = ProductVariant.objects.bulk_create([
+            ProductVariant(
+                id=f'bench-{i}', product=product, storage='64GB', color=f'bench-{i}', price=Decimal('10'),
+            )
+            for i in range(options['skus'])
+        ], batch_size=2000)
+        User.objects.bulk_create([
+            User(username=f'bench-{i}', email=f'bench-{i}@example.com', password='!')
+            for i in range(options['customers'])
+        ], batch_size=2000)
+        customers = list(User.objects.filter(username__startswith='bench-').values_list('pk', flat=True))
+
+        now = timezone.now()
+        day = (now - timedelta(days=1)).date()
+        noon = now.replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        shipping = dict(
+            shipping_name='Bench', shipping_email='bench@example.com', shipping_phone='555',
+            shipping_address_line1='1 Bench St', shipping_city='City', shipping_state='ST',
+            shipping_postal_code='00000',
+        )
+        methods = [value for value, _ in Order.PaymentMethod.choices]
+        statuses = ['PROCESSING', 'SHIPPED', 'DELIVERED', 'DELIVERED', 'CANCELLED']
+
+        def orders(prefix, users):
+            return [
+                Order(
+                    order_number=f'{prefix}-{i}', user_id=user_id, status=rng.choice(statuses),
+                    payment_method=rng.choice(methods), subtotal=Decimal('100'), tax=Decimal('8'),
+                    shipping_cost=Decimal('10'), total=Decimal('118'), **shipping,
+                )
+                for i, user_id in enumerate(users)
+            ]
+
+        Order.objects.bulk_create(
+            orders('BENCH-PAST', rng.sample(customers, int(len(customers) * options['returning']))),
+            batch_size=2000,
+        )
+        Order.objects.filter(order_number__startswith='BENCH-PAST-').update(created_at=noon - timedelta(days=30))
+        Order.objects.bulk_create(
+            orders('BENCH-DAY', rng.choices(customers, k=options['orders'])), batch_size=2000,
+        )
+        day_orders = Order.objects.filter(order_number__startswith='BENCH-DAY-')
+        day_orders.update(created_at=noon)
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order_id=order_id, product=product, variant=variant, product_name=product.name,
+                variant_storage=variant.storage, variant_color=variant.color, unit_price=Decimal('50'),
+                quantity=quantity, subtotal=Decimal('50') * quantity,
+            )
+            for order_id in day_orders.values_list('pk', flat=True).iterator()
+            for variant, quantity in [(rng.choice(variants), rng.randrange(1, 3)) for _ in range(rng.randrange(1, 4))]
+        ], batch_size=2000)
+        self.stdout.write(
+            f"Created {options['orders']} orders of {options['customers']} customers on {day} "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        return day
+
+    def run(self, day, options):
+        from orders.models import Order
+        from reports.cube import REPORTED_STATUSES, day_bounds
+        from reports.cube import ensure_sales_facts, refresh_sales_facts
+        from reports.reporting import generate_daily_report, generate_yearly_report
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            report = generate_daily_report(day)
+            elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"  daily report: {elapsed * 1000:8.1f}ms, {len(queries)} queries, {report['total_orders']} orders, "
+            f"{report['new_customers']} new and {report['returning_customers']} returning customers"
+        )
+
+        started = time.perf_counter()
+        stats = refresh_sales_facts([day])
+        self.stdout.write(
+            f"  sales cube day rebuild: {(time.perf_counter() - started) * 1000:8.1f}ms, {stats['facts']} fact rows"
+        )
+        # The rest of the two years the yearly report reads, so it is timed off a built cube
+        ensure_sales_facts(day.replace(year=day.year - 1, month=1, day=1), day.replace(month=12, day=31))
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            generate_yearly_report(day.year)
+            elapsed = time.perf_counter() - started
+        self.stdout.write(f"  yearly report from the cube: {elapsed * 1000:8.1f}ms, {len(queries)} queries")
+
+        if options['compare']:
+            start, end = day_bounds(day)
+            started = time.perf_counter()
+            customer_ids = set(Order.objects.filter(
+                created_at__gte=start, created_at__lt=end, status__in=REPORTED_STATUSES,
+            ).values_list('user_id', flat=True))
+            new_customers = 0
+            for customer_id in customer_ids:
+                first_order = Order.objects.filter(user_id=customer_id).order_by('created_at').first()
+                new_customers += first_order.created_at.date() == day
+            self.stdout.write(
+                f"  per-customer first-order queries alone: {(time.perf_counter() - started) * 1000:8.1f}ms, "
+                f"{len(customer_ids) + 1} queries, {new_customers} new customers"
+            )
@@ -0,0 +1,144 @@
+import os
+import random
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the report backfill over a synthetic order history, in-process and on a process pool. The '
+        'workers read committed rows, so the history is written to the database (dated from 2001 to stay '
+        'clear of real data) and deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--orders-per-day', type=int, default=100)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--skus', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        start = date(2001, 1, 1)
+        end = start + timedelta(days=options['days'] - 1)
+        try:
+            self.populate(start, options)
+            for workers in sorted({1, max(options['workers'], 1)}):
+                self.run(start, end, workers)
+        finally:
+            self.cleanup(start, end)
+
+    def populate(self, start, options):
+        from orders.models import Order, OrderItem
+        from products.models import Brand, Category, Product, ProductVariant
+        from users.models import User
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        brand = Brand.objects.create(name='bench-brand')
+        categories = [Category.objects.create(name=f'bench-category-{i}') for i in range(4)]
+        products = [
+            Product.objects.create(
+                id=f'bench-product-{i}', name=f'Bench product {i}', brand=brand, category=category,
+                base_price=Decimal('10'), image='/bench.png', description='',
+            )
+            for i, category in enumerate(categories)
+        ]
+        variants = ProductVariant.objects.bulk_create([
+            ProductVariant(
+                id=f'bench-{i}', product=products[i % len(products)], storage='64GB', color=f'bench-{i}',
+                price=Decimal('10'),
+            )
+            for i in range(options['skus'])
+        ], batch_size=2000)
+        User.objects.bulk_create([
+            User(username=f'bench-{i}', email=f'bench-{i}@example.com', password='!')
+            for i in range(options['customers'])
+        ], batch_size=2000)
+        customers = list(User.objects.filter(username__startswith='bench-').values_list('pk', flat=True))
+
+        methods = [value for value, _ in Order.PaymentMethod.choices]
+        statuses = ['PROCESSING', 'SHIPPED', 'DELIVERED', 'DELIVERED', 'CANCELLED']
+        shipping = dict(
+            shipping_name='Bench', shipping_email='bench@example.com', shipping_phone='555',
+            shipping_address_line1='1 Bench St', shipping_city='City', shipping_state='ST',
+            shipping_postal_code='00000',
+        )
+        tz = timezone.get_current_timezone()
+        for offset in range(options['days']):
+            day = start + timedelta(days=offset)
+            numbers = [f'BENCH-{day:%Y%m%d}-{i}' for i in range(options['orders_per_day'])]
+            Order.objects.bulk_create([
+                Order(
+                    order_number=number, user_id=rng.choice(customers), status=rng.choice(statuses),
+                    payment_method=rng.choice(methods), subtotal=Decimal('100'), tax=Decimal('8'),
+                    shipping_cost=Decimal('10'), total=Decimal('118'), **shipping,
+                )
+                for number in numbers
+            ], batch_size=2000)
+            # created_at is auto_now_add: backdate after the insert
+            Order.objects.filter(order_number__in=numbers).update(
+                created_at=datetime.combine(day, dt_time(12), tzinfo=tz),
+            )
+        orders = Order.objects.filter(order_number__startswith='BENCH-').values_list('pk', flat=True)
+        for batch_start in range(0, len(orders), 10000):
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order_id=order_id, product=variant.product, variant=variant, product_name='Bench',
+                    variant_storage=variant.storage, variant_color=variant.color, unit_price=Decimal('50'),
+                    quantity=quantity, subtotal=Decimal('50') * quantity,
+                )
+                for order_id in orders[batch_start:batch_start + 10000]
+                for variant, quantity in [
+                    (rng.choice(variants), rng.randrange(1, 3)) for _ in range(rng.randrange(1, 4))
+                ]
+            ], batch_size=2000)
+        # Without statistics for the bulk-loaded rows SQLite reads the day's orders off the status index
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(
+            f"Created {options['days'] * options['orders_per_day']} orders over {options['days']} days "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+
+    def run(self, start, end, workers):
+        from reports.backfill import backfill_reports
+
+        stats = backfill_reports(start, end, workers=workers, restart=True)
+        self.stdout.write(
+            f"  {workers:2d} workers: {stats['seconds']:6.1f}s, {stats['days'] / stats['seconds']:7.1f} days/s, "
+            f"{stats['orders'] / stats['seconds']:8.0f} orders/s ({stats['chunks']} months, "
+            f"{stats['reports']} reports)"
+        )
+
+    def cleanup(self, start, end):
+        from orders.models import Order
+        from products.models import Brand, Category, Product, ProductVariant
+        from reports.models import (
+            DailySalesFact, ProductPerformance, ReportBackfillChunk, SalesCubeDay, SalesReport,
+        )
+        from users.models import User
+
+        Order.objects.filter(order_number__startswith='BENCH-').delete()
+        # Weekly reports can start in the last days of the previous year
+        reports_start = start - timedelta(days=7)
+        SalesReport.objects.filter(report_date__gte=reports_start, report_date__lte=end).delete()
+        # The period reports build the cube back to the start of the previous year
+        cube_start, cube_end = date(start.year - 1, 1, 1), date(end.year, 12, 31)
+        ProductPerformance.objects.filter(report_date__gte=cube_start, report_date__lte=cube_end).delete()
+        DailySalesFact.objects.filter(date__gte=cube_start, date__lte=cube_end).delete()
+        SalesCubeDay.objects.filter(date__gte=cube_start, date__lte=cube_end).delete()
+        ReportBackfillChunk.objects.filter(start_date__gte=start, end_date__lte=end).delete()
+        # Variant deletes reindex their product, so they must go before the products do
+        ProductVariant.objects.filter(product__id__startswith='bench-product-').delete()
+        Product.objects.filter(id__startswith='bench-product-').delete()
+        Category.objects.filter(name__startswith='bench-category-').delete()
+        Brand.objects.filter(name='bench-brand').delete()
+        User.objects.filter(username__startswith='bench-').delete()
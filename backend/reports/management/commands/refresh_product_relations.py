@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the orders created since the previous run into the product co-purchase matrix and re-rank '
+        'the frequently bought together relations of their products.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recount every order (done anyway on the first run).')
+        parser.add_argument('--top', type=int, default=10, help='Relations kept per product.')
+        parser.add_argument('--min-support', type=int, default=3,
+                            help='Orders two products must share to be related.')
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help='Keep running, sleeping this long between runs (default: run once).')
+        parser.add_argument('--lag', type=int, default=30, metavar='SECONDS',
+                            help='Leave orders younger than this to the next run.')
+
+    def handle(self, *args, **options):
+        from reports.relations import refresh_product_relations
+
+        rebuild = options['rebuild']
+        while True:
+            run = refresh_product_relations(
+                lag=timedelta(seconds=options['lag']), rebuild=rebuild, top_k=options['top'],
+                min_support=options['min_support'],
+            )
+            self.stdout.write(
+                f"{'Rebuilt' if run.rebuilt else 'Refreshed'} up to {run.watermark:%Y-%m-%d %H:%M:%S}: "
+                f'{run.orders_read} orders read ({run.baskets} in total), {run.pairs_updated} pairs, '
+                f'{run.products_refreshed} products, {run.relations_written} relations in {run.duration_ms}ms'
+            )
+            if not options['loop']:
+                return
+            rebuild = False
+            try:
+                time.sleep(options['loop'])
+            except KeyboardInterrupt:
+                return
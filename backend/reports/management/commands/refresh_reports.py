@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Refresh the sales cube and the generated reports for orders changed since the previous run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                            help='Keep running, sleeping this long between runs (default: run once).')
+        parser.add_argument('--lag', type=int, default=30, metavar='SECONDS',
+                            help='Leave order changes younger than this to the next run.')
+
+    def handle(self, *args, **options):
+        from reports.refresh import refresh_reports
+
+        while True:
+            run = refresh_reports(lag=timedelta(seconds=options['lag']))
+            self.stdout.write(
+                f'Refreshed up to {run.watermark:%Y-%m-%d %H:%M:%S}: {run.orders_changed} orders changed, '
+                f'{run.days_refreshed} days rebuilt, {run.reports_refreshed} reports regenerated '
+                f'in {run.duration_ms}ms'
+            )
+            if not options['loop']:
+                return
+            try:
+                time.sleep(options['loop'])
+            except KeyboardInterrupt:
+                return
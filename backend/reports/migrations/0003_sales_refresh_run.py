@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0002_daily_sales_fact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRefreshRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('watermark', models.DateTimeField()),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('orders_changed', models.PositiveIntegerField(default=0)),
+                ('days_refreshed', models.PositiveIntegerField(default=0)),
+                ('reports_refreshed', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0003_sales_refresh_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportBackfillChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('facts_written', models.PositiveIntegerField(default=0)),
+                ('reports_written', models.PositiveIntegerField(default=0)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['start_date'],
+                'unique_together': {('start_date', 'end_date')},
+            },
+        ),
+    ]
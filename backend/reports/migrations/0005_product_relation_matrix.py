@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_created_at_index'),
+        ('reports', '0004_report_backfill_chunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRelationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('watermark', models.DateTimeField()),
+                ('rebuilt', models.BooleanField(default=False)),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+                ('orders_read', models.PositiveIntegerField(default=0)),
+                ('baskets', models.PositiveIntegerField(default=0)),
+                ('pairs_updated', models.PositiveIntegerField(default=0)),
+                ('products_refreshed', models.PositiveIntegerField(default=0)),
+                ('relations_written', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='productrelation',
+            name='lift',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='productrelation',
+            name='support',
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=7),
+        ),
+        migrations.CreateModel(
+            name='ProductCoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('product_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+                ('product_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.product')),
+            ],
+            options={
+                'unique_together': {('product_a', 'product_b')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reports', '0005_product_relation_matrix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesCubeDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('built_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+    ]
@@ -47,6 +47,94 @@ class SalesReport(models.Model):
         return f"{self.report_type} Report - {self.report_date}"
 
 
+class DailySalesFact(models.Model):
+    """
+    Sales of one day per warehouse, category, brand and payment method
+
+    The cube weekly, monthly and yearly reports roll up (see `reports.cube`).
+    Line measures (`items`, `item_revenue`) are split by category and brand;
+    order measures (`orders`, `revenue`, `tax`, `shipping`, `discount`) are
+    counted once, in the cell of the order's largest line.
+    """
+    date = models.DateField()
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales_facts')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales_facts')
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_sales_facts')
+    payment_method = models.CharField(max_length=20)
+    
+    # Order measures
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    shipping = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    discount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    # Line measures
+    items = models.IntegerField(default=0)
+    item_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            models.Index(fields=['date', 'warehouse']),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.payment_method}: {self.orders} orders"
+
+
+class SalesCubeDay(models.Model):
+    """A day of the sales cube and when it was last built; days without orders have no facts but a row here"""
+    date = models.DateField(unique=True)
+    built_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = ['date']
+    
+    def __str__(self):
+        return f"Sales cube {self.date} built at {self.built_at}"
+
+
+class SalesRefreshRun(models.Model):
+    """One pass of the incremental report refresh; the latest `watermark` is where the next one resumes"""
+    started_at = models.DateTimeField()
+    # Orders updated up to and including this instant are reflected in the reports
+    watermark = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+    
+    orders_changed = models.PositiveIntegerField(default=0)
+    days_refreshed = models.PositiveIntegerField(default=0)
+    reports_refreshed = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Report refresh at {self.started_at} up to {self.watermark}"
+
+
+class ReportBackfillChunk(models.Model):
+    """Checkpoint of the historical report backfill: a range of days and when it was written"""
+    start_date = models.DateField()
+    end_date = models.DateField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    # Stats of the last completed pass
+    orders = models.PositiveIntegerField(default=0)
+    facts_written = models.PositiveIntegerField(default=0)
+    reports_written = models.PositiveIntegerField(default=0)
+    # Aggregation time in the worker, not counting the write
+    duration_ms = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['start_date', 'end_date']
+        ordering = ['start_date']
+    
+    def __str__(self):
+        state = 'done' if self.completed_at else 'pending'
+        return f"Backfill {self.start_date} to {self.end_date} ({state})"
+
+
 class ProductPerformance(models.Model):
     """Track individual product performance over time"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='performance_reports')
@@ -129,6 +217,8 @@ class ProductRelation(models.Model):
     # Relationship strength
     times_bought_together = models.IntegerField(default=0)
     confidence_score = models.DecimalField(max_digits=5, decimal_places=4, default=0)  # 0-1
+    support = models.DecimalField(max_digits=7, decimal_places=6, default=0)  # Share of all orders, 0-1
+    lift = models.DecimalField(max_digits=12, decimal_places=4, default=0)  # Above 1: bought together more than by chance
     
     # Metadata
     last_updated = models.DateTimeField(auto_now=True)
@@ -145,6 +235,46 @@ class ProductRelation(models.Model):
         return f"{self.product_a.name} + {self.product_b.name} ({self.times_bought_together} times)"
 
 
+class ProductCoPurchase(models.Model):
+    """
+    Cell of the co-purchase matrix: orders containing both products
+
+    Only the upper triangle is stored (`product_a` <= `product_b`); the
+    diagonal holds each product's own order count.
+    """
+    product_a = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    product_b = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    orders = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['product_a', 'product_b']
+    
+    def __str__(self):
+        return f"{self.product_a_id} + {self.product_b_id}: {self.orders} orders"
+
+
+class ProductRelationRun(models.Model):
+    """One pass of the product relation job; the latest `watermark` is where the next one resumes"""
+    started_at = models.DateTimeField()
+    # Orders created up to and including this instant are counted in the matrix
+    watermark = models.DateTimeField()
+    rebuilt = models.BooleanField(default=False)
+    duration_ms = models.PositiveIntegerField(default=0)
+    
+    orders_read = models.PositiveIntegerField(default=0)
+    # Orders counted in the matrix in total, the denominator of support and lift
+    baskets = models.PositiveIntegerField(default=0)
+    pairs_updated = models.PositiveIntegerField(default=0)
+    products_refreshed = models.PositiveIntegerField(default=0)
+    relations_written = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Product relations at {self.started_at} up to {self.watermark}"
+
+
 class CustomerSegment(models.Model):
     """Customer segmentation for personalized recommendations"""
     
@@ -0,0 +1,129 @@
+"""
+Incremental report refresh
+
+Reports are computed once per period, but orders keep changing after that:
+a late status change (a refund, a cancellation) moves an order in or out
+of the reported sales of the day it was created. `Order.updated_at` is the
+change log: each `refresh_reports` run picks up the orders updated since
+the previous run's watermark, and only for the days those orders were
+created
+
+- rebuilds the days in the sales cube (`reports.cube`);
+- regenerates the `SalesReport` rows already generated for those days, the
+  weeks starting in the six days before them, and their months and years.
+
+Bulk writes to orders must set `updated_at` themselves. Runs are
+idempotent: an interrupted run records nothing and the next one redoes
+its days.
+"""
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional, Set, Tuple
+
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order
+from reports.cube import refresh_sales_facts
+from reports.models import SalesRefreshRun, SalesReport
+
+logger = logging.getLogger(__name__)
+
+# Orders updated this recently are left to the next run: a transaction can
+# commit after a later one and carry an older `updated_at`
+SAFETY_LAG = timedelta(seconds=30)
+
+
+def last_watermark() -> Optional[datetime]:
+    """Instant up to which order changes are reflected, if any run happened"""
+    return SalesRefreshRun.objects.order_by('-watermark').values_list('watermark', flat=True).first()
+
+
+def changed_days(since: Optional[datetime], until: datetime) -> Tuple[int, Set[date]]:
+    """
+    Creation days of the orders updated in (since, until]
+
+    Returns:
+        Tuple of (orders changed, their creation days)
+    """
+    changed = Order.objects.filter(updated_at__lte=until)
+    if since is not None:
+        changed = changed.filter(updated_at__gt=since)
+    orders, days = 0, set()
+    for day, count in changed.annotate(day=TruncDate('created_at')).values('day').annotate(
+        orders=Count('pk'),
+    ).order_by().values_list('day', 'orders'):
+        orders += count
+        days.add(day)
+    return orders, days
+
+
+def affected_reports(days: Iterable[date]):
+    """Generated `SalesReport` rows whose period contains one of `days`"""
+    days = set(days)
+    if not days:
+        return SalesReport.objects.none()
+    periods = Q(report_type=SalesReport.ReportType.DAILY, report_date__in=days)
+    periods |= Q(report_type=SalesReport.ReportType.WEEKLY, report_date__in={
+        day - timedelta(days=offset) for day in days for offset in range(7)
+    })
+    periods |= Q(report_type=SalesReport.ReportType.MONTHLY, report_date__in={day.replace(day=1) for day in days})
+    periods |= Q(report_type=SalesReport.ReportType.YEARLY, report_date__in={
+        day.replace(month=1, day=1) for day in days
+    })
+    return SalesReport.objects.filter(periods, category__isnull=True, brand__isnull=True).select_related('warehouse')
+
+
+def regenerate_report(report: SalesReport):
+    """Recompute a `SalesReport` row with the generator of its type"""
+    from reports.reporting import (
+        generate_daily_report, generate_monthly_report, generate_weekly_report, generate_yearly_report,
+    )
+    day, warehouse = report.report_date, report.warehouse
+    if report.report_type == SalesReport.ReportType.DAILY:
+        return generate_daily_report(day, warehouse)
+    if report.report_type == SalesReport.ReportType.WEEKLY:
+        return generate_weekly_report(day, warehouse)
+    if report.report_type == SalesReport.ReportType.MONTHLY:
+        return generate_monthly_report(day.year, day.month, warehouse)
+    return generate_yearly_report(day.year, warehouse)
+
+
+def refresh_reports(now: Optional[datetime] = None, lag: timedelta = SAFETY_LAG) -> SalesRefreshRun:
+    """
+    Bring the cube and the generated reports up to date with order changes
+
+    Args:
+        now: Current time (default: now)
+        lag: Changes younger than this wait for the next run
+
+    Returns:
+        The recorded run, with its watermark and stats
+    """
+    started_at, started = now or timezone.now(), time.perf_counter()
+    since = last_watermark()
+    until = started_at - lag
+    if since is not None and until < since:
+        until = since
+
+    orders, days = changed_days(since, until)
+    refresh_sales_facts(days)
+    # The cube first: weekly and longer reports roll up from it
+    reports = list(affected_reports(days).order_by('report_date', 'report_type', 'pk'))
+    for report in reports:
+        regenerate_report(report)
+
+    run = SalesRefreshRun.objects.create(
+        started_at=started_at,
+        watermark=until,
+        duration_ms=int((time.perf_counter() - started) * 1000),
+        orders_changed=orders,
+        days_refreshed=len(days),
+        reports_refreshed=len(reports),
+    )
+    logger.info(
+        f"Reports refreshed up to {until}: {orders} orders changed, {len(days)} days, {len(reports)} reports"
+    )
+    return run
@@ -0,0 +1,242 @@
+"""
+Frequently bought together: the product co-purchase matrix
+
+Order baskets (the distinct products of an order) are streamed once, in
+order id order, and counted into a sparse co-purchase matrix held as a
+counter of product pairs. `ProductCoPurchase` stores its upper triangle,
+the diagonal being each product's order count. From it every product gets
+its top relations, written to `ProductRelation` in both directions:
+
+- support: share of all orders containing both products;
+- confidence: share of the product's orders that also contain the other;
+- lift: confidence over the other product's own share of orders, above 1
+  when the two are bought together more often than by chance.
+
+`refresh_product_relations` builds the matrix from every order on its
+first run (or with `rebuild`), then adds only the orders created since
+the previous run's watermark and re-ranks the products in them. Every
+order counts, whatever its status: a basket is what the customer put
+together. Relations of products without new orders keep their support and
+lift until they appear in an order again or the matrix is rebuilt.
+"""
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import combinations_with_replacement, groupby
+from operator import itemgetter
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.db import conflict_target
+from orders.models import OrderItem
+from reports.cube import BATCH_SIZE
+from reports.models import ProductCoPurchase, ProductRelation, ProductRelationRun
+from reports.refresh import SAFETY_LAG
+
+logger = logging.getLogger(__name__)
+
+# Relations kept per product
+TOP_K = 10
+# Orders two products must share to be related
+MIN_SUPPORT = 3
+
+# Products whose matrix cells are read per query
+PRODUCTS_PER_QUERY = 500
+
+
+def baskets(since: Optional[datetime], until: datetime) -> Iterator[Set[str]]:
+    """Distinct products of each order created in (since, until], streamed in order id order"""
+    items = OrderItem.objects.filter(order__created_at__lte=until)
+    if since is not None:
+        items = items.filter(order__created_at__gt=since)
+    rows = items.order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=10000)
+    for _, lines in groupby(rows, key=itemgetter(0)):
+        yield {product_id for _, product_id in lines}
+
+
+def count_pairs(orders: Iterable[Set[str]]) -> Tuple[Counter, int]:
+    """
+    Co-purchase counts of baskets
+
+    Returns:
+        Tuple of (counter of (product a, product b) with a <= b, the
+        diagonal included, baskets counted)
+    """
+    pairs, count = Counter(), 0
+    for basket in orders:
+        count += 1
+        pairs.update(combinations_with_replacement(sorted(basket), 2))
+    return pairs, count
+
+
+def add_to_matrix(pairs: Counter, batch_size: int = BATCH_SIZE) -> int:
+    """Add co-purchase counts to the stored matrix; returns the cells written"""
+    if not pairs:
+        return 0
+    products = sorted({product for pair in pairs for product in pair})
+    current = {}
+    for start in range(0, len(products), PRODUCTS_PER_QUERY):
+        chunk = products[start:start + PRODUCTS_PER_QUERY]
+        current.update(
+            ((a, b), orders) for a, b, orders in ProductCoPurchase.objects.filter(
+                product_a_id__in=chunk, product_b_id__in=products,
+            ).values_list('product_a_id', 'product_b_id', 'orders')
+        )
+    ProductCoPurchase.objects.bulk_create(
+        [
+            ProductCoPurchase(product_a_id=a, product_b_id=b, orders=current.get((a, b), 0) + orders)
+            for (a, b), orders in sorted(pairs.items())
+        ],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=conflict_target(['product_a', 'product_b']),
+        update_fields=['orders'],
+    )
+    return len(pairs)
+
+
+def matrix_cells(products: Set[str]) -> Iterator[Tuple[str, str, int]]:
+    """Stored cells of the rows and columns of `products`, and the diagonal of the products they meet"""
+    partners = set()
+    products = sorted(products)
+    for start in range(0, len(products), PRODUCTS_PER_QUERY):
+        chunk = products[start:start + PRODUCTS_PER_QUERY]
+        for a, b, orders in ProductCoPurchase.objects.filter(
+            Q(product_a_id__in=chunk) | Q(product_b_id__in=chunk),
+        ).values_list('product_a_id', 'product_b_id', 'orders').iterator(chunk_size=10000):
+            partners.update((a, b))
+            yield a, b, orders
+    partners = sorted(partners.difference(products))
+    for start in range(0, len(partners), PRODUCTS_PER_QUERY):
+        yield from ProductCoPurchase.objects.filter(
+            product_a_id__in=partners[start:start + PRODUCTS_PER_QUERY], product_b=F('product_a'),
+        ).values_list('product_a_id', 'product_b_id', 'orders')
+
+
+def rank_relations(cells: Iterable[Tuple[str, str, int]], products: Set[str], total: int,
+                   top_k: int = TOP_K, min_support: int = MIN_SUPPORT) -> List[ProductRelation]:
+    """
+    Top relations of `products` from matrix cells
+
+    Args:
+        cells: (product a, product b, orders) cells; those of the diagonal
+            must include every product met
+        products: Products to rank the relations of
+        total: Orders counted in the matrix
+    """
+    own, partners = {}, defaultdict(list)
+    for a, b, together in cells:
+        if a == b:
+            own[a] = together
+        elif together >= min_support:
+            if a in products:
+                partners[a].append((b, together))
+            if b in products:
+                partners[b].append((a, together))
+
+    relations = []
+    for product, candidates in partners.items():
+        # Confidence ranks as the count does for a given product; rarer partners (more lift) first on ties
+        candidates.sort(key=lambda candidate: (-candidate[1], own[candidate[0]], candidate[0]))
+        for partner, together in candidates[:top_k]:
+            relations.append(ProductRelation(
+                product_a_id=product,
+                product_b_id=partner,
+                times_bought_together=together,
+                confidence_score=Decimal(together / own[product]).quantize(Decimal('0.0001')),
+                support=Decimal(together / total).quantize(Decimal('0.000001')),
+                lift=Decimal(together * total / (own[product] * own[partner])).quantize(Decimal('0.0001')),
+            ))
+    return relations
+
+
+def write_relations(products: Set[str], relations: List[ProductRelation], batch_size: int = BATCH_SIZE) -> int:
+    """Upsert the relations of `products` and delete the ones that left their top list"""
+    ProductRelation.objects.bulk_create(
+        relations,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=conflict_target(['product_a', 'product_b']),
+        update_fields=['times_bought_together', 'confidence_score', 'support', 'lift', 'last_updated'],
+    )
+    kept = {(relation.product_a_id, relation.product_b_id) for relation in relations}
+    products = sorted(products)
+    stale = []
+    for start in range(0, len(products), PRODUCTS_PER_QUERY):
+        stale.extend(
+            pk for pk, a, b in ProductRelation.objects.filter(
+                product_a_id__in=products[start:start + PRODUCTS_PER_QUERY],
+            ).values_list('pk', 'product_a_id', 'product_b_id')
+            if (a, b) not in kept
+        )
+    for start in range(0, len(stale), batch_size):
+        ProductRelation.objects.filter(pk__in=stale[start:start + batch_size]).delete()
+    return len(relations)
+
+
+def refresh_product_relations(now: Optional[datetime] = None, lag: timedelta = SAFETY_LAG, rebuild: bool = False,
+                              top_k: int = TOP_K, min_support: int = MIN_SUPPORT,
+                              batch_size: int = BATCH_SIZE) -> ProductRelationRun:
+    """
+    Bring the co-purchase matrix and the product relations up to date
+
+    Args:
+        now: Current time (default: now)
+        lag: Orders younger than this wait for the next run
+        rebuild: Recount every order instead of the new ones
+        top_k: Relations kept per product
+        min_support: Orders two products must share to be related
+
+    Returns:
+        The recorded run, with its watermark and stats
+    """
+    started_at, started = now or timezone.now(), time.perf_counter()
+    with transaction.atomic():
+        # Concurrent runs wait here, so no order is counted twice
+        previous = ProductRelationRun.objects.select_for_update().order_by('-watermark').first()
+        rebuild = rebuild or previous is None
+        since = None if rebuild else previous.watermark
+        until = started_at - lag
+        if since is not None and until < since:
+            until = since
+
+        pairs, orders = count_pairs(baskets(since, until))
+        products = {a for a, b in pairs if a == b}
+        if rebuild:
+            total = orders
+            ProductCoPurchase.objects.all().delete()
+            ProductCoPurchase.objects.bulk_create(
+                [ProductCoPurchase(product_a_id=a, product_b_id=b, orders=count) for (a, b), count in pairs.items()],
+                batch_size=batch_size,
+            )
+            cells = ((a, b, count) for (a, b), count in pairs.items())
+            # Products without orders any more lose their relations too
+            products.update(ProductRelation.objects.values_list('product_a_id', flat=True).distinct())
+        else:
+            total = previous.baskets + orders
+            add_to_matrix(pairs, batch_size)
+            cells = matrix_cells(products)
+        relations = rank_relations(cells, products, total, top_k, min_support) if products else []
+        written = write_relations(products, relations, batch_size) if products else 0
+
+        run = ProductRelationRun.objects.create(
+            started_at=started_at,
+            watermark=until,
+            rebuilt=rebuild,
+            duration_ms=int((time.perf_counter() - started) * 1000),
+            orders_read=orders,
+            baskets=total,
+            pairs_updated=len(pairs),
+            products_refreshed=len(products),
+            relations_written=written,
+        )
+    logger.info(
+        f"Product relations {'rebuilt' if rebuild else 'refreshed'} up to {until}: {orders} orders, "
+        f"{len(pairs)} pairs, {len(products)} products, {written} relations"
+    )
+    return run
@@ -1,11 +1,15 @@
 """
 Comprehensive reporting generation for daily, weekly, monthly, and yearly reports
 """
-from django.db.models import Sum, Count, Avg, F, Q
+from django.db.models import Sum, Count, Avg, DecimalField, Exists, F, OuterRef, Q
 from django.utils import timezone
 from datetime import datetime, timedelta
 from decimal import Decimal
 from typing import Dict, List, Optional
+from reports.cube import (
+    REPORTED_STATUSES, date_range, day_bounds, ensure_sales_facts, line_warehouse, order_warehouse,
+    refresh_sales_facts, rollup, sales_facts, top_products, total,
+)
 from reports.models import SalesReport, ProductPerformance, ProductTrend
 from orders.models import Order
 from products.models import Product, ProductVariant, Category, Brand
@@ -19,6 +23,11 @@ logger = logging.getLogger(__name__)
 def generate_daily_report(date: datetime.date, warehouse: Optional[Warehouse] = None) -> Dict:
     """
     Generate comprehensive daily sales report
+
+    Two grouped queries whatever the volume: one pass over the day's orders
+    computes the totals, the payment method breakdown (conditional
+    aggregation) and the new customers (an EXISTS on earlier orders), and
+    one pass over their items gives the units sold and the top products.
     
     Args:
         date: Date for the report
@@ -28,60 +37,68 @@ def generate_daily_report(date: datetime.date, warehouse: Optional[Warehouse] =
         Dict with daily metrics
     """
     # Query orders for the day
+    start, end = day_bounds(date)
     orders_query = Order.objects.filter(
-        created_at__date=date,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
+        created_at__gte=start,
+        created_at__lt=end,
+        status__in=REPORTED_STATUSES
     )
     
-    if warehouse:
-        orders_query = orders_query.filter(warehouse=warehouse)
-    
-    # Calculate metrics
-    total_orders = orders_query.count()
-    total_items = orders_query.aggregate(
-        items=Sum('items__quantity')
-    )['items'] or 0
-    
-    revenue_data = orders_query.aggregate(
-        revenue=Sum('total'),
-        subtotal=Sum('subtotal'),
-        tax=Sum('tax_amount'),
-        shipping=Sum('shipping_cost'),
-        discount=Sum('discount_amount')
-    )
+    # Units sold and top products from one grouped pass over the items
+    from orders.models import OrderItem
+    items_query = OrderItem.objects.filter(order__in=orders_query)
     
+    if warehouse:
+        # Attributed as in the sales cube: lines to the warehouse their stock
+        # was reserved at, orders to the warehouse of their largest line
+        orders_query = orders_query.annotate(attributed_to=order_warehouse()).filter(attributed_to=warehouse.pk)
+        items_query = items_query.annotate(attributed_to=line_warehouse()).filter(attributed_to=warehouse.pk)
+    
+    # Totals, payment methods and customers in one pass
+    methods = [value for value, _ in Order.PaymentMethod.choices]
+    aggregates = {
+        'orders': Count('pk'),
+        'revenue': Sum('total'),
+        'subtotal': Sum('subtotal'),
+        'tax': Sum('tax'),
+        'shipping': Sum('shipping_cost'),
+        'discount': Sum('discount'),
+        'customers': Count('user', distinct=True),
+        # A customer is new if the day holds their first order of any status
+        'returning': Count('user', distinct=True, filter=Q(ordered_before=True)),
+    }
+    for i, method in enumerate(methods):
+        aggregates[f'method_{i}_count'] = Count('pk', filter=Q(payment_method=method))
+        aggregates[f'method_{i}_revenue'] = Sum('total', filter=Q(payment_method=method))
+    revenue_data = orders_query.annotate(
+        ordered_before=Exists(Order.objects.filter(user=OuterRef('user'), created_at__lt=start)),
+    ).aggregate(**aggregates)
+    
+    total_orders = revenue_data['orders']
     total_revenue = revenue_data['revenue'] or Decimal('0')
     avg_order_value = (total_revenue / total_orders) if total_orders > 0 else Decimal('0')
+    returning_customers = revenue_data['returning']
+    new_customers = revenue_data['customers'] - returning_customers
     
     # Payment method breakdown
-    payment_methods = orders_query.values('payment_method').annotate(
-        count=Count('id'),
-        revenue=Sum('total')
-    )
+    payment_methods = [
+        {
+            'payment_method': method,
+            'count': revenue_data[f'method_{i}_count'],
+            'revenue': revenue_data[f'method_{i}_revenue'],
+        }
+        for i, method in enumerate(methods) if revenue_data[f'method_{i}_count']
+    ]
     
-    # Top products for the day
-    from orders.models import OrderItem
-    top_products = OrderItem.objects.filter(
-        order__in=orders_query
-    ).values(
+    products = list(items_query.values(
         'variant__product__name',
         'variant__product__id'
     ).annotate(
         units_sold=Sum('quantity'),
-        revenue=Sum(F('price') * F('quantity'))
-    ).order_by('-units_sold')[:10]
-    
-    # New vs returning customers
-    customer_ids = orders_query.filter(user__isnull=False).values_list('user_id', flat=True)
-    new_customers = 0
-    returning_customers = 0
-    
-    for customer_id in set(customer_ids):
-        first_order = Order.objects.filter(user_id=customer_id).order_by('created_at').first()
-        if first_order and first_order.created_at.date() == date:
-            new_customers += 1
-        else:
-            returning_customers += 1
+        revenue=Sum(F('unit_price') * F('quantity'), output_field=DecimalField())
+    ).order_by())
+    total_items = sum(product['units_sold'] for product in products)
+    top_sellers = sorted(products, key=lambda product: -product['units_sold'])[:10]
     
     report_data = {
         'report_date': date,
@@ -92,8 +109,8 @@ def generate_daily_report(date: datetime.date, warehouse: Optional[Warehouse] =
         'average_order_value': float(avg_order_value),
         'new_customers': new_customers,
         'returning_customers': returning_customers,
-        'payment_methods': list(payment_methods),
-        'top_products': list(top_products),
+        'payment_methods': payment_methods,
+        'top_products': top_sellers,
         'revenue_breakdown': {
             'subtotal': float(revenue_data['subtotal'] or 0),
             'tax': float(revenue_data['tax'] or 0),
@@ -121,9 +138,16 @@ def generate_daily_report(date: datetime.date, warehouse: Optional[Warehouse] =
     return report_data
 
 
+def percent_change(current: Decimal, previous: Decimal) -> float:
+    return float(((current - previous) / previous * 100) if previous > 0 else 0)
+
+
 def generate_weekly_report(start_date: datetime.date, warehouse: Optional[Warehouse] = None) -> Dict:
     """
     Generate weekly sales report (7 days)
+
+    Rolled up from the daily sales cube, once the days it is missing are
+    built: the week and the week before are one range read.
     
     Args:
         start_date: Start date of the week
@@ -133,59 +157,27 @@ def generate_weekly_report(start_date: datetime.date, warehouse: Optional[Wareho
         Dict with weekly metrics
     """
     end_date = start_date + timedelta(days=6)
-    
-    # Query orders for the week
-    orders_query = Order.objects.filter(
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
-    )
-    
-    if warehouse:
-        orders_query = orders_query.filter(warehouse=warehouse)
+    prev_start = start_date - timedelta(days=7)
+    ensure_sales_facts(prev_start, end_date)
+    by_day = rollup(sales_facts(prev_start, end_date, warehouse), lambda fact: fact['date'])
+    days = date_range(start_date, end_date)
     
     # Calculate metrics
-    total_orders = orders_query.count()
-    total_items = orders_query.aggregate(items=Sum('items__quantity'))['items'] or 0
-    total_revenue = orders_query.aggregate(revenue=Sum('total'))['revenue'] or Decimal('0')
+    week = total(by_day[day] for day in days)
+    total_orders = week['orders']
+    total_items = week['items']
+    total_revenue = week['revenue']
     avg_order_value = (total_revenue / total_orders) if total_orders > 0 else Decimal('0')
     
     # Daily breakdown
-    daily_breakdown = []
-    for i in range(7):
-        day = start_date + timedelta(days=i)
-        day_orders = orders_query.filter(created_at__date=day)
-        daily_breakdown.append({
-            'date': day.isoformat(),
-            'orders': day_orders.count(),
-            'revenue': float(day_orders.aggregate(r=Sum('total'))['r'] or 0)
-        })
+    daily_breakdown = [
+        {'date': day.isoformat(), 'orders': by_day[day]['orders'], 'revenue': float(by_day[day]['revenue'])}
+        for day in days
+    ]
     
     # Week-over-week comparison
-    prev_start = start_date - timedelta(days=7)
-    prev_end = start_date - timedelta(days=1)
-    prev_orders = Order.objects.filter(
-        created_at__date__gte=prev_start,
-        created_at__date__lte=prev_end,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
-    )
-    if warehouse:
-        prev_orders = prev_orders.filter(warehouse=warehouse)
-    
-    prev_revenue = prev_orders.aggregate(r=Sum('total'))['r'] or Decimal('0')
-    revenue_change = float(((total_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue > 0 else 0)
-    
-    # Top products
-    from orders.models import OrderItem
-    top_products = OrderItem.objects.filter(
-        order__in=orders_query
-    ).values(
-        'variant__product__name',
-        'variant__product__id'
-    ).annotate(
-        units_sold=Sum('quantity'),
-        revenue=Sum(F('price') * F('quantity'))
-    ).order_by('-revenue')[:10]
+    prev_revenue = total(by_day[day] for day in date_range(prev_start, start_date - timedelta(days=1)))['revenue']
+    revenue_change = percent_change(total_revenue, prev_revenue)
     
     report_data = {
         'report_type': 'WEEKLY',
@@ -197,7 +189,7 @@ def generate_weekly_report(start_date: datetime.date, warehouse: Optional[Wareho
         'average_order_value': float(avg_order_value),
         'revenue_change_percent': revenue_change,
         'daily_breakdown': daily_breakdown,
-        'top_products': list(top_products),
+        'top_products': top_products(start_date, end_date, warehouse),
     }
     
     # Save to database
@@ -217,9 +209,24 @@ def generate_weekly_report(start_date: datetime.date, warehouse: Optional[Wareho
     return report_data
 
 
+def performance(facts: List[Dict], field: str) -> List[Dict]:
+    """Units and line revenue per category or brand name, best first"""
+    cells = rollup(facts, lambda fact: fact[field])
+    return sorted(
+        (
+            {f'variant__product__{field}': name, 'revenue': cell['item_revenue'], 'units': cell['items']}
+            for name, cell in cells.items() if name is not None
+        ),
+        key=lambda row: -row['revenue'],
+    )
+
+
 def generate_monthly_report(year: int, month: int, warehouse: Optional[Warehouse] = None) -> Dict:
     """
     Generate comprehensive monthly sales report
+
+    Rolled up from the daily sales cube, once the days it is missing are
+    built: the month and the month before are one range read.
     
     Args:
         year: Year for the report
@@ -234,21 +241,18 @@ def generate_monthly_report(year: int, month: int, warehouse: Optional[Warehouse
     start_date = datetime(year, month, 1).date()
     last_day = monthrange(year, month)[1]
     end_date = datetime(year, month, last_day).date()
+    prev_start = (start_date - timedelta(days=1)).replace(day=1)
+    ensure_sales_facts(prev_start, end_date)
     
-    # Query orders for the month
-    orders_query = Order.objects.filter(
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
-    )
-    
-    if warehouse:
-        orders_query = orders_query.filter(warehouse=warehouse)
+    facts = sales_facts(prev_start, end_date, warehouse, fields=('date', 'category__name', 'brand__name'))
+    month_facts = [fact for fact in facts if fact['date'] >= start_date]
+    by_day = rollup(facts, lambda fact: fact['date'])
     
     # Calculate metrics
-    total_orders = orders_query.count()
-    total_items = orders_query.aggregate(items=Sum('items__quantity'))['items'] or 0
-    total_revenue = orders_query.aggregate(revenue=Sum('total'))['revenue'] or Decimal('0')
+    totals = total(by_day[day] for day in date_range(start_date, end_date))
+    total_orders = totals['orders']
+    total_items = totals['items']
+    total_revenue = totals['revenue']
     avg_order_value = (total_revenue / total_orders) if total_orders > 0 else Decimal('0')
     
     # Week-by-week breakdown
@@ -257,58 +261,20 @@ def generate_monthly_report(year: int, month: int, warehouse: Optional[Warehouse
     week_num = 1
     while current_date <= end_date:
         week_end = min(current_date + timedelta(days=6), end_date)
-        week_orders = orders_query.filter(
-            created_at__date__gte=current_date,
-            created_at__date__lte=week_end
-        )
+        week = total(by_day[day] for day in date_range(current_date, week_end))
         weekly_breakdown.append({
             'week': week_num,
             'start_date': current_date.isoformat(),
             'end_date': week_end.isoformat(),
-            'orders': week_orders.count(),
-            'revenue': float(week_orders.aggregate(r=Sum('total'))['r'] or 0)
+            'orders': week['orders'],
+            'revenue': float(week['revenue'])
         })
         current_date = week_end + timedelta(days=1)
         week_num += 1
     
     # Month-over-month comparison
-    prev_month = month - 1 if month > 1 else 12
-    prev_year = year if month > 1 else year - 1
-    prev_start = datetime(prev_year, prev_month, 1).date()
-    prev_last_day = monthrange(prev_year, prev_month)[1]
-    prev_end = datetime(prev_year, prev_month, prev_last_day).date()
-    
-    prev_orders = Order.objects.filter(
-        created_at__date__gte=prev_start,
-        created_at__date__lte=prev_end,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
-    )
-    if warehouse:
-        prev_orders = prev_orders.filter(warehouse=warehouse)
-    
-    prev_revenue = prev_orders.aggregate(r=Sum('total'))['r'] or Decimal('0')
-    revenue_change = float(((total_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue > 0 else 0)
-    
-    # Category performance
-    from orders.models import OrderItem
-    category_performance = OrderItem.objects.filter(
-        order__in=orders_query
-    ).values(
-        'variant__product__category__name'
-    ).annotate(
-        revenue=Sum(F('price') * F('quantity')),
-        units=Sum('quantity')
-    ).order_by('-revenue')
-    
-    # Brand performance
-    brand_performance = OrderItem.objects.filter(
-        order__in=orders_query
-    ).values(
-        'variant__product__brand__name'
-    ).annotate(
-        revenue=Sum(F('price') * F('quantity')),
-        units=Sum('quantity')
-    ).order_by('-revenue')
+    prev_revenue = total(by_day[day] for day in date_range(prev_start, start_date - timedelta(days=1)))['revenue']
+    revenue_change = percent_change(total_revenue, prev_revenue)
     
     report_data = {
         'report_type': 'MONTHLY',
@@ -322,8 +288,8 @@ def generate_monthly_report(year: int, month: int, warehouse: Optional[Warehouse
         'average_order_value': float(avg_order_value),
         'revenue_change_percent': revenue_change,
         'weekly_breakdown': weekly_breakdown,
-        'category_performance': list(category_performance),
-        'brand_performance': list(brand_performance),
+        'category_performance': performance(month_facts, 'category__name'),
+        'brand_performance': performance(month_facts, 'brand__name'),
     }
     
     # Save to database
@@ -346,6 +312,10 @@ def generate_monthly_report(year: int, month: int, warehouse: Optional[Warehouse
 def generate_yearly_report(year: int, warehouse: Optional[Warehouse] = None) -> Dict:
     """
     Generate comprehensive yearly sales report
+
+    Rolled up from the daily sales cube, once the days it is missing are
+    built: the year and the year before are one range read, the top
+    products one read of the DAILY product rows.
     
     Args:
         year: Year for the report
@@ -356,69 +326,35 @@ def generate_yearly_report(year: int, warehouse: Optional[Warehouse] = None) ->
     """
     start_date = datetime(year, 1, 1).date()
     end_date = datetime(year, 12, 31).date()
+    prev_start = datetime(year - 1, 1, 1).date()
+    ensure_sales_facts(prev_start, end_date)
     
-    # Query orders for the year
-    orders_query = Order.objects.filter(
-        created_at__date__gte=start_date,
-        created_at__date__lte=end_date,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
+    by_month = rollup(
+        sales_facts(prev_start, end_date, warehouse),
+        lambda fact: (fact['date'].year, fact['date'].month),
     )
     
-    if warehouse:
-        orders_query = orders_query.filter(warehouse=warehouse)
-    
     # Calculate metrics
-    total_orders = orders_query.count()
-    total_items = orders_query.aggregate(items=Sum('items__quantity'))['items'] or 0
-    total_revenue = orders_query.aggregate(revenue=Sum('total'))['revenue'] or Decimal('0')
+    totals = total(by_month[(year, month)] for month in range(1, 13))
+    total_orders = totals['orders']
+    total_items = totals['items']
+    total_revenue = totals['revenue']
     avg_order_value = (total_revenue / total_orders) if total_orders > 0 else Decimal('0')
     
     # Monthly breakdown
-    monthly_breakdown = []
-    for month in range(1, 13):
-        month_start = datetime(year, month, 1).date()
-        from calendar import monthrange
-        last_day = monthrange(year, month)[1]
-        month_end = datetime(year, month, last_day).date()
-        
-        month_orders = orders_query.filter(
-            created_at__date__gte=month_start,
-            created_at__date__lte=month_end
-        )
-        monthly_breakdown.append({
+    monthly_breakdown = [
+        {
             'month': month,
             'month_name': datetime(year, month, 1).strftime('%B'),
-            'orders': month_orders.count(),
-            'revenue': float(month_orders.aggregate(r=Sum('total'))['r'] or 0)
-        })
+            'orders': by_month[(year, month)]['orders'],
+            'revenue': float(by_month[(year, month)]['revenue'])
+        }
+        for month in range(1, 13)
+    ]
     
     # Year-over-year comparison
-    prev_year = year - 1
-    prev_start = datetime(prev_year, 1, 1).date()
-    prev_end = datetime(prev_year, 12, 31).date()
-    
-    prev_orders = Order.objects.filter(
-        created_at__date__gte=prev_start,
-        created_at__date__lte=prev_end,
-        status__in=['PROCESSING', 'SHIPPED', 'DELIVERED']
-    )
-    if warehouse:
-        prev_orders = prev_orders.filter(warehouse=warehouse)
-    
-    prev_revenue = prev_orders.aggregate(r=Sum('total'))['r'] or Decimal('0')
-    revenue_change = float(((total_revenue - prev_revenue) / prev_revenue * 100) if prev_revenue > 0 else 0)
-    
-    # Top products of the year
-    from orders.models import OrderItem
-    top_products = OrderItem.objects.filter(
-        order__in=orders_query
-    ).values(
-        'variant__product__name',
-        'variant__product__id'
-    ).annotate(
-        units_sold=Sum('quantity'),
-        revenue=Sum(F('price') * F('quantity'))
-    ).order_by('-revenue')[:20]
+    prev_revenue = total(by_month[(year - 1, month)] for month in range(1, 13))['revenue']
+    revenue_change = percent_change(total_revenue, prev_revenue)
     
     report_data = {
         'report_type': 'YEARLY',
@@ -429,7 +365,7 @@ def generate_yearly_report(year: int, warehouse: Optional[Warehouse] = None) ->
         'average_order_value': float(avg_order_value),
         'revenue_change_percent': revenue_change,
         'monthly_breakdown': monthly_breakdown,
-        'top_products': list(top_products),
+        'top_products': top_products(start_date, end_date, warehouse, limit=20),
     }
     
     # Save to database
@@ -457,6 +393,9 @@ def generate_all_reports(date: Optional[datetime.date] = None):
     if date is None:
         date = timezone.now().date()
     
+    # Bring the day into the cube the other reports roll up
+    refresh_sales_facts([date])
+    
     # Generate daily report
     daily = generate_daily_report(date)
     
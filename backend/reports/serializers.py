@@ -81,7 +81,7 @@ class ProductRelationSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'product_a', 'product_a_name', 'product_a_image',
             'product_b', 'product_b_name', 'product_b_image',
-            'times_bought_together', 'confidence_score',
+            'times_bought_together', 'confidence_score', 'support', 'lift',
             'last_updated', 'created_at'
         ]
         read_only_fields = ['id', 'last_updated', 'created_at']
@@ -1,3 +1,396 @@
+import pickle
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from inventory.models import Stock, StockReservation
+from inventory.tests import make_variant, make_warehouse
+from orders.models import Order, OrderItem
+from orders.tests import SHIPPING
+from products.models import Category, Product
+from .backfill import backfill_reports, compute_chunk
+from .cube import date_range, refresh_sales_facts
+from .models import (
+    DailySalesFact, ProductCoPurchase, ProductRelation, ProductRelationRun, ReportBackfillChunk, SalesCubeDay,
+    SalesRefreshRun, SalesReport,
+)
+from .refresh import refresh_reports
+from .relations import refresh_product_relations
+from .reporting import generate_daily_report, generate_monthly_report, generate_weekly_report, generate_yearly_report
+
+
+def make_order(user, variant, quantity, created_at, status='DELIVERED', payment_method='CREDIT_CARD',
+               unit_price='100.00'):
+    subtotal = Decimal(unit_price) * quantity
+    order = Order.objects.create(
+        user=user, status=status, subtotal=subtotal, tax=Decimal('8.00'), shipping_cost=Decimal('10.00'),
+        discount=Decimal('5.00'), total=subtotal + Decimal('13.00'),
+        **{**SHIPPING, 'payment_method': payment_method},
+    )
+    OrderItem.objects.create(
+        order=order, product=variant.product, variant=variant, product_name=variant.product.name,
+        variant_storage=variant.storage, variant_color=variant.color, unit_price=Decimal(unit_price),
+        quantity=quantity,
+    )
+    Order.objects.filter(pk=order.pk).update(created_at=created_at)
+    order.created_at = created_at
+    return order
+
+
+class DailyReportTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.day = timezone.now().date() - timedelta(days=1)
+        noon = timezone.now().replace(hour=12) - timedelta(days=1)
+        self.phone = make_variant()
+        self.tablet = make_variant(product_id='tablet', variant_id='tablet-64', price='300.00')
+        new, returning, cancelled_only = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('new', 'returning', 'late')
+        )
+        # Earlier orders of any status make a customer returning
+        make_order(returning, self.phone, 1, noon - timedelta(days=30), status='CANCELLED')
+        self.orders = [
+            make_order(new, self.phone, 2, noon),
+            make_order(new, self.tablet, 1, noon, payment_method='PAYPAL', unit_price='300.00'),
+            make_order(returning, self.phone, 3, noon, status='SHIPPED'),
+        ]
+        # Not sales, or not that day
+        make_order(cancelled_only, self.phone, 5, noon, status='PENDING')
+        make_order(returning, self.phone, 4, noon + timedelta(days=1))
+
+    def test_daily_report_in_two_passes(self):
+        with CaptureQueriesContext(connection) as queries:
+            report = generate_daily_report(self.day)
+        self.assertEqual(len([query for query in queries if 'orders_order' in query['sql']]), 2)
+
+        self.assertEqual(report['total_orders'], 3)
+        self.assertEqual(report['total_items_sold'], 6)
+        self.assertEqual(report['total_revenue'], 839.0)
+        self.assertAlmostEqual(report['average_order_value'], 839 / 3)
+        self.assertEqual((report['new_customers'], report['returning_customers']), (1, 1))
+        self.assertEqual(report['payment_methods'], [
+            {'payment_method': 'CREDIT_CARD', 'count': 2, 'revenue': Decimal('526.00')},
+            {'payment_method': 'PAYPAL', 'count': 1, 'revenue': Decimal('313.00')},
+        ])
+        self.assertEqual(report['top_products'], [
+            {'variant__product__name': 'Phone', 'variant__product__id': 'phone', 'units_sold': 5,
+             'revenue': Decimal('500.00')},
+            {'variant__product__name': 'Tablet', 'variant__product__id': 'tablet', 'units_sold': 1,
+             'revenue': Decimal('300.00')},
+        ])
+        self.assertEqual(report['revenue_breakdown'], {'subtotal': 800.0, 'tax': 24.0, 'shipping': 30.0,
+                                                       'discount': 15.0})
+        saved = SalesReport.objects.get(report_type='DAILY', report_date=self.day)
+        self.assertEqual((saved.total_orders, saved.new_customers), (3, 1))
+
+    def test_warehouse_filter_uses_reservations(self):
+        east = make_warehouse('EAST')
+        stock = Stock.objects.create(warehouse=east, variant=self.phone, quantity=10)
+        StockReservation.objects.create(stock=stock, order=self.orders[2], quantity=3)
+        report = generate_daily_report(self.day, warehouse=east)
+        self.assertEqual((report['total_orders'], report['total_items_sold']), (1, 3))
+        self.assertEqual((report['new_customers'], report['returning_customers']), (0, 1))
+
+
+class SalesCubeTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='jane', email='jane@example.com', password='x')
+        self.phone = make_variant()
+        self.tablet = make_variant(product_id='tablet', variant_id='tablet-64', price='300.00')
+        Product.objects.filter(pk='tablet').update(category=Category.objects.create(name='Tablets'))
+        self.east = make_warehouse('EAST')
+
+        def at(day):
+            return datetime.combine(day, datetime.min.time(), tzinfo=dt_timezone.utc) + timedelta(hours=12)
+
+        # Monday 2025-03-03 starts the reported week
+        self.order = make_order(self.user, self.phone, 2, at(date(2025, 3, 3)))
+        OrderItem.objects.create(
+            order=self.order, product=self.tablet.product, variant=self.tablet, product_name='Tablet',
+            variant_storage='64', variant_color='Black', unit_price=Decimal('300.00'), quantity=1,
+        )
+        make_order(self.user, self.tablet, 1, at(date(2025, 3, 5)), payment_method='PAYPAL', unit_price='300.00')
+        make_order(self.user, self.phone, 1, at(date(2025, 2, 27)))
+        make_order(self.user, self.phone, 1, at(date(2024, 6, 1)))
+        make_order(self.user, self.phone, 9, at(date(2025, 3, 4)), status='CANCELLED')
+        stock = Stock.objects.create(warehouse=self.east, variant=self.phone, quantity=10)
+        StockReservation.objects.create(stock=stock, order=self.order, quantity=2)
+
+        out = StringIO()
+        call_command('build_sales_cube', '--start', '2024-01-01', '--end', '2025-12-31', stdout=out)
+        self.assertIn('4 orders', out.getvalue())
+
+    def test_weekly_report_rolls_up_days(self):
+        report = generate_weekly_report(date(2025, 3, 3))
+        self.assertEqual((report['total_orders'], report['total_items_sold']), (2, 4))
+        self.assertEqual(report['total_revenue'], 526.0)
+        self.assertEqual(report['revenue_change_percent'], float((Decimal('526') - 113) / 113 * 100))
+        self.assertEqual(
+            [(day['date'], day['orders'], day['revenue']) for day in report['daily_breakdown'][:3]],
+            [('2025-03-03', 1, 213.0), ('2025-03-04', 0, 0.0), ('2025-03-05', 1, 313.0)],
+        )
+        self.assertEqual(report['top_products'], [
+            {'variant__product__name': 'Tablet', 'variant__product__id': 'tablet', 'units_sold': 2,
+             'revenue': Decimal('600.00')},
+            {'variant__product__name': 'Phone', 'variant__product__id': 'phone', 'units_sold': 2,
+             'revenue': Decimal('200.00')},
+        ])
+
+        # The phone line was reserved at EAST, and the order goes with its largest line (the tablet)
+        east = generate_weekly_report(date(2025, 3, 3), warehouse=self.east)
+        self.assertEqual((east['total_orders'], east['total_items_sold']), (0, 2))
+        self.assertEqual([row['variant__product__id'] for row in east['top_products']], ['phone'])
+
+    def test_daily_warehouse_reports_add_up_to_the_week(self):
+        # The order's larger tablet line ships from WEST, its phone line from EAST
+        west = make_warehouse('WEST')
+        tablet = Stock.objects.create(warehouse=west, variant=self.tablet, quantity=10)
+        StockReservation.objects.create(stock=tablet, order=self.order, quantity=1)
+        StockReservation.objects.create(
+            stock=Stock.objects.create(warehouse=self.east, variant=self.tablet, quantity=10),
+            order=Order.objects.get(created_at__date=date(2025, 3, 5)), quantity=1,
+        )
+        week = date_range(date(2025, 3, 3), date(2025, 3, 9))
+        refresh_sales_facts(week)
+
+        fields = ('total_orders', 'total_items_sold', 'total_revenue')
+        for warehouse, expected in ((self.east, (1, 3, 313.0)), (west, (1, 1, 213.0))):
+            days = [generate_daily_report(day, warehouse=warehouse) for day in week]
+            weekly = generate_weekly_report(week[0], warehouse=warehouse)
+            self.assertEqual(tuple(sum(day[field] for day in days) for field in fields), expected)
+            self.assertEqual(tuple(weekly[field] for field in fields), expected)
+
+    def test_monthly_and_yearly_reports(self):
+        report = generate_monthly_report(2025, 3)
+        self.assertEqual((report['total_orders'], report['revenue_change_percent']), (2, float(
+            (Decimal('526') - 113) / 113 * 100)))
+        self.assertEqual(report['category_performance'], [
+            {'variant__product__category__name': 'Tablets', 'revenue': Decimal('600.00'), 'units': 2},
+            {'variant__product__category__name': 'Phones', 'revenue': Decimal('200.00'), 'units': 2},
+        ])
+        self.assertEqual(report['brand_performance'], [
+            {'variant__product__brand__name': 'Acme', 'revenue': Decimal('800.00'), 'units': 4},
+        ])
+
+        # One range read of the cube and one of the product rows, no order scans
+        with CaptureQueriesContext(connection) as queries:
+            report = generate_yearly_report(2025)
+        reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len([sql for sql in reads if 'reports_dailysalesfact' in sql]), 1)
+        self.assertEqual(len([sql for sql in reads if 'reports_productperformance' in sql]), 1)
+        self.assertFalse([sql for sql in reads if 'orders_order' in sql])
+        self.assertEqual((report['total_orders'], report['total_revenue']), (3, 639.0))
+        self.assertEqual([month['orders'] for month in report['monthly_breakdown'][:3]], [0, 1, 2])
+        self.assertEqual(report['revenue_change_percent'], float((Decimal('639') - 113) / 113 * 100))
+
+    def test_reports_build_the_days_the_cube_is_missing(self):
+        DailySalesFact.objects.filter(date__gte=date(2025, 3, 1)).delete()
+        SalesCubeDay.objects.filter(date__gte=date(2025, 3, 1)).delete()
+        # Built while the day was still going, before its last order
+        noon = datetime(2025, 2, 27, 12, tzinfo=dt_timezone.utc)
+        SalesCubeDay.objects.filter(date=date(2025, 2, 27)).update(built_at=noon)
+        make_order(self.user, self.phone, 1, noon + timedelta(hours=6))
+
+        report = generate_weekly_report(date(2025, 3, 3))
+        self.assertEqual((report['total_orders'], report['total_revenue']), (2, 526.0))
+        self.assertEqual(report['revenue_change_percent'], float((Decimal('526') - 226) / 226 * 100))
+        self.assertEqual(SalesReport.objects.get(report_type='WEEKLY').total_orders, 2)
+        self.assertGreater(SalesCubeDay.objects.get(date=date(2025, 2, 27)).built_at, noon)
+
+    def test_refresh_replaces_a_day(self):
+        facts = DailySalesFact.objects.filter(date=date(2025, 3, 3))
+        self.assertEqual(facts.count(), 2)
+        Order.objects.filter(pk=self.order.pk).update(status='CANCELLED')
+        refresh_sales_facts([date(2025, 3, 3)])
+        self.assertFalse(facts.exists())
+
+
+class ReportRefreshTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='jane', email='jane@example.com', password='x')
+        self.phone = make_variant()
+        noon = datetime(2025, 3, 4, 12, tzinfo=dt_timezone.utc)
+        self.refunded = make_order(self.user, self.phone, 2, noon)
+        make_order(self.user, self.phone, 1, noon)
+        make_order(self.user, self.phone, 1, noon - timedelta(days=20))
+        self.first = refresh_reports(lag=timedelta(0))
+        generate_daily_report(date(2025, 3, 4))
+        generate_weekly_report(date(2025, 3, 3))
+        generate_monthly_report(2025, 3)
+        generate_yearly_report(2024)
+
+    def test_late_changes_refresh_only_affected_periods(self):
+        self.assertEqual((self.first.orders_changed, self.first.days_refreshed), (3, 2))
+        self.assertEqual(SalesReport.objects.get(report_type='MONTHLY').total_orders, 2)
+
+        self.refunded.status = 'REFUNDED'
+        self.refunded.save()
+        out = StringIO()
+        call_command('refresh_reports', '--lag', '0', stdout=out)
+        self.assertIn('1 orders changed, 1 days rebuilt, 3 reports regenerated', out.getvalue())
+        self.assertEqual(
+            sorted(SalesReport.objects.values_list('report_type', 'total_orders')),
+            [('DAILY', 1), ('MONTHLY', 1), ('WEEKLY', 1), ('YEARLY', 0)],
+        )
+        self.assertEqual(sum(DailySalesFact.objects.values_list('orders', flat=True)), 2)
+
+        # Nothing changed since the watermark
+        run = refresh_reports(lag=timedelta(0))
+        self.assertEqual((run.orders_changed, run.days_refreshed, run.reports_refreshed), (0, 0, 0))
+        self.assertEqual(SalesRefreshRun.objects.count(), 3)
+
+    def test_changes_younger_than_the_lag_wait(self):
+        self.refunded.save()
+        run = refresh_reports(lag=timedelta(minutes=5))
+        self.assertEqual(run.orders_changed, 0)
+        self.assertEqual(run.watermark, self.first.watermark)
+        self.assertEqual(refresh_reports(now=timezone.now() + timedelta(minutes=10)).orders_changed, 1)
+
+
+class ReportBackfillTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.phone = make_variant()
+        jane, john = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('jane', 'john')
+        )
+        noon = datetime(2025, 1, 30, 12, tzinfo=dt_timezone.utc)
+        make_order(jane, self.phone, 1, noon)
+        make_order(jane, self.phone, 2, noon + timedelta(days=2))
+        make_order(john, self.phone, 3, noon + timedelta(days=2))
+        make_order(john, self.phone, 1, noon + timedelta(days=31), status='PENDING')
+        # A report generated before the backfill is updated in place
+        SalesReport.objects.create(report_type='DAILY', report_date=date(2025, 2, 1), total_orders=99)
+
+    def test_backfill_matches_the_daily_report_and_resumes(self):
+        chunks = []
+        stats = backfill_reports(date(2025, 1, 1), date(2025, 3, 31), on_chunk=chunks.append)
+        self.assertEqual([(chunk['start'], chunk['end']) for chunk in chunks], [
+            (date(2025, 1, 1), date(2025, 1, 31)), (date(2025, 2, 1), date(2025, 2, 28)),
+            (date(2025, 3, 1), date(2025, 3, 31)),
+        ])
+        self.assertEqual((stats['days'], stats['orders'], stats['skipped']), (90, 3, 0))
+
+        daily = SalesReport.objects.filter(report_type='DAILY')
+        self.assertEqual(daily.count(), 90)
+        backfilled = daily.values('total_orders', 'total_items_sold', 'total_revenue', 'new_customers',
+                                  'returning_customers').get(report_date=date(2025, 2, 1))
+        self.assertEqual(backfilled, {'total_orders': 2, 'total_items_sold': 5, 'total_revenue': Decimal('526.00'),
+                                      'new_customers': 1, 'returning_customers': 1})
+        generate_daily_report(date(2025, 2, 1))
+        self.assertEqual(daily.values(*backfilled).get(report_date=date(2025, 2, 1)), backfilled)
+        self.assertEqual(SalesReport.objects.get(report_type='MONTHLY', report_date=date(2025, 2, 1)).total_orders, 2)
+        self.assertEqual(SalesReport.objects.get(report_type='YEARLY').total_orders, 3)
+
+        # Completed months are skipped
+        ReportBackfillChunk.objects.filter(start_date=date(2025, 2, 1)).update(completed_at=None)
+        stats = backfill_reports(date(2025, 1, 1), date(2025, 3, 31), periods=False)
+        self.assertEqual((stats['chunks'], stats['skipped'], stats['orders']), (1, 2, 2))
+        self.assertEqual(daily.count(), 90)
+        self.assertEqual(DailySalesFact.objects.count(), 2)
+
+    def test_period_reports_follow_a_run_stopped_after_the_last_month(self):
+        backfill_reports(date(2025, 1, 1), date(2025, 3, 31), periods=False)
+        self.assertFalse(SalesReport.objects.filter(report_type='MONTHLY').exists())
+        stats = backfill_reports(date(2025, 1, 1), date(2025, 3, 31))
+        self.assertEqual((stats['chunks'], stats['skipped']), (0, 3))
+        self.assertEqual(SalesReport.objects.get(report_type='MONTHLY', report_date=date(2025, 2, 1)).total_orders, 2)
+        self.assertEqual(SalesReport.objects.get(report_type='YEARLY').total_orders, 3)
+
+    def test_chunk_results_cross_process_boundaries(self):
+        result = compute_chunk(date(2025, 1, 30), date(2025, 2, 1))
+        self.assertEqual(pickle.loads(pickle.dumps(result)), result)
+        self.assertEqual(result['reports'][date(2025, 1, 30)]['new_customers'], 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('backfill_reports', '--start', '2025-01-15', '--end', '2025-02-15', '--workers', '1',
+                     stdout=out)
+        self.assertIn('2 months written, 0 already done; 32 days, 3 orders', out.getvalue())
+
+
+class ProductRelationTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='jane', email='jane@example.com', password='x')
+        self.phone, self.tablet, self.watch, self.case = (
+            make_variant(product_id=name, variant_id=f'{name}-1') for name in ('phone', 'tablet', 'watch', 'case')
+        )
+        noon = datetime(2025, 3, 4, 12, tzinfo=dt_timezone.utc)
+        for basket in ([self.phone, self.tablet], [self.phone, self.tablet], [self.phone, self.tablet, self.watch],
+                       [self.phone, self.watch], [self.case]):
+            self.make_basket(basket, noon)
+
+    def make_basket(self, variants, created_at):
+        order = make_order(self.user, variants[0], 1, created_at)
+        for variant in variants[1:]:
+            OrderItem.objects.create(
+                order=order, product=variant.product, variant=variant, product_name=variant.product.name,
+                variant_storage=variant.storage, variant_color=variant.color, unit_price=Decimal('100.00'),
+                quantity=1,
+            )
+
+    def relations(self, product_id):
+        return list(ProductRelation.objects.filter(product_a_id=product_id).order_by(
+            '-times_bought_together', 'product_b_id',
+        ).values_list('product_b_id', 'times_bought_together', 'confidence_score', 'support', 'lift'))
+
+    def matrix(self):
+        return sorted(ProductCoPurchase.objects.values_list('product_a_id', 'product_b_id', 'orders'))
+
+    def test_build_then_add_new_orders(self):
+        run = refresh_product_relations(lag=timedelta(0), min_support=2)
+        self.assertEqual((run.rebuilt, run.orders_read, run.baskets, run.relations_written), (True, 5, 5, 4))
+        self.assertIn(('phone', 'phone', 4), self.matrix())
+        self.assertEqual(self.relations('phone'), [
+            ('tablet', 3, Decimal('0.7500'), Decimal('0.600000'), Decimal('1.2500')),
+            ('watch', 2, Decimal('0.5000'), Decimal('0.400000'), Decimal('1.2500')),
+        ])
+        self.assertEqual(self.relations('tablet'), [
+            ('phone', 3, Decimal('1.0000'), Decimal('0.600000'), Decimal('1.2500')),
+        ])
+        self.assertEqual(self.relations('case'), [])
+
+        # Only the new order is read, and only its products re-ranked
+        now = timezone.now()
+        self.make_basket([self.tablet, self.watch], now)
+        run = refresh_product_relations(now=now + timedelta(minutes=1), lag=timedelta(0), min_support=2)
+        self.assertEqual((run.rebuilt, run.orders_read, run.baskets, run.products_refreshed), (False, 1, 6, 2))
+        self.assertEqual(self.relations('tablet'), [
+            ('phone', 3, Decimal('0.7500'), Decimal('0.500000'), Decimal('1.1250')),
+            ('watch', 2, Decimal('0.5000'), Decimal('0.333333'), Decimal('1.0000')),
+        ])
+        incremental = self.matrix()
+
+        # A rebuild counts the same matrix; a smaller top list drops relations
+        run = refresh_product_relations(now=now + timedelta(minutes=1), lag=timedelta(0), rebuild=True,
+                                        top_k=1, min_support=2)
+        self.assertEqual((run.orders_read, run.baskets), (6, 6))
+        self.assertEqual(self.matrix(), incremental)
+        self.assertEqual(self.relations('phone'), [
+            ('tablet', 3, Decimal('0.7500'), Decimal('0.500000'), Decimal('1.1250')),
+        ])
+        self.assertEqual(ProductRelationRun.objects.count(), 3)
+
+    def test_endpoint_reads_the_relations(self):
+        out = StringIO()
+        call_command('refresh_product_relations', '--lag', '0', stdout=out)
+        self.assertIn('5 orders read (5 in total)', out.getvalue())
 
-# Create your tests here.
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/products/products/phone/frequently_bought_together/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'orders_orderitem' in query['sql']])
+        self.assertEqual(response.json(), [{
+            'variant__product__id': 'tablet', 'variant__product__name': 'Tablet', 'co_purchase_count': 3,
+            'confidence': 75.0, 'lift': 1.25,
+        }])
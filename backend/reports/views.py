@@ -303,7 +303,7 @@ class ProductRelationViewSet(viewsets.ReadOnlyModelViewSet):
     authentication_classes = []
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['product_a', 'product_b']
-    ordering_fields = ['times_bought_together', 'confidence_score']
+    ordering_fields = ['times_bought_together', 'confidence_score', 'support', 'lift']
     ordering = ['-times_bought_together']
     
     @action(detail=False, methods=['get'])